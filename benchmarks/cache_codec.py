@@ -0,0 +1,119 @@
+"""
+Benchmark encoded size, encode time and decode time of every cache codec
+
+Values are built by the NextBus parsers from routeConfig and schedule XML responses. Saved sf-muni
+responses can be given as arguments, for example obtained with:
+  curl 'http://webservices.nextbus.com/service/publicXMLFeed?command=routeConfig&a=sf-muni&r=N' > N.xml
+Without arguments, responses with the size of a long sf-muni line (N-Judah) are generated.
+
+Usage: PYTHONPATH=. python benchmarks/cache_codec.py [response.xml ...]
+"""
+import random
+import sys
+import time
+
+import xmltodict
+
+from pubtrans.repositories import codec
+from pubtrans.services import next_bus_xml
+
+ROUNDS = 20
+
+
+def make_route_config(stops=110, paths=24, points_per_path=90):
+    rand = random.Random(0)
+    lines = ['<body copyright="All data copyright San Francisco Muni 2016.">',
+             '<route tag="N" title="N-Judah" color="003399" oppositeColor="ffffff" latMin="37.7601699" '
+             'latMax="37.7932299" lonMin="-122.5092" lonMax="-122.38798">']
+    for index in range(stops):
+        lines.append('<stop tag="{0}" title="Judah St &amp; {1}th Ave" lat="37.76{2:05d}" '
+                     'lon="-122.4{3:05d}" stopId="1{0}"/>'.
+                     format(5000 + index, index, rand.randint(0, 99999), rand.randint(0, 99999)))
+    for direction in ['N____O_F00', 'N____I_F00']:
+        lines.append('<direction tag="{0}" title="Outbound to Ocean Beach" name="Outbound" useForUI="true">'.
+                     format(direction))
+        lines.extend('<stop tag="{0}" />'.format(5000 + index) for index in range(stops / 2))
+        lines.append('</direction>')
+    for _ in range(paths):
+        lines.append('<path>')
+        lines.extend('<point lat="37.76{0:05d}" lon="-122.4{1:05d}"/>'.
+                     format(rand.randint(0, 99999), rand.randint(0, 99999)) for _ in range(points_per_path))
+        lines.append('</path>')
+    lines.append('</route></body>')
+
+    return next_bus_xml.build_route(xmltodict.parse(''.join(lines)))
+
+
+def make_schedule(stops=25, trips=150):
+    lines = ['<body copyright="All data copyright San Francisco Muni 2016.">']
+    for service_class in ['wkd', 'sat', 'sun']:
+        for direction in ['Inbound', 'Outbound']:
+            lines.append('<route tag="N" title="N-Judah" scheduleClass="2016T_FALL" serviceClass="{0}" '
+                         'direction="{1}">'.format(service_class, direction))
+            lines.append('<header>')
+            lines.extend('<stop tag="{0}">Judah St &amp; {1}th Ave</stop>'.format(5000 + index, index)
+                         for index in range(stops))
+            lines.append('</header>')
+            for trip in range(trips):
+                lines.append('<tr blockID="{0}">'.format(9700 + trip % 40))
+                for index in range(stops):
+                    epoch = 18000000 + trip * 360000 + index * 90000
+                    lines.append('<stop tag="{0}" epochTime="{1}">{2:02d}:{3:02d}:00</stop>'.
+                                 format(5000 + index, epoch, epoch / 3600000 % 24, epoch / 60000 % 60))
+                lines.append('</tr>')
+            lines.append('</route>')
+    lines.append('</body>')
+
+    return next_bus_xml.build_schedule(xmltodict.parse(''.join(lines)))
+
+
+def load_response(file_name):
+    with open(file_name) as response_file:
+        response = xmltodict.parse(response_file.read())
+
+    body = response.get(next_bus_xml.ELEMENT_BODY)
+    route = body.get(next_bus_xml.ELEMENT_ROUTE)
+    if isinstance(route, list) or next_bus_xml.ELEMENT_TR in route:
+        return next_bus_xml.build_schedule(response)
+
+    return next_bus_xml.build_route(response)
+
+
+def measure(codec_name, value):
+    fetched_at = time.time()
+
+    start = time.time()
+    for _ in range(ROUNDS):
+        data, _ = codec.encode(codec_name, value, fetched_at)
+    encode_time = (time.time() - start) / ROUNDS
+
+    start = time.time()
+    for _ in range(ROUNDS):
+        codec.decode(data)
+    decode_time = (time.time() - start) / ROUNDS
+
+    return len(data), encode_time, decode_time
+
+
+def main():
+    if len(sys.argv) > 1:
+        values = [(file_name, load_response(file_name)) for file_name in sys.argv[1:]]
+    else:
+        values = [('route config (generated)', make_route_config()),
+                  ('schedule (generated)', make_schedule())]
+
+    for name, value in values:
+        print name
+        json_size = None
+        for codec_obj in codec.CODECS:
+            if not codec.is_available(codec_obj.name):
+                print '  {0:<14} not available'.format(codec_obj.name)
+                continue
+            size, encode_time, decode_time = measure(codec_obj.name, value)
+            json_size = json_size or size
+            print '  {0:<14} {1:>9} bytes ({2:>5.1f}%)  encode {3:>7.2f} ms  decode {4:>7.2f} ms'.format(
+                codec_obj.name, size, 100.0 * size / json_size, encode_time * 1000, decode_time * 1000)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+"""
+Benchmark memory taken by route configs and schedules in the memory cache, as nested dicts and as entities
+
+Each value is measured as built by the NextBus parsers, as decoded from cache, and as the entity the
+repository keeps in memory, with the bytes of all the objects it is made of, how many of them are tracked
+by the garbage collector, and the time to build it and to write it as the JSON body of a response.
+
+Saved sf-muni responses can be given as arguments, for example obtained with:
+  curl 'http://webservices.nextbus.com/service/publicXMLFeed?command=routeConfig&a=sf-muni&r=N' > N.xml
+Without arguments, responses with the size of a long sf-muni line (N-Judah) are generated.
+
+Usage: PYTHONPATH=. python benchmarks/entity_memory.py [response.xml ...]
+"""
+import gc
+import json
+import sys
+import time
+from array import array
+
+from pubtrans.config import settings
+from pubtrans.domain import api
+from pubtrans.domain import entities
+from pubtrans.repositories import codec
+
+import cache_codec
+
+ROUNDS = 20
+
+
+def get_size(value):
+    """
+    Return bytes of value and all the objects it refers to, and how many of them the GC tracks.
+    Interned strings and small ints shared by every value are counted as well.
+    """
+
+    seen = set()
+    size = tracked = 0
+    pending = [value]
+    while pending:
+        value = pending.pop()
+        if id(value) in seen:
+            continue
+        seen.add(id(value))
+        size += sys.getsizeof(value)
+        tracked += gc.is_tracked(value)
+        if isinstance(value, dict):
+            pending.extend(value.keys())
+            pending.extend(value.values())
+        elif isinstance(value, (list, tuple)):
+            pending.extend(value)
+        elif isinstance(value, entities.Entity):
+            pending.extend(getattr(value, slot) for slot in type(value).__slots__)
+        elif not isinstance(value, (basestring, int, long, float, array)) and value is not None:
+            raise TypeError('Unexpected {0!r}'.format(type(value)))
+
+    return size, tracked
+
+
+def measure_time(call):
+
+    start = time.time()
+    for _ in range(ROUNDS):
+        call()
+
+    return (time.time() - start) / ROUNDS
+
+
+def benchmark(name, value):
+    entity_type = entities.Schedule if api.TAG_SCHEDULE_ITEMS in value else entities.Route
+    data, _ = codec.encode(settings.ROUTE_CACHE_CODEC, value, 0)
+    decoded = codec.decode(data)[0]
+    entity = entity_type.from_dict(decoded)
+
+    print name
+    parsed_size = None
+    for label, shape, build, dumps in [
+            ('parsed dicts', value, None, json.dumps),
+            ('cached dicts', decoded, lambda: codec.decode(data), json.dumps),
+            ('entity', entity, lambda: entity_type.from_dict(decoded), entities.dumps)]:
+        size, tracked = get_size(shape)
+        parsed_size = parsed_size or size
+        build_time = measure_time(build) if build else None
+        dumps_time = measure_time(lambda: dumps(shape))
+        build_label = '-' if build_time is None else '{0:.2f} ms'.format(build_time * 1000)
+        print '  {0:<14} {1:>9} bytes ({2:>5.1f}%) {3:>6} GC objects build {4:>8} dumps {5:>6.2f} ms'.format(
+            label, size, 100.0 * size / parsed_size, tracked, build_label, dumps_time * 1000)
+
+
+def main():
+    if len(sys.argv) > 1:
+        values = [(file_name, cache_codec.load_response(file_name)) for file_name in sys.argv[1:]]
+    else:
+        values = [('route config (generated)', cache_codec.make_route_config()),
+                  ('schedule (generated)', cache_codec.make_schedule())]
+
+    for name, value in values:
+        benchmark(name, value)
+
+
+if __name__ == '__main__':
+    main()
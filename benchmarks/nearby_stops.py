@@ -0,0 +1,150 @@
+"""
+Benchmark nearby stops queries over an agency with thousands of stops
+
+Stops are spread at random over an area the size of San Francisco, in routes of 50 stops. Queries for the
+stops around random points are answered scanning every stop, as a client with all the route configs would
+do, with the grid of the stop index, and through the agency with the route stops already in cache.
+
+Usage: PYTHONPATH=. python benchmarks/nearby_stops.py [stops] [radius_meters]
+"""
+import random
+import sys
+import time
+
+import mock
+from tornado import gen
+from tornado import ioloop
+
+from pubtrans.common import dictionaries
+from pubtrans.common import fetch_lease
+from pubtrans.common import micro_batch
+from pubtrans.common import single_flight
+from pubtrans.common.support import Support
+from pubtrans.config import settings
+from pubtrans.domain import agency
+from pubtrans.domain import api
+from pubtrans.domain import stop_index
+from pubtrans.domain import vehicle_positions
+from pubtrans.services import provider
+
+QUERIES = 1000
+STOPS_PER_ROUTE = 50
+
+LAT_MIN, LAT_MAX = 37.70, 37.81
+LON_MIN, LON_MAX = -122.52, -122.36
+
+
+class CachedRepository(object):
+    """
+    Repository with the routes and the stops of all of them
+    """
+
+    def __init__(self, route_stops):
+        self.routes = [{api.TAG_TAG: route_tag} for route_tag in route_stops]
+        self.route_stops = route_stops
+
+    @property
+    def agency_index(self):
+        # The agency index is a repository of its own in RedisRepository
+        return self
+
+    @gen.coroutine
+    def get_routes(self, agency_tag):  # pylint: disable=unused-argument
+        raise gen.Return(self.routes)
+
+    @gen.coroutine
+    def get_route_stops(self, agency_tag):  # pylint: disable=unused-argument
+        raise gen.Return(self.route_stops)
+
+
+def make_route_stops(stop_count):
+
+    route_stops = {}
+    for index in range(stop_count):
+        route_tag = str(index / STOPS_PER_ROUTE)
+        route_stops.setdefault(route_tag, []).append({
+            api.TAG_TAG: str(index),
+            api.TAG_LAT: str(random.uniform(LAT_MIN, LAT_MAX)),
+            api.TAG_LON: str(random.uniform(LON_MIN, LON_MAX)),
+            api.TAG_DIRECTIONS: [route_tag + '_O']
+        })
+
+    return route_stops
+
+
+def make_points():
+    return [(random.uniform(LAT_MIN, LAT_MAX), random.uniform(LON_MIN, LON_MAX)) for _ in range(QUERIES)]
+
+
+def scan_nearby_stops(stops, lat, lon, radius):
+
+    nearby_stops = []
+    for stop in stops:
+        distance = stop_index.get_distance(lat, lon, float(stop[api.TAG_LAT]), float(stop[api.TAG_LON]))
+        if distance <= radius:
+            nearby_stops.append((distance, stop))
+
+    nearby_stops.sort(key=lambda nearby_stop: nearby_stop[0])
+
+    return nearby_stops
+
+
+def make_app_settings(repository):
+
+    return dictionaries.DictAsObject(
+        support=mock.MagicMock(spec=Support),
+        circuit_breaker_set=mock.MagicMock(),
+        repository=repository,
+        single_flight=single_flight.SingleFlight(),
+        fetch_lease=fetch_lease.FetchLease(repository, 30, 10, 0.1),
+        predictions_batcher=micro_batch.MicroBatcher(0.015, 100),
+        vehicle_positions=vehicle_positions.VehiclePositions(),
+        providers=provider.build_providers(mock.MagicMock(), None))
+
+
+@gen.coroutine
+def run_agency_queries(repository, points, radius):
+    agency_obj = agency.Agency('sf-muni', make_app_settings(repository))
+
+    start = time.time()
+    for lat, lon in points:
+        yield agency_obj.index.get_nearby_stops(lat, lon, radius)
+    raise gen.Return((time.time() - start) / len(points))
+
+
+def main():
+    stop_count = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    radius = float(sys.argv[2]) if len(sys.argv) > 2 else 400.0
+
+    random.seed(0)
+    route_stops = make_route_stops(stop_count)
+    points = make_points()
+
+    start = time.time()
+    index = stop_index.build_index(route_stops)
+    print '{0:<16} {1} stops: {2:.1f} ms'.format('build index', stop_count, (time.time() - start) * 1000)
+
+    stops = [stop for stops in route_stops.values() for stop in stops]
+    start = time.time()
+    for lat, lon in points:
+        scan_nearby_stops(stops, lat, lon, radius)
+    elapsed = (time.time() - start) / len(points)
+    print '{0:<16} {1} stops, {2:.0f} m: {3:.0f} us per query'.format('scan (before)', stop_count, radius,
+                                                                      elapsed * 1000000)
+
+    start = time.time()
+    found = 0
+    for lat, lon in points:
+        found += len(stop_index.find_nearby_stops(index, lat, lon, radius, settings.NEARBY_STOPS_MAX_RESULTS))
+    elapsed = (time.time() - start) / len(points)
+    print '{0:<16} {1} stops, {2:.0f} m: {3:.0f} us per query, {4:.1f} stops found'.format(
+        'grid', stop_count, radius, elapsed * 1000000, float(found) / len(points))
+
+    elapsed = ioloop.IOLoop.current().run_sync(
+        lambda: run_agency_queries(CachedRepository(route_stops), points, radius))
+    print '{0:<16} {1} stops, {2:.0f} m: {3:.0f} us per query'.format('agency', stop_count, radius,
+                                                                      elapsed * 1000000)
+
+
+if __name__ == '__main__':
+    main()
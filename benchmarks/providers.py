@@ -0,0 +1,95 @@
+"""
+Benchmark calls for an agency while the provider of another agency is slow
+
+A burst of calls for a slow agency is made while calls for a fast agency are made one after the other,
+first with both agencies on a single provider, as all of them were on NextBus before, and then with each
+agency on a provider of its own. Providers are local stand-ins, and each call waits for the simulated
+latency of its agency, so on a single provider calls for the fast agency are still fast once they start.
+
+Usage: PYTHONPATH=. python benchmarks/providers.py [slow_calls] [slow_latency_ms]
+"""
+import sys
+import time
+
+import mock
+from tornado import gen
+from tornado import ioloop
+
+from pubtrans.common import exceptions
+from pubtrans.common.context import Context
+from pubtrans.services import provider
+
+FAST_CALLS = 50
+FAST_LATENCY_SECONDS = 0.02
+
+PROVIDER_CONFIG = {
+    'type': 'local',
+    'max_concurrency': 8,
+    'calls_per_second': 1000,
+    'burst': 1000,
+    'max_wait_seconds': 5
+}
+
+
+def make_providers(agency_providers):
+    providers = provider.build_providers(
+        mock.MagicMock(), None,
+        {'slow': PROVIDER_CONFIG, 'fast': PROVIDER_CONFIG}, agency_providers, 'slow')
+    for name in ['slow-agency', 'fast-agency']:
+        for local_provider in providers.providers.values():
+            local_provider.service.add('get_routes', [name], [{'tag': 'N'}])
+
+    return providers
+
+
+@gen.coroutine
+def call(providers, agency_tag, latency, context):
+
+    @gen.coroutine
+    def get_routes(service):
+        yield gen.sleep(latency)
+        result = yield service.get_routes(agency_tag)
+        raise gen.Return(result)
+
+    start = time.time()
+    try:
+        yield providers.get_provider(agency_tag).call(get_routes, context)
+    except exceptions.ExternalProviderUnavailableTemporarily:
+        raise gen.Return((time.time() - start, False))
+    raise gen.Return((time.time() - start, True))
+
+
+@gen.coroutine
+def run(providers, slow_calls, slow_latency):
+    context = Context(support=mock.MagicMock())
+
+    slow_futures = [call(providers, 'slow-agency', slow_latency, context) for _ in range(slow_calls)]
+    fast_times = []
+    for _ in range(FAST_CALLS):
+        fast_time = yield call(providers, 'fast-agency', FAST_LATENCY_SECONDS, context)
+        fast_times.append(fast_time)
+    yield slow_futures
+
+    raise gen.Return(fast_times)
+
+
+def main():
+    slow_calls = int(sys.argv[1]) if len(sys.argv) > 1 else 64
+    slow_latency = (float(sys.argv[2]) if len(sys.argv) > 2 else 1000.0) / 1000
+
+    io_loop = ioloop.IOLoop.current()
+    for name, agency_providers in [('single provider', {}),
+                                   ('provider per agency', {'fast-agency': 'fast'})]:
+        providers = make_providers(agency_providers)
+        start = time.time()
+        fast_times = io_loop.run_sync(lambda: run(providers, slow_calls, slow_latency))
+        elapsed = time.time() - start
+        answered = len([fast_time for fast_time, ok in fast_times if ok])
+        times = sorted(fast_time for fast_time, _ in fast_times)
+        print '{0:<20} fast agency: {1}/{2} answered, median {3:.0f} ms, max {4:.0f} ms, ' \
+            'total {5:.2f} s'.format(name, answered, FAST_CALLS, times[len(times) / 2] * 1000,
+                                     times[-1] * 1000, elapsed)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+"""
+Benchmark concurrent RedisRepository reads against a redis server with simulated latency
+
+Compares the previous behaviour (redis commands executed inline in the IOLoop thread) with the
+current one (redis commands executed in the repository executor).
+
+Usage: PYTHONPATH=. python benchmarks/redis_repository_concurrency.py [requests] [latency_ms]
+"""
+import sys
+import time
+
+import mock
+from tornado import concurrent
+from tornado import gen
+from tornado import ioloop
+
+from pubtrans.repositories import codec
+from pubtrans.repositories import redis_repository
+
+
+class SlowRedis(object):  # pylint: disable=too-few-public-methods
+    """
+    Fake redis connection that takes latency seconds to answer every command
+    """
+
+    def __init__(self, latency):
+        self.latency = latency
+        self.data = codec.encode('json', {'allMessages': []}, time.time())[0]
+
+    def get(self, key_name):  # pylint: disable=unused-argument
+        time.sleep(self.latency)
+        return self.data
+
+
+class InlineRedisRepository(redis_repository.RedisRepository):
+    """
+    Repository that runs redis commands in the calling thread, as it was done before the executor
+    """
+
+    def _execute(self, role, command, *args, **kwargs):
+        future = concurrent.Future()
+        r_connection = self.get_redis_connection(role)
+        future.set_result(getattr(r_connection, command)(*args, **kwargs))
+        return future
+
+
+@gen.coroutine
+def run_requests(repository, requests):
+    start = time.time()
+    # Messages are not kept in the memory cache, so every read goes to redis
+    yield [repository.get_route_messages('sf-muni', 'E') for _ in range(requests)]
+    raise gen.Return(time.time() - start)
+
+
+def main():
+    requests = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    latency = (float(sys.argv[2]) if len(sys.argv) > 2 else 2.0) / 1000
+
+    connection = SlowRedis(latency)
+    with mock.patch.object(redis_repository.RedisRepository, 'get_redis_connection',
+                           return_value=connection):
+        io_loop = ioloop.IOLoop.current()
+        for name, repository in [('inline (before)', InlineRedisRepository(None)),
+                                 ('executor (after)', redis_repository.RedisRepository(None))]:
+            elapsed = io_loop.run_sync(lambda repo=repository: run_requests(repo, requests))
+            print '{0:<18} {1} concurrent reads, {2:.1f} ms latency: {3:.3f} s, {4:.0f} req/s'.format(
+                name, requests, latency * 1000, elapsed, requests / elapsed)
+
+
+if __name__ == '__main__':
+    main()
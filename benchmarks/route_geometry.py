@@ -0,0 +1,157 @@
+"""
+Benchmark size and latency of route configs served with every point of their paths and in compact geometries
+
+Each route is answered through the agency with the route config and its geometry already in cache, and
+encoded as the JSON body of the response, with its raw paths and with simplified and polyline encoded paths
+for every tolerance. The time to build the geometry, once per refresh of the route config, and the size of
+the cached values are measured too.
+
+Saved routeConfig responses can be given as arguments, for example obtained with:
+  curl 'http://webservices.nextbus.com/service/publicXMLFeed?command=routeConfig&a=sf-muni&r=N' > N.xml
+Without arguments, a route with paths of points along streets, with the size of a long sf-muni line, is
+generated.
+
+Usage: PYTHONPATH=. python benchmarks/route_geometry.py [routeConfig.xml ...]
+"""
+import math
+import random
+import sys
+import time
+from collections import OrderedDict
+
+import mock
+import xmltodict
+from tornado import gen
+from tornado import ioloop
+
+from pubtrans.common import dictionaries
+from pubtrans.common import fetch_lease
+from pubtrans.common import micro_batch
+from pubtrans.common import single_flight
+from pubtrans.common.support import Support
+from pubtrans.config import settings
+from pubtrans.domain import agency
+from pubtrans.domain import api
+from pubtrans.domain import entities
+from pubtrans.domain import route_geometry
+from pubtrans.domain import vehicle_positions
+from pubtrans.repositories import codec
+from pubtrans.services import next_bus_xml
+from pubtrans.services import provider
+
+ROUNDS = 200
+
+
+class CachedRepository(object):
+    """
+    Repository with a route config and its geometry, with the route config as it is kept in memory
+    """
+
+    def __init__(self, route, geometry):
+        self.route = entities.Route.from_dict(route)
+        self.geometry = geometry
+
+    @gen.coroutine
+    def get_route(self, agency_tag, route_tag):  # pylint: disable=unused-argument
+        raise gen.Return(self.route)
+
+    @gen.coroutine
+    def get_route_geometry(self, agency_tag, route_tag):  # pylint: disable=unused-argument
+        raise gen.Return(self.geometry)
+
+
+def make_route_config(paths=24, segments_per_path=12, points_per_segment=8):
+    """
+    Route with paths along streets, as straight segments with points every few tens of meters that are
+    about a meter off the street
+    """
+
+    rand = random.Random(0)
+    route = OrderedDict([
+        (api.TAG_TAG, 'N'),
+        (api.TAG_TITLE, 'N-Judah'),
+        (api.TAG_PATHS, [])
+    ])
+    for _ in range(paths):
+        lat, lon = 37.76 + rand.uniform(0, 0.03), -122.5 + rand.uniform(0, 0.1)
+        points = []
+        for _ in range(segments_per_path):
+            heading = rand.choice([0, 90, 180, 270]) + rand.uniform(-10, 10)
+            length = rand.uniform(0.001, 0.004)
+            for _ in range(points_per_segment):
+                lat += length / points_per_segment * math.cos(math.radians(heading)) + rand.gauss(0, 0.00001)
+                lon += length / points_per_segment * math.sin(math.radians(heading)) + rand.gauss(0, 0.00001)
+                points.append(OrderedDict([
+                    (api.TAG_LAT, '{0:.7f}'.format(lat)),
+                    (api.TAG_LON, '{0:.7f}'.format(lon))
+                ]))
+        route[api.TAG_PATHS].append({api.TAG_POINTS: points})
+
+    return route
+
+
+def load_route_config(file_name):
+    with open(file_name) as response_file:
+        return next_bus_xml.build_route(xmltodict.parse(response_file.read()))
+
+
+def make_app_settings(repository):
+
+    return dictionaries.DictAsObject(
+        support=mock.MagicMock(spec=Support),
+        circuit_breaker_set=mock.MagicMock(),
+        repository=repository,
+        single_flight=single_flight.SingleFlight(),
+        fetch_lease=fetch_lease.FetchLease(repository, 30, 10, 0.1),
+        predictions_batcher=micro_batch.MicroBatcher(0.015, 100),
+        vehicle_positions=vehicle_positions.VehiclePositions(),
+        providers=provider.build_providers(mock.MagicMock(), None))
+
+
+@gen.coroutine
+def run_route_requests(repository, geometry, tolerance):
+    agency_obj = agency.Agency('sf-muni', make_app_settings(repository))
+
+    start = time.time()
+    for _ in range(ROUNDS):
+        route = yield agency_obj.get_route('N', None, geometry, tolerance)
+        body = entities.dumps(route)
+    raise gen.Return(((time.time() - start) / ROUNDS, len(body)))
+
+
+def benchmark(name, route):
+    point_count = sum(len(path.get(api.TAG_POINTS, [])) for path in route.get(api.TAG_PATHS, []))
+    print '{0}: {1} paths, {2} points'.format(name, len(route.get(api.TAG_PATHS, [])), point_count)
+
+    start = time.time()
+    geometry = route_geometry.build_geometry(route.get(api.TAG_PATHS, []),
+                                             settings.ROUTE_GEOMETRY_TOLERANCES_METERS)
+    print '  {0:<24} {1:.1f} ms'.format('build geometry', (time.time() - start) * 1000)
+
+    for entity, value in [('route', route), ('geometry', geometry)]:
+        data, _ = codec.encode(settings.ROUTE_CACHE_CODEC, value, 0)
+        print '  {0:<24} {1} bytes'.format('cached ' + entity, len(data))
+
+    repository = CachedRepository(route, geometry)
+    modes = [('raw', None, None)]
+    for tolerance in settings.ROUTE_GEOMETRY_TOLERANCES_METERS:
+        modes.extend((geometry_mode, geometry_mode, tolerance) for geometry_mode in route_geometry.GEOMETRIES)
+
+    for label, geometry_mode, tolerance in modes:
+        elapsed, size = ioloop.IOLoop.current().run_sync(
+            lambda: run_route_requests(repository, geometry_mode, tolerance))
+        if tolerance is not None:
+            label = '{0} {1} m'.format(label, tolerance)
+        print '  {0:<24} {1:>7} bytes {2:>7.0f} us per request'.format(label, size, elapsed * 1000000)
+
+
+def main():
+    if len(sys.argv) > 1:
+        for file_name in sys.argv[1:]:
+            benchmark(file_name, load_route_config(file_name))
+    else:
+        benchmark('generated route config', make_route_config())
+
+
+if __name__ == '__main__':
+    main()
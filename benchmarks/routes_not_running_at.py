@@ -0,0 +1,145 @@
+"""
+Benchmark a cold routes not running at query against a NextBus with simulated latency
+
+Neither service windows nor schedules are cached, so one schedule per route is fetched from NextBus. The
+query is run with schedules fetched one at a time, as it was done before, and with increasing concurrency
+limits. Then it is run with the service windows of all routes in the agency index.
+
+Usage: PYTHONPATH=. python benchmarks/routes_not_running_at.py [routes] [latency_ms]
+"""
+import sys
+import time
+
+import mock
+import xmltodict
+from tornado import gen
+from tornado import ioloop
+
+from pubtrans.common import dictionaries
+from pubtrans.common import fetch_lease
+from pubtrans.common import micro_batch
+from pubtrans.common import single_flight
+from pubtrans.common.rest_adapter import RestAdapter
+from pubtrans.common.support import Support
+from pubtrans.config import settings
+from pubtrans.domain import agency
+from pubtrans.domain import service_windows
+from pubtrans.domain import vehicle_positions
+from pubtrans.services import next_bus_xml
+from pubtrans.services import provider
+
+INDEXED_QUERIES = 1000
+
+SCHEDULE_RESPONSE = \
+    '<body copyright="All data copyright San Francisco Muni 2016.">' \
+    '<route tag="{0}" title="{0}" scheduleClass="2016T_FALL" serviceClass="wkd" direction="Inbound">' \
+    '<header><stop tag="5184">Jones St &amp; Beach St</stop></header>' \
+    '<tr blockID="9201"><stop tag="5184" epochTime="18000000">05:00:00</stop></tr>' \
+    '<tr blockID="9202"><stop tag="5184" epochTime="86000000">23:53:20</stop></tr>' \
+    '</route>' \
+    '</body>'
+
+
+class EmptyRepository(object):
+    """
+    Repository where nothing is cached
+    """
+
+    @property
+    def agency_index(self):
+        # The agency index is a repository of its own in RedisRepository
+        return self
+
+    @gen.coroutine
+    def get_route_schedules(self, agency_tag, route_tags):  # pylint: disable=unused-argument
+        raise gen.Return(({}, list(route_tags)))
+
+    @gen.coroutine
+    def store_route_schedules(self, agency_tag, schedules):  # pylint: disable=unused-argument
+        raise gen.Return(schedules)
+
+    @gen.coroutine
+    def get_service_windows(self, agency_tag):  # pylint: disable=unused-argument
+        raise gen.Return({})
+
+    @gen.coroutine
+    def store_service_windows(self, agency_tag, windows):  # pylint: disable=unused-argument
+        raise gen.Return(None)
+
+    @gen.coroutine
+    def get_fetch_error(self, fetch_name):  # pylint: disable=unused-argument
+        raise gen.Return(None)
+
+    @gen.coroutine
+    def acquire_fetch_lease(self, lease_name, token, ttl):  # pylint: disable=unused-argument
+        raise gen.Return(True)
+
+
+class IndexedRepository(EmptyRepository):
+    """
+    Repository with the service windows of all routes
+    """
+
+    def __init__(self, routes):
+        schedule = next_bus_xml.build_schedule(xmltodict.parse(SCHEDULE_RESPONSE.format('N')))
+        self.windows = dict((route['tag'], service_windows.build_windows(schedule)) for route in routes)
+
+    @gen.coroutine
+    def get_service_windows(self, agency_tag):  # pylint: disable=unused-argument
+        raise gen.Return(self.windows)
+
+
+def make_nextbus(latency):
+
+    @gen.coroutine
+    def get(path=None, body=None, query=None, headers=None, timeout=None):  # pylint: disable=unused-argument
+        yield gen.sleep(latency)
+        raise gen.Return((200, SCHEDULE_RESPONSE.format(query['r'])))
+
+    return get
+
+
+def make_app_settings(repository):
+
+    return dictionaries.DictAsObject(
+        support=mock.MagicMock(spec=Support),
+        circuit_breaker_set=mock.MagicMock(),
+        repository=repository,
+        single_flight=single_flight.SingleFlight(),
+        fetch_lease=fetch_lease.FetchLease(repository, 30, 10, 0.1),
+        predictions_batcher=micro_batch.MicroBatcher(0.015, 100),
+        vehicle_positions=vehicle_positions.VehiclePositions(),
+        providers=provider.build_providers(mock.MagicMock(), None))
+
+
+@gen.coroutine
+def run_queries(repository, routes, queries=1):
+    agency_obj = agency.Agency('sf-muni', make_app_settings(repository))
+
+    start = time.time()
+    for _ in range(queries):
+        yield agency_obj.index.get_routes_not_running_at(routes, '02:00:00')
+    raise gen.Return((time.time() - start) / queries)
+
+
+def main():
+    route_count = int(sys.argv[1]) if len(sys.argv) > 1 else 80
+    latency = (float(sys.argv[2]) if len(sys.argv) > 2 else 150.0) / 1000
+
+    routes = [{'tag': str(index), 'title': str(index)} for index in range(route_count)]
+    io_loop = ioloop.IOLoop.current()
+
+    with mock.patch.object(RestAdapter, 'get', side_effect=make_nextbus(latency)):
+        for concurrency in [1, 4, 8, 16]:
+            with mock.patch.object(settings, 'SCHEDULE_FETCH_CONCURRENCY', concurrency):
+                elapsed = io_loop.run_sync(lambda: run_queries(EmptyRepository(), routes))
+            name = 'serial (before)' if concurrency == 1 else 'concurrency {0}'.format(concurrency)
+            print '{0:<16} {1} routes, {2:.0f} ms per NextBus call: {3:.2f} s'.format(
+                name, route_count, latency * 1000, elapsed)
+
+    elapsed = io_loop.run_sync(lambda: run_queries(IndexedRepository(routes), routes, INDEXED_QUERIES))
+    print '{0:<16} {1} routes: {2:.0f} us per query'.format('indexed', route_count, elapsed * 1000000)
+
+
+if __name__ == '__main__':
+    main()
@@ -10,7 +10,13 @@ import tornado.web
 
 from pubtrans.common import breaker
 from pubtrans.common import exceptions
+from pubtrans.common import fetch_lease
+from pubtrans.common import micro_batch
+from pubtrans.common import single_flight
 from pubtrans.config import settings
+from pubtrans.domain import refresher
+from pubtrans.domain import registry
+from pubtrans.domain import vehicle_positions
 from pubtrans.handlers import default_handler
 from pubtrans.handlers import health
 from pubtrans.handlers import agencies
@@ -20,7 +26,12 @@ from pubtrans.handlers import route_schedule
 from pubtrans.handlers import route_messages
 from pubtrans.handlers import route_vehicles
 from pubtrans.handlers import stats
+from pubtrans.handlers import stop_arrivals
+from pubtrans.handlers import stops
+from pubtrans.handlers import stops_predictions
+from pubtrans.handlers import vehicles
 from pubtrans.repositories import redis_repository
+from pubtrans.services import provider
 
 
 def shutdown():
@@ -42,6 +53,35 @@ def make_app():
 
     settings.circuit_breaker_set = circuit_breaker
 
+    settings.single_flight = single_flight.SingleFlight()
+    settings.fetch_lease = fetch_lease.FetchLease(settings.repository,
+                                                  settings.NEXTBUS_REQUEST_MIN_INTERVAL_SECONDS,
+                                                  settings.FETCH_LEASE_WAIT_TIMEOUT_SECONDS,
+                                                  settings.FETCH_LEASE_POLL_INTERVAL_SECONDS)
+
+    settings.predictions_batcher = micro_batch.MicroBatcher(settings.PREDICTIONS_BATCH_WINDOW_SECONDS,
+                                                            settings.PREDICTIONS_MAX_STOPS_PER_CALL)
+
+    settings.vehicle_positions = vehicle_positions.VehiclePositions()
+
+    # Long lived domain objects and providers, used by requests with a context of their own
+    settings.providers = provider.build_providers(settings.circuit_breaker_set,
+                                                  refresher.make_support('Provider'))
+    settings.agencies = registry.AgencyRegistry(settings, refresher.make_support('AgencyRegistry'),
+                                                settings.AGENCY_REGISTRY_MAX_AGENCIES)
+
+    settings.stale_refresher = refresher.StaleRefresher(settings)
+    settings.repository.stale_handler = settings.stale_refresher.refresh
+
+    settings.popularity_refresher = refresher.PopularityRefresher(settings,
+                                                                  settings.POPULAR_REFRESH_INTERVAL_SECONDS,
+                                                                  settings.POPULAR_REFRESH_TOP_URIS,
+                                                                  settings.POPULAR_REFRESH_BUDGET)
+
+    settings.vehicle_poller = refresher.VehiclePoller(settings,
+                                                      settings.VEHICLE_POLL_INTERVAL_SECONDS,
+                                                      settings.VEHICLE_POLL_AGENCIES)
+
     _the_app = tornado.web.Application(
         [
             (r'.*/v1/agencies$', agencies.AgenciesHandlerV1,
@@ -56,6 +96,14 @@ def make_app():
              {'application_settings': settings, 'handler_name': 'RoutePredictionsHandlerV1'}),
             (r'.*/v1/([^/]*)/routes/?([^/]*)/vehicles$', route_vehicles.RouteVehiclesHandlerV1,
              {'application_settings': settings, 'handler_name': 'RouteVehiclesHandlerV1'}),
+            (r'.*/v1/([^/]*)/routes/?([^/]*)/stops/([^/]*)/arrivals$', stop_arrivals.StopArrivalsHandlerV1,
+             {'application_settings': settings, 'handler_name': 'StopArrivalsHandlerV1'}),
+            (r'.*/v1/([^/]*)/predictions$', stops_predictions.StopsPredictionsHandlerV1,
+             {'application_settings': settings, 'handler_name': 'StopsPredictionsHandlerV1'}),
+            (r'.*/v1/([^/]*)/stops/?([^/]*)$', stops.StopsHandlerV1,
+             {'application_settings': settings, 'handler_name': 'StopsHandlerV1'}),
+            (r'.*/v1/([^/]*)/vehicles$', vehicles.VehiclesHandlerV1,
+             {'application_settings': settings, 'handler_name': 'VehiclesHandlerV1'}),
             (r'.*/v1/stats/?([^/]*)$', stats.StatsHandlerV1,
              {'application_settings': settings, 'handler_name': 'StatsHandlerV1'}),
             (r'.*/v1/health/?$', health.HealthHandlerV1,
@@ -73,5 +121,9 @@ if __name__ == "__main__":
 
     APPLICATION = make_app()
     APPLICATION.listen(settings.DEFAULT_PORT)
+    if settings.POPULAR_REFRESH_ENABLED:
+        settings.popularity_refresher.start()
+    if settings.VEHICLE_POLL_ENABLED:
+        settings.vehicle_poller.start()
     print "Listening at port {0}...".format(settings.DEFAULT_PORT)
     tornado.ioloop.IOLoop.current().start()
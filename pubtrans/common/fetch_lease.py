@@ -0,0 +1,92 @@
+"""
+Cluster wide lease on upstream fetches, so the same NextBus request is made only once in a while
+by all replicas of the service
+"""
+import sys
+import uuid
+from collections import OrderedDict
+
+from tornado import gen
+from tornado import ioloop
+from tornado import util
+
+from pubtrans.common import exceptions
+
+STAT_ACQUIRED = 'leasesAcquired'
+STAT_SUPPRESSED = 'suppressed'
+STAT_UNGUARDED = 'unguarded'
+
+
+class FetchLease(object):
+    """
+    Before fetching an entity a replica must acquire its lease, which is kept in redis for ttl seconds.
+    Replicas that do not get the lease poll the cache until the holder fills it, so no other
+    request for the same entity reaches the upstream service while the lease is alive.
+    If the holder fails the lease is released and a waiting replica can take it.
+    If redis is not available the fetch is done anyway, to keep working without cache.
+    """
+
+    def __init__(self, repository, ttl, wait_timeout, poll_interval):
+        self.repository = repository
+        self.ttl = ttl
+        self.wait_timeout = wait_timeout
+        self.poll_interval = poll_interval
+        self._counts = OrderedDict((stat, 0) for stat in [STAT_ACQUIRED, STAT_SUPPRESSED, STAT_UNGUARDED])
+
+    @gen.coroutine
+    def run(self, name, function, cache_call):
+        """
+        Run coroutine function holding lease name, or return the value that cache_call gets from cache
+        once the holder of the lease stored it
+        """
+
+        io_loop = ioloop.IOLoop.current()
+        deadline = io_loop.time() + self.wait_timeout
+        token = uuid.uuid4().hex
+
+        while True:
+            try:
+                acquired = yield self.repository.acquire_fetch_lease(name, token, self.ttl)
+            except exceptions.DatabaseOperationError:
+                self._counts[STAT_UNGUARDED] += 1
+                result = yield function()
+                raise gen.Return(result)
+
+            if acquired:
+                break
+
+            value = yield cache_call()
+            if value is not None:
+                self._counts[STAT_SUPPRESSED] += 1
+                raise gen.Return(value)
+
+            if io_loop.time() >= deadline:
+                self._counts[STAT_SUPPRESSED] += 1
+                raise exceptions.ExternalProviderUnavailableTemporarily('NextBus')
+
+            yield gen.sleep(self.poll_interval)
+
+        self._counts[STAT_ACQUIRED] += 1
+
+        try:
+            result = yield function()
+        except Exception:  # pylint: disable=broad-except
+            # Let another replica try, the lease is kept only for successful fetches. The error is kept
+            # before, as releasing may handle others.
+            exc_info = sys.exc_info()
+            yield self._release(name, token)
+            util.raise_exc_info(exc_info)
+
+        raise gen.Return(result)
+
+    @gen.coroutine
+    def _release(self, name, token):
+
+        try:
+            yield self.repository.release_fetch_lease(name, token)
+        except exceptions.DatabaseOperationError:
+            # It will expire anyway
+            pass
+
+    def get_stats(self):
+        return OrderedDict(self._counts)
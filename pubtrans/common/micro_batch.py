@@ -0,0 +1,124 @@
+"""
+Batch calls for different items made within a short window of each other
+"""
+import sys
+from collections import OrderedDict
+
+from tornado import concurrent
+from tornado import gen
+from tornado import ioloop
+
+STAT_BATCHES = 'batches'
+STAT_BATCHED_CALLS = 'batchedCalls'
+STAT_MAX_BATCH_SIZE = 'maxBatchSize'
+STAT_BATCH_SIZES = 'batchSizes'
+
+
+class _Batch(object):  # pylint: disable=too-few-public-methods
+
+    def __init__(self, function):
+        self.function = function
+        self.futures = OrderedDict()
+
+
+def get_size_bucket(size):
+    """
+    Return the name of the power of two bucket batches of size are counted in
+    """
+
+    upper = 1
+    while upper < size:
+        upper *= 2
+
+    lower = upper / 2 + 1
+    if lower >= upper:
+        return str(upper)
+
+    return '{0}-{1}'.format(lower, upper)
+
+
+class MicroBatcher(object):
+    """
+    Keyed registry of batches being collected.
+    Calls for items of the same group made within window seconds of the first one are run together with
+    a single call to the batch function of the first one, which gets the list of items and returns a
+    dict with the value for each item. Values that are exceptions are raised to the callers of their items.
+    A batch is run before the window closes when it has max_size items.
+    It is meant to be used only from the IOLoop thread, so it is not thread safe.
+    """
+
+    def __init__(self, window, max_size):
+        self.window = window
+        self.max_size = max_size
+        self.batches = 0
+        self.batched_calls = 0
+        self.max_batch_size = 0
+        self.batch_sizes = {}
+        self._collecting = {}
+
+    @gen.coroutine
+    def run(self, group, item, function):
+        """
+        Add item to the batch being collected for group, and return its value once the batch is run
+        """
+
+        batch = self._collecting.get(group)
+        if batch is None:
+            batch = _Batch(function)
+            self._collecting[group] = batch
+            ioloop.IOLoop.current().call_later(self.window, self._close, group, batch)
+
+        self.batched_calls += 1
+
+        future = batch.futures.get(item)
+        if future is None:
+            future = concurrent.Future()
+            batch.futures[item] = future
+            if len(batch.futures) >= self.max_size:
+                self._close(group, batch)
+
+        result = yield future
+        raise gen.Return(result)
+
+    def _close(self, group, batch):
+
+        if self._collecting.get(group) is not batch:
+            # Already closed because it was full
+            return
+
+        del self._collecting[group]
+        ioloop.IOLoop.current().spawn_callback(self._run_batch, batch)
+
+    @gen.coroutine
+    def _run_batch(self, batch):
+
+        size = len(batch.futures)
+        self.batches += 1
+        self.max_batch_size = max(self.max_batch_size, size)
+        bucket = get_size_bucket(size)
+        self.batch_sizes[bucket] = self.batch_sizes.get(bucket, 0) + 1
+
+        try:
+            results = yield batch.function(batch.futures.keys())
+        except Exception:  # pylint: disable=broad-except
+            # Whatever the batch function raises is raised to the callers of every item
+            exc_info = sys.exc_info()
+            for future in batch.futures.values():
+                future.set_exc_info(exc_info)
+            return
+
+        for item, future in batch.futures.items():
+            result = results.get(item)
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+    def get_stats(self):
+        return OrderedDict([
+            (STAT_BATCHES, self.batches),
+            (STAT_BATCHED_CALLS, self.batched_calls),
+            (STAT_MAX_BATCH_SIZE, self.max_batch_size),
+            (STAT_BATCH_SIZES, OrderedDict(sorted(self.batch_sizes.items(),
+                                                  key=lambda bucket: int(bucket[0].split('-')[0]))))
+        ])
@@ -0,0 +1,158 @@
+"""
+Process wide redis connection pools
+
+There is one pool per role (master for writes, slave for reads) shared by every redis user in the
+process, so connections are reused instead of being created for each command.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+import redis
+
+from pubtrans.config import settings
+
+ROLE_MASTER = 'master'
+ROLE_SLAVE = 'slave'
+
+# Errors raised by redis-py when redis is not reachable or does not answer in time
+ERRORS = (redis.ConnectionError, redis.TimeoutError)
+
+STAT_MAX_CONNECTIONS = 'maxConnections'
+STAT_CREATED = 'created'
+STAT_IN_USE = 'inUse'
+STAT_IDLE = 'idle'
+STAT_WAITING = 'waiting'
+STAT_HEALTH_CHECK_FAILURES = 'healthCheckFailures'
+
+_POOLS = {}
+_CLIENTS = {}
+_LOCK = threading.Lock()
+
+
+class MonitoredConnectionPool(redis.BlockingConnectionPool):
+    """
+    Blocking connection pool that keeps usage counters and pings connections that have been idle for
+    more than health_check_interval seconds before handing them out again
+    """
+
+    def __init__(self, health_check_interval=0, **kwargs):
+        self.health_check_interval = health_check_interval
+        self.created = 0
+        self.waiting = 0
+        self.health_check_failures = 0
+        self._counters_lock = threading.Lock()
+        super(MonitoredConnectionPool, self).__init__(**kwargs)
+
+    def make_connection(self):
+        connection = super(MonitoredConnectionPool, self).make_connection()
+        with self._counters_lock:
+            self.created += 1
+        return connection
+
+    def get_connection(self, command_name, *keys, **options):
+        with self._counters_lock:
+            self.waiting += 1
+        try:
+            connection = super(MonitoredConnectionPool, self).get_connection(command_name, *keys, **options)
+        finally:
+            with self._counters_lock:
+                self.waiting -= 1
+
+        self._check_health(connection)
+
+        return connection
+
+    def release(self, connection):
+        connection.released_at = time.time()
+        super(MonitoredConnectionPool, self).release(connection)
+
+    def _check_health(self, connection):
+        """
+        Ping a connection that was idle for too long. If redis does not answer the connection is
+        dropped and it will be reopened by the next command sent through it
+        """
+
+        released_at = getattr(connection, 'released_at', None)
+        if not self.health_check_interval or released_at is None or \
+                time.time() - released_at < self.health_check_interval:
+            return
+
+        try:
+            connection.send_command('PING')
+            connection.read_response()
+        except ERRORS:
+            with self._counters_lock:
+                self.health_check_failures += 1
+            connection.disconnect()
+
+    def get_stats(self):
+        in_use = self.max_connections - self.pool.qsize()
+        return OrderedDict([
+            (STAT_MAX_CONNECTIONS, self.max_connections),
+            (STAT_CREATED, self.created),
+            (STAT_IN_USE, in_use),
+            (STAT_IDLE, max(len(self._connections) - in_use, 0)),
+            (STAT_WAITING, self.waiting),
+            (STAT_HEALTH_CHECK_FAILURES, self.health_check_failures)
+        ])
+
+
+def _create_pool(role):
+    host = settings.REDIS_MASTER_HOST if role == ROLE_MASTER else settings.REDIS_SLAVE_HOST
+
+    return MonitoredConnectionPool(host=host,
+                                   port=settings.REDIS_PORT,
+                                   db=0,
+                                   max_connections=settings.REDIS_POOL_MAX_CONNECTIONS,
+                                   timeout=settings.REDIS_POOL_TIMEOUT_SECONDS,
+                                   socket_timeout=settings.REDIS_SOCKET_TIMEOUT_SECONDS,
+                                   socket_connect_timeout=settings.REDIS_SOCKET_CONNECT_TIMEOUT_SECONDS,
+                                   health_check_interval=settings.REDIS_POOL_HEALTH_CHECK_INTERVAL_SECONDS)
+
+
+def get_pool(role):
+    """
+    Return the connection pool for role, creating it the first time
+    """
+
+    pool = _POOLS.get(role)
+    if pool is None:
+        with _LOCK:
+            pool = _POOLS.get(role)
+            if pool is None:
+                pool = _create_pool(role)
+                _POOLS[role] = pool
+
+    return pool
+
+
+def get_connection(role):
+    """
+    Return a redis client for role backed by the shared connection pool
+    """
+
+    client = _CLIENTS.get(role)
+    if client is None:
+        pool = get_pool(role)
+        with _LOCK:
+            client = _CLIENTS.get(role)
+            if client is None:
+                client = redis.StrictRedis(connection_pool=pool)
+                _CLIENTS[role] = client
+
+    return client
+
+
+def get_stats():
+    """
+    Return usage counters of every pool created so far
+    """
+
+    stats = OrderedDict()
+    for role in [ROLE_MASTER, ROLE_SLAVE]:
+        pool = _POOLS.get(role)
+        if pool is not None:
+            stats[role] = pool.get_stats()
+
+    return stats
@@ -0,0 +1,63 @@
+"""
+Coalesce concurrent executions of the same operation
+"""
+import sys
+from collections import OrderedDict
+
+from tornado import concurrent
+from tornado import gen
+
+STAT_IN_FLIGHT = 'inFlight'
+STAT_EXECUTED = 'executed'
+STAT_COALESCED = 'coalesced'
+
+
+class SingleFlight(object):
+    """
+    Keyed registry of in flight operations.
+    While an operation for a key is running, calls with the same key do not run it again but wait for
+    it and share its result or its exception.
+    It is meant to be used only from the IOLoop thread, so it is not thread safe.
+    """
+
+    def __init__(self):
+        self.executed = 0
+        self.coalesced = 0
+        self._in_flight = {}
+
+    @gen.coroutine
+    def run(self, key, function, *args, **kwargs):
+        """
+        Run coroutine function with args unless there is already one running for key
+        """
+
+        future = self._in_flight.get(key)
+        if future is not None:
+            self.coalesced += 1
+            result = yield future
+            raise gen.Return(result)
+
+        future = concurrent.Future()
+        self._in_flight[key] = future
+        self.executed += 1
+
+        try:
+            result = yield function(*args, **kwargs)
+        except Exception:
+            future.set_exc_info(sys.exc_info())
+            # Mark exception as retrieved, it is re raised below and by every waiter
+            future.exception()
+            raise
+        else:
+            future.set_result(result)
+        finally:
+            del self._in_flight[key]
+
+        raise gen.Return(result)
+
+    def get_stats(self):
+        return OrderedDict([
+            (STAT_IN_FLIGHT, len(self._in_flight)),
+            (STAT_EXECUTED, self.executed),
+            (STAT_COALESCED, self.coalesced)
+        ])
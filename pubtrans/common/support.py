@@ -2,24 +2,24 @@
 Generic (domain agnostic) stuff to support application
 """
 import Queue
+import time
 from _socket import gaierror
-from collections import OrderedDict
 
-import redis
 import statsd
 
 from pubtrans.common import constants
 from pubtrans.config import settings
 
+# Stats clients by environment with the time they were created, shared by all the instances so the stats
+# host is not resolved, blocking the IOLoop, for every request
+_STATS_CLIENTS = {}
+
 
 class Support(object):
     """
     Class used to notify events useful to support the application
     """
 
-    SET_URIS_COUNT = 'uris:count'
-    SET_SLOW_REQUESTS = 'uris:slow_requests'
-
     def __init__(self, logger, extra_info=None):
         """
         Initialize instance with a logger to be used, info related to the request and info related to
@@ -46,12 +46,30 @@ class Support(object):
 
         self._stats_enabled = settings.STATS_ENABLED
         if self._stats_enabled:
-            try:
-                self._stats_client = statsd.StatsClient(host=settings.STATS_SERVICE_HOSTNAME,
-                                                        port=8125, prefix='pubtrans.' + environment)
-            except gaierror as ex:
-                self.notify_warning('Could not create stats client: {0}'. format(ex.strerror))
-                self._stats_enabled = False
+            self._stats_client = self._get_stats_client(environment)
+            self._stats_enabled = self._stats_client is not None
+
+    def _get_stats_client(self, environment):
+        """
+        Return the stats client of environment, or None if it could not be created. Creating it is tried
+        again once STATS_CLIENT_RETRY_SECONDS have passed since it last failed.
+        """
+
+        stats_client, created_at = _STATS_CLIENTS.get(environment, (None, None))
+        if stats_client is not None or \
+                (created_at is not None and time.time() - created_at < settings.STATS_CLIENT_RETRY_SECONDS):
+            return stats_client
+
+        try:
+            stats_client = statsd.StatsClient(host=settings.STATS_SERVICE_HOSTNAME,
+                                              port=8125, prefix='pubtrans.' + environment)
+        except gaierror as ex:
+            self.notify_warning('Could not create stats client: {0}'. format(ex.strerror))
+            stats_client = None
+
+        _STATS_CLIENTS[environment] = (stats_client, time.time())
+
+        return stats_client
 
     def _log_entire_request(self, log_method):
         try:
@@ -122,56 +140,3 @@ class Support(object):
     def stat_timing(self, stat, value, rate=1):
         if self._stats_enabled:
             self._stats_client.timing(stat, value, rate)
-
-    def update_uri_stats(self, uri, timing):
-        count = 1
-        try:
-            r_connection = redis.StrictRedis(host=settings.REDIS_MASTER_HOST, port=settings.REDIS_PORT, db=0)
-            r_connection.zincrby(self.SET_URIS_COUNT, uri, count)
-            r_connection.zadd(self.SET_SLOW_REQUESTS, timing, uri)
-
-        except redis.ConnectionError as ex:
-            # Should not fail if cache is not available
-            self.notify_info('[{0}] Not using cache. Cache not available: {1}'.
-                             format('Support', ex.message))
-
-    def get_uri_count(self):
-
-        try:
-            r_connection = redis.StrictRedis(host=settings.REDIS_MASTER_HOST, port=settings.REDIS_PORT, db=0)
-            redis_response = r_connection.zrevrangebyscore(self.SET_URIS_COUNT, '+inf', '-inf',
-                                                           withscores=True)
-        except redis.ConnectionError as ex:
-            # Should not fail if cache is not available
-            self.notify_info('[{0}] Not using cache. Cache not available: {1}'.
-                             format('Support', ex.message))
-            redis_response = []
-
-        response = OrderedDict()
-        for uri in redis_response:
-            response[uri[0]] = int(uri[1])
-
-        return response
-
-    def get_slow_requests(self, slow_limit):
-
-        try:
-            r_connection = redis.StrictRedis(host=settings.REDIS_MASTER_HOST, port=settings.REDIS_PORT, db=0)
-
-            min_score = '-inf'
-            if slow_limit:
-                min_score = slow_limit
-
-            redis_response = r_connection.zrevrangebyscore(self.SET_SLOW_REQUESTS, '+inf', min_score,
-                                                           withscores=True)
-        except redis.ConnectionError as ex:
-            # Should not fail if cache is not available
-            self.notify_info('[{0}] Not using cache. Cache not available: {1}'.
-                             format('Support', ex.message))
-            redis_response = []
-
-        response = OrderedDict()
-        for uri in redis_response:
-            response[uri[0]] = int(uri[1])
-
-        return response
@@ -7,6 +7,12 @@ DEFAULT_PORT = 8888
 REDIS_MASTER_HOST = "redis-master"
 REDIS_SLAVE_HOST = "redis-slave"
 REDIS_PORT = 6379
+REDIS_EXECUTOR_MAX_WORKERS = 16
+REDIS_POOL_MAX_CONNECTIONS = 32
+REDIS_POOL_TIMEOUT_SECONDS = 1
+REDIS_POOL_HEALTH_CHECK_INTERVAL_SECONDS = 30
+REDIS_SOCKET_TIMEOUT_SECONDS = 1
+REDIS_SOCKET_CONNECT_TIMEOUT_SECONDS = 1
 AGENCIES_CACHE_TTL_SECONDS = 60 * 60 * 24
 ROUTES_CACHE_TTL_SECONDS = 60 * 5
 ROUTE_CACHE_TTL_SECONDS = 60 * 5
@@ -14,15 +20,100 @@ SCHEDULE_CACHE_TTL_SECONDS = 60 * 60
 ROUTE_MESSAGES_CACHE_TTL_SECONDS = 60 * 5
 ROUTE_VEHICLES_CACHE_TTL_SECONDS = 60 * 1
 ROUTE_PREDICTIONS_CACHE_TTL_SECONDS = 60 * 1
+# After the ttl above an entity is stale. It is still returned during the stale window while it is
+# refreshed in background.
+AGENCIES_CACHE_STALE_SECONDS = 60 * 60 * 24
+ROUTES_CACHE_STALE_SECONDS = 60 * 60
+ROUTE_CACHE_STALE_SECONDS = 60 * 60
+SCHEDULE_CACHE_STALE_SECONDS = 60 * 60 * 24
+ROUTE_MESSAGES_CACHE_STALE_SECONDS = 60 * 5
+ROUTE_VEHICLES_CACHE_STALE_SECONDS = 30
+ROUTE_PREDICTIONS_CACHE_STALE_SECONDS = 30
+# Codecs used to store entities in cache: json, msgpack, or any of them followed by +zlib, or msgpack+lz4.
+# Entities stored with json codecs are served without decoding them, when they are returned as they are.
+AGENCIES_CACHE_CODEC = 'json'
+ROUTES_CACHE_CODEC = 'json'
+ROUTE_CACHE_CODEC = 'msgpack+zlib'
+SCHEDULE_CACHE_CODEC = 'json+zlib'
+ROUTE_MESSAGES_CACHE_CODEC = 'json'
+ROUTE_VEHICLES_CACHE_CODEC = 'json'
+ROUTE_PREDICTIONS_CACHE_CODEC = 'json'
+# Not found and bad request errors from NextBus, for example for unknown route or stop tags
+FETCH_ERROR_CACHE_TTL_SECONDS = 60
+# Most requested resources are refreshed before they get stale, with at most BUDGET calls to NextBus
+# every INTERVAL
+POPULAR_REFRESH_ENABLED = True
+POPULAR_REFRESH_INTERVAL_SECONDS = 10
+POPULAR_REFRESH_TOP_URIS = 300
+POPULAR_REFRESH_BUDGET = 40
+POPULAR_REFRESH_CONCURRENCY = 8
+# Vehicles that do not report for this long are left out of the vehicle state of their route, as NextBus does
+VEHICLES_EXPIRE_SECONDS = 15 * 60
+# Vehicles of every route of these agencies are polled with one call to NextBus per agency every INTERVAL.
+# It is longer than NEXTBUS_REQUEST_MIN_INTERVAL_SECONDS, the fetch lease of a poll, so the lease of a poll is
+# gone when the next one starts.
+VEHICLE_POLL_ENABLED = True
+VEHICLE_POLL_AGENCIES = ['sf-muni']
+VEHICLE_POLL_INTERVAL_SECONDS = 35
+# Vehicles in a bounding box are answered from the positions of the last poll of the agency, which is polled
+# again first if they are older than this
+VEHICLE_POSITIONS_MAX_AGE_SECONDS = 60
+# Schedules missing in cache for a routes query are fetched concurrently, at most this many at a time
+SCHEDULE_FETCH_CONCURRENCY = 8
+# Route configs missing in cache to build the stop index of an agency are fetched concurrently, at most this
+# many at a time
+ROUTE_FETCH_CONCURRENCY = 8
+# Stops near a point are searched within this radius in meters if none is given, and never beyond the max
+NEARBY_STOPS_DEFAULT_RADIUS_METERS = 400
+NEARBY_STOPS_MAX_RADIUS_METERS = 2000
+NEARBY_STOPS_MAX_RESULTS = 50
+# Scheduled arrivals at a stop returned if no limit is given, and never more than the max
+NEXT_ARRIVALS_DEFAULT_LIMIT = 3
+NEXT_ARRIVALS_MAX_LIMIT = 20
+# Paths of route configs are simplified with each of these tolerances in whole meters when they are refreshed.
+# Routes asked in a compact geometry without a tolerance use the default one.
+ROUTE_GEOMETRY_TOLERANCES_METERS = [0, 2, 5, 10, 25]
+ROUTE_GEOMETRY_DEFAULT_TOLERANCE_METERS = 5
+# Predictions for many stops are asked to NextBus in calls with at most this many stops each
+PREDICTIONS_MAX_STOPS_PER_CALL = 100
+# Predictions missing in cache for different stops of an agency within this window share a call to NextBus
+PREDICTIONS_BATCH_ENABLED = True
+PREDICTIONS_BATCH_WINDOW_SECONDS = 0.015
+MEMORY_CACHE_MAX_BYTES = 64 * 1024 * 1024
+# Agency objects are kept for the agencies most recently asked for, as any tag can be asked for in a request
+AGENCY_REGISTRY_MAX_AGENCIES = 256
 
 STATS_ENABLED = True
 STATS_SERVICE_HOSTNAME = "telegraf"
+# Seconds to wait before trying again to create a stats client that could not be created
+STATS_CLIENT_RETRY_SECONDS = 60
 
 NEXTBUS_SERVICE_URL = 'http://webservices.nextbus.com/service/publicXMLFeed'
 NEXTBUS_SERVICE_TIMEOUT = 5
 NEXTBUS_SERVICE_RETRIES = 3
 NEXTBUS_SERVICE_RETRIES_DELAY = 0
 NEXTBUS_SERVICE_RETRIES_BACKOFF = 0
+# The same request is not made to NextBus more than once in this interval by any replica
+NEXTBUS_REQUEST_MIN_INTERVAL_SECONDS = 30
+FETCH_LEASE_WAIT_TIMEOUT_SECONDS = NEXTBUS_SERVICE_TIMEOUT * 2
+FETCH_LEASE_POLL_INTERVAL_SECONDS = 0.1
+# Providers of transit data by name, each with its own connector, circuit breaker and limits: at most
+# max_concurrency calls at a time and calls_per_second on average with bursts of burst calls. Calls wait at
+# most max_wait_seconds for their turn. Agencies are served by the default provider unless they are in the
+# agency -> provider map.
+PROVIDERS = {
+    'next_bus': {
+        'type': 'next_bus',
+        'title': 'NextBus',
+        'timeout': NEXTBUS_SERVICE_TIMEOUT,
+        'max_concurrency': 32,
+        'calls_per_second': 50,
+        'burst': 100,
+        'max_wait_seconds': NEXTBUS_SERVICE_TIMEOUT
+    }
+}
+DEFAULT_PROVIDER = 'next_bus'
+AGENCY_PROVIDERS = {}
 
 LOG_LEVEL = 'DEBUG'
 LOGGER_NAME = 'service'
@@ -1,20 +1,55 @@
-import datetime
 
 from tornado import gen
 
-from pubtrans.common import breaker
 from pubtrans.common import exceptions
+from pubtrans.config import settings
+from pubtrans.domain import agency_index
+from pubtrans.domain import agency_messages
+from pubtrans.domain import agency_predictions
+from pubtrans.domain import agency_schedules
+from pubtrans.domain import agency_vehicles
 from pubtrans.domain import api
+from pubtrans.domain import base_domain
+from pubtrans.domain import entities
+from pubtrans.domain import route_geometry
+from pubtrans.domain import stop_index
 from pubtrans.services.next_bus import NextBusService
 
 
-class Agency(object):
+class Agency(base_domain.BaseDomain):
 
-    def __init__(self, agency_tag, app_settings):
+    LOG_TAG = '[Agency]'
+
+    def __init__(self, agency_tag, app_settings, support=None):
+        super(Agency, self).__init__(app_settings, support)
         self.agency_tag = agency_tag
-        self.support = app_settings.support
-        self.breaker_set = app_settings.circuit_breaker_set
-        self.repository = app_settings.repository
+
+    @property
+    def provider(self):
+        return self.app_settings.providers.get_provider(self.agency_tag)
+
+    # Entities of each kind are got by a part of the agency built for this object, so a view for a request
+    # gets parts with its context
+
+    @property
+    def predictions(self):
+        return agency_predictions.AgencyPredictions(self)
+
+    @property
+    def vehicles(self):
+        return agency_vehicles.AgencyVehicles(self)
+
+    @property
+    def schedules(self):
+        return agency_schedules.AgencySchedules(self)
+
+    @property
+    def messages(self):
+        return agency_messages.AgencyMessages(self)
+
+    @property
+    def index(self):
+        return agency_index.AgencyIndex(self)
 
     @gen.coroutine
     def get_routes(self, criteria):
@@ -25,25 +60,17 @@ class Agency(object):
             # Use service and cache result
             self.support.notify_debug('[Agency] routes for {0} not found in cache. Using service'.
                                       format(self.agency_tag))
-            try:
-                with self.breaker_set.context('next_bus'):
-                    nextbus_service = NextBusService(support=self.support)
-                    routes = yield nextbus_service.get_routes(self.agency_tag)
-            except breaker.CircuitOpenError:
-                self.support.notify_debug('[Agency] Call to service provider failed. Circuit is open')
-                raise exceptions.ExternalProviderUnavailableTemporarily('NextBus')
-
-            yield self.store_routes_in_cache(routes)
+            routes = yield self.fetch_routes()
 
         not_running_at = criteria.get(api.CRITERIA_NOT_RUNNING_AT)
 
         if not_running_at:
-            routes = yield self.get_routes_not_running_at(routes, not_running_at)
+            routes, _ = yield self.index.get_routes_not_running_at(routes, not_running_at)
 
         raise gen.Return(routes)
 
     @gen.coroutine
-    def get_route(self, route_tag, fields=None):
+    def get_route(self, route_tag, fields=None, geometry=None, tolerance=None):
 
         route = yield self.get_route_from_cache(route_tag)
 
@@ -51,127 +78,73 @@ class Agency(object):
             # Use service and cache result
             self.support.notify_debug('[Agency] route {0}/{1} not found in cache. Using service'.
                                       format(self.agency_tag, route_tag))
-            try:
-                with self.breaker_set.context('next_bus'):
-                    nextbus_service = NextBusService(support=self.support)
-                    route = yield nextbus_service.get_route(self.agency_tag, route_tag)
-            except breaker.CircuitOpenError:
-                self.support.notify_debug('[Agency] Call to service provider failed. Circuit is open')
-                raise exceptions.ExternalProviderUnavailableTemporarily('NextBus')
-
-            yield self.store_route_in_cache(route_tag, route)
-
-        filtered_route = {}
-        if fields:
-            for field in fields:
-                filtered_route[field] = route.get(field)
-            route = filtered_route
+            route = yield self.fetch_route(route_tag)
 
-        raise gen.Return(route)
+        route = entities.Route.from_value(route)
 
-    @gen.coroutine
-    def get_routes_not_running_at(self, routes, not_running_at):
-        service_class = ['sun', 'sat', 'wkd', 'wkd', 'wkd', 'wkd', 'wkd']
-        now_weekday = datetime.datetime.now().strftime("%w")
-        schedule_item_key = service_class[int(now_weekday)] + ':inbound'
-        self.support.notify_debug('[Service] not_running_at: {0}'.format(not_running_at))
-        self.support.notify_debug('[Service] now_weekday: {0}'.format(now_weekday))
-        self.support.notify_debug('[Service] schedule_item_key: {0}'.format(schedule_item_key))
-
-        filtered_routes = []
-        for route in routes:
-            route_schedule = yield self.get_route_schedule(self.agency_tag, route[api.TAG_TAG])
-            schedule_item = route_schedule.get(api.TAG_SCHEDULE_ITEMS).get(schedule_item_key)
-            if schedule_item is None or \
-                    ((not_running_at < schedule_item.get(api.TAG_SCHEDULE_START_TIME)) and
-                     (not_running_at > schedule_item.get(api.TAG_SCHEDULE_END_TIME))):
-                filtered_routes.append(route)
-
-        raise gen.Return(filtered_routes)
-
-    @gen.coroutine
-    def get_route_schedule(self, agency_tag, route_tag):
+        paths = None
+        if geometry and (not fields or api.TAG_PATHS in fields):
+            route_geometry_obj = yield self.get_route_geometry(route_tag, route)
+            tolerance, paths = route_geometry.get_paths(route.paths, route_geometry_obj, geometry, tolerance)
 
-        schedule = yield self.get_route_schedule_from_cache(agency_tag, route_tag)
-
-        if schedule is None:
-            # Use service and cache result
-            self.support.notify_debug('schedule for route {0}/{1} not found in cache. Using service'.
-                                      format(agency_tag, route_tag))
-            try:
-                with self.breaker_set.context('next_bus'):
-                    nextbus_service = NextBusService(support=self.support)
-                    schedule = yield nextbus_service.get_route_schedule(agency_tag, route_tag)
-            except breaker.CircuitOpenError:
-                self.support.notify_debug('[Agency] Call to service provider failed. Circuit is open')
-                raise exceptions.ExternalProviderUnavailableTemporarily('NextBus')
+        if paths is not None:
+            # Compact paths are written instead of those of the route
+            route_fields = route.get_fields([field for field in fields or route.get_tags()
+                                             if field != api.TAG_PATHS])
+            route_fields[api.TAG_PATHS] = paths
+            route_fields[api.TAG_PATHS_TOLERANCE] = tolerance
+            raise gen.Return(route_fields)
 
-            yield self.store_route_schedule_in_cache(agency_tag, route_tag, schedule)
-
-        raise gen.Return(schedule)
+        raise gen.Return(route.get_fields(fields) if fields else route)
 
     @gen.coroutine
-    def get_route_predictions(self, agency_tag, route_tag, stop_tag):
-
-        predictions = yield self.get_predictions_from_cache(agency_tag, route_tag, stop_tag)
+    def get_route_geometry(self, route_tag, route):
 
-        if predictions is None:
-            # Use service and cache result
-            self.support.notify_debug('predictions for route {0}/{1} and stop {2} not found in cache. '
-                                      'Using service'.format(agency_tag, route_tag, stop_tag))
-            try:
-                with self.breaker_set.context('next_bus'):
-                    nextbus_service = NextBusService(support=self.support)
-                    predictions = yield nextbus_service.get_route_predictions(agency_tag, route_tag, stop_tag)
-            except breaker.CircuitOpenError:
-                self.support.notify_debug('[Agency] Call to service provider failed. Circuit is open')
-                raise exceptions.ExternalProviderUnavailableTemporarily('NextBus')
+        geometry = yield self.get_route_geometry_from_cache(route_tag)
 
-            yield self.store_predictions_in_cache(agency_tag, route_tag, stop_tag, predictions)
+        if geometry is None:
+            # Built when route configs are stored, but they may have been cached before geometries were
+            geometry = route_geometry.build_geometry(route.paths, settings.ROUTE_GEOMETRY_TOLERANCES_METERS)
+            yield self.store_route_geometry_in_cache(route_tag, geometry)
+        elif not route_geometry.is_built_for(geometry, route.paths):
+            # Cached apart from the route config, so it can be of another config of the route until both
+            # expire. It is not stored, as the cached one may be of the newer config.
+            self.support.notify_debug('[Agency] geometry of route {0}/{1} is of another config. Building it'.
+                                      format(self.agency_tag, route_tag))
+            geometry = route_geometry.build_geometry(route.paths, settings.ROUTE_GEOMETRY_TOLERANCES_METERS)
 
-        raise gen.Return(predictions)
+        raise gen.Return(geometry)
 
     @gen.coroutine
-    def get_route_messages(self, agency_tag, route_tag):
+    def get_rendered_routes(self):
 
-        messages = yield self.get_route_messages_from_cache(agency_tag, route_tag)
+        routes = yield self.get_rendered(
+            lambda: self.repository.get_rendered_routes(self.agency_tag),
+            lambda: self.get_routes({}))
 
-        if messages is None:
-            # Use service and cache result
-            self.support.notify_debug('messages for route {0}/{1} not found in cache. Using service'.
-                                      format(agency_tag, route_tag))
-            try:
-                with self.breaker_set.context('next_bus'):
-                    nextbus_service = NextBusService(support=self.support)
-                    messages = yield nextbus_service.get_route_messages(agency_tag, route_tag)
-            except breaker.CircuitOpenError:
-                self.support.notify_debug('[Agency] Call to service provider failed. Circuit is open')
-                raise exceptions.ExternalProviderUnavailableTemporarily('NextBus')
-
-            yield self.store_route_messages_in_cache(agency_tag, route_tag, messages)
-
-        raise gen.Return(messages)
+        raise gen.Return(routes)
 
     @gen.coroutine
-    def get_route_vehicles(self, agency_tag, route_tag, last_time):
+    def fetch_routes(self):
 
-        vehicles = yield self.get_route_vehicles_from_cache(agency_tag, route_tag)
+        routes = yield self.fetch(
+            (NextBusService.COMMAND_ROUTE_LIST, self.agency_tag),
+            lambda service: service.get_routes(self.agency_tag),
+            self.store_routes_in_cache,
+            self.get_routes_from_cache)
 
-        if vehicles is None:
-            # Use service and cache result
-            self.support.notify_debug('vehicles for route {0}/{1} not found in cache. Using service'.
-                                      format(agency_tag, route_tag))
-            try:
-                with self.breaker_set.context('next_bus'):
-                    nextbus_service = NextBusService(support=self.support)
-                    vehicles = yield nextbus_service.get_route_vehicles(agency_tag, route_tag, last_time)
-            except breaker.CircuitOpenError:
-                self.support.notify_debug('[Agency] Call to service provider failed. Circuit is open')
-                raise exceptions.ExternalProviderUnavailableTemporarily('NextBus')
+        raise gen.Return(routes)
+
+    @gen.coroutine
+    def fetch_route(self, route_tag):
 
-            yield self.store_route_vehicles_in_cache(agency_tag, route_tag, vehicles)
+        route = yield self.fetch(
+            (NextBusService.COMMAND_ROUTE_CONFIG, self.agency_tag, route_tag),
+            lambda service: service.get_route(self.agency_tag, route_tag),
+            lambda route: self.store_route_in_cache(route_tag, route),
+            lambda: self.get_route_from_cache(route_tag))
 
-        raise gen.Return(vehicles)
+        raise gen.Return(route)
 
     @gen.coroutine
     def get_routes_from_cache(self):
@@ -219,94 +192,34 @@ class Agency(object):
             self.support.notify_info('[{0}] Not using cache. Cache not available: {1}'.
                                      format('Agency', ex.message))
 
-    @gen.coroutine
-    def get_route_schedule_from_cache(self, agency_tag, route_tag):
-
-        try:
-            routes = yield self.repository.get_route_schedule(agency_tag, route_tag)
-        except exceptions.DatabaseOperationError as ex:
-            # We should work even if cache is not working
-            self.support.notify_info('[{0}] Not using cache. Cache not available: {1}'.
-                                     format('Service', ex.message))
-            routes = None
-
-        raise gen.Return(routes)
-
-    @gen.coroutine
-    def store_route_schedule_in_cache(self, agency_tag, route_tag, schedule):
+        route = entities.Route.from_value(route)
 
-        try:
-            yield self.repository.store_route_schedule(agency_tag, route_tag, schedule)
-        except exceptions.DatabaseOperationError as ex:
-            # We should work even if cache is not working
-            self.support.notify_info('[{0}] Not using cache. Cache not available: {1}'.
-                                     format('Service', ex.message))
+        # Keep the stop index up to date with refreshed route configs
+        yield self.index.store_route_stops_in_cache({route_tag: stop_index.build_route_stops(route)})
 
-    @gen.coroutine
-    def get_route_messages_from_cache(self, agency_tag, route_tag):
-
-        try:
-            messages = yield self.repository.get_route_messages(agency_tag, route_tag)
-        except exceptions.DatabaseOperationError as ex:
-            # We should work even if cache is not working
-            self.support.notify_info('[{0}] Not using cache. Cache not available: {1}'.
-                                     format('Service', ex.message))
-            messages = None
-
-        raise gen.Return(messages)
+        # Compact geometries are built once per refresh of the route config
+        geometry = route_geometry.build_geometry(route.paths, settings.ROUTE_GEOMETRY_TOLERANCES_METERS)
+        yield self.store_route_geometry_in_cache(route_tag, geometry)
 
     @gen.coroutine
-    def store_route_messages_in_cache(self, agency_tag, route_tag, messages):
+    def get_route_geometry_from_cache(self, route_tag):
 
         try:
-            yield self.repository.store_route_messages(agency_tag, route_tag, messages)
+            geometry = yield self.repository.get_route_geometry(self.agency_tag, route_tag)
         except exceptions.DatabaseOperationError as ex:
             # We should work even if cache is not working
             self.support.notify_info('[{0}] Not using cache. Cache not available: {1}'.
-                                     format('Service', ex.message))
-
-    @gen.coroutine
-    def get_route_vehicles_from_cache(self, agency_tag, route_tag):
-
-        try:
-            vehicles = yield self.repository.get_route_vehicles(agency_tag, route_tag)
-        except exceptions.DatabaseOperationError as ex:
-            # We should work even if cache is not working
-            self.support.notify_info('[{0}] Not using cache. Cache not available: {1}'.
-                                     format('Service', ex.message))
-            vehicles = None
-
-        raise gen.Return(vehicles)
-
-    @gen.coroutine
-    def store_route_vehicles_in_cache(self, agency_tag, route_tag, vehicles):
-
-        try:
-            yield self.repository.store_route_vehicles(agency_tag, route_tag, vehicles)
-        except exceptions.DatabaseOperationError as ex:
-            # We should work even if cache is not working
-            self.support.notify_info('[{0}] Not using cache. Cache not available: {1}'.
-                                     format('Service', ex.message))
-
-    @gen.coroutine
-    def get_predictions_from_cache(self, agency_tag, route_tag, stop_tag):
-
-        try:
-            predictions = yield self.repository.get_route_predictions(agency_tag, route_tag, stop_tag)
-        except exceptions.DatabaseOperationError as ex:
-            # We should work even if cache is not working
-            self.support.notify_info('[{0}] Not using cache. Cache not available: {1}'.
-                                     format('Service', ex.message))
-            predictions = None
+                                     format('Agency', ex.message))
+            geometry = None
 
-        raise gen.Return(predictions)
+        raise gen.Return(geometry)
 
     @gen.coroutine
-    def store_predictions_in_cache(self, agency_tag, route_tag, stop_tag, predictions):
+    def store_route_geometry_in_cache(self, route_tag, geometry):
 
         try:
-            yield self.repository.store_route_predictions(agency_tag, route_tag, stop_tag, predictions)
+            yield self.repository.store_route_geometry(self.agency_tag, route_tag, geometry)
         except exceptions.DatabaseOperationError as ex:
             # We should work even if cache is not working
             self.support.notify_info('[{0}] Not using cache. Cache not available: {1}'.
-                                     format('Service', ex.message))
+                                     format('Agency', ex.message))
@@ -0,0 +1,206 @@
+"""
+Indexes of an agency built from the entities of its routes: the service windows of the routes, from their
+schedules, and its stops, from their configs
+"""
+import datetime
+
+from tornado import gen
+from tornado import locks
+
+from pubtrans.common import exceptions
+from pubtrans.config import settings
+from pubtrans.domain import api
+from pubtrans.domain import base_domain
+from pubtrans.domain import service_windows
+from pubtrans.domain import stop_index
+
+
+class AgencyIndex(base_domain.AgencyPart):
+
+    @gen.coroutine
+    def get_routes_not_running_at(self, routes, not_running_at):
+        """
+        Filter routes not running at not_running_at.
+        Return them and the tags of the routes left out because their schedule could not be got.
+        """
+
+        weekday = int(datetime.datetime.now().strftime("%w"))
+        seconds = service_windows.parse_time(not_running_at)
+        self.support.notify_debug('[Agency] not_running_at: {0}, weekday: {1}'.
+                                  format(not_running_at, weekday))
+
+        windows, errors = yield self.get_service_windows([route[api.TAG_TAG] for route in routes])
+        if errors and not windows:
+            raise errors.values()[0]
+
+        filtered_routes = []
+        unavailable_schedules = []
+        for route in routes:
+            route_windows = windows.get(route[api.TAG_TAG])
+            if route_windows is None:
+                unavailable_schedules.append(route[api.TAG_TAG])
+            elif not service_windows.is_running(route_windows, seconds, weekday):
+                filtered_routes.append(route)
+
+        raise gen.Return((filtered_routes, unavailable_schedules))
+
+    @gen.coroutine
+    def get_service_windows(self, route_tags):
+        """
+        Get service windows of many routes of the agency from the agency index.
+        Routes that are not in the index yet are added from their schedules.
+        Return a dict with the windows by route tag, and a dict with the error got for each route whose
+        schedule could not be fetched.
+        """
+
+        windows = yield self.get_service_windows_from_cache()
+        windows = dict(windows)
+
+        missing = [route_tag for route_tag in route_tags if route_tag not in windows]
+        errors = {}
+        if missing:
+            schedules, errors = yield self.agency.schedules.get_route_schedules(missing)
+            built_windows = dict((route_tag, service_windows.build_windows(schedule))
+                                 for route_tag, schedule in schedules.items())
+            if built_windows:
+                yield self.store_service_windows_in_cache(built_windows)
+            windows.update(built_windows)
+
+        raise gen.Return((windows, errors))
+
+    @gen.coroutine
+    def get_stop(self, stop):
+        """
+        Get a stop of the agency, given by stop tag or stopId, with the routes and directions serving it
+        """
+
+        index, errors = yield self.get_stop_index()
+
+        found = stop_index.find_stop(index, stop)
+        if found is None:
+            if errors:
+                # The stop could be in a route whose config could not be got
+                raise errors.values()[0]
+            raise exceptions.NotFound('Stop {0}/{1}'.format(self.agency_tag, stop))
+
+        raise gen.Return(found)
+
+    @gen.coroutine
+    def get_nearby_stops(self, lat, lon, radius):
+        """
+        Get the stops of the agency within radius meters of lat, lon, closest first.
+        Return them and the tags of the routes left out because their config could not be got.
+        """
+
+        index, errors = yield self.get_stop_index()
+
+        nearby_stops = stop_index.find_nearby_stops(index, lat, lon, radius,
+                                                    settings.NEARBY_STOPS_MAX_RESULTS)
+        if errors and not nearby_stops:
+            raise errors.values()[0]
+
+        raise gen.Return((nearby_stops, sorted(errors)))
+
+    @gen.coroutine
+    def get_stop_index(self):
+        """
+        Get the index of the stops of the agency, built from the stops of its routes kept in cache.
+        Routes that are not in it yet are added from their configs.
+        Return the index, and a dict with the error got for each route whose config could not be got.
+        """
+
+        routes = yield self.agency.get_routes({})
+        route_tags = [route[api.TAG_TAG] for route in routes]
+
+        route_stops = yield self.get_route_stops_from_cache()
+        if set(route_stops) - set(route_tags):
+            # Leave out routes the agency does not have anymore
+            route_stops = dict((route_tag, stops) for route_tag, stops in route_stops.items()
+                               if route_tag in route_tags)
+
+        missing = [route_tag for route_tag in route_tags if route_tag not in route_stops]
+        errors = {}
+        if missing:
+            self.support.notify_debug('[Agency] stops of {0} routes of {1} not found in cache. Using configs'.
+                                      format(len(missing), self.agency_tag))
+            route_configs, errors = yield self.get_route_configs(missing)
+            built_route_stops = dict((route_tag, stop_index.build_route_stops(route))
+                                     for route_tag, route in route_configs.items())
+            if built_route_stops:
+                yield self.store_route_stops_in_cache(built_route_stops)
+            route_stops = dict(route_stops, **built_route_stops)
+
+        raise gen.Return((stop_index.get_index(self.agency_tag, route_stops), errors))
+
+    @gen.coroutine
+    def get_route_configs(self, route_tags):
+        """
+        Get configs of many routes of the agency, fetching the ones not in cache concurrently.
+        Return a dict with the configs by route tag, and a dict with the error got for each route whose
+        config could not be got.
+        """
+
+        route_configs = {}
+        errors = {}
+        # Do not flood NextBus with requests for every route of the agency
+        semaphore = locks.Semaphore(settings.ROUTE_FETCH_CONCURRENCY)
+
+        @gen.coroutine
+        def get_route_config(route_tag):
+            with (yield semaphore.acquire()):
+                try:
+                    route_configs[route_tag] = yield self.agency.get_route(route_tag)
+                except exceptions.InfoException as ex:
+                    self.support.notify_info('[Agency] Cannot get config for route {0}/{1}: {2}'.
+                                             format(self.agency_tag, route_tag, ex))
+                    errors[route_tag] = ex
+
+        yield [get_route_config(route_tag) for route_tag in route_tags]
+
+        raise gen.Return((route_configs, errors))
+
+    @gen.coroutine
+    def get_service_windows_from_cache(self):
+
+        try:
+            windows = yield self.repository.agency_index.get_service_windows(self.agency_tag)
+        except exceptions.DatabaseOperationError as ex:
+            # We should work even if cache is not working
+            self.support.notify_info('[{0}] Not using cache. Cache not available: {1}'.
+                                     format('Agency', ex.message))
+            windows = {}
+
+        raise gen.Return(windows)
+
+    @gen.coroutine
+    def store_service_windows_in_cache(self, windows):
+
+        try:
+            yield self.repository.agency_index.store_service_windows(self.agency_tag, windows)
+        except exceptions.DatabaseOperationError as ex:
+            # We should work even if cache is not working
+            self.support.notify_info('[{0}] Not using cache. Cache not available: {1}'.
+                                     format('Agency', ex.message))
+
+    @gen.coroutine
+    def get_route_stops_from_cache(self):
+
+        try:
+            route_stops = yield self.repository.agency_index.get_route_stops(self.agency_tag)
+        except exceptions.DatabaseOperationError as ex:
+            # We should work even if cache is not working
+            self.support.notify_info('[{0}] Not using cache. Cache not available: {1}'.
+                                     format('Agency', ex.message))
+            route_stops = {}
+
+        raise gen.Return(route_stops)
+
+    @gen.coroutine
+    def store_route_stops_in_cache(self, route_stops):
+
+        try:
+            yield self.repository.agency_index.store_route_stops(self.agency_tag, route_stops)
+        except exceptions.DatabaseOperationError as ex:
+            # We should work even if cache is not working
+            self.support.notify_info('[{0}] Not using cache. Cache not available: {1}'.
+                                     format('Agency', ex.message))
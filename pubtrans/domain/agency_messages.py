@@ -0,0 +1,68 @@
+"""
+Messages of the routes of an agency
+"""
+
+from tornado import gen
+
+from pubtrans.common import exceptions
+from pubtrans.domain import base_domain
+from pubtrans.services.next_bus import NextBusService
+
+
+class AgencyMessages(base_domain.AgencyPart):
+
+    @gen.coroutine
+    def get_route_messages(self, agency_tag, route_tag):
+
+        messages = yield self.get_route_messages_from_cache(agency_tag, route_tag)
+
+        if messages is None:
+            # Use service and cache result
+            self.support.notify_debug('messages for route {0}/{1} not found in cache. Using service'.
+                                      format(agency_tag, route_tag))
+            messages = yield self.fetch_route_messages(agency_tag, route_tag)
+
+        raise gen.Return(messages)
+
+    @gen.coroutine
+    def get_rendered_route_messages(self, agency_tag, route_tag):
+
+        messages = yield self.get_rendered(
+            lambda: self.repository.get_rendered_route_messages(agency_tag, route_tag),
+            lambda: self.get_route_messages(agency_tag, route_tag))
+
+        raise gen.Return(messages)
+
+    @gen.coroutine
+    def fetch_route_messages(self, agency_tag, route_tag):
+
+        messages = yield self.fetch(
+            (NextBusService.COMMAND_MESSAGES, agency_tag, route_tag),
+            lambda service: service.get_route_messages(agency_tag, route_tag),
+            lambda messages: self.store_route_messages_in_cache(agency_tag, route_tag, messages),
+            lambda: self.get_route_messages_from_cache(agency_tag, route_tag))
+
+        raise gen.Return(messages)
+
+    @gen.coroutine
+    def get_route_messages_from_cache(self, agency_tag, route_tag):
+
+        try:
+            messages = yield self.repository.get_route_messages(agency_tag, route_tag)
+        except exceptions.DatabaseOperationError as ex:
+            # We should work even if cache is not working
+            self.support.notify_info('[{0}] Not using cache. Cache not available: {1}'.
+                                     format('Service', ex.message))
+            messages = None
+
+        raise gen.Return(messages)
+
+    @gen.coroutine
+    def store_route_messages_in_cache(self, agency_tag, route_tag, messages):
+
+        try:
+            yield self.repository.store_route_messages(agency_tag, route_tag, messages)
+        except exceptions.DatabaseOperationError as ex:
+            # We should work even if cache is not working
+            self.support.notify_info('[{0}] Not using cache. Cache not available: {1}'.
+                                     format('Service', ex.message))
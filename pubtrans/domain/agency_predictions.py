@@ -0,0 +1,227 @@
+"""
+Predictions of the stops of an agency, fetched for a stop or for many stops together
+"""
+
+from tornado import gen
+
+from pubtrans.common import exceptions
+from pubtrans.config import settings
+from pubtrans.domain import api
+from pubtrans.domain import base_domain
+from pubtrans.services.next_bus import NextBusService
+
+
+class AgencyPredictions(base_domain.AgencyPart):
+
+    @property
+    def predictions_batcher(self):
+        return self.app_settings.predictions_batcher
+
+    @gen.coroutine
+    def get_route_predictions(self, agency_tag, route_tag, stop_tag):
+
+        predictions = yield self.get_predictions_from_cache(agency_tag, route_tag, stop_tag)
+
+        if predictions is None:
+            # Use service and cache result
+            self.support.notify_debug('predictions for route {0}/{1} and stop {2} not found in cache. '
+                                      'Using service'.format(agency_tag, route_tag, stop_tag))
+            predictions = yield self.fetch_route_predictions(agency_tag, route_tag, stop_tag)
+
+        raise gen.Return(predictions)
+
+    @gen.coroutine
+    def get_stops_predictions(self, stops):
+        """
+        Get predictions for many (route tag, stop tag) pairs of the agency.
+        Cached ones are read together, and the rest are fetched with as few calls to NextBus as possible
+        and cached by stop, so later requests for any of the stops find them.
+        Return a list with the predictions of each stop, in the same order.
+        """
+
+        predictions, missing = yield self.get_many_predictions_from_cache(stops)
+
+        if missing:
+            # Use service and cache result
+            self.support.notify_debug('[Agency] predictions for {0} stops of {1} not found in cache. '
+                                      'Using service'.format(len(missing), self.agency_tag))
+            fetched = yield self.fetch_stops_predictions(missing)
+            predictions.update(fetched)
+
+        # NextBus does not return anything for stops it does not know about
+        raise gen.Return([predictions.get(stop, {api.TAG_DIRECTIONS: []}) for stop in stops])
+
+    @gen.coroutine
+    def get_rendered_route_predictions(self, agency_tag, route_tag, stop_tag):
+
+        predictions = yield self.get_rendered(
+            lambda: self.repository.predictions.get_rendered_route_predictions(agency_tag, route_tag,
+                                                                               stop_tag),
+            lambda: self.get_route_predictions(agency_tag, route_tag, stop_tag))
+
+        raise gen.Return(predictions)
+
+    @gen.coroutine
+    def fetch_route_predictions(self, agency_tag, route_tag, stop_tag):
+
+        predictions = yield self.fetch_with_call(
+            (NextBusService.COMMAND_PREDICTIONS, agency_tag, route_tag, stop_tag),
+            lambda: self.call_route_predictions(agency_tag, route_tag, stop_tag),
+            lambda predictions: self.store_predictions_in_cache(agency_tag, route_tag, stop_tag, predictions),
+            lambda: self.get_predictions_from_cache(agency_tag, route_tag, stop_tag))
+
+        raise gen.Return(predictions)
+
+    @gen.coroutine
+    def fetch_stops_predictions(self, stops):
+
+        max_stops = settings.PREDICTIONS_MAX_STOPS_PER_CALL
+        batches = [stops[index:index + max_stops] for index in range(0, len(stops), max_stops)]
+
+        fetched = yield [self.fetch_stops_predictions_batch(batch) for batch in batches]
+
+        predictions = {}
+        for batch_predictions in fetched:
+            predictions.update(batch_predictions)
+
+        raise gen.Return(predictions)
+
+    @gen.coroutine
+    def fetch_stops_predictions_batch(self, stops):
+
+        @gen.coroutine
+        def call_stops_predictions(service):
+            try:
+                stops_predictions = yield self.call_stops_predictions(service, self.agency_tag, stops)
+            except (exceptions.NotFound, exceptions.BadRequest) as ex:
+                # Raised only for a batch of a single stop
+                stops_predictions = {stops[0]: ex}
+
+            # Unknown stops have no predictions, as when NextBus leaves them out of a multi-stop answer,
+            # so they do not fail the other stops of the batch
+            raise gen.Return(dict((stop, {api.TAG_DIRECTIONS: []} if isinstance(predictions, Exception)
+                                   else predictions) for stop, predictions in stops_predictions.items()))
+
+        predictions = yield self.fetch(
+            (NextBusService.COMMAND_MULTI_STOP_PREDICTIONS, self.agency_tag) +
+            tuple(route_tag + '|' + stop_tag for route_tag, stop_tag in stops),
+            call_stops_predictions,
+            self.store_many_predictions_in_cache,
+            lambda: self.get_stops_batch_from_cache(stops))
+
+        raise gen.Return(predictions)
+
+    @gen.coroutine
+    def call_route_predictions(self, agency_tag, route_tag, stop_tag):
+
+        if not settings.PREDICTIONS_BATCH_ENABLED:
+            predictions = yield self.call_service(
+                lambda service: service.get_route_predictions(agency_tag, route_tag, stop_tag))
+            raise gen.Return(predictions)
+
+        # Misses for other stops of the agency made at about the same time share a call to NextBus.
+        # The whole batch is a single call to the provider, so a failure is counted once by its breaker.
+        predictions = yield self.predictions_batcher.run(
+            agency_tag, (route_tag, stop_tag), lambda stops: self.call_predictions_batch(agency_tag, stops))
+
+        raise gen.Return(predictions)
+
+    def call_predictions_batch(self, agency_tag, stops):
+        """
+        Get predictions for a batch of stops with a single call to the provider
+        """
+
+        return self.call_service(lambda service: self.call_stops_predictions(service, agency_tag, stops))
+
+    @gen.coroutine
+    def call_stops_predictions(self, service, agency_tag, stops):
+        """
+        Get predictions for a batch of stops with service.
+        Return a dict with the predictions, or the error got, by (route tag, stop tag).
+        """
+
+        if len(stops) == 1:
+            route_tag, stop_tag = stops[0]
+            predictions = yield service.get_route_predictions(agency_tag, route_tag, stop_tag)
+            raise gen.Return({stops[0]: predictions})
+
+        try:
+            predictions = yield service.get_multi_stop_predictions(agency_tag, stops)
+        except (exceptions.NotFound, exceptions.BadRequest) as ex:
+            # A single unknown stop fails the whole call, so ask for each one to know which
+            self.support.notify_info('[Agency] Cannot get predictions for {0} stops of {1} together: {2}'.
+                                     format(len(stops), agency_tag, ex))
+            predictions = {}
+
+            @gen.coroutine
+            def get_stop_predictions(route_tag, stop_tag):
+                try:
+                    predictions[(route_tag, stop_tag)] = \
+                        yield service.get_route_predictions(agency_tag, route_tag, stop_tag)
+                except (exceptions.NotFound, exceptions.BadRequest) as stop_ex:
+                    predictions[(route_tag, stop_tag)] = stop_ex
+
+            yield [get_stop_predictions(*stop) for stop in stops]
+
+        # NextBus does not return anything for stops it does not know about
+        raise gen.Return(dict((stop, predictions.get(stop, {api.TAG_DIRECTIONS: []})) for stop in stops))
+
+    @gen.coroutine
+    def get_predictions_from_cache(self, agency_tag, route_tag, stop_tag):
+
+        try:
+            predictions = yield self.repository.predictions.get_route_predictions(agency_tag, route_tag,
+                                                                                  stop_tag)
+        except exceptions.DatabaseOperationError as ex:
+            # We should work even if cache is not working
+            self.support.notify_info('[{0}] Not using cache. Cache not available: {1}'.
+                                     format('Service', ex.message))
+            predictions = None
+
+        raise gen.Return(predictions)
+
+    @gen.coroutine
+    def store_predictions_in_cache(self, agency_tag, route_tag, stop_tag, predictions):
+
+        try:
+            yield self.repository.predictions.store_route_predictions(agency_tag, route_tag, stop_tag,
+                                                                      predictions)
+        except exceptions.DatabaseOperationError as ex:
+            # We should work even if cache is not working
+            self.support.notify_info('[{0}] Not using cache. Cache not available: {1}'.
+                                     format('Service', ex.message))
+
+    @gen.coroutine
+    def get_many_predictions_from_cache(self, stops):
+
+        try:
+            predictions, missing = yield self.repository.predictions.get_stops_predictions(self.agency_tag,
+                                                                                           stops)
+        except exceptions.DatabaseOperationError as ex:
+            # We should work even if cache is not working
+            self.support.notify_info('[{0}] Not using cache. Cache not available: {1}'.
+                                     format('Agency', ex.message))
+            predictions, missing = {}, list(stops)
+
+        raise gen.Return((predictions, missing))
+
+    @gen.coroutine
+    def get_stops_batch_from_cache(self, stops):
+        """
+        Get predictions for stops fetched together by another replica, or None if any of them is not cached
+        yet
+        """
+
+        predictions, missing = yield self.get_many_predictions_from_cache(stops)
+
+        raise gen.Return(None if missing else predictions)
+
+    @gen.coroutine
+    def store_many_predictions_in_cache(self, predictions):
+
+        try:
+            yield self.repository.predictions.store_stops_predictions(self.agency_tag, predictions)
+        except exceptions.DatabaseOperationError as ex:
+            # We should work even if cache is not working
+            self.support.notify_info('[{0}] Not using cache. Cache not available: {1}'.
+                                     format('Agency', ex.message))
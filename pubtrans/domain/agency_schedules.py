@@ -0,0 +1,169 @@
+"""
+Schedules of the routes of an agency
+"""
+import datetime
+
+from tornado import gen
+from tornado import locks
+
+from pubtrans.common import exceptions
+from pubtrans.config import settings
+from pubtrans.domain import base_domain
+from pubtrans.domain import service_windows
+from pubtrans.domain import stop_schedules
+from pubtrans.services.next_bus import NextBusService
+
+
+class AgencySchedules(base_domain.AgencyPart):
+
+    @gen.coroutine
+    def get_route_schedule(self, agency_tag, route_tag):
+
+        schedule = yield self.get_route_schedule_from_cache(agency_tag, route_tag)
+
+        if schedule is None:
+            # Use service and cache result
+            self.support.notify_debug('schedule for route {0}/{1} not found in cache. Using service'.
+                                      format(agency_tag, route_tag))
+            schedule = yield self.fetch_route_schedule(agency_tag, route_tag)
+
+        raise gen.Return(schedule)
+
+    @gen.coroutine
+    def get_next_arrivals(self, route_tag, stop_tag, not_before, limit):
+        """
+        Get up to limit scheduled arrivals of a route at a stop, soonest first, from not_before today.
+        Return the stop title and the arrivals.
+        """
+
+        weekday = int(datetime.datetime.now().strftime("%w"))
+        seconds = service_windows.parse_time(not_before)
+
+        schedule = yield self.get_route_schedule(self.agency_tag, route_tag)
+
+        sliced_schedule = stop_schedules.get_stop_schedules(self.agency_tag, route_tag, schedule)
+        next_arrivals = stop_schedules.find_next_arrivals(sliced_schedule, stop_tag, seconds, weekday, limit)
+        if next_arrivals is None:
+            raise exceptions.NotFound('Stop {0}/{1}/{2}'.format(self.agency_tag, route_tag, stop_tag))
+
+        raise gen.Return(next_arrivals)
+
+    @gen.coroutine
+    def get_route_schedules(self, route_tags):
+        """
+        Get schedules of many routes of the agency.
+        Cached ones are read together, and the rest are fetched concurrently and then cached together.
+        Return a dict with the schedules by route tag, and a dict with the error got for each route whose
+        schedule could not be fetched.
+        """
+
+        schedules, missing = yield self.get_route_schedules_from_cache(route_tags)
+
+        errors = {}
+        if missing:
+            self.support.notify_debug('[Agency] {0} schedules for {1} not found in cache. Using service'.
+                                      format(len(missing), self.agency_tag))
+            fetched, errors = yield self.fetch_route_schedules(missing)
+            schedules.update(fetched)
+
+        raise gen.Return((schedules, errors))
+
+    @gen.coroutine
+    def get_rendered_route_schedule(self, agency_tag, route_tag):
+
+        schedule = yield self.get_rendered(
+            lambda: self.repository.get_rendered_route_schedule(agency_tag, route_tag),
+            lambda: self.get_route_schedule(agency_tag, route_tag))
+
+        raise gen.Return(schedule)
+
+    @gen.coroutine
+    def fetch_route_schedule(self, agency_tag, route_tag):
+
+        schedule = yield self.fetch(
+            (NextBusService.COMMAND_SCHEDULE, agency_tag, route_tag),
+            lambda service: service.get_route_schedule(agency_tag, route_tag),
+            lambda schedule: self.store_route_schedule_in_cache(agency_tag, route_tag, schedule),
+            lambda: self.get_route_schedule_from_cache(agency_tag, route_tag))
+
+        raise gen.Return(schedule)
+
+    @gen.coroutine
+    def fetch_route_schedules(self, route_tags):
+
+        schedules = {}
+        errors = {}
+        # Do not flood NextBus with requests for every route of the agency
+        semaphore = locks.Semaphore(settings.SCHEDULE_FETCH_CONCURRENCY)
+
+        @gen.coroutine
+        def fetch_route_schedule(route_tag):
+            with (yield semaphore.acquire()):
+                try:
+                    schedules[route_tag] = yield self.fetch(
+                        (NextBusService.COMMAND_SCHEDULE, self.agency_tag, route_tag),
+                        lambda service: service.get_route_schedule(self.agency_tag, route_tag),
+                        self.store_later,
+                        lambda: self.get_route_schedule_from_cache(self.agency_tag, route_tag))
+                except exceptions.InfoException as ex:
+                    self.support.notify_info('[Agency] Cannot get schedule for route {0}/{1}: {2}'.
+                                             format(self.agency_tag, route_tag, ex))
+                    errors[route_tag] = ex
+
+        yield [fetch_route_schedule(route_tag) for route_tag in route_tags]
+
+        if schedules:
+            yield self.store_route_schedules_in_cache(schedules)
+
+        raise gen.Return((schedules, errors))
+
+    @gen.coroutine
+    def get_route_schedule_from_cache(self, agency_tag, route_tag):
+
+        try:
+            routes = yield self.repository.get_route_schedule(agency_tag, route_tag)
+        except exceptions.DatabaseOperationError as ex:
+            # We should work even if cache is not working
+            self.support.notify_info('[{0}] Not using cache. Cache not available: {1}'.
+                                     format('Service', ex.message))
+            routes = None
+
+        raise gen.Return(routes)
+
+    @gen.coroutine
+    def store_route_schedule_in_cache(self, agency_tag, route_tag, schedule):
+
+        try:
+            yield self.repository.store_route_schedule(agency_tag, route_tag, schedule)
+        except exceptions.DatabaseOperationError as ex:
+            # We should work even if cache is not working
+            self.support.notify_info('[{0}] Not using cache. Cache not available: {1}'.
+                                     format('Service', ex.message))
+
+        # Keep the agency index up to date with refreshed schedules
+        windows = {route_tag: service_windows.build_windows(schedule)}
+        yield self.agency.index.store_service_windows_in_cache(windows)
+
+    @gen.coroutine
+    def get_route_schedules_from_cache(self, route_tags):
+
+        try:
+            schedules, missing = yield self.repository.agency_index.get_route_schedules(self.agency_tag,
+                                                                                        route_tags)
+        except exceptions.DatabaseOperationError as ex:
+            # We should work even if cache is not working
+            self.support.notify_info('[{0}] Not using cache. Cache not available: {1}'.
+                                     format('Agency', ex.message))
+            schedules, missing = {}, list(route_tags)
+
+        raise gen.Return((schedules, missing))
+
+    @gen.coroutine
+    def store_route_schedules_in_cache(self, schedules):
+
+        try:
+            yield self.repository.agency_index.store_route_schedules(self.agency_tag, schedules)
+        except exceptions.DatabaseOperationError as ex:
+            # We should work even if cache is not working
+            self.support.notify_info('[{0}] Not using cache. Cache not available: {1}'.
+                                     format('Agency', ex.message))
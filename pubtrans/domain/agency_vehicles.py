@@ -0,0 +1,195 @@
+"""
+Vehicles of the routes of an agency, polled for a route or for the whole agency
+"""
+
+from tornado import gen
+
+from pubtrans.common import exceptions
+from pubtrans.config import settings
+from pubtrans.domain import api
+from pubtrans.domain import base_domain
+from pubtrans.domain import vehicle_state
+from pubtrans.services.next_bus import NextBusService
+
+
+@gen.coroutine
+def call_route_vehicles(service, agency_tag, route_tag, state):
+    """
+    Get the vehicles of a route reported since the last time of state, and return state updated with them
+    """
+
+    last_time = vehicle_state.get_last_time(state)
+    vehicles = yield service.get_route_vehicles(agency_tag, route_tag, str(last_time))
+
+    raise gen.Return(vehicle_state.merge(state, vehicles, settings.VEHICLES_EXPIRE_SECONDS))
+
+
+class AgencyVehicles(base_domain.AgencyPart):
+
+    @property
+    def vehicle_positions(self):
+        return self.app_settings.vehicle_positions
+
+    @gen.coroutine
+    def get_route_vehicles(self, agency_tag, route_tag, last_time):
+        """
+        Get the vehicles of a route reported after last_time from the vehicle state of the route
+        """
+
+        state = yield self.get_route_vehicles_from_cache(agency_tag, route_tag)
+
+        if state is None:
+            # Use service and cache result
+            self.support.notify_debug('vehicles for route {0}/{1} not found in cache. Using service'.
+                                      format(agency_tag, route_tag))
+            state = yield self.poll_route_vehicles(agency_tag, route_tag, None)
+
+        raise gen.Return(vehicle_state.diff(state, last_time))
+
+    @gen.coroutine
+    def fetch_route_vehicles(self, agency_tag, route_tag):
+
+        state = yield self.get_route_vehicles_from_cache(agency_tag, route_tag)
+
+        state = yield self.poll_route_vehicles(agency_tag, route_tag, state)
+
+        raise gen.Return(state)
+
+    @gen.coroutine
+    def poll_route_vehicles(self, agency_tag, route_tag, state):
+        """
+        Update the vehicle state of a route with the vehicles NextBus reports since the lastTime of state,
+        or with all of them if state is None
+        """
+
+        state = yield self.fetch(
+            (NextBusService.COMMAND_VEHICLE_LOCATIONS, agency_tag, route_tag),
+            lambda service: call_route_vehicles(service, agency_tag, route_tag, state),
+            lambda new_state: self.store_route_vehicles_in_cache(agency_tag, route_tag, new_state),
+            lambda: self.get_route_vehicles_from_cache(agency_tag, route_tag))
+
+        raise gen.Return(state)
+
+    @gen.coroutine
+    def get_vehicles_in_box(self, west, south, east, north):
+        """
+        Get vehicles of every route of the agency inside a bounding box, from the positions of the last poll.
+        The agency is polled first if they are older than VEHICLE_POSITIONS_MAX_AGE_SECONDS.
+        """
+
+        age = self.vehicle_positions.get_age(self.agency_tag)
+        if age is None or age > settings.VEHICLE_POSITIONS_MAX_AGE_SECONDS:
+            try:
+                yield self.poll_agency_vehicles()
+            except exceptions.InfoException as ex:
+                if age is None:
+                    raise
+                # Old positions are better than none
+                self.support.notify_info('[Agency] Cannot poll vehicles of {0}: {1}'.
+                                         format(self.agency_tag, ex))
+
+        raise gen.Return(self.vehicle_positions.find(self.agency_tag, (west, south, east, north)))
+
+    @gen.coroutine
+    def poll_agency_vehicles(self):
+        """
+        Update the vehicle state of every route of the agency with a single call to NextBus, and store
+        all of them together, and the positions of their vehicles. Return the states by route tag.
+        """
+
+        routes = yield self.agency.get_routes({})
+        route_tags = [route[api.TAG_TAG] for route in routes]
+
+        states = yield self.get_routes_vehicles_from_cache(route_tags)
+
+        states = yield self.fetch(
+            (NextBusService.COMMAND_VEHICLE_LOCATIONS, self.agency_tag),
+            lambda service: self.call_agency_vehicles(service, route_tags, states),
+            self.store_routes_vehicles_in_cache,
+            lambda: self.get_polled_vehicles_from_cache(route_tags))
+
+        self.vehicle_positions.update(self.agency_tag, states)
+
+        raise gen.Return(states)
+
+    @gen.coroutine
+    def call_agency_vehicles(self, service, route_tags, states):
+
+        # Ask for what changed since the oldest state, or for every vehicle if a route has none yet
+        last_times = [vehicle_state.get_last_time(states.get(route_tag)) for route_tag in route_tags]
+        last_time = min(last_times or [0])
+        vehicles_by_route, response_last_time = yield service.get_agency_vehicles(self.agency_tag,
+                                                                                  str(last_time))
+
+        # Routes without vehicles that changed still get the lastTime of the response
+        no_vehicles = {api.TAG_VEHICLES: [], api.TAG_LAST_TIME: response_last_time}
+
+        new_states = {}
+        for route_tag in set(route_tags) | set(vehicles_by_route.keys()):
+            new_states[route_tag] = vehicle_state.merge(states.get(route_tag),
+                                                        vehicles_by_route.get(route_tag, no_vehicles),
+                                                        settings.VEHICLES_EXPIRE_SECONDS)
+
+        raise gen.Return(new_states)
+
+    @gen.coroutine
+    def get_route_vehicles_from_cache(self, agency_tag, route_tag):
+
+        try:
+            state = yield self.repository.vehicles.get_route_vehicles(agency_tag, route_tag)
+        except exceptions.DatabaseOperationError as ex:
+            # We should work even if cache is not working
+            self.support.notify_info('[{0}] Not using cache. Cache not available: {1}'.
+                                     format('Service', ex.message))
+            state = None
+
+        if state is not None and not vehicle_state.is_state(state):
+            # Cached by a previous version
+            state = None
+
+        raise gen.Return(state)
+
+    @gen.coroutine
+    def store_route_vehicles_in_cache(self, agency_tag, route_tag, vehicles):
+
+        try:
+            yield self.repository.vehicles.store_route_vehicles(agency_tag, route_tag, vehicles)
+        except exceptions.DatabaseOperationError as ex:
+            # We should work even if cache is not working
+            self.support.notify_info('[{0}] Not using cache. Cache not available: {1}'.
+                                     format('Service', ex.message))
+
+    @gen.coroutine
+    def get_routes_vehicles_from_cache(self, route_tags):
+
+        try:
+            states, _ = yield self.repository.vehicles.get_routes_vehicles(self.agency_tag, route_tags)
+        except exceptions.DatabaseOperationError as ex:
+            # We should work even if cache is not working
+            self.support.notify_info('[{0}] Not using cache. Cache not available: {1}'.
+                                     format('Agency', ex.message))
+            states = {}
+
+        # Values cached by a previous version are not states
+        raise gen.Return(dict((route_tag, state) for route_tag, state in states.items()
+                              if vehicle_state.is_state(state)))
+
+    @gen.coroutine
+    def get_polled_vehicles_from_cache(self, route_tags):
+        """
+        Get vehicle states of routes polled by another replica, or None if they are not cached yet
+        """
+
+        states = yield self.get_routes_vehicles_from_cache(route_tags)
+
+        raise gen.Return(states or None)
+
+    @gen.coroutine
+    def store_routes_vehicles_in_cache(self, states):
+
+        try:
+            yield self.repository.vehicles.store_routes_vehicles(self.agency_tag, states)
+        except exceptions.DatabaseOperationError as ex:
+            # We should work even if cache is not working
+            self.support.notify_info('[{0}] Not using cache. Cache not available: {1}'.
+                                     format('Agency', ex.message))
@@ -1,14 +1,28 @@
 STAT_RESOURCE_URI_COUNT = 'uri_count'
 STAT_RESOURCE_SLOW_REQUESTS = 'slow_requests'
+STAT_RESOURCE_REDIS_POOLS = 'redis_pools'
+STAT_RESOURCE_MEMORY_CACHE = 'memory_cache'
+STAT_RESOURCE_UPSTREAM = 'upstream'
 
 QUERY_SLOW_LIMIT = 'slow_limit'
 QUERY_FIELDS = 'fields'
 QUERY_NOT_RUNNING_AT = 'not_running_at'
 QUERY_LAST_TIME = 'lastTime'
 QUERY_STOP_TAG = 'stopTag'
+QUERY_STOPS = 'stops'
+QUERY_LAT = 'lat'
+QUERY_LON = 'lon'
+QUERY_RADIUS = 'radius'
+QUERY_BBOX = 'bbox'
+QUERY_TIME = 'time'
+QUERY_LIMIT = 'limit'
+QUERY_GEOMETRY = 'geometry'
+QUERY_TOLERANCE = 'tolerance'
 
 TAG_AGENCIES = 'agencies'
 TAG_ROUTES = 'routes'
+TAG_UNAVAILABLE_SCHEDULES = 'unavailableSchedules'
+TAG_UNAVAILABLE_ROUTES = 'unavailableRoutes'
 TAG_VEHICLES = 'vehicles'
 TAG_VEHICLE = 'vehicle'
 TAG_TAG = 'tag'
@@ -31,6 +45,8 @@ TAG_DIRECTIONS = 'directions'
 TAG_DIRECTION = 'direction'
 TAG_POINTS = 'points'
 TAG_PATHS = 'paths'
+TAG_POLYLINE = 'polyline'
+TAG_PATHS_TOLERANCE = 'pathsTolerance'
 TAG_SCHEDULE_CLASS = 'scheduleClass'
 TAG_SCHEDULE_ITEMS = 'scheduleItems'
 TAG_SCHEDULE_START_TIME = 'scheduleStartTime'
@@ -45,6 +61,10 @@ TAG_TIME_DATA = 'timeData'
 TAG_STOP_TITLE = 'stopTitle'
 TAG_URI_COUNT = 'uriCount'
 TAG_SLOW_REQUESTS = 'slowRequests'
+TAG_REDIS_POOLS = 'redisPools'
+TAG_MEMORY_CACHE = 'memoryCache'
+TAG_UPSTREAM = 'upstream'
+TAG_PROVIDERS = 'providers'
 TAG_BLOCK_DATA = 'blockData'
 TAG_ID = 'id'
 TAG_SEND_TO_BUSES = 'sendToBuses'
@@ -70,6 +90,10 @@ TAG_IS_DEPARTURE = 'isDeparture'
 TAG_AFFECTED_BY_LAYOVER = 'affectedByLayover'
 TAG_BLOCK = 'block'
 TAG_TRIP_TAG = 'tripTag'
+TAG_ROUTE_TAG = 'routeTag'
+TAG_STOP_TAG = 'stopTag'
+TAG_DISTANCE = 'distance'
+TAG_ARRIVALS = 'arrivals'
 
 CRITERIA_ROUTE_TAG = 'route_tag'
 CRITERIA_NOT_RUNNING_AT = 'not_running_at'
@@ -0,0 +1,209 @@
+"""
+Base class for domain objects that get entities from cache or from their provider, NextBus by default
+
+Domain objects are long lived and shared by every request, see registry. What belongs to a request, its
+support and request id, is in a context given to the view of the object each request uses.
+"""
+import copy
+
+from tornado import gen
+
+from pubtrans.common import exceptions
+from pubtrans.common.context import Context
+from pubtrans.domain import entities
+
+
+class BaseDomain(object):
+
+    LOG_TAG = '[Domain]'
+
+    def __init__(self, app_settings, support=None):
+        self.app_settings = app_settings
+        self.support = app_settings.support if support is None else support
+        self.context = Context(support=self.support)
+
+    def with_context(self, context):
+        """
+        Return a view of this object for a request, sharing all of its state but the request context
+        """
+
+        view = copy.copy(self)
+        view.context = context
+        view.support = context.support
+
+        return view
+
+    # Shared runtime objects are read from settings each time, so objects kept for long use current ones
+
+    @property
+    def breaker_set(self):
+        return self.app_settings.circuit_breaker_set
+
+    @property
+    def repository(self):
+        return self.app_settings.repository
+
+    @property
+    def single_flight(self):
+        return self.app_settings.single_flight
+
+    @property
+    def fetch_lease(self):
+        return self.app_settings.fetch_lease
+
+    @property
+    def provider(self):
+        """
+        Provider that entities are fetched from, the default one unless the object is for an agency
+        """
+
+        return self.app_settings.providers.get_provider()
+
+    @gen.coroutine
+    def fetch(self, key, service_call, store_call, cache_call):
+        """
+        Get an entity calling service_call with a NextBus service and cache it using store_call.
+        Concurrent fetches with the same key share a single call to NextBus, and only the replica
+        holding the fetch lease for the key makes it. Other replicas get the entity with cache_call.
+        """
+
+        entity = yield self.fetch_with_call(key, lambda: self.call_service(service_call), store_call,
+                                            cache_call)
+
+        raise gen.Return(entity)
+
+    @gen.coroutine
+    def fetch_with_call(self, key, fetch_call, store_call, cache_call):
+        """
+        Same as fetch, getting the entity with fetch_call, which makes its own call to the provider.
+        It is for fetches sharing a call with others, as batches of them, so the call counts once.
+        """
+
+        entity = yield self.single_flight.run(key, self._fetch_with_lease, key, fetch_call, store_call,
+                                              cache_call)
+
+        raise gen.Return(entity)
+
+    @gen.coroutine
+    def _fetch_with_lease(self, key, fetch_call, store_call, cache_call):
+
+        fetch_name = ':'.join(key)
+
+        # Do not ask NextBus again for what it said recently that does not exist
+        error = yield self.get_fetch_error(fetch_name)
+        if error is not None:
+            raise error
+
+        entity = yield self.fetch_lease.run(
+            fetch_name,
+            lambda: self._fetch_and_store(fetch_name, fetch_call, store_call),
+            lambda: self._get_from_cache(fetch_name, cache_call))
+
+        raise gen.Return(entity)
+
+    @gen.coroutine
+    def _get_from_cache(self, fetch_name, cache_call):
+        """
+        Get an entity fetched by another replica, or the error it got
+        """
+
+        error = yield self.get_fetch_error(fetch_name)
+        if error is not None:
+            raise error
+
+        entity = yield cache_call()
+
+        raise gen.Return(entity)
+
+    @gen.coroutine
+    def _fetch_and_store(self, fetch_name, fetch_call, store_call):
+
+        try:
+            entity = yield fetch_call()
+        except (exceptions.NotFound, exceptions.BadRequest) as ex:
+            yield self.store_fetch_error(fetch_name, ex)
+            raise
+
+        yield store_call(entity)
+
+        raise gen.Return(entity)
+
+    @staticmethod
+    @gen.coroutine
+    def store_later(entity):  # pylint: disable=unused-argument
+        """
+        Store call for fetches of entities that are stored together once all of them are fetched
+        """
+
+        pass
+
+    @gen.coroutine
+    def get_fetch_error(self, fetch_name):
+
+        try:
+            error = yield self.repository.get_fetch_error(fetch_name)
+        except exceptions.DatabaseOperationError as ex:
+            # We should work even if cache is not working
+            self.support.notify_info('{0} Not using cache. Cache not available: {1}'.
+                                     format(self.LOG_TAG, ex.message))
+            error = None
+
+        raise gen.Return(error)
+
+    @gen.coroutine
+    def store_fetch_error(self, fetch_name, error):
+
+        try:
+            yield self.repository.store_fetch_error(fetch_name, error)
+        except exceptions.DatabaseOperationError as ex:
+            # We should work even if cache is not working
+            self.support.notify_info('{0} Not using cache. Cache not available: {1}'.
+                                     format(self.LOG_TAG, ex.message))
+
+    @gen.coroutine
+    def get_rendered(self, rendered_cache_call, get_call):
+        """
+        Get the json document of an entity that is returned as it is.
+        It is taken from cache without decoding it with rendered_cache_call, or built from what get_call
+        returns if it is not there.
+        """
+
+        try:
+            rendered = yield rendered_cache_call()
+        except exceptions.DatabaseOperationError as ex:
+            # We should work even if cache is not working
+            self.support.notify_info('{0} Not using cache. Cache not available: {1}'.
+                                     format(self.LOG_TAG, ex.message))
+            rendered = None
+
+        if rendered is None:
+            entity = yield get_call()
+            rendered = entities.dumps(entity)
+
+        raise gen.Return(rendered)
+
+    @gen.coroutine
+    def call_service(self, service_call):
+
+        result = yield self.provider.call(service_call, self.context)
+
+        raise gen.Return(result)
+
+
+class AgencyPart(BaseDomain):
+    """
+    Base class for the objects that get the entities of one kind of an agency. They are built for an Agency
+    object, or a view of it, and share its settings and context.
+    """
+
+    LOG_TAG = '[Agency]'
+
+    def __init__(self, agency_obj):
+        super(AgencyPart, self).__init__(agency_obj.app_settings, agency_obj.support)
+        self.agency = agency_obj
+        self.agency_tag = agency_obj.agency_tag
+        self.context = agency_obj.context
+
+    @property
+    def provider(self):
+        return self.agency.provider
@@ -0,0 +1,475 @@
+"""
+Compact entities for what each worker keeps in memory for long: route configs, schedules and vehicles
+
+Entities are built from the dicts NextBus responses are parsed to, or from what is read from cache, with
+__slots__, so they take a fraction of the memory of nested dicts and there are far fewer objects for the
+garbage collector to go through. The coordinates of the points of a path are kept joined in a string, and
+the arrivals at a stop of a schedule in an array.
+
+They are written back with exactly the JSON shape of those dicts, either as dicts with to_dict or directly
+as a JSON document with dumps: every field the NextBus parsers build is written, as null if it has no
+value, and values are the strings in the responses, so 37.80 is still written as 37.80.
+"""
+import json
+import re
+from array import array
+from collections import OrderedDict
+from itertools import izip
+from itertools import izip_longest
+
+from pubtrans.domain import api
+
+NAN = float('nan')
+
+# Texts joined in a string are each followed by TEXT_END, and None is written as NONE_TEXT. XML does not
+# allow these control characters, so they are never in the values of NextBus responses.
+TEXT_END = '\x1f'
+NONE_TEXT = '\x00'
+
+# Texts that are written in JSON as they are
+_PLAIN_TEXTS = re.compile('[-+.0-9eE\x1f]*\\Z')
+
+_encode_string = json.encoder.encode_basestring_ascii  # pylint: disable=invalid-name
+
+
+def parse_float(value):
+    """
+    Return value as a float, or NaN if it is not a number
+    """
+
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return NAN
+
+
+def parse_int(value, default=None):
+    """
+    Return value as an int, or default if it is not an integer
+    """
+
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return default
+
+
+def join_texts(values):
+    """
+    Return strings or None values joined in a single string, which takes far less memory than a list of them
+    """
+
+    text = ''.join([NONE_TEXT + TEXT_END if value is None else value + TEXT_END for value in values])
+
+    try:
+        return str(text)
+    except UnicodeError:
+        return text
+
+
+def split_texts(text):
+    """
+    Return the values joined with join_texts
+    """
+
+    return [None if value == NONE_TEXT else value for value in text.split(TEXT_END)[:-1]]
+
+
+def intern_string(value):
+    """
+    Return value interned if it is an ASCII string, so repeated values like times share memory
+    """
+
+    try:
+        return intern(str(value))
+    except (TypeError, UnicodeError):
+        return value
+
+
+def dumps(value):
+    """
+    Return the JSON document of value, with the entities in it written with their JSON shape
+    """
+
+    return _dumps_value(value)
+
+
+def _contains_entity(value):
+
+    if isinstance(value, Entity):
+        return True
+    if isinstance(value, dict):
+        return any(_contains_entity(item) for item in value.itervalues())
+    if isinstance(value, (list, tuple)):
+        return any(_contains_entity(item) for item in value)
+
+    return False
+
+
+def _dumps_value(value):
+
+    if value is None:
+        return 'null'
+    if isinstance(value, basestring):
+        return _encode_string(value)
+    if isinstance(value, Entity):
+        return value.dumps()
+    if not _contains_entity(value):
+        # Values without entities are written by the C encoder
+        return json.dumps(value)
+    if isinstance(value, dict):
+        return _dumps_object(value.items())
+
+    return '[' + ', '.join([_dumps_value(item) for item in value]) + ']'
+
+
+def _dumps_object(items):
+
+    return '{' + ', '.join([_encode_string(tag) + ': ' + _dumps_value(value) for tag, value in items]) + '}'
+
+
+def _to_dict_value(value):
+
+    if isinstance(value, Entity):
+        return value.to_dict()
+    if isinstance(value, dict):
+        return OrderedDict((tag, _to_dict_value(item)) for tag, item in value.items())
+    if isinstance(value, (list, tuple)):
+        return [_to_dict_value(item) for item in value]
+
+    return value
+
+
+class Entity(object):
+    """
+    Base of the entities. Subclasses are built with the values of their __slots__ in order, slots left out
+    being None, and give their fields as they are in JSON with get_items.
+    """
+
+    __slots__ = ()
+
+    def __init__(self, *values):
+        if len(values) > len(self.__slots__):
+            raise TypeError('{0} takes at most {1} values'.format(type(self).__name__, len(self.__slots__)))
+
+        for slot, value in izip_longest(self.__slots__, values):
+            setattr(self, slot, value)
+
+    @classmethod
+    def from_dict(cls, value):
+        raise NotImplementedError()
+
+    @classmethod
+    def from_value(cls, value):
+        """
+        Return value if it is already an entity of this class, or build it from its dict otherwise
+        """
+
+        if value is None or isinstance(value, cls):
+            return value
+
+        return cls.from_dict(value)
+
+    def get_items(self):
+        """
+        Return (tag, value) pairs of the JSON shape of the entity. Values are strings, None, entities, or
+        lists and dicts of them.
+        """
+
+        raise NotImplementedError()
+
+    def get_tags(self):
+
+        return [tag for tag, _ in self.get_items()]
+
+    def get_fields(self, fields):
+        """
+        Return some fields of the entity in their JSON shape, in the order given. Unknown ones are None.
+        """
+
+        items = dict(self.get_items())
+
+        return OrderedDict((field, _to_dict_value(items.get(field))) for field in fields)
+
+    def to_dict(self):
+
+        return OrderedDict((tag, _to_dict_value(value)) for tag, value in self.get_items())
+
+    def dumps(self):
+
+        return _dumps_object(self.get_items())
+
+    def __eq__(self, other):
+
+        return isinstance(other, Entity) and self.dumps() == other.dumps()
+
+    def __ne__(self, other):
+
+        return not self == other
+
+    def __repr__(self):
+
+        return '{0}({1})'.format(type(self).__name__, self.dumps())
+
+
+class Stop(Entity):
+
+    __slots__ = ('tag', 'title', 'lat', 'lon', 'stop_id')
+
+    @classmethod
+    def from_dict(cls, value):
+
+        return cls(value.get(api.TAG_TAG), value.get(api.TAG_TITLE), value.get(api.TAG_LAT),
+                   value.get(api.TAG_LON), value.get(api.TAG_STOP_ID))
+
+    def get_items(self):
+
+        return [
+            (api.TAG_TAG, self.tag),
+            (api.TAG_TITLE, self.title),
+            (api.TAG_LAT, self.lat),
+            (api.TAG_LON, self.lon),
+            (api.TAG_STOP_ID, self.stop_id)
+        ]
+
+
+class Direction(Entity):
+
+    __slots__ = ('tag', 'title', 'name', 'use_for_ui', 'stop_tags')
+
+    @classmethod
+    def from_dict(cls, value):
+
+        return cls(value.get(api.TAG_TAG), value.get(api.TAG_TITLE), value.get(api.TAG_NAME),
+                   value.get(api.TAG_USE_FOR_UI),
+                   tuple(stop[api.TAG_TAG] for stop in value.get(api.TAG_STOPS, [])))
+
+    def get_items(self):
+
+        return [
+            (api.TAG_TAG, self.tag),
+            (api.TAG_TITLE, self.title),
+            (api.TAG_NAME, self.name),
+            (api.TAG_USE_FOR_UI, self.use_for_ui),
+            (api.TAG_STOPS, [{api.TAG_TAG: stop_tag} for stop_tag in self.stop_tags])
+        ]
+
+
+class Path(Entity):
+    """
+    Path of a route, with the latitudes and the longitudes of its points each joined in a string
+    """
+
+    __slots__ = ('lats', 'lons')
+
+    @classmethod
+    def from_dict(cls, value):
+
+        points = value.get(api.TAG_POINTS, [])
+
+        return cls(join_texts([point.get(api.TAG_LAT) for point in points]),
+                   join_texts([point.get(api.TAG_LON) for point in points]))
+
+    def get_positions(self):
+        """
+        Return latitude and longitude of each point as floats, which are NaN if they are not numbers
+        """
+
+        return [(parse_float(lat), parse_float(lon))
+                for lat, lon in izip(split_texts(self.lats), split_texts(self.lons))]
+
+    def get_point_count(self):
+
+        return self.lats.count(TEXT_END)
+
+    def select(self, indexes):
+        """
+        Return a path with only the points at indexes
+        """
+
+        lats = split_texts(self.lats)
+        lons = split_texts(self.lons)
+
+        return Path(join_texts([lats[index] for index in indexes]),
+                    join_texts([lons[index] for index in indexes]))
+
+    def get_points(self):
+        """
+        Return the points of the path in their JSON shape
+        """
+
+        return [OrderedDict([(api.TAG_LAT, lat), (api.TAG_LON, lon)])
+                for lat, lon in izip(split_texts(self.lats), split_texts(self.lons))]
+
+    def get_items(self):
+
+        return [(api.TAG_POINTS, self.get_points())]
+
+    def dumps(self):
+
+        if not _PLAIN_TEXTS.match(self.lats) or not _PLAIN_TEXTS.match(self.lons):
+            return super(Path, self).dumps()
+
+        # Paths have most of the values of a route config, so points with plain numbers are written directly
+        points = ['{"lat": "' + lat + '", "lon": "' + lon + '"}'
+                  for lat, lon in izip(self.lats.split(TEXT_END)[:-1], self.lons.split(TEXT_END)[:-1])]
+
+        return '{"points": [' + ', '.join(points) + ']}'
+
+
+class Route(Entity):
+
+    __slots__ = ('tag', 'title', 'color', 'opposite_color', 'lat_min', 'lat_max', 'lon_min', 'lon_max',
+                 'stops', 'directions', 'paths')
+
+    @classmethod
+    def from_dict(cls, value):
+
+        return cls(value.get(api.TAG_TAG), value.get(api.TAG_TITLE), value.get(api.TAG_COLOR),
+                   value.get(api.TAG_OPPOSITE_COLOR), value.get(api.TAG_LAT_MIN), value.get(api.TAG_LAT_MAX),
+                   value.get(api.TAG_LON_MIN), value.get(api.TAG_LON_MAX),
+                   tuple(Stop.from_dict(stop) for stop in value.get(api.TAG_STOPS, [])),
+                   tuple(Direction.from_dict(direction) for direction in value.get(api.TAG_DIRECTIONS, [])),
+                   tuple(Path.from_dict(path) for path in value.get(api.TAG_PATHS, [])))
+
+    def get_items(self):
+
+        return [
+            (api.TAG_TAG, self.tag),
+            (api.TAG_TITLE, self.title),
+            (api.TAG_COLOR, self.color),
+            (api.TAG_OPPOSITE_COLOR, self.opposite_color),
+            (api.TAG_LAT_MIN, self.lat_min),
+            (api.TAG_LAT_MAX, self.lat_max),
+            (api.TAG_LON_MIN, self.lon_min),
+            (api.TAG_LON_MAX, self.lon_max),
+            (api.TAG_STOPS, self.stops),
+            (api.TAG_DIRECTIONS, self.directions),
+            (api.TAG_PATHS, self.paths)
+        ]
+
+
+class ScheduleStop(Entity):
+    """
+    Scheduled arrivals at a stop in a schedule item, with their epoch times in an array of ints.
+    Epoch times are written from the array, unless any of them is not an integer written as such, in which
+    case their texts are kept joined in epoch_texts too.
+    """
+
+    __slots__ = ('tag', 'title', 'epochs', 'times', 'epoch_texts')
+
+    @classmethod
+    def from_dict(cls, value):
+
+        arrivals = value.get(api.TAG_SCHEDULED_ARRIVALS, [])
+        epoch_texts = [arrival.get(api.TAG_EPOCH_TIME) for arrival in arrivals]
+        epochs = array('l', [parse_int(epoch_text, -1) for epoch_text in epoch_texts])
+        written = all(epoch_text == str(epoch) for epoch_text, epoch in izip(epoch_texts, epochs))
+
+        return cls(value.get(api.TAG_TAG), value.get(api.TAG_TITLE), epochs,
+                   tuple(intern_string(arrival.get(api.TAG_TIME_DATA)) for arrival in arrivals),
+                   None if written else join_texts(epoch_texts))
+
+    def get_epoch_texts(self):
+
+        if self.epoch_texts is not None:
+            return split_texts(self.epoch_texts)
+
+        return [str(epoch) for epoch in self.epochs]
+
+    def get_items(self):
+
+        return [
+            (api.TAG_TAG, self.tag),
+            (api.TAG_TITLE, self.title),
+            (api.TAG_SCHEDULED_ARRIVALS, [OrderedDict([
+                (api.TAG_EPOCH_TIME, epoch_text),
+                (api.TAG_TIME_DATA, time_data)
+            ]) for epoch_text, time_data in izip(self.get_epoch_texts(), self.times)])
+        ]
+
+    def dumps(self):
+
+        if self.tag is None or self.title is None or self.epoch_texts is not None:
+            return super(ScheduleStop, self).dumps()
+
+        # Arrivals are most of the values of a schedule, so they are written directly
+        arrivals = ['{"epochTime": "' + str(epoch) + '", "timeData": ' + _dumps_value(time_data) + '}'
+                    for epoch, time_data in izip(self.epochs, self.times)]
+
+        return '{"tag": ' + _dumps_value(self.tag) + ', "title": ' + _dumps_value(self.title) + \
+            ', "scheduledArrivals": [' + ', '.join(arrivals) + ']}'
+
+
+class ScheduleItem(Entity):
+
+    __slots__ = ('service_class', 'direction', 'stops', 'schedule_start_time', 'schedule_end_time')
+
+    @classmethod
+    def from_dict(cls, value):
+
+        return cls(value.get(api.TAG_SERVICE_CLASS), value.get(api.TAG_DIRECTION),
+                   OrderedDict((stop_tag, ScheduleStop.from_dict(stop))
+                               for stop_tag, stop in value.get(api.TAG_STOPS, {}).items()),
+                   value.get(api.TAG_SCHEDULE_START_TIME), value.get(api.TAG_SCHEDULE_END_TIME))
+
+    def get_items(self):
+
+        return [
+            (api.TAG_SERVICE_CLASS, self.service_class),
+            (api.TAG_DIRECTION, self.direction),
+            (api.TAG_STOPS, self.stops),
+            (api.TAG_SCHEDULE_START_TIME, self.schedule_start_time),
+            (api.TAG_SCHEDULE_END_TIME, self.schedule_end_time)
+        ]
+
+
+class Schedule(Entity):
+
+    __slots__ = ('schedule_class', 'items')
+
+    @classmethod
+    def from_dict(cls, value):
+
+        return cls(value.get(api.TAG_SCHEDULE_CLASS),
+                   OrderedDict((key, ScheduleItem.from_dict(item))
+                               for key, item in value.get(api.TAG_SCHEDULE_ITEMS, {}).items()))
+
+    def get_items(self):
+
+        return [
+            (api.TAG_SCHEDULE_CLASS, self.schedule_class),
+            (api.TAG_SCHEDULE_ITEMS, self.items)
+        ]
+
+
+class Vehicle(Entity):
+    """
+    Vehicle as reported in a vehicleLocations response, with the tag of its route when it is known
+    """
+
+    __slots__ = ('route_tag', 'id', 'dir_tag', 'lat', 'lon', 'secs_since_report', 'predictable', 'heading',
+                 'speed_km_hr')
+
+    @classmethod
+    def from_dict(cls, value):
+
+        return cls(value.get(api.TAG_ROUTE_TAG), value.get(api.TAG_ID), value.get(api.TAG_DIR_TAG),
+                   value.get(api.TAG_LAT), value.get(api.TAG_LON), value.get(api.TAG_SECS_SINCE_REPORT),
+                   value.get(api.TAG_PREDICTABLE), value.get(api.TAG_HEADING), value.get(api.TAG_SPEED_KM_HR))
+
+    def get_items(self):
+
+        # The route tag is not in vehicleLocations responses, it is added to vehicles found in a box
+        route_items = [] if self.route_tag is None else [(api.TAG_ROUTE_TAG, self.route_tag)]
+
+        return route_items + [
+            (api.TAG_ID, self.id),
+            (api.TAG_DIR_TAG, self.dir_tag),
+            (api.TAG_LAT, self.lat),
+            (api.TAG_LON, self.lon),
+            (api.TAG_SECS_SINCE_REPORT, self.secs_since_report),
+            (api.TAG_PREDICTABLE, self.predictable),
+            (api.TAG_HEADING, self.heading),
+            (api.TAG_SPEED_KM_HR, self.speed_km_hr)
+        ]
@@ -0,0 +1,350 @@
+"""
+Refresh cached entities in background, out of the path of requests
+"""
+import logging
+import logging.config
+import os
+import re
+from collections import OrderedDict
+
+from tornado import gen
+from tornado import ioloop
+
+from pubtrans.common import dictionaries
+from pubtrans.common import exceptions
+from pubtrans.common.context import Context
+from pubtrans.common.support import Support
+from pubtrans.config import settings
+from pubtrans.repositories import redis_repository
+
+STAT_STALE_SCHEDULED = 'staleRefreshesScheduled'
+STAT_STALE_FAILED = 'staleRefreshesFailed'
+STAT_STALE_SKIPPED = 'staleRefreshesSkipped'
+STAT_POPULAR_REFRESHED = 'popularRefreshes'
+STAT_POPULAR_FAILED = 'popularRefreshesFailed'
+STAT_POPULAR_OVER_BUDGET = 'popularRefreshesOverBudget'
+STAT_VEHICLE_POLLS = 'vehiclePolls'
+STAT_VEHICLE_POLLS_FAILED = 'vehiclePollsFailed'
+
+
+# Resources as they are counted in uris:count and the cached entity each one is served from
+URI_PATTERNS = [
+    (re.compile(r'.*/v1/agencies$'), redis_repository.KEY_AGENCIES),
+    (re.compile(r'.*/v1/([^/]+)/routes/?$'), redis_repository.KEY_ROUTES),
+    (re.compile(r'.*/v1/([^/]+)/routes/([^/]+)$'), redis_repository.KEY_ROUTE),
+    (re.compile(r'.*/v1/([^/]+)/routes/([^/]+)/schedule$'), redis_repository.KEY_ROUTE_SCHEDULE),
+    (re.compile(r'.*/v1/([^/]+)/routes/([^/]+)/stops/[^/]+/arrivals(?:\?.*)?$'),
+     redis_repository.KEY_ROUTE_SCHEDULE),
+    (re.compile(r'.*/v1/([^/]+)/routes/([^/]+)/messages$'), redis_repository.KEY_ROUTE_MESSAGES),
+    (re.compile(r'.*/v1/([^/]+)/routes/([^/]+)/vehicles(?:\?.*)?$'), redis_repository.KEY_ROUTE_VEHICLES),
+    (re.compile(r'.*/v1/([^/]+)/routes/([^/]+)/predictions\?stopTag=([^&]+)$'),
+     redis_repository.KEY_ROUTE_PREDICTIONS)
+]
+
+
+def make_support(handler_name):
+    """
+    Build a Support instance for work that is not done for a request
+    """
+
+    logging.config.dictConfig(settings.LOGGING)
+    logger = logging.getLogger(settings.LOGGER_NAME)
+
+    extra_info = {
+        'environment': os.environ.get('PUBTRANS_ENV') or 'unknown',
+        'service': 'pubtrans',
+        'handler': handler_name
+    }
+
+    return Support(logger, extra_info)
+
+
+def make_domain_settings(app_settings, handler_name):
+    """
+    Build settings for work done out of requests, with the shared objects of app_settings and a support and
+    context of its own to use the long lived domain objects with
+    """
+
+    support = make_support(handler_name)
+
+    return dictionaries.DictAsObject(
+        support=support,
+        context=Context(support=support),
+        agencies=app_settings.agencies,
+        repository=app_settings.repository)
+
+
+def parse_uri(uri):
+    """
+    Return entity and key args of the cached entity used to serve uri, or None if it is not cached
+    """
+
+    for pattern, entity in URI_PATTERNS:
+        match = pattern.match(uri)
+        if match:
+            return entity, match.groups()
+
+    return None
+
+
+def fetch_entity(domain_settings, entity, key_args):
+    """
+    Fetch entity identified by key_args from NextBus and store it in cache
+    """
+
+    if entity == redis_repository.KEY_AGENCIES:
+        return domain_settings.agencies.get_service(domain_settings.context).fetch_agencies()
+
+    agency_tag = key_args[0]
+    agency_obj = domain_settings.agencies.get_agency(agency_tag, domain_settings.context)
+
+    if entity == redis_repository.KEY_ROUTES:
+        fetched = agency_obj.fetch_routes()
+    elif entity in (redis_repository.KEY_ROUTE, redis_repository.KEY_ROUTE_GEOMETRY):
+        # Geometry is built again when its route config is stored
+        fetched = agency_obj.fetch_route(key_args[1])
+    elif entity == redis_repository.KEY_ROUTE_SCHEDULE:
+        fetched = agency_obj.schedules.fetch_route_schedule(agency_tag, key_args[1])
+    elif entity == redis_repository.KEY_ROUTE_MESSAGES:
+        fetched = agency_obj.messages.fetch_route_messages(agency_tag, key_args[1])
+    elif entity == redis_repository.KEY_ROUTE_VEHICLES:
+        fetched = agency_obj.vehicles.fetch_route_vehicles(agency_tag, key_args[1])
+    elif entity == redis_repository.KEY_ROUTE_PREDICTIONS:
+        fetched = agency_obj.predictions.fetch_route_predictions(agency_tag, key_args[1], key_args[2])
+    else:
+        raise ValueError('Unknown entity {0}'.format(entity))
+
+    return fetched
+
+
+@gen.coroutine
+def refresh_stale_entity(domain_settings, entity, key_args):
+    """
+    Fetch a stale entity again, unless another replica already stored a fresh one in redis.
+    Return True if it was fetched.
+    """
+
+    repository = domain_settings.repository
+
+    # The copy in memory is the stale one, so what another replica stores is read from redis
+    repository.forget_in_memory(entity, key_args)
+
+    try:
+        time_to_stale, = yield repository.get_times_to_stale([(entity, tuple(key_args))])
+    except exceptions.DatabaseOperationError:
+        time_to_stale = None
+
+    if time_to_stale is not None and time_to_stale > 0:
+        raise gen.Return(False)
+
+    yield fetch_entity(domain_settings, entity, key_args)
+
+    raise gen.Return(True)
+
+
+class StaleRefresher(object):
+    """
+    Stale handler of the repository. Each stale entity is refreshed once on the IOLoop while
+    requests keep being answered with the stale value.
+    """
+
+    def __init__(self, app_settings):
+        self.app_settings = app_settings
+        self.scheduled = 0
+        self.failed = 0
+        self.skipped = 0
+        self._refreshing = set()
+        self._domain_settings = None
+
+    def refresh(self, entity, key_args):
+        """
+        Schedule a refresh of entity identified by key_args, unless one is going on
+        """
+
+        key = (entity,) + tuple(key_args)
+        if key in self._refreshing:
+            return
+
+        self._refreshing.add(key)
+        self.scheduled += 1
+        ioloop.IOLoop.current().spawn_callback(self._refresh, key, entity, key_args)
+
+    @gen.coroutine
+    def _refresh(self, key, entity, key_args):
+
+        domain_settings = self._get_domain_settings()
+
+        try:
+            fetched = yield refresh_stale_entity(domain_settings, entity, key_args)
+            self.skipped += not fetched
+        except Exception as ex:  # pylint: disable=broad-except
+            self.failed += 1
+            domain_settings.support.notify_info('[StaleRefresher] Cannot refresh {0}: {1}'.
+                                                format(':'.join(key), ex))
+        finally:
+            self._refreshing.discard(key)
+
+    def _get_domain_settings(self):
+
+        if self._domain_settings is None:
+            self._domain_settings = make_domain_settings(self.app_settings, 'StaleRefresher')
+
+        return self._domain_settings
+
+    def get_stats(self):
+        return OrderedDict([
+            (STAT_STALE_SCHEDULED, self.scheduled),
+            (STAT_STALE_FAILED, self.failed),
+            (STAT_STALE_SKIPPED, self.skipped)
+        ])
+
+
+class PeriodicRefresher(object):
+    """
+    Base of refreshers that run every interval seconds on the IOLoop, skipping a run while the previous one
+    is still going on
+    """
+
+    def __init__(self, app_settings, interval):
+        self.app_settings = app_settings
+        self.interval = interval
+        self._running = False
+        self._periodic_callback = None
+        self._domain_settings = None
+
+    def start(self):
+
+        self._periodic_callback = ioloop.PeriodicCallback(self.run, self.interval * 1000)
+        self._periodic_callback.start()
+
+    def stop(self):
+
+        if self._periodic_callback is not None:
+            self._periodic_callback.stop()
+            self._periodic_callback = None
+
+    @gen.coroutine
+    def run(self):
+        """
+        Run the refresh, unless previous run is still going on
+        """
+
+        if self._running:
+            return
+
+        self._running = True
+        try:
+            yield self._run(self._get_domain_settings())
+        finally:
+            self._running = False
+
+    @gen.coroutine
+    def _run(self, domain_settings):
+        raise NotImplementedError()
+
+    def _get_domain_settings(self):
+
+        if self._domain_settings is None:
+            self._domain_settings = make_domain_settings(self.app_settings, type(self).__name__)
+
+        return self._domain_settings
+
+
+class PopularityRefresher(PeriodicRefresher):
+    """
+    Keep the most requested resources warm.
+    Every interval the entities behind the top uris in uris:count that would get stale before the next
+    runs are refreshed, most requested first, making at most budget calls to NextBus.
+    """
+
+    def __init__(self, app_settings, interval, top_uris, budget):
+        super(PopularityRefresher, self).__init__(app_settings, interval)
+        self.top_uris = top_uris
+        self.budget = budget
+        self._counts = OrderedDict((stat, 0) for stat in [STAT_POPULAR_REFRESHED,
+                                                          STAT_POPULAR_FAILED,
+                                                          STAT_POPULAR_OVER_BUDGET])
+
+    @gen.coroutine
+    def _run(self, domain_settings):
+
+        try:
+            due = yield self._get_due(domain_settings.repository)
+        except exceptions.DatabaseOperationError as ex:
+            domain_settings.support.notify_info('[PopularityRefresher] Cache not available: {0}'.
+                                                format(ex.message))
+            return
+
+        self._counts[STAT_POPULAR_OVER_BUDGET] += max(len(due) - self.budget, 0)
+        due = due[:self.budget]
+
+        concurrency = settings.POPULAR_REFRESH_CONCURRENCY
+        for start in range(0, len(due), concurrency):
+            yield [self._refresh(domain_settings, entity, key_args)
+                   for entity, key_args in due[start:start + concurrency]]
+
+    @gen.coroutine
+    def _get_due(self, repository):
+        """
+        Entities behind the top uris, most requested first, that would get stale before the next run has
+        finished too
+        """
+
+        uris = yield repository.uri_stats.get_popular_uris(self.top_uris)
+        items = []
+        for uri in uris:
+            item = parse_uri(uri)
+            if item is not None and item not in items:
+                items.append(item)
+
+        times_to_stale = yield repository.get_times_to_stale(items)
+
+        raise gen.Return([due_item for due_item, time_to_stale in zip(items, times_to_stale)
+                          if time_to_stale is None or time_to_stale < 2 * self.interval])
+
+    @gen.coroutine
+    def _refresh(self, domain_settings, entity, key_args):
+
+        try:
+            yield fetch_entity(domain_settings, entity, key_args)
+            self._counts[STAT_POPULAR_REFRESHED] += 1
+        except Exception as ex:  # pylint: disable=broad-except
+            self._counts[STAT_POPULAR_FAILED] += 1
+            domain_settings.support.notify_info('[PopularityRefresher] Cannot refresh {0} {1}: {2}'.
+                                                format(entity, ':'.join(key_args), ex))
+
+    def get_stats(self):
+        return OrderedDict(self._counts)
+
+
+class VehiclePoller(PeriodicRefresher):
+    """
+    Keep the vehicles of every route of some agencies in cache, and their positions in memory.
+    Every interval the vehicle states of all the routes of each agency are updated with a single call to
+    NextBus, instead of one for each route, and stored together.
+    """
+
+    def __init__(self, app_settings, interval, agency_tags):
+        super(VehiclePoller, self).__init__(app_settings, interval)
+        self.agency_tags = agency_tags
+        self._counts = OrderedDict((stat, 0) for stat in [STAT_VEHICLE_POLLS, STAT_VEHICLE_POLLS_FAILED])
+
+    @gen.coroutine
+    def _run(self, domain_settings):
+
+        yield [self._poll(domain_settings, agency_tag) for agency_tag in self.agency_tags]
+
+    @gen.coroutine
+    def _poll(self, domain_settings, agency_tag):
+
+        try:
+            agency_obj = domain_settings.agencies.get_agency(agency_tag, domain_settings.context)
+            yield agency_obj.vehicles.poll_agency_vehicles()
+            self._counts[STAT_VEHICLE_POLLS] += 1
+        except Exception as ex:  # pylint: disable=broad-except
+            self._counts[STAT_VEHICLE_POLLS_FAILED] += 1
+            domain_settings.support.notify_info('[VehiclePoller] Cannot poll vehicles of {0}: {1}'.
+                                                format(agency_tag, ex))
+
+    def get_stats(self):
+        return OrderedDict(self._counts)
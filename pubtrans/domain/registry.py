@@ -0,0 +1,51 @@
+"""
+Long lived domain objects of the process, so state kept in them survives requests
+
+There is an Agency object for each agency most recently asked for and a single Service object. Requests
+get a view of them for their context with get_agency and get_service, which shares everything with the
+object kept here but the support and request id of the request.
+"""
+from collections import OrderedDict
+
+from pubtrans.domain import agency
+from pubtrans.domain import service
+
+
+class AgencyRegistry(object):
+    """
+    Agency objects by agency tag, and the Service object, built once with the settings of the application.
+    It is meant to be used only from the IOLoop thread, so it is not thread safe.
+    """
+
+    def __init__(self, app_settings, support, max_agencies):
+        self.app_settings = app_settings
+        self.support = support
+        self.max_agencies = max_agencies
+        self._agencies = OrderedDict()
+        self._service = None
+
+    def get_agency(self, agency_tag, context=None):
+        """
+        Return the Agency object of agency_tag, as a view for context if it is given
+        """
+
+        agency_obj = self._agencies.pop(agency_tag, None)
+        if agency_obj is None:
+            agency_obj = agency.Agency(agency_tag, self.app_settings, self.support)
+
+        # Re insert to keep the most recently used ones
+        self._agencies[agency_tag] = agency_obj
+        while len(self._agencies) > self.max_agencies:
+            self._agencies.popitem(last=False)
+
+        return agency_obj if context is None else agency_obj.with_context(context)
+
+    def get_service(self, context=None):
+        """
+        Return the Service object, as a view for context if it is given
+        """
+
+        if self._service is None:
+            self._service = service.Service(self.app_settings, self.support)
+
+        return self._service if context is None else self._service.with_context(context)
@@ -0,0 +1,226 @@
+"""
+Compact forms of the paths of a route config, to serve its geometry without every point of every path
+
+Paths are simplified with the Douglas-Peucker algorithm for each of a few tolerances in meters, keeping the
+indexes of the points that are left, and each simplified path is also encoded as a Google polyline. They are
+built once each time the route config is refreshed and kept in cache next to it, so a request only picks
+the ones built with the largest tolerance not above the one it asks for. As the route config is cached
+apart, the number of points of each path the geometry was built from is kept in it too.
+"""
+import math
+from collections import OrderedDict
+
+from pubtrans.domain import api
+from pubtrans.domain import entities
+from pubtrans.domain import stop_index
+
+GEOMETRY_SIMPLIFIED = 'simplified'
+GEOMETRY_POLYLINE = 'polyline'
+GEOMETRIES = [GEOMETRY_SIMPLIFIED, GEOMETRY_POLYLINE]
+
+KEY_INDEXES = 'indexes'
+KEY_POLYLINES = 'polylines'
+KEY_POINT_COUNTS = 'pointCounts'
+
+POLYLINE_PRECISION = 1e5
+
+
+def build_geometry(paths, tolerances):
+    """
+    Return the indexes of the points kept and the polylines of every path simplified with each tolerance
+    in whole meters, by tolerance as a string, with the number of points of each path
+    """
+
+    point_counts = get_point_counts(paths)
+    simplifiable_paths = []
+    for path in paths:
+        indexed_positions = get_positions(path)
+        significances = get_significances([position for _, position in indexed_positions])
+        simplifiable_paths.append(zip(indexed_positions, significances))
+
+    geometry = OrderedDict()
+    for tolerance in sorted(tolerances):
+        indexes_list, polylines = simplify_paths(simplifiable_paths, tolerance)
+        geometry[str(tolerance)] = {
+            KEY_INDEXES: indexes_list,
+            KEY_POLYLINES: polylines,
+            KEY_POINT_COUNTS: point_counts
+        }
+
+    return geometry
+
+
+def simplify_paths(simplifiable_paths, tolerance):
+    """
+    Return the indexes of the points kept and the polyline of each path, as a list of indexed positions
+    with their significance, simplified with tolerance
+    """
+
+    indexes_list = []
+    polylines = []
+    for simplifiable_path in simplifiable_paths:
+        kept = [indexed_position for indexed_position, significance in simplifiable_path
+                if significance > tolerance]
+        indexes_list.append([index for index, _ in kept])
+        polylines.append(encode_polyline([position for _, position in kept]))
+
+    return indexes_list, polylines
+
+
+def get_point_counts(paths):
+    """
+    Return the number of points of each path
+    """
+
+    return [entities.Path.from_value(path).get_point_count() for path in paths]
+
+
+def is_built_for(geometry, paths):
+    """
+    Return whether geometry was built for paths with as many points as these ones, so their indexes fit them.
+    Geometries built before point counts were kept in them are not.
+    """
+
+    point_counts = get_point_counts(paths)
+
+    return all(simplified.get(KEY_POINT_COUNTS) == point_counts for simplified in geometry.values())
+
+
+def get_positions(path):
+    """
+    Return index and lat, lon of the points of a path that have valid ones
+    """
+
+    path = entities.Path.from_value(path)
+
+    return [(index, (lat, lon)) for index, (lat, lon) in enumerate(path.get_positions())
+            if lat == lat and lon == lon]
+
+
+def simplify(positions, tolerance):
+    """
+    Return sorted indexes of the positions kept by the Douglas-Peucker algorithm, so none of the ones left out
+    is further than tolerance meters from the simplified line
+    """
+
+    significances = get_significances(positions)
+
+    return [index for index, significance in enumerate(significances) if significance > tolerance]
+
+
+def get_significances(positions):
+    """
+    Return for each position the largest tolerance in meters for which the Douglas-Peucker algorithm keeps it,
+    so paths are simplified once for every tolerance. Ends are always kept.
+    """
+
+    count = len(positions)
+    significances = [float('inf')] * count
+    if count < 3:
+        return significances
+
+    # Project to meters around the first point, which is close enough for the length of a route
+    lon_meters = stop_index.METERS_PER_DEGREE * math.cos(math.radians(positions[0][0]))
+    points = [(lon * lon_meters, lat * stop_index.METERS_PER_DEGREE) for lat, lon in positions]
+
+    # Iterative, as long paths would go beyond the recursion limit. A position split off a segment is only
+    # kept if the segment is split too, so it is not more significant than the position that split it.
+    segments = [(0, count - 1, float('inf'))]
+    while segments:
+        first, last, bound = segments.pop()
+        if last - first < 2:
+            continue
+        farthest, max_squared_distance = get_farthest(points, first, last)
+        significance = min(math.sqrt(max_squared_distance), bound)
+        significances[farthest] = significance
+        segments.append((first, farthest, significance))
+        segments.append((farthest, last, significance))
+
+    return significances
+
+
+def get_farthest(points, first, last):
+    """
+    Return the index of the point between first and last that is farthest from the segment between them,
+    and its squared distance to it
+    """
+
+    farthest, max_squared_distance = None, -1.0
+    start, end = points[first], points[last]
+    for index in xrange(first + 1, last):
+        squared_distance = get_squared_segment_distance(points[index], start, end)
+        if squared_distance > max_squared_distance:
+            farthest, max_squared_distance = index, squared_distance
+
+    return farthest, max_squared_distance
+
+
+def get_squared_segment_distance(point, start, end):
+    """
+    Return squared distance from point to the segment from start to end, all of them as x, y
+    """
+
+    point_x, point_y = point
+    closest_x, closest_y = start
+    delta_x, delta_y = end[0] - closest_x, end[1] - closest_y
+    squared_length = delta_x * delta_x + delta_y * delta_y
+    if squared_length > 0:
+        # Closest point of the segment, as a fraction of its length from start
+        fraction = max(0.0, min(1.0, ((point_x - closest_x) * delta_x + (point_y - closest_y) * delta_y) /
+                                squared_length))
+        closest_x, closest_y = closest_x + fraction * delta_x, closest_y + fraction * delta_y
+
+    return (point_x - closest_x) * (point_x - closest_x) + (point_y - closest_y) * (point_y - closest_y)
+
+
+def encode_polyline(positions):
+    """
+    Return positions encoded with the Google polyline algorithm, with 5 decimals
+    """
+
+    chunks = []
+    previous_lat = previous_lon = 0
+    for lat, lon in positions:
+        lat = int(round(lat * POLYLINE_PRECISION))
+        lon = int(round(lon * POLYLINE_PRECISION))
+        for delta in (lat - previous_lat, lon - previous_lon):
+            value = ~(delta << 1) if delta < 0 else delta << 1
+            while value >= 0x20:
+                chunks.append(chr((0x20 | (value & 0x1f)) + 63))
+                value >>= 5
+            chunks.append(chr(value + 63))
+        previous_lat, previous_lon = lat, lon
+
+    return ''.join(chunks)
+
+
+def select_tolerance(geometry, tolerance):
+    """
+    Return the largest tolerance of geometry not above tolerance, or the smallest one if all are above it
+    """
+
+    tolerances = sorted(int(key) for key in geometry)
+    selected = tolerances[0]
+    for candidate in tolerances:
+        if candidate <= tolerance:
+            selected = candidate
+
+    return selected
+
+
+def get_paths(paths, geometry, geometry_mode, tolerance):
+    """
+    Return tolerance used and paths of a route in a geometry mode, simplified with that tolerance from
+    the geometry built for them, as is_built_for tells
+    """
+
+    selected = select_tolerance(geometry, tolerance)
+    simplified = geometry[str(selected)]
+
+    if geometry_mode == GEOMETRY_POLYLINE:
+        compact_paths = [{api.TAG_POLYLINE: polyline} for polyline in simplified[KEY_POLYLINES]]
+    else:
+        compact_paths = [entities.Path.from_value(path).select(indexes)
+                         for path, indexes in zip(paths, simplified[KEY_INDEXES])]
+
+    return selected, compact_paths
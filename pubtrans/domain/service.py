@@ -1,15 +1,13 @@
 from tornado import gen
 
-from pubtrans.common import breaker
 from pubtrans.common import exceptions
+from pubtrans.domain import base_domain
 from pubtrans.services.next_bus import NextBusService
 
 
-class Service(object):
-    def __init__(self, app_settings):
-        self.support = app_settings.support
-        self.breaker_set = app_settings.circuit_breaker_set
-        self.repository = app_settings.repository
+class Service(base_domain.BaseDomain):
+
+    LOG_TAG = '[Service]'
 
     @gen.coroutine
     def get_agencies(self):
@@ -20,15 +18,25 @@ class Service(object):
             # Use service and cache result
             self.support.notify_debug('agencies not found in cache. Using service')
 
-            try:
-                with self.breaker_set.context('next_bus'):
-                    nextbus_service = NextBusService(support=self.support)
-                    agencies = yield nextbus_service.get_agencies()
-            except breaker.CircuitOpenError:
-                self.support.notify_debug('[Service] Call to service provider failed. Circuit is open')
-                raise exceptions.ExternalProviderUnavailableTemporarily('NextBus')
+            agencies = yield self.fetch_agencies()
+
+        raise gen.Return(agencies)
+
+    @gen.coroutine
+    def get_rendered_agencies(self):
+
+        agencies = yield self.get_rendered(self.repository.get_rendered_agencies, self.get_agencies)
+
+        raise gen.Return(agencies)
+
+    @gen.coroutine
+    def fetch_agencies(self):
 
-            yield self.store_agencies_in_cache(agencies)
+        agencies = yield self.fetch(
+            (NextBusService.COMMAND_AGENCY_LIST,),
+            lambda service: service.get_agencies(),
+            self.store_agencies_in_cache,
+            self.get_agencies_from_cache)
 
         raise gen.Return(agencies)
 
@@ -0,0 +1,61 @@
+"""
+Service windows of routes, the first and last time a route runs for each service class and direction
+
+Times are seconds since the start of the service day. Service that goes on past midnight ends after
+SECONDS_PER_DAY, and it is also taken into account in the early hours of the next day.
+"""
+from pubtrans.domain import entities
+
+# Service class of each day, by weekday number as given by %w
+SERVICE_CLASSES = ['sun', 'wkd', 'wkd', 'wkd', 'wkd', 'wkd', 'sat']
+
+SECONDS_PER_DAY = 24 * 60 * 60
+
+
+def build_windows(schedule):
+    """
+    Return the service windows in a route schedule, as [service class, direction, start, end] lists
+    """
+
+    schedule = entities.Schedule.from_value(schedule)
+
+    windows = []
+    for schedule_item in schedule.items.values():
+        epochs = [epoch for stop in schedule_item.stops.values() for epoch in stop.epochs if epoch >= 0]
+        if not epochs:
+            continue
+
+        windows.append([schedule_item.service_class.lower(),
+                        schedule_item.direction.lower(),
+                        min(epochs) / 1000,
+                        max(epochs) / 1000])
+
+    return windows
+
+
+def parse_time(time_str):
+    """
+    Return seconds since midnight of a HH:MM:SS time
+    """
+
+    hours, minutes, seconds = [int(part) for part in time_str.split(':')]
+
+    return hours * 3600 + minutes * 60 + seconds
+
+
+def is_running(windows, seconds, weekday):
+    """
+    Return True if a route with windows runs at seconds since midnight of weekday (0 is Sunday),
+    in any direction
+    """
+
+    service_class = SERVICE_CLASSES[weekday]
+    previous_service_class = SERVICE_CLASSES[(weekday - 1) % 7]
+
+    for window_service_class, _, start, end in windows:
+        if window_service_class == service_class and start <= seconds <= end:
+            return True
+        if window_service_class == previous_service_class and start <= seconds + SECONDS_PER_DAY <= end:
+            return True
+
+    return False
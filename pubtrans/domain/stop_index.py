@@ -0,0 +1,202 @@
+"""
+Inverted index of the stops of an agency, with the routes and directions that serve each of them
+
+It is built from the stops of each route, taken from its config, so it can be updated one route at a time.
+Stops are found by stop tag or by stopId, and stops near a point are found with a grid of GRID_CELL_DEGREES
+cells, so only the stops in the cells around the point are measured.
+"""
+import math
+from collections import OrderedDict
+
+from pubtrans.domain import api
+from pubtrans.domain import entities
+
+# About 550 m of latitude, so a few hundred meters around a point are in the 3x3 cells around it
+GRID_CELL_DEGREES = 0.005
+
+EARTH_RADIUS_METERS = 6371000.0
+METERS_PER_DEGREE = EARTH_RADIUS_METERS * math.pi / 180
+
+# Last index built for each agency, with the route stops it was built from.
+# It is meant to be used only from the IOLoop thread, so it is not thread safe.
+_INDEXES = {}
+
+
+def build_route_stops(route):
+    """
+    Return the stops of a route config, each with the tags of the directions of the route that serve it
+    """
+
+    route = entities.Route.from_value(route)
+
+    directions_by_stop = {}
+    for direction in route.directions:
+        for stop_tag in direction.stop_tags:
+            directions_by_stop.setdefault(stop_tag, []).append(direction.tag)
+
+    return [OrderedDict([
+        (api.TAG_TAG, stop.tag),
+        (api.TAG_TITLE, stop.title),
+        (api.TAG_LAT, stop.lat),
+        (api.TAG_LON, stop.lon),
+        (api.TAG_STOP_ID, stop.stop_id),
+        (api.TAG_DIRECTIONS, directions_by_stop.get(stop.tag, []))
+    ]) for stop in route.stops]
+
+
+def build_index(route_stops):
+    """
+    Invert the stops of the routes of an agency, given by route tag.
+    Return a dict with each stop and the routes serving it by stop tag, a dict with stop tags by stopId and
+    a dict with the stops in each grid cell, with their positions.
+    """
+
+    stops = {}
+    stop_ids = {}
+    grid = {}
+    for route_tag in sorted(route_stops):
+        for route_stop in route_stops[route_tag]:
+            stop_tag = route_stop[api.TAG_TAG]
+            stop = stops.get(stop_tag)
+            if stop is None:
+                stop = OrderedDict([
+                    (api.TAG_TAG, stop_tag),
+                    (api.TAG_TITLE, route_stop.get(api.TAG_TITLE)),
+                    (api.TAG_LAT, route_stop.get(api.TAG_LAT)),
+                    (api.TAG_LON, route_stop.get(api.TAG_LON)),
+                    (api.TAG_STOP_ID, route_stop.get(api.TAG_STOP_ID)),
+                    (api.TAG_ROUTES, [])
+                ])
+                stops[stop_tag] = stop
+                if stop[api.TAG_STOP_ID]:
+                    stop_ids[stop[api.TAG_STOP_ID]] = stop_tag
+                position = get_position(stop)
+                if position is not None:
+                    grid.setdefault(get_cell(*position), []).append((position, stop))
+
+            stop[api.TAG_ROUTES].append(OrderedDict([
+                (api.TAG_TAG, route_tag),
+                (api.TAG_DIRECTIONS, route_stop.get(api.TAG_DIRECTIONS, []))
+            ]))
+
+    return stops, stop_ids, grid
+
+
+def get_index(agency_tag, route_stops):
+    """
+    Return the index of route_stops of an agency, reusing the last one built while they have the same stops.
+    Route stops are given in a new dict whenever routes are added to them, so they are compared by route.
+    """
+
+    built = _INDEXES.get(agency_tag)
+    if built is not None and has_same_stops(built[0], route_stops):
+        # Keep the latest ones, so the stops of each route are the same objects next time
+        _INDEXES[agency_tag] = (route_stops, built[1])
+        return built[1]
+
+    index = build_index(route_stops)
+    _INDEXES[agency_tag] = (route_stops, index)
+
+    return index
+
+
+def has_same_stops(built_route_stops, route_stops):
+    """
+    Return whether route stops have the same routes with the same stops as the ones an index was built from.
+    Stops of a route that are the same object, as those read from the memory cache until they are updated or
+    expire, are not compared.
+    """
+
+    if len(built_route_stops) != len(route_stops):
+        return False
+
+    for route_tag, stops in route_stops.items():
+        built_stops = built_route_stops.get(route_tag)
+        if built_stops is not stops and built_stops != stops:
+            return False
+
+    return True
+
+
+def find_stop(index, stop):
+    """
+    Return the stop with the routes serving it, given by stop tag or stopId, or None if no route serves it
+    """
+
+    stops, stop_ids, _ = index
+
+    found = stops.get(stop)
+    if found is None and stop in stop_ids:
+        found = stops[stop_ids[stop]]
+
+    return found
+
+
+def find_nearby_stops(index, lat, lon, radius, limit):
+    """
+    Return up to limit stops within radius meters of lat, lon, closest first, with their distance in meters
+    """
+
+    _, _, grid = index
+
+    nearby_stops = []
+    for cell in get_cells_around(lat, lon, radius):
+        for position, stop in grid.get(cell, []):
+            distance = get_distance(lat, lon, position[0], position[1])
+            if distance <= radius:
+                nearby_stops.append((distance, stop))
+
+    nearby_stops.sort(key=lambda nearby_stop: nearby_stop[0])
+
+    response = []
+    for distance, stop in nearby_stops[:limit]:
+        nearby_stop = OrderedDict(stop)
+        nearby_stop[api.TAG_DISTANCE] = int(round(distance))
+        response.append(nearby_stop)
+
+    return response
+
+
+def get_position(stop):
+    """
+    Return lat and lon of a stop as floats, or None if it does not have valid ones
+    """
+
+    try:
+        return float(stop[api.TAG_LAT]), float(stop[api.TAG_LON])
+    except (TypeError, ValueError):
+        return None
+
+
+def get_cell(lat, lon):
+    """
+    Return the grid cell of a position
+    """
+
+    return int(math.floor(lat / GRID_CELL_DEGREES)), int(math.floor(lon / GRID_CELL_DEGREES))
+
+
+def get_cells_around(lat, lon, radius):
+    """
+    Return the grid cells with positions that may be within radius meters of lat, lon
+    """
+
+    lat_degrees = radius / METERS_PER_DEGREE
+    lon_degrees = radius / (METERS_PER_DEGREE * max(math.cos(math.radians(lat)), 0.01))
+    min_row, min_column = get_cell(lat - lat_degrees, lon - lon_degrees)
+    max_row, max_column = get_cell(lat + lat_degrees, lon + lon_degrees)
+
+    return [(row, column) for row in xrange(min_row, max_row + 1)
+            for column in xrange(min_column, max_column + 1)]
+
+
+def get_distance(lat1, lon1, lat2, lon2):
+    """
+    Return distance in meters between two positions, with an equirectangular approximation that is good
+    enough for the few kilometers stops are searched around a point
+    """
+
+    delta_lon = math.radians(lon2 - lon1) * math.cos(math.radians((lat1 + lat2) / 2))
+    delta_lat = math.radians(lat2 - lat1)
+
+    return math.sqrt(delta_lon * delta_lon + delta_lat * delta_lat) * EARTH_RADIUS_METERS
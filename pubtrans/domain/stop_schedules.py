@@ -0,0 +1,117 @@
+"""
+Scheduled arrivals of a route sliced by stop, to find the next ones at a stop without the whole schedule
+
+Arrivals of each stop are kept for each service class and direction as a sorted array of epoch times, in
+milliseconds since the start of the service day as in the schedule, so the next ones after a time are
+found with a binary search. Service that goes on past midnight is also taken into account in the early
+hours of the next day.
+"""
+import bisect
+from array import array
+from collections import OrderedDict
+
+from pubtrans.domain import api
+from pubtrans.domain import entities
+from pubtrans.domain import service_windows
+
+MILLISECONDS_PER_DAY = service_windows.SECONDS_PER_DAY * 1000
+
+# Arrivals built for the last schedules used, with the schedule each one was built from.
+# It is meant to be used only from the IOLoop thread, so it is not thread safe.
+MAX_SLICED_SCHEDULES = 512
+_SLICED_SCHEDULES = OrderedDict()
+
+
+def build_stop_schedules(schedule):
+    """
+    Return the arrivals in a route schedule by stop tag, each with the stop title and a list of
+    [service class, direction, sorted array of epoch times] lists
+    """
+
+    schedule = entities.Schedule.from_value(schedule)
+
+    stop_schedules = {}
+    for schedule_item in schedule.items.values():
+        service_class = schedule_item.service_class.lower()
+        direction = schedule_item.direction
+        for stop_tag, stop in schedule_item.stops.items():
+            epochs = sorted(epoch for epoch in stop.epochs if epoch >= 0)
+            stop_schedule = stop_schedules.setdefault(stop_tag, (stop.title, []))
+            stop_schedule[1].append([service_class, direction, array('l', epochs)])
+
+    return stop_schedules
+
+
+def get_stop_schedules(agency_tag, route_tag, schedule):
+    """
+    Return arrivals by stop of a route schedule, reusing the last ones built while it is the same.
+    Schedules read from the memory cache are the same object until they are updated or expire.
+    """
+
+    key = (agency_tag, route_tag)
+    sliced = _SLICED_SCHEDULES.pop(key, None)
+    if sliced is None or sliced[0] is not schedule:
+        sliced = (schedule, build_stop_schedules(schedule))
+
+    # Re insert to keep the most recently used ones
+    _SLICED_SCHEDULES[key] = sliced
+    while len(_SLICED_SCHEDULES) > MAX_SLICED_SCHEDULES:
+        _SLICED_SCHEDULES.popitem(last=False)
+
+    return sliced[1]
+
+
+def find_next_arrivals(stop_schedules, stop_tag, seconds, weekday, limit):
+    """
+    Return the stop title and up to limit arrivals at a stop after seconds since midnight of weekday
+    (0 is Sunday), in any direction and soonest first, or None if the route does not stop there
+    """
+
+    stop_schedule = stop_schedules.get(stop_tag)
+    if stop_schedule is None:
+        return None
+
+    title, schedule_items = stop_schedule
+    candidates = get_candidate_arrivals(schedule_items, seconds * 1000, weekday, limit)
+    candidates.sort(key=lambda candidate: candidate[0])
+
+    arrivals = [OrderedDict([
+        (api.TAG_DIRECTION, direction),
+        (api.TAG_EPOCH_TIME, str(epoch)),
+        (api.TAG_TIME_DATA, format_time(epoch))
+    ]) for _, direction, epoch in candidates[:limit]]
+
+    return title, arrivals
+
+
+def get_candidate_arrivals(schedule_items, milliseconds, weekday, limit):
+    """
+    Return up to limit arrivals of each schedule item after milliseconds since midnight of weekday, as
+    (milliseconds since midnight of weekday, direction, epoch time in their schedule)
+    """
+
+    service_class = service_windows.SERVICE_CLASSES[weekday]
+    previous_service_class = service_windows.SERVICE_CLASSES[(weekday - 1) % 7]
+
+    candidates = []
+    for item_service_class, direction, epochs in schedule_items:
+        if item_service_class == service_class:
+            start = bisect.bisect_left(epochs, milliseconds)
+            candidates.extend((epoch, direction, epoch) for epoch in epochs[start:start + limit])
+        if item_service_class == previous_service_class:
+            # Service of the day before that goes on past midnight
+            start = bisect.bisect_left(epochs, milliseconds + MILLISECONDS_PER_DAY)
+            candidates.extend((epoch - MILLISECONDS_PER_DAY, direction, epoch)
+                              for epoch in epochs[start:start + limit])
+
+    return candidates
+
+
+def format_time(epoch):
+    """
+    Return HH:MM:SS time of an epoch time in milliseconds since the start of the service day
+    """
+
+    seconds = epoch / 1000 % service_windows.SECONDS_PER_DAY
+
+    return '{0:02d}:{1:02d}:{2:02d}'.format(seconds / 3600, seconds / 60 % 60, seconds % 60)
@@ -0,0 +1,95 @@
+"""
+Latest positions of the vehicles of every route of some agencies, to find the ones in a bounding box
+
+Positions are taken from the vehicle states of all the routes of an agency each time they are polled.
+Vehicles are kept sorted by longitude, with longitudes and latitudes in arrays of floats, so a box is
+answered bisecting the longitudes and checking the latitudes of the vehicles between them in one pass.
+"""
+import bisect
+import time
+from array import array
+
+from pubtrans.domain import api
+from pubtrans.domain import entities
+from pubtrans.domain import vehicle_state
+
+
+class _AgencyPositions(object):  # pylint: disable=too-few-public-methods
+
+    __slots__ = ('lons', 'lats', 'vehicles', 'updated_at')
+
+    def __init__(self, lons, lats, vehicles, updated_at):
+        self.lons = lons
+        self.lats = lats
+        self.vehicles = vehicles
+        self.updated_at = updated_at
+
+
+def build_positions(states, updated_at):
+    """
+    Return the positions of the vehicles in the vehicle states of the routes of an agency, given by route tag.
+    Vehicles are entities with the tag of their route.
+    """
+
+    located_vehicles = []
+    for route_tag, state in states.items():
+        for vehicle in vehicle_state.diff(state, 0)[api.TAG_VEHICLES]:
+            located_vehicle = entities.Vehicle.from_dict(vehicle)
+            lat, lon = entities.parse_float(located_vehicle.lat), entities.parse_float(located_vehicle.lon)
+            if lat != lat or lon != lon:
+                continue
+            located_vehicle.route_tag = route_tag
+            located_vehicles.append((lon, lat, located_vehicle))
+
+    located_vehicles.sort(key=lambda located: located[0])
+
+    return _AgencyPositions(array('d', [located[0] for located in located_vehicles]),
+                            array('d', [located[1] for located in located_vehicles]),
+                            [located[2] for located in located_vehicles],
+                            updated_at)
+
+
+class VehiclePositions(object):
+    """
+    Latest positions of the vehicles of agencies, replaced as a whole each time an agency is polled.
+    It is meant to be used only from the IOLoop thread, so it is not thread safe.
+    """
+
+    def __init__(self, clock=time.time):
+        self.clock = clock
+        self._agencies = {}
+
+    def update(self, agency_tag, states):
+        """
+        Replace positions of the vehicles of an agency with the ones in the vehicle states of its routes
+        """
+
+        self._agencies[agency_tag] = build_positions(states, self.clock())
+
+    def get_age(self, agency_tag):
+        """
+        Return seconds since positions of an agency were updated, or None if there are none
+        """
+
+        positions = self._agencies.get(agency_tag)
+        if positions is None:
+            return None
+
+        return self.clock() - positions.updated_at
+
+    def find(self, agency_tag, box):
+        """
+        Return vehicles of an agency inside a bounding box (west, south, east, north), sorted by longitude
+        """
+
+        west, south, east, north = box
+
+        positions = self._agencies.get(agency_tag)
+        if positions is None:
+            return []
+
+        start = bisect.bisect_left(positions.lons, west)
+        end = bisect.bisect_right(positions.lons, east)
+        lats = positions.lats
+
+        return [positions.vehicles[index] for index in xrange(start, end) if south <= lats[index] <= north]
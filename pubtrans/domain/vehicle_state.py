@@ -0,0 +1,79 @@
+"""
+State of the vehicles of a route, kept up to date with the changes NextBus reports since the last poll
+
+The state has the vehicles with the time of their last report, and the lastTime NextBus returned. Clients
+asking for the vehicles reported since any lastTime are answered from it, as vehicleLocations would.
+"""
+from collections import OrderedDict
+
+from pubtrans.domain import api
+
+# Time of the last report of a vehicle, in milliseconds since epoch as lastTime. Only kept in the state.
+REPORT_TIME = 'reportTime'
+
+
+def is_state(value):
+    """
+    Return True if value is a vehicle state, and not a vehicleLocations response cached by previous versions
+    """
+
+    return isinstance(value, dict) and isinstance(value.get(api.TAG_LAST_TIME), (int, long))
+
+
+def get_last_time(state):
+    """
+    Return the lastTime to poll NextBus with to get the changes since state, 0 for all vehicles
+    """
+
+    return state[api.TAG_LAST_TIME] if state is not None else 0
+
+
+def merge(state, vehicles, expire_seconds):
+    """
+    Return state updated with vehicles, as built from a vehicleLocations response.
+    Vehicles not reported in the expire_seconds before the lastTime of NextBus are left out.
+    """
+
+    response_last_time = int(vehicles[api.TAG_LAST_TIME] or 0)
+    last_time = max(response_last_time, get_last_time(state))
+
+    merged = OrderedDict()
+    if state is not None:
+        for vehicle in state[api.TAG_VEHICLES]:
+            merged[vehicle[api.TAG_ID]] = vehicle
+
+    for reported_vehicle in vehicles[api.TAG_VEHICLES]:
+        vehicle = OrderedDict(reported_vehicle)
+        vehicle[REPORT_TIME] = response_last_time - int(vehicle.get(api.TAG_SECS_SINCE_REPORT) or 0) * 1000
+        merged[vehicle[api.TAG_ID]] = vehicle
+
+    oldest_report_time = last_time - expire_seconds * 1000
+
+    return OrderedDict([
+        (api.TAG_VEHICLES, [merged_vehicle for merged_vehicle in merged.values()
+                            if merged_vehicle[REPORT_TIME] >= oldest_report_time]),
+        (api.TAG_LAST_TIME, last_time)
+    ])
+
+
+def diff(state, last_time):
+    """
+    Return the vehicles in state reported after last_time, in the format of a vehicleLocations response
+    """
+
+    last_time = int(last_time)
+    state_last_time = state[api.TAG_LAST_TIME]
+
+    vehicles = []
+    for vehicle in state[api.TAG_VEHICLES]:
+        if vehicle[REPORT_TIME] <= last_time:
+            continue
+        vehicle = OrderedDict(vehicle)
+        report_time = vehicle.pop(REPORT_TIME)
+        vehicle[api.TAG_SECS_SINCE_REPORT] = str(max(0, (state_last_time - report_time) / 1000))
+        vehicles.append(vehicle)
+
+    return OrderedDict([
+        (api.TAG_VEHICLES, vehicles),
+        (api.TAG_LAST_TIME, str(state_last_time))
+    ])
@@ -5,7 +5,6 @@ from tornado import gen
 
 
 from pubtrans.domain import api
-from pubtrans.domain import service as svc
 from pubtrans.handlers import base_handler
 
 
@@ -19,11 +18,7 @@ class AgenciesHandlerV1(base_handler.BaseHandler):
 
         # repository = self.application_settings.repository
 
-        service = svc.Service(self.application_settings)
-        agencies = yield service.get_agencies()
+        service = self.application_settings.agencies.get_service(self.context)
+        agencies = yield service.get_rendered_agencies()
 
-        response = {
-            api.TAG_AGENCIES: agencies
-        }
-
-        self.build_response(response)
+        self.build_rendered_response(agencies, api.TAG_AGENCIES)
@@ -9,13 +9,17 @@ import os
 import sys
 import uuid
 
+import tornado.gen
+import tornado.ioloop
 import tornado.web
 import tornado.httpclient
 
 from pubtrans.common import constants
 from pubtrans.common import exceptions
 from pubtrans.config import settings
+from pubtrans.common.context import Context
 from pubtrans.common.support import Support
+from pubtrans.domain import entities
 
 
 class BaseHandler(tornado.web.RequestHandler):
@@ -68,8 +72,9 @@ class BaseHandler(tornado.web.RequestHandler):
         }
         self.support = Support(logger, extra_info)
 
-        if self.application_settings:
-            self.application_settings.support = self.support
+        # Request information is given to the shared domain objects each request uses, not kept in settings
+        self.context = Context(self.request, self.support)
+        self.context.request_id = self.request_id
 
     def prepare(self):
         """
@@ -123,6 +128,18 @@ class BaseHandler(tornado.web.RequestHandler):
         """
         self._build_response_internal(False, result, status_code)
 
+    def build_rendered_response(self, rendered, tag=None, status_code=None):
+        """
+        Build the response with a json document that is already rendered, wrapped in an object under tag
+        if given
+        """
+
+        if tag is not None:
+            rendered = '{' + json.dumps(tag) + ':' + rendered + '}'
+
+        self.set_header("Content-Type", "application/json")
+        self._build_response_internal(False, rendered, status_code)
+
     def _build_response_internal(self, apply_format, result, status_code=None):
         """
         Build the response data with the required format according to result
@@ -136,7 +153,7 @@ class BaseHandler(tornado.web.RequestHandler):
             self.write(body)
         else:
             if apply_format:
-                body = json.dumps(result)
+                body = entities.dumps(result)
             else:
                 body = result
 
@@ -166,7 +183,9 @@ class BaseHandler(tornado.web.RequestHandler):
         self.support.stat_timing('net.responses.time', timing)
 
         if not isinstance(result, exceptions.NotFoundBase):
-            self.support.update_uri_stats(self.request.path, timing)
+            # Not waited for, so the response is not held by redis
+            tornado.ioloop.IOLoop.current().spawn_callback(self._update_uri_stats, self.get_stats_uri(),
+                                                           timing)
 
         self.support.notify_debug(
             "[BaseHandler] response code: %s" % str(self.get_status()))
@@ -175,6 +194,23 @@ class BaseHandler(tornado.web.RequestHandler):
 
         self.finish()
 
+    @tornado.gen.coroutine
+    def _update_uri_stats(self, uri, timing):
+        try:
+            yield self.application_settings.repository.uri_stats.update_uri_stats(uri, timing)
+        except exceptions.DatabaseOperationError as ex:
+            # Should not fail if cache is not available
+            self.support.notify_info('[{0}] Not using cache. Cache not available: {1}'.
+                                     format('BaseHandler', ex.message))
+
+    def get_stats_uri(self):
+        """
+        URI under which requests to this resource are counted. Query arguments are not part of it unless
+        a handler needs them to identify the resource.
+        """
+
+        return self.request.path
+
     def _build_response_from_exception(self, ex):
         """
         Build HTTP response from an exception
@@ -4,7 +4,6 @@ Tornado handler for route messages resource
 from tornado import gen
 
 from pubtrans.common import exceptions
-from pubtrans.domain import agency
 from pubtrans.handlers import base_handler
 
 
@@ -26,8 +25,8 @@ class RouteMessagesHandlerV1(base_handler.BaseHandler):
             self.build_response(error_response)
             return
 
-        agency_obj = agency.Agency(agency_tag, self.application_settings)
+        agency_obj = self.application_settings.agencies.get_agency(agency_tag, self.context)
 
-        route_messages = yield agency_obj.get_route_messages(agency_tag, route_tag)
+        route_messages = yield agency_obj.messages.get_rendered_route_messages(agency_tag, route_tag)
 
-        self.build_response(route_messages)
+        self.build_rendered_response(route_messages)
@@ -4,7 +4,6 @@ Tornado handler for route messages resource
 from tornado import gen
 
 from pubtrans.common import exceptions
-from pubtrans.domain import agency
 from pubtrans.domain import api
 from pubtrans.handlers import base_handler
 
@@ -34,8 +33,18 @@ class RoutePredictionsHandlerV1(base_handler.BaseHandler):
             self.build_response(error_response3)
             return
 
-        agency_obj = agency.Agency(agency_tag, self.application_settings)
+        agency_obj = self.application_settings.agencies.get_agency(agency_tag, self.context)
 
-        route_messages = yield agency_obj.get_route_predictions(agency_tag, route_tag, stop_tag)
+        route_messages = yield agency_obj.predictions.get_rendered_route_predictions(agency_tag, route_tag,
+                                                                                     stop_tag)
 
-        self.build_response(route_messages)
+        self.build_rendered_response(route_messages)
+
+    def get_stats_uri(self):
+
+        stop_tag = self.get_query_argument(api.QUERY_STOP_TAG, None)
+        if not stop_tag:
+            return self.request.path
+
+        # Predictions are cached per stop, so they are counted per stop too
+        return self.request.path + '?' + api.QUERY_STOP_TAG + '=' + stop_tag
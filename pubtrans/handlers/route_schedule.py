@@ -4,7 +4,6 @@ Tornado handler for route schedule resource
 from tornado import gen
 
 from pubtrans.common import exceptions
-from pubtrans.domain import agency
 from pubtrans.handlers import base_handler
 
 
@@ -26,8 +25,8 @@ class RouteScheduleHandlerV1(base_handler.BaseHandler):
             self.build_response(error_response)
             return
 
-        agency_obj = agency.Agency(agency_tag, self.application_settings)
+        agency_obj = self.application_settings.agencies.get_agency(agency_tag, self.context)
 
-        schedule = yield agency_obj.get_route_schedule(agency_tag, route_tag)
+        schedule = yield agency_obj.schedules.get_rendered_route_schedule(agency_tag, route_tag)
 
-        self.build_response(schedule)
+        self.build_rendered_response(schedule)
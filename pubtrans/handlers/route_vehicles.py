@@ -5,7 +5,6 @@ from tornado import gen
 
 from pubtrans.common import exceptions
 from pubtrans.domain import api
-from pubtrans.domain import agency
 from pubtrans.handlers import base_handler
 
 
@@ -34,8 +33,12 @@ class RouteVehiclesHandlerV1(base_handler.BaseHandler):
             self.build_response(error_response3)
             return
 
-        agency_obj = agency.Agency(agency_tag, self.application_settings)
+        # It used to be passed to NextBus as it was, so a value that is not a time is taken as 0 and gets
+        # every vehicle of the route
+        last_time = int(last_time) if last_time.isdigit() else 0
 
-        route_messages = yield agency_obj.get_route_vehicles(agency_tag, route_tag, last_time)
+        agency_obj = self.application_settings.agencies.get_agency(agency_tag, self.context)
 
-        self.build_response(route_messages)
+        route_vehicles = yield agency_obj.vehicles.get_route_vehicles(agency_tag, route_tag, last_time)
+
+        self.build_response(route_vehicles)
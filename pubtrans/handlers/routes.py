@@ -4,8 +4,9 @@ Tornado handler for routes resource
 from tornado import gen
 
 from pubtrans.common import exceptions
-from pubtrans.domain import agency
+from pubtrans.config import settings
 from pubtrans.domain import api
+from pubtrans.domain import route_geometry
 from pubtrans.handlers import base_handler
 
 
@@ -25,39 +26,80 @@ class RoutesHandlerV1(base_handler.BaseHandler):
         criteria = {}
         if route_tag:
             criteria[api.CRITERIA_ROUTE_TAG] = route_tag
-        not_running_at = self.get_query_argument(api.QUERY_NOT_RUNNING_AT, None)
-        if not_running_at:
-            if len(not_running_at) == 1:
-                not_running_at = '0{0}:00:00'.format(not_running_at)
-            elif len(not_running_at) == 2:
-                not_running_at = '{0}:00:00'.format(not_running_at)
-            elif len(not_running_at) == 4:
-                not_running_at = '0{0}:00'.format(not_running_at)
-            elif len(not_running_at) == 5:
-                not_running_at = '{0}:00'.format(not_running_at)
-            elif len(not_running_at) == 8:
-                pass
-            else:
-                error_response2 = exceptions.InvalidArgumentValue('Invalid value {0} for {1} argument'
-                                                                  .format(not_running_at,
-                                                                          api.QUERY_NOT_RUNNING_AT))
-                self.build_response(error_response2)
-                return
 
+        try:
+            not_running_at = self._get_not_running_at()
+            geometry, tolerance = self._get_geometry_arguments()
+        except exceptions.InvalidArgumentValue as ex:
+            self.build_response(ex)
+            return
+
+        if not_running_at:
             criteria[api.CRITERIA_NOT_RUNNING_AT] = not_running_at
 
         fields = self.get_query_argument(api.QUERY_FIELDS, None)
         fields = fields.split(',') if fields else []
 
-        agency_obj = agency.Agency(agency_tag, self.application_settings)
+        agency_obj = self.application_settings.agencies.get_agency(agency_tag, self.context)
 
         if route_tag:
-            route = yield agency_obj.get_route(route_tag, fields)
+            route = yield agency_obj.get_route(route_tag, fields, geometry, tolerance)
             self.build_response(route)
+        elif not criteria:
+            routes = yield agency_obj.get_rendered_routes()
+            self.build_rendered_response(routes, api.TAG_ROUTES)
         else:
-            routes = yield agency_obj.get_routes(criteria)
+            routes = yield agency_obj.get_routes({})
+            routes, unavailable_schedules = yield agency_obj.index.get_routes_not_running_at(
+                routes, criteria[api.CRITERIA_NOT_RUNNING_AT])
             response = {
                 api.TAG_ROUTES: routes
             }
+            if unavailable_schedules:
+                # Routes whose schedule could not be got are left out
+                response[api.TAG_UNAVAILABLE_SCHEDULES] = unavailable_schedules
 
             self.build_response(response)
+
+    def _get_not_running_at(self):
+        """
+        Return the time asked in not_running_at as HH:MM:SS, or None if it was not asked
+        """
+
+        not_running_at = self.get_query_argument(api.QUERY_NOT_RUNNING_AT, None)
+        if not not_running_at:
+            return None
+
+        if len(not_running_at) == 1:
+            return '0{0}:00:00'.format(not_running_at)
+        elif len(not_running_at) == 2:
+            return '{0}:00:00'.format(not_running_at)
+        elif len(not_running_at) == 4:
+            return '0{0}:00'.format(not_running_at)
+        elif len(not_running_at) == 5:
+            return '{0}:00'.format(not_running_at)
+        elif len(not_running_at) == 8:
+            return not_running_at
+
+        raise exceptions.InvalidArgumentValue('Invalid value {0} for {1} argument'.
+                                              format(not_running_at, api.QUERY_NOT_RUNNING_AT))
+
+    def _get_geometry_arguments(self):
+        """
+        Return the geometry asked for route paths, or None, and the tolerance in meters to simplify them
+        """
+
+        geometry = self.get_query_argument(api.QUERY_GEOMETRY, None)
+        tolerance = self.get_query_argument(api.QUERY_TOLERANCE,
+                                            str(settings.ROUTE_GEOMETRY_DEFAULT_TOLERANCE_METERS))
+        try:
+            tolerance = float(tolerance)
+        except ValueError:
+            tolerance = None
+
+        if geometry and (geometry not in route_geometry.GEOMETRIES or tolerance is None or tolerance < 0):
+            raise exceptions.InvalidArgumentValue(
+                'Invalid arguments {0} or {1}. Geometry is one of {2} and tolerance is in meters'.format(
+                    api.QUERY_GEOMETRY, api.QUERY_TOLERANCE, ', '.join(route_geometry.GEOMETRIES)))
+
+        return geometry, tolerance
@@ -1,8 +1,12 @@
 """
 Tornado handler for stats resource
 """
+from collections import OrderedDict
+
 import tornado.gen
 
+from pubtrans.common import exceptions
+from pubtrans.common import redis_pool
 from pubtrans.domain import api
 from pubtrans.handlers.base_handler import BaseHandler
 
@@ -18,14 +22,44 @@ class StatsHandlerV1(BaseHandler):
         /stats GET handler
         """
         response = {}
+        uri_stats = self.application_settings.repository.uri_stats
 
         if stat_name in [api.STAT_RESOURCE_URI_COUNT, '']:
-            uri_count = self.support.get_uri_count()
+            try:
+                uri_count = yield uri_stats.get_uri_count()
+            except exceptions.DatabaseOperationError as ex:
+                self._notify_cache_not_available(ex)
+                uri_count = OrderedDict()
             response[api.TAG_URI_COUNT] = uri_count
 
         if stat_name in [api.STAT_RESOURCE_SLOW_REQUESTS, '']:
             slow_limit = self.get_query_argument(api.QUERY_SLOW_LIMIT, None)
-            slow_requests = self.support.get_slow_requests(slow_limit)
+            try:
+                slow_requests = yield uri_stats.get_slow_requests(slow_limit)
+            except exceptions.DatabaseOperationError as ex:
+                self._notify_cache_not_available(ex)
+                slow_requests = OrderedDict()
             response[api.TAG_SLOW_REQUESTS] = slow_requests
 
+        if stat_name in [api.STAT_RESOURCE_REDIS_POOLS, '']:
+            response[api.TAG_REDIS_POOLS] = redis_pool.get_stats()
+
+        if stat_name in [api.STAT_RESOURCE_MEMORY_CACHE, '']:
+            response[api.TAG_MEMORY_CACHE] = self.application_settings.repository.memory_cache.get_stats()
+
+        if stat_name in [api.STAT_RESOURCE_UPSTREAM, '']:
+            upstream = self.application_settings.single_flight.get_stats()
+            upstream.update(self.application_settings.fetch_lease.get_stats())
+            upstream.update(self.application_settings.stale_refresher.get_stats())
+            upstream.update(self.application_settings.popularity_refresher.get_stats())
+            upstream.update(self.application_settings.vehicle_poller.get_stats())
+            upstream.update(self.application_settings.predictions_batcher.get_stats())
+            upstream[api.TAG_PROVIDERS] = self.application_settings.providers.get_stats()
+            response[api.TAG_UPSTREAM] = upstream
+
         self.build_response(response)
+
+    def _notify_cache_not_available(self, ex):
+        # Should not fail if cache is not available
+        self.support.notify_info('[{0}] Not using cache. Cache not available: {1}'.
+                                 format('StatsHandlerV1', ex.message))
@@ -0,0 +1,72 @@
+"""
+Tornado handler for next scheduled arrivals of a route at a stop resource
+"""
+import datetime
+import re
+from collections import OrderedDict
+
+from tornado import gen
+
+from pubtrans.common import exceptions
+from pubtrans.config import settings
+from pubtrans.domain import api
+from pubtrans.handlers import base_handler
+
+TIME_PATTERN = re.compile(r'^([01][0-9]|2[0-3]):[0-5][0-9](:[0-5][0-9])?$')
+
+
+class StopArrivalsHandlerV1(base_handler.BaseHandler):
+    """
+    Tornado handler class for next scheduled arrivals of a route at a stop resource
+    """
+
+    @gen.coroutine
+    def get(self, agency_tag, route_tag, stop_tag):  # pylint: disable=arguments-differ
+
+        if not agency_tag:
+            error_response1 = exceptions.MissingArgumentValue('Missing argument agency')
+            self.build_response(error_response1)
+            return
+
+        if not route_tag:
+            error_response2 = exceptions.MissingArgumentValue('Missing argument route tag')
+            self.build_response(error_response2)
+            return
+
+        if not stop_tag:
+            error_response3 = exceptions.MissingArgumentValue('Missing argument stop tag')
+            self.build_response(error_response3)
+            return
+
+        not_before = self.get_query_argument(api.QUERY_TIME, None)
+        if not not_before:
+            not_before = datetime.datetime.now().strftime('%H:%M:%S')
+        elif not TIME_PATTERN.match(not_before):
+            error_response4 = exceptions.InvalidArgumentValue('Invalid value {0} for {1} argument. '
+                                                              'Expected HH:MM or HH:MM:SS'.
+                                                              format(not_before, api.QUERY_TIME))
+            self.build_response(error_response4)
+            return
+        elif len(not_before) == 5:
+            not_before = '{0}:00'.format(not_before)
+
+        limit = self.get_query_argument(api.QUERY_LIMIT, str(settings.NEXT_ARRIVALS_DEFAULT_LIMIT))
+        if not limit.isdigit() or not 0 < int(limit) <= settings.NEXT_ARRIVALS_MAX_LIMIT:
+            error_response5 = exceptions.InvalidArgumentValue('Invalid value {0} for {1} argument. '
+                                                              'Expected up to {2}'.
+                                                              format(limit, api.QUERY_LIMIT,
+                                                                     settings.NEXT_ARRIVALS_MAX_LIMIT))
+            self.build_response(error_response5)
+            return
+
+        agency_obj = self.application_settings.agencies.get_agency(agency_tag, self.context)
+
+        title, arrivals = yield agency_obj.schedules.get_next_arrivals(route_tag, stop_tag, not_before,
+                                                                       int(limit))
+
+        self.build_response(OrderedDict([
+            (api.TAG_ROUTE_TAG, route_tag),
+            (api.TAG_STOP_TAG, stop_tag),
+            (api.TAG_STOP_TITLE, title),
+            (api.TAG_ARRIVALS, arrivals)
+        ]))
@@ -0,0 +1,63 @@
+"""
+Tornado handler for stops resource
+"""
+from tornado import gen
+
+from pubtrans.common import exceptions
+from pubtrans.config import settings
+from pubtrans.domain import api
+from pubtrans.handlers import base_handler
+
+
+class StopsHandlerV1(base_handler.BaseHandler):
+    """
+    Tornado handler class for stops resource
+    """
+
+    @gen.coroutine
+    def get(self, agency_tag, stop):  # pylint: disable=arguments-differ
+
+        if not agency_tag:
+            error_response1 = exceptions.MissingArgumentValue('Missing argument agency')
+            self.build_response(error_response1)
+            return
+
+        agency_obj = self.application_settings.agencies.get_agency(agency_tag, self.context)
+
+        if stop:
+            found = yield agency_obj.index.get_stop(stop)
+            self.build_response(found)
+            return
+
+        lat = self.get_query_argument(api.QUERY_LAT, None)
+        lon = self.get_query_argument(api.QUERY_LON, None)
+        if not lat or not lon:
+            error_response2 = exceptions.MissingArgumentValue('Missing argument stop or {0} and {1}'.
+                                                              format(api.QUERY_LAT, api.QUERY_LON))
+            self.build_response(error_response2)
+            return
+
+        radius = self.get_query_argument(api.QUERY_RADIUS, str(settings.NEARBY_STOPS_DEFAULT_RADIUS_METERS))
+        try:
+            lat, lon, radius = float(lat), float(lon), float(radius)
+        except ValueError:
+            lat = lon = radius = None
+
+        if lat is None or not -90 <= lat <= 90 or not -180 <= lon <= 180 or \
+                not 0 < radius <= settings.NEARBY_STOPS_MAX_RADIUS_METERS:
+            error_response3 = exceptions.InvalidArgumentValue(
+                'Invalid arguments {0}, {1} or {2}. Radius is in meters, up to {3}'.format(
+                    api.QUERY_LAT, api.QUERY_LON, api.QUERY_RADIUS, settings.NEARBY_STOPS_MAX_RADIUS_METERS))
+            self.build_response(error_response3)
+            return
+
+        nearby_stops, unavailable_routes = yield agency_obj.index.get_nearby_stops(lat, lon, radius)
+
+        response = {
+            api.TAG_STOPS: nearby_stops
+        }
+        if unavailable_routes:
+            # Stops of routes whose config could not be got are left out
+            response[api.TAG_UNAVAILABLE_ROUTES] = unavailable_routes
+
+        self.build_response(response)
@@ -0,0 +1,65 @@
+"""
+Tornado handler for predictions of many stops resource
+"""
+from collections import OrderedDict
+
+from tornado import gen
+
+from pubtrans.common import exceptions
+from pubtrans.domain import api
+from pubtrans.handlers import base_handler
+
+
+class StopsPredictionsHandlerV1(base_handler.BaseHandler):
+    """
+    Tornado handler class for predictions of many stops resource
+    """
+
+    @gen.coroutine
+    def get(self, agency_tag):  # pylint: disable=arguments-differ
+
+        if not agency_tag:
+            error_response = exceptions.MissingArgumentValue('Missing argument agency')
+            self.build_response(error_response)
+            return
+
+        try:
+            stops = self._get_stops()
+        except exceptions.BadRequestBase as ex:
+            self.build_response(ex)
+            return
+
+        agency_obj = self.application_settings.agencies.get_agency(agency_tag, self.context)
+
+        stops_predictions = yield agency_obj.predictions.get_stops_predictions(stops)
+
+        response = []
+        for (route_tag, stop_tag), predictions in zip(stops, stops_predictions):
+            stop_predictions = OrderedDict([
+                (api.TAG_ROUTE_TAG, route_tag),
+                (api.TAG_STOP_TAG, stop_tag)
+            ])
+            stop_predictions.update(predictions)
+            response.append(stop_predictions)
+
+        self.build_response({api.TAG_PREDICTIONS: response})
+
+    def _get_stops(self):
+        """
+        Return the (route tag, stop tag) pairs asked in stops, without repeating any of them
+        """
+
+        stops_args = self.get_query_arguments(api.QUERY_STOPS)
+        if not stops_args:
+            raise exceptions.MissingArgumentValue('Missing argument {0}'.format(api.QUERY_STOPS))
+
+        stops = []
+        for stop_arg in stops_args:
+            stop = tuple(stop_arg.split('|'))
+            if len(stop) != 2 or not all(stop):
+                raise exceptions.InvalidArgumentValue(
+                    'Invalid argument {0}: {1}. Expected routeTag|stopTag'.format(api.QUERY_STOPS, stop_arg))
+            if stop not in stops:
+                stops.append(stop)
+
+        return stops
@@ -0,0 +1,46 @@
+"""
+Tornado handler for vehicles of all routes resource
+"""
+from tornado import gen
+
+from pubtrans.common import exceptions
+from pubtrans.domain import api
+from pubtrans.handlers import base_handler
+
+
+class VehiclesHandlerV1(base_handler.BaseHandler):
+    """
+    Tornado handler class for vehicles of all routes resource
+    """
+
+    @gen.coroutine
+    def get(self, agency_tag):  # pylint: disable=arguments-differ
+
+        if not agency_tag:
+            error_response1 = exceptions.MissingArgumentValue('Missing argument agency')
+            self.build_response(error_response1)
+            return
+
+        bbox = self.get_query_argument(api.QUERY_BBOX, None)
+        if not bbox:
+            error_response2 = exceptions.MissingArgumentValue('Missing argument {0}'.format(api.QUERY_BBOX))
+            self.build_response(error_response2)
+            return
+
+        try:
+            west, south, east, north = [float(value) for value in bbox.split(',')]
+        except ValueError:
+            west = south = east = north = None
+
+        if west is None or not -180 <= west <= east <= 180 or not -90 <= south <= north <= 90:
+            error_response3 = exceptions.InvalidArgumentValue(
+                'Invalid value {0} for {1} argument. Expected west,south,east,north'.
+                format(bbox, api.QUERY_BBOX))
+            self.build_response(error_response3)
+            return
+
+        agency_obj = self.application_settings.agencies.get_agency(agency_tag, self.context)
+
+        vehicles = yield agency_obj.vehicles.get_vehicles_in_box(west, south, east, north)
+
+        self.build_response({api.TAG_VEHICLES: vehicles})
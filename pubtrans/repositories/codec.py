@@ -0,0 +1,169 @@
+"""
+Encode cached values to bytes and back
+
+Encoded values start with a header with the format version, the codec used for the payload and the time
+the value was fetched, so values written by any codec can be read no matter which codec is configured,
+and the format can change in a rolling deploy.
+Values written before the header existed are json documents, and they can be read too.
+Payloads of json codecs are the json documents that are sent to clients, so they can be served as they are.
+"""
+import json
+import struct
+import zlib
+from collections import namedtuple
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import lz4.frame as lz4_frame
+except ImportError:
+    lz4_frame = None
+
+VERSION = 1
+
+# Version, codec id and fetch time
+HEADER = struct.Struct('>BBd')
+
+CODEC_JSON = 'json'
+CODEC_JSON_ZLIB = 'json+zlib'
+CODEC_MSGPACK = 'msgpack'
+CODEC_MSGPACK_ZLIB = 'msgpack+zlib'
+CODEC_MSGPACK_LZ4 = 'msgpack+lz4'
+
+ZLIB_LEVEL = 6
+
+# Fields of the json envelope used before the header existed
+LEGACY_FETCHED_AT = 'fetchedAt'
+LEGACY_VALUE = 'value'
+LEGACY_KEYS = set([LEGACY_FETCHED_AT, LEGACY_VALUE])
+
+Codec = namedtuple('Codec', ['codec_id', 'name', 'dumps', 'loads', 'compress', 'decompress'])
+
+
+def _json_dumps(value):
+    return json.dumps(value, separators=(',', ':'))
+
+
+def _msgpack_dumps(value):
+    return msgpack.packb(value, use_bin_type=True)
+
+
+def _msgpack_loads(data):
+    return msgpack.unpackb(data, raw=False)
+
+
+def _identity(data):
+    return data
+
+
+def _zlib_compress(data):
+    return zlib.compress(data, ZLIB_LEVEL)
+
+
+def _lz4_compress(data):
+    return lz4_frame.compress(data)
+
+
+def _lz4_decompress(data):
+    return lz4_frame.decompress(data)
+
+
+CODECS = [
+    Codec(0, CODEC_JSON, _json_dumps, json.loads, _identity, _identity),
+    Codec(1, CODEC_JSON_ZLIB, _json_dumps, json.loads, _zlib_compress, zlib.decompress),
+    Codec(2, CODEC_MSGPACK, _msgpack_dumps, _msgpack_loads, _identity, _identity),
+    Codec(3, CODEC_MSGPACK_ZLIB, _msgpack_dumps, _msgpack_loads, _zlib_compress, zlib.decompress),
+    Codec(4, CODEC_MSGPACK_LZ4, _msgpack_dumps, _msgpack_loads, _lz4_compress, _lz4_decompress)
+]
+CODECS_BY_ID = dict((codec.codec_id, codec) for codec in CODECS)
+CODECS_BY_NAME = dict((codec.name, codec) for codec in CODECS)
+JSON_CODEC_IDS = set([0, 1])
+
+
+def is_available(name):
+    """
+    Return True if the libraries needed by codec name are installed
+    """
+
+    if name.startswith(CODEC_MSGPACK) and msgpack is None:
+        return False
+    if name.endswith('lz4') and lz4_frame is None:
+        return False
+
+    return name in CODECS_BY_NAME
+
+
+def get_codec(name):
+    """
+    Return codec name, or the closest one that is available if its libraries are not installed
+    """
+
+    if not is_available(name):
+        compressed = name.endswith('zlib') or name.endswith('lz4')
+        name = CODEC_MSGPACK if msgpack is not None else CODEC_JSON
+        if compressed:
+            name += '+zlib'
+
+    return CODECS_BY_NAME[name]
+
+
+def encode(name, value, fetched_at):
+    """
+    Encode value fetched at fetched_at with codec name.
+    Return encoded bytes and the size of the value before compression, which is a better estimation of
+    the memory it uses once decoded.
+    """
+
+    codec = get_codec(name)
+    payload = codec.dumps(value)
+
+    return HEADER.pack(VERSION, codec.codec_id, fetched_at) + codec.compress(payload), len(payload)
+
+
+def decode(data):
+    """
+    Decode bytes written by encode, or by previous versions of the service.
+    Return value, time it was fetched (None if unknown) and its size before compression.
+    Raise ValueError if data cannot be decoded.
+    """
+
+    if data[:1] != chr(VERSION):
+        # Written as json before the header existed
+        value = json.loads(data)
+        if isinstance(value, dict) and set(value.keys()) == LEGACY_KEYS:
+            return value[LEGACY_VALUE], value[LEGACY_FETCHED_AT], len(data)
+        return value, None, len(data)
+
+    try:
+        _, codec_id, fetched_at = HEADER.unpack_from(data)
+        codec = CODECS_BY_ID[codec_id]
+        payload = codec.decompress(data[HEADER.size:])
+        value = codec.loads(payload)
+    except (struct.error, KeyError, zlib.error, RuntimeError, TypeError, AttributeError) as ex:
+        raise ValueError('Cannot decode value: {0}'.format(ex))
+
+    return value, fetched_at, len(payload)
+
+
+def decode_rendered(data):
+    """
+    Return the json document in bytes written by encode with a json codec without decoding it, and the
+    time it was fetched. Return None if data was written with another codec or before the header existed.
+    Raise ValueError if data cannot be decoded.
+    """
+
+    if data[:1] != chr(VERSION):
+        return None
+
+    try:
+        _, codec_id, fetched_at = HEADER.unpack_from(data)
+        if codec_id not in JSON_CODEC_IDS:
+            return None
+        payload = CODECS_BY_ID[codec_id].decompress(data[HEADER.size:])
+    except (struct.error, zlib.error) as ex:
+        raise ValueError('Cannot decode value: {0}'.format(ex))
+
+    return payload, fetched_at
@@ -0,0 +1,87 @@
+"""
+In-process LRU cache used as first level cache in front of redis
+"""
+import time
+from collections import OrderedDict
+
+STAT_HITS = 'hits'
+STAT_MISSES = 'misses'
+STAT_EVICTIONS = 'evictions'
+STAT_EXPIRATIONS = 'expirations'
+STAT_ENTRIES = 'entries'
+STAT_BYTES = 'bytes'
+STAT_MAX_BYTES = 'maxBytes'
+
+
+class MemoryCache(object):
+    """
+    LRU cache bounded by the total size in bytes of its entries, where each entry has its own ttl.
+    The size of an entry is given by the caller, usually the length of its serialized form.
+    It is meant to be used only from the IOLoop thread, so it is not thread safe.
+    """
+
+    def __init__(self, max_bytes, clock=time.time):
+        self.max_bytes = max_bytes
+        self.clock = clock
+        self.size = 0
+        self._counts = OrderedDict((stat, 0) for stat in [STAT_HITS, STAT_MISSES, STAT_EVICTIONS,
+                                                          STAT_EXPIRATIONS])
+        self._entries = OrderedDict()
+
+    def get(self, key):
+        """
+        Return value for key or None if it is not cached or it expired
+        """
+
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            self._counts[STAT_MISSES] += 1
+            return None
+
+        value, size, expires_at = entry
+        if expires_at <= self.clock():
+            self.size -= size
+            self._counts[STAT_EXPIRATIONS] += 1
+            self._counts[STAT_MISSES] += 1
+            return None
+
+        # Re insert to mark the entry as the most recently used one
+        self._entries[key] = entry
+        self._counts[STAT_HITS] += 1
+
+        return value
+
+    def set(self, key, value, size, ttl):
+        """
+        Cache value for ttl seconds evicting least recently used entries if max_bytes is exceeded.
+        Values bigger than max_bytes or with no ttl are not cached.
+        """
+
+        self.delete(key)
+
+        if size > self.max_bytes or ttl is None or ttl <= 0:
+            return
+
+        self._entries[key] = (value, size, self.clock() + ttl)
+        self.size += size
+
+        while self.size > self.max_bytes:
+            _, (_, evicted_size, _) = self._entries.popitem(last=False)
+            self.size -= evicted_size
+            self._counts[STAT_EVICTIONS] += 1
+
+    def delete(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.size -= entry[1]
+
+    def clear(self):
+        self._entries.clear()
+        self.size = 0
+
+    def get_stats(self):
+        return OrderedDict(self._counts.items() + [
+            (STAT_ENTRIES, len(self._entries)),
+            (STAT_BYTES, self.size),
+            (STAT_MAX_BYTES, self.max_bytes)
+        ])
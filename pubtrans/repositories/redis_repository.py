@@ -2,12 +2,19 @@
 Store NextBus entities in a Redis database
 """
 import json
+import time
 
-import redis
+from concurrent import futures
+from tornado import concurrent
 from tornado import gen
 
 from pubtrans.common import exceptions
+from pubtrans.common import redis_pool
 from pubtrans.config import settings
+from pubtrans.domain import entities
+from pubtrans.repositories import codec
+from pubtrans.repositories import memory_cache
+from pubtrans.repositories import uri_stats_repository
 
 KEY_AGENCIES = 'agencies'
 KEY_ROUTE = 'route'
@@ -16,264 +23,911 @@ KEY_ROUTE_SCHEDULE = 'route_schedule'
 KEY_ROUTE_MESSAGES = 'route_messages'
 KEY_ROUTE_VEHICLES = 'route_vehicles'
 KEY_ROUTE_PREDICTIONS = 'route_predictions'
+KEY_FETCH_LEASE = 'fetch_lease'
+KEY_FETCH_ERROR = 'fetch_error'
+KEY_SERVICE_WINDOWS = 'service_windows'
+KEY_ROUTE_STOPS = 'route_stops'
+KEY_ROUTE_GEOMETRY = 'route_geometry'
+
+# Errors returned by NextBus for requests that will keep failing, so they are cached for a while
+CACHEABLE_ERRORS = {
+    'NotFound': exceptions.NotFound,
+    'BadRequest': exceptions.BadRequest
+}
+
+# Delete a lease only if it is still held by the given token
+RELEASE_LEASE_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+# Settings with the fresh and stale windows of each entity. Entities are returned as they are while
+# fresh, and returned but reported to the stale handler while stale. After that they expire.
+CACHE_WINDOWS = {
+    KEY_AGENCIES: ('AGENCIES_CACHE_TTL_SECONDS', 'AGENCIES_CACHE_STALE_SECONDS'),
+    KEY_ROUTES: ('ROUTES_CACHE_TTL_SECONDS', 'ROUTES_CACHE_STALE_SECONDS'),
+    KEY_ROUTE: ('ROUTE_CACHE_TTL_SECONDS', 'ROUTE_CACHE_STALE_SECONDS'),
+    # Built from the route config, so it is kept as long as it is
+    KEY_ROUTE_GEOMETRY: ('ROUTE_CACHE_TTL_SECONDS', 'ROUTE_CACHE_STALE_SECONDS'),
+    KEY_ROUTE_SCHEDULE: ('SCHEDULE_CACHE_TTL_SECONDS', 'SCHEDULE_CACHE_STALE_SECONDS'),
+    KEY_ROUTE_MESSAGES: ('ROUTE_MESSAGES_CACHE_TTL_SECONDS', 'ROUTE_MESSAGES_CACHE_STALE_SECONDS'),
+    KEY_ROUTE_VEHICLES: ('ROUTE_VEHICLES_CACHE_TTL_SECONDS', 'ROUTE_VEHICLES_CACHE_STALE_SECONDS'),
+    KEY_ROUTE_PREDICTIONS: ('ROUTE_PREDICTIONS_CACHE_TTL_SECONDS', 'ROUTE_PREDICTIONS_CACHE_STALE_SECONDS')
+}
+
+# Settings with the codec used to store each entity
+CACHE_CODECS = {
+    KEY_AGENCIES: 'AGENCIES_CACHE_CODEC',
+    KEY_ROUTES: 'ROUTES_CACHE_CODEC',
+    KEY_ROUTE: 'ROUTE_CACHE_CODEC',
+    KEY_ROUTE_GEOMETRY: 'ROUTE_CACHE_CODEC',
+    KEY_ROUTE_SCHEDULE: 'SCHEDULE_CACHE_CODEC',
+    KEY_ROUTE_MESSAGES: 'ROUTE_MESSAGES_CACHE_CODEC',
+    KEY_ROUTE_VEHICLES: 'ROUTE_VEHICLES_CACHE_CODEC',
+    KEY_ROUTE_PREDICTIONS: 'ROUTE_PREDICTIONS_CACHE_CODEC'
+}
+
+# Big and slow changing entities that are also kept in the in-process memory cache
+MEMORY_CACHED_ENTITIES = [KEY_AGENCIES, KEY_ROUTES, KEY_ROUTE, KEY_ROUTE_GEOMETRY, KEY_ROUTE_SCHEDULE]
+
+# Memory cached entities that are kept as compact entities instead of the dicts they are stored as
+MEMORY_ENTITY_TYPES = {
+    KEY_ROUTE: entities.Route,
+    KEY_ROUTE_SCHEDULE: entities.Schedule
+}
+
+# redis-py is synchronous, so every command runs in this bounded pool of threads and the IOLoop only
+# waits on a future. It is shared by all repository instances in the process.
+EXECUTOR = futures.ThreadPoolExecutor(max_workers=settings.REDIS_EXECUTOR_MAX_WORKERS)
+
+# First level cache, one per worker process
+MEMORY_CACHE = memory_cache.MemoryCache(settings.MEMORY_CACHE_MAX_BYTES)
+
+
+def get_key_name(entity, key_args):
+    """
+    Build redis key name for entity. key_args are agency tag first and then route and stop tags if needed.
+    """
+
+    if not key_args:
+        return entity
+
+    return ':'.join((key_args[0], entity) + tuple(key_args[1:]))
+
+
+def get_cache_windows(entity):
+    """
+    Return fresh and stale windows in seconds for entity
+    """
+
+    fresh_setting, stale_setting = CACHE_WINDOWS[entity]
+
+    return getattr(settings, fresh_setting), getattr(settings, stale_setting)
+
+
+def make_memory_entry(entity, value, fetched_at, size, data):
+    """
+    Build memory cache entry for value read or written as data, with its json document if data has it.
+    Return entry and its size.
+    """
 
+    entity_type = MEMORY_ENTITY_TYPES.get(entity)
+    if entity_type is not None:
+        value = entity_type.from_value(value)
 
-class RedisRepository(object):
-    def __init__(self, context):
+    result = codec.decode_rendered(data)
+    if result is None:
+        return (value, fetched_at, None), size
+
+    rendered, _ = result
+
+    return (value, fetched_at, rendered), size + len(rendered)
+
+
+class BaseRepository(object):
+    """
+    Keep entities in redis, and the big and slow changing ones also in the memory cache. Redis commands run
+    in the executor.
+    """
+
+    def __init__(self, context, executor=None, memory_cache_instance=None, clock=time.time):
         self.context = context
+        self.executor = executor if executor is not None else EXECUTOR
+        self.memory_cache = memory_cache_instance if memory_cache_instance is not None else MEMORY_CACHE
+        self.clock = clock
+        # Called with entity and key args when an entity past its fresh window is returned
+        self.stale_handler = lambda entity, key_args: None
 
     @gen.coroutine
-    def get_agencies(self):  # pylint: disable=no-self-use
-        r_connection = self.get_redis_connection('slave')
+    def get_times_to_stale(self, items):
+        """
+        Return for each (entity, key_args) in items the seconds left until it is stale, which are
+        negative if it is stale already, or None if it is not cached
+        """
+
+        key_names = [get_key_name(entity, key_args) for entity, key_args in items]
         try:
-            data = r_connection.get(KEY_AGENCIES)
-        except redis.ConnectionError as ex:
-            raise exceptions.DatabaseOperationError('Cannot get agencies from redis: {0}'.format(ex.message))
+            ttls_milliseconds = yield self._get_ttls(key_names)
+        except redis_pool.ERRORS as ex:
+            raise exceptions.DatabaseOperationError('Cannot get ttls from redis: {0}'.format(ex.message))
 
-        if data is None:
-            agencies = None
+        times_to_stale = []
+        for (entity, _), ttl_milliseconds in zip(items, ttls_milliseconds):
+            if ttl_milliseconds < 0:
+                times_to_stale.append(None)
+            else:
+                _, stale_seconds = get_cache_windows(entity)
+                times_to_stale.append(ttl_milliseconds / 1000.0 - stale_seconds)
+
+        raise gen.Return(times_to_stale)
+
+    def forget_in_memory(self, entity, key_args):
+        """
+        Drop the copy in memory of an entity, so it is read from redis the next time
+        """
+
+        self.memory_cache.delete(get_key_name(entity, tuple(key_args)))
+
+    @gen.coroutine
+    def get_many(self, entity, key_args_list):
+        """
+        Get many entities of the same kind, looking in redis for the ones that are not in memory with a
+        single round trip.
+        Return a dict with the entities found by key args, and the list of key args not found.
+        """
+
+        key_args_list = [tuple(item) for item in key_args_list]
+
+        if entity in MEMORY_CACHED_ENTITIES:
+            found, pending = self._get_many_from_memory(entity, key_args_list)
         else:
-            try:
-                agencies = json.loads(data)
-            except TypeError:
-                raise exceptions.DatabaseOperationError('Invalid format for agencies')
+            found, pending = {}, key_args_list
 
-        raise gen.Return(agencies)
+        if pending:
+            found_in_redis = yield self._get_many_from_redis(entity, pending)
+            found.update(found_in_redis)
+
+        missing = [item for item in key_args_list if item not in found]
+
+        raise gen.Return((found, missing))
 
     @gen.coroutine
-    def store_agencies(self, agencies):  # pylint: disable=no-self-use
+    def store_many(self, entity, items):
+        """
+        Store many entities of the same kind, given as (key args, value) pairs, in a single round trip
+        """
+
+        fetched_at = self.clock()
+
+        commands = []
+        for key_args, value in items:
+            key_name = get_key_name(entity, key_args)
+            commands.append((key_name, self._encode(entity, key_name, value, fetched_at)))
 
-        r_connection = self.get_redis_connection('master')
+        if not commands:
+            return
 
-        agencies_ttl = settings.AGENCIES_CACHE_TTL_SECONDS
+        fresh_seconds, stale_seconds = get_cache_windows(entity)
         try:
+            yield self._set_many(commands, fresh_seconds + stale_seconds)
+        except redis_pool.ERRORS as ex:
+            raise exceptions.DatabaseOperationError('Cannot store {0} in redis: {1}'.
+                                                    format(entity.replace('_', ' '), ex.message))
+
+    def _get_many_from_memory(self, entity, key_args_list):
+        """
+        Return a dict with the entities found in memory by key args, and the list of key args not found
+        """
+
+        found = {}
+        pending = []
+
+        for key_args in key_args_list:
+            entry = self.memory_cache.get(get_key_name(entity, key_args))
+            if entry is None:
+                pending.append(key_args)
+                continue
+            value, fetched_at, _ = entry
+            self._check_freshness(entity, key_args, fetched_at)
+            found[key_args] = value
+
+        return found, pending
 
-            r_connection.set(KEY_AGENCIES, json.dumps(agencies), ex=agencies_ttl)
-        except redis.ConnectionError as ex:
-            raise exceptions.DatabaseOperationError('Cannot store agencies in redis: {0}'.format(ex.message))
+    @gen.coroutine
+    def _get_many_from_redis(self, entity, key_args_list):
+        """
+        Return a dict with the entities found in redis by key args, read with a single round trip
+        """
 
-        raise gen.Return(agencies)
+        key_names = [get_key_name(entity, key_args) for key_args in key_args_list]
+        try:
+            if entity in MEMORY_CACHED_ENTITIES:
+                results = yield self._get_many_with_ttl(key_names)
+            else:
+                data_list = yield self._execute(redis_pool.ROLE_SLAVE, 'mget', key_names)
+                results = [(data, None) for data in data_list]
+        except redis_pool.ERRORS as ex:
+            raise exceptions.DatabaseOperationError('Cannot get {0} from redis: {1}'.
+                                                    format(entity.replace('_', ' '), ex.message))
+
+        found = {}
+        for key_args, (data, ttl_milliseconds) in zip(key_args_list, results):
+            if data is None:
+                continue
+            try:
+                found[key_args] = self._decode(entity, key_args, data, ttl_milliseconds)
+            except exceptions.DatabaseOperationError:
+                # It is fetched again and overwritten
+                continue
+
+        raise gen.Return(found)
 
     @gen.coroutine
-    def get_routes(self, agency_tag):  # pylint: disable=no-self-use
+    def _get(self, entity, key_args, description):
+        """
+        Get an entity from the memory cache or from redis if it is not there.
+        If it is not fresh anymore the stale handler is notified, so it can be refreshed in background.
+        """
+
+        key_name = get_key_name(entity, key_args)
+        use_memory_cache = entity in MEMORY_CACHED_ENTITIES
+
+        if use_memory_cache:
+            entry = self.memory_cache.get(key_name)
+            if entry is not None:
+                value, fetched_at, _ = entry
+                self._check_freshness(entity, key_args, fetched_at)
+                raise gen.Return(value)
 
-        r_connection = self.get_redis_connection('slave')
+        try:
+            if use_memory_cache:
+                data, ttl_milliseconds = yield self._get_with_ttl(key_name)
+            else:
+                data = yield self._execute(redis_pool.ROLE_SLAVE, 'get', key_name)
+        except redis_pool.ERRORS as ex:
+            raise exceptions.DatabaseOperationError('Cannot get {0} from redis: {1}'.
+                                                    format(description, ex.message))
+
+        if data is None:
+            raise gen.Return(None)
+
+        value = self._decode(entity, key_args, data, ttl_milliseconds if use_memory_cache else None)
+
+        raise gen.Return(value)
+
+    def _decode(self, entity, key_args, data, ttl_milliseconds):
+        """
+        Decode an entity read from redis, and keep it in memory for the time it has left in redis if it is
+        one of the memory cached entities
+        """
 
         try:
-            key_name = agency_tag + ':' + KEY_ROUTES
-            data = r_connection.get(key_name)
-        except redis.ConnectionError as ex:
-            raise exceptions.DatabaseOperationError('Cannot get routes from redis: {0}'.format(ex.message))
+            value, fetched_at, size = codec.decode(data)
+        except (TypeError, ValueError):
+            raise exceptions.DatabaseOperationError('Invalid format for {0}'.format(entity.replace('_', ' ')))
+
+        if ttl_milliseconds is not None and entity in MEMORY_CACHED_ENTITIES:
+            entry, size = make_memory_entry(entity, value, fetched_at, size, data)
+            self.memory_cache.set(get_key_name(entity, key_args), entry, size, ttl_milliseconds / 1000.0)
+            # Return the same value that is served from memory from now on
+            value = entry[0]
+
+        self._check_freshness(entity, key_args, fetched_at)
+
+        return value
+
+    @gen.coroutine
+    def _get_rendered(self, entity, key_args, description):
+        """
+        Get the json document of an entity as it was stored, without decoding it.
+        Return None if it is not cached or if it was not stored with a json codec.
+        """
+
+        key_name = get_key_name(entity, key_args)
+
+        if entity in MEMORY_CACHED_ENTITIES:
+            entry = self.memory_cache.get(key_name)
+            if entry is not None:
+                _, fetched_at, rendered = entry
+                if rendered is not None:
+                    self._check_freshness(entity, key_args, fetched_at)
+                raise gen.Return(rendered)
+
+        # Not kept in memory from here, that needs the decoded value too
+        try:
+            data = yield self._execute(redis_pool.ROLE_SLAVE, 'get', key_name)
+        except redis_pool.ERRORS as ex:
+            raise exceptions.DatabaseOperationError('Cannot get {0} from redis: {1}'.
+                                                    format(description, ex.message))
 
         if data is None:
-            routes = None
-        else:
-            try:
-                routes = json.loads(data)
-            except TypeError:
-                raise exceptions.DatabaseOperationError('Invalid format for routes')
+            raise gen.Return(None)
 
-        raise gen.Return(routes)
+        try:
+            result = codec.decode_rendered(data)
+        except (TypeError, ValueError):
+            raise exceptions.DatabaseOperationError('Invalid format for {0}'.format(description))
+
+        if result is None:
+            raise gen.Return(None)
+
+        rendered, fetched_at = result
+        self._check_freshness(entity, key_args, fetched_at)
+
+        raise gen.Return(rendered)
 
     @gen.coroutine
-    def store_routes(self, agency_tag, routes):  # pylint: disable=no-self-use
+    def _store(self, entity, key_args, value, description):
+        """
+        Store an entity in redis and in the memory cache until the end of its stale window
+        """
 
-        r_connection = self.get_redis_connection('master')
+        key_name = get_key_name(entity, key_args)
+        fresh_seconds, stale_seconds = get_cache_windows(entity)
+        ttl = fresh_seconds + stale_seconds
+        data = self._encode(entity, key_name, value, self.clock())
 
-        routes_ttl = settings.ROUTES_CACHE_TTL_SECONDS
         try:
-            key_name = agency_tag + ':' + KEY_ROUTES
-            r_connection.set(key_name, json.dumps(routes), ex=routes_ttl)
-        except redis.ConnectionError as ex:
-            raise exceptions.DatabaseOperationError('Cannot store routes in redis: {0}'.format(ex.message))
+            yield self._execute(redis_pool.ROLE_MASTER, 'set', key_name, data, ex=ttl)
+        except redis_pool.ERRORS as ex:
+            raise exceptions.DatabaseOperationError('Cannot store {0} in redis: {1}'.
+                                                    format(description, ex.message))
+
+    def _encode(self, entity, key_name, value, fetched_at):
+        """
+        Encode an entity to store it in redis, and keep it in memory until the end of its stale window if
+        it is one of the memory cached entities
+        """
+
+        data, size = codec.encode(getattr(settings, CACHE_CODECS[entity]), value, fetched_at)
+
+        if entity in MEMORY_CACHED_ENTITIES:
+            fresh_seconds, stale_seconds = get_cache_windows(entity)
+            entry, size = make_memory_entry(entity, value, fetched_at, size, data)
+            self.memory_cache.set(key_name, entry, size, fresh_seconds + stale_seconds)
+
+        return data
+
+    def _check_freshness(self, entity, key_args, fetched_at):
+
+        if fetched_at is None:
+            return
+
+        fresh_seconds, _ = get_cache_windows(entity)
+        if self.clock() - fetched_at > fresh_seconds:
+            self.stale_handler(entity, key_args)
+
+    @concurrent.run_on_executor
+    def _execute(self, role, command, *args, **kwargs):
+        """
+        Run a redis command in the executor and return a future with its result
+        """
+
+        r_connection = self.get_redis_connection(role)
+
+        return getattr(r_connection, command)(*args, **kwargs)
+
+    @concurrent.run_on_executor
+    def _get_with_ttl(self, key_name):
+        """
+        Get value and remaining time to live in milliseconds of a key in a single round trip
+        """
+
+        pipeline = self.get_redis_connection(redis_pool.ROLE_SLAVE).pipeline(transaction=False)
+        pipeline.get(key_name)
+        pipeline.pttl(key_name)
+
+        return pipeline.execute()
+
+    @concurrent.run_on_executor
+    def _get_many_with_ttl(self, key_names):
+        """
+        Get values and remaining times to live in milliseconds of many keys in a single round trip
+        """
+
+        pipeline = self.get_redis_connection(redis_pool.ROLE_SLAVE).pipeline(transaction=False)
+        for key_name in key_names:
+            pipeline.get(key_name)
+            pipeline.pttl(key_name)
+        results = pipeline.execute()
+
+        return zip(results[::2], results[1::2])
+
+    @concurrent.run_on_executor
+    def _set_many(self, commands, ttl):
+        """
+        Set many keys with the same time to live in a single round trip
+        """
+
+        pipeline = self.get_redis_connection(redis_pool.ROLE_MASTER).pipeline(transaction=False)
+        for key_name, data in commands:
+            pipeline.set(key_name, data, ex=ttl)
+
+        return pipeline.execute()
+
+    @concurrent.run_on_executor
+    def _get_hash_with_ttl(self, key_name):
+        """
+        Get all fields of a hash and its remaining time to live in milliseconds in a single round trip
+        """
+
+        pipeline = self.get_redis_connection(redis_pool.ROLE_SLAVE).pipeline(transaction=False)
+        pipeline.hgetall(key_name)
+        pipeline.pttl(key_name)
+
+        return pipeline.execute()
+
+    @concurrent.run_on_executor
+    def _set_hash(self, key_name, mapping, ttl):
+        """
+        Set fields of a hash and its time to live in a single round trip
+        """
+
+        pipeline = self.get_redis_connection(redis_pool.ROLE_MASTER).pipeline(transaction=False)
+        for field, value in mapping.items():
+            pipeline.hset(key_name, field, value)
+        pipeline.expire(key_name, ttl)
+
+        return pipeline.execute()
+
+    @concurrent.run_on_executor
+    def _get_ttls(self, key_names):
+        """
+        Get remaining time to live in milliseconds of many keys in a single round trip
+        """
+
+        pipeline = self.get_redis_connection(redis_pool.ROLE_SLAVE).pipeline(transaction=False)
+        for key_name in key_names:
+            pipeline.pttl(key_name)
+
+        return pipeline.execute()
+
+    @staticmethod
+    def get_redis_connection(role):
+
+        return redis_pool.get_connection(role)
+
+
+class RedisRepository(BaseRepository):
+    """
+    Repository of the entities got from NextBus. Entities kept by stop or route of an agency, and the indexes
+    of an agency, are in repositories of their own that share its executor and memory cache.
+    """
+
+    def __init__(self, context, executor=None, memory_cache_instance=None, clock=time.time):
+        super(RedisRepository, self).__init__(context, executor, memory_cache_instance, clock)
+
+        self.predictions = PredictionsRepository(context, self.executor, self.memory_cache, clock)
+        self.vehicles = VehiclesRepository(context, self.executor, self.memory_cache, clock)
+        self.agency_index = AgencyIndexRepository(context, self.executor, self.memory_cache, clock)
+        self.uri_stats = uri_stats_repository.UriStatsRepository(self.executor)
+        for repository in [self.predictions, self.vehicles, self.agency_index]:
+            repository.stale_handler = self._report_stale
+
+    @gen.coroutine
+    def get_agencies(self):
+
+        agencies = yield self._get(KEY_AGENCIES, (), 'agencies')
+
+        raise gen.Return(agencies)
+
+    @gen.coroutine
+    def get_rendered_agencies(self):
+
+        agencies = yield self._get_rendered(KEY_AGENCIES, (), 'agencies')
+
+        raise gen.Return(agencies)
+
+    @gen.coroutine
+    def store_agencies(self, agencies):
+
+        yield self._store(KEY_AGENCIES, (), agencies, 'agencies')
+
+        raise gen.Return(agencies)
+
+    @gen.coroutine
+    def get_routes(self, agency_tag):
+
+        routes = yield self._get(KEY_ROUTES, (agency_tag,), 'routes')
 
         raise gen.Return(routes)
 
     @gen.coroutine
-    def get_route(self, agency_tag, route_tag):  # pylint: disable=no-self-use
+    def get_rendered_routes(self, agency_tag):
 
-        r_connection = self.get_redis_connection('slave')
+        routes = yield self._get_rendered(KEY_ROUTES, (agency_tag,), 'routes')
 
-        try:
-            key_name = agency_tag + ':' + KEY_ROUTE + ':' + route_tag
-            data = r_connection.get(key_name)
-        except redis.ConnectionError as ex:
-            raise exceptions.DatabaseOperationError('Cannot get route from redis: {0}'.format(ex.message))
+        raise gen.Return(routes)
 
-        if data is None:
-            route = None
-        else:
-            try:
-                route = json.loads(data)
-            except TypeError:
-                raise exceptions.DatabaseOperationError('Invalid format for route')
+    @gen.coroutine
+    def store_routes(self, agency_tag, routes):
 
-        raise gen.Return(route)
+        yield self._store(KEY_ROUTES, (agency_tag,), routes, 'routes')
+
+        raise gen.Return(routes)
 
     @gen.coroutine
-    def store_route(self, agency_tag, route_tag, route):  # pylint: disable=no-self-use
+    def get_route(self, agency_tag, route_tag):
 
-        r_connection = self.get_redis_connection('master')
+        route = yield self._get(KEY_ROUTE, (agency_tag, route_tag), 'route')
 
-        routes_ttl = settings.ROUTE_CACHE_TTL_SECONDS
-        try:
-            key_name = agency_tag + ':' + KEY_ROUTE + ':' + route_tag
-            r_connection.set(key_name, json.dumps(route), ex=routes_ttl)
-        except redis.ConnectionError as ex:
-            raise exceptions.DatabaseOperationError('Cannot store route in redis: {0}'.format(ex.message))
+        raise gen.Return(route)
+
+    @gen.coroutine
+    def store_route(self, agency_tag, route_tag, route):
+
+        yield self._store(KEY_ROUTE, (agency_tag, route_tag), route, 'route')
 
         raise gen.Return(route)
 
     @gen.coroutine
-    def get_route_schedule(self, agency_tag, route_tag):  # pylint: disable=no-self-use
+    def get_route_geometry(self, agency_tag, route_tag):
 
-        r_connection = self.get_redis_connection('slave')
+        geometry = yield self._get(KEY_ROUTE_GEOMETRY, (agency_tag, route_tag), 'route geometry')
 
-        try:
-            key_name = agency_tag + ':' + KEY_ROUTE_SCHEDULE + ':' + route_tag
-            data = r_connection.get(key_name)
-        except redis.ConnectionError as ex:
-            raise exceptions.DatabaseOperationError('Cannot get route schedule from redis: {0}'.
-                                                    format(ex.message))
-        if data is None:
-            schedule = None
-        else:
-            try:
-                schedule = json.loads(data)
-            except TypeError:
-                raise exceptions.DatabaseOperationError('Invalid format for schedule')
+        raise gen.Return(geometry)
+
+    @gen.coroutine
+    def store_route_geometry(self, agency_tag, route_tag, geometry):
+
+        yield self._store(KEY_ROUTE_GEOMETRY, (agency_tag, route_tag), geometry, 'route geometry')
+
+        raise gen.Return(geometry)
+
+    @gen.coroutine
+    def get_route_schedule(self, agency_tag, route_tag):
+
+        schedule = yield self._get(KEY_ROUTE_SCHEDULE, (agency_tag, route_tag), 'route schedule')
 
         raise gen.Return(schedule)
 
     @gen.coroutine
-    def store_route_schedule(self, agency_tag, route_tag, schedule):  # pylint: disable=no-self-use
+    def get_rendered_route_schedule(self, agency_tag, route_tag):
 
-        r_connection = self.get_redis_connection('master')
+        schedule = yield self._get_rendered(KEY_ROUTE_SCHEDULE, (agency_tag, route_tag), 'route schedule')
 
-        route_schedule_ttl = settings.SCHEDULE_CACHE_TTL_SECONDS
-        try:
-            key_name = agency_tag + ':' + KEY_ROUTE_SCHEDULE + ':' + route_tag
-            r_connection.set(key_name, json.dumps(schedule), ex=route_schedule_ttl)
-        except redis.ConnectionError as ex:
-            raise exceptions.DatabaseOperationError('Cannot store route schedule in redis: {0}'.
-                                                    format(ex.message))
+        raise gen.Return(schedule)
+
+    @gen.coroutine
+    def store_route_schedule(self, agency_tag, route_tag, schedule):
+
+        yield self._store(KEY_ROUTE_SCHEDULE, (agency_tag, route_tag), schedule, 'route schedule')
 
         raise gen.Return(schedule)
 
     @gen.coroutine
-    def get_route_messages(self, agency_tag, route_tag):  # pylint: disable=no-self-use
+    def get_route_messages(self, agency_tag, route_tag):
+
+        messages = yield self._get(KEY_ROUTE_MESSAGES, (agency_tag, route_tag), 'route messages')
+
+        raise gen.Return(messages)
+
+    @gen.coroutine
+    def get_rendered_route_messages(self, agency_tag, route_tag):
+
+        messages = yield self._get_rendered(KEY_ROUTE_MESSAGES, (agency_tag, route_tag), 'route messages')
+
+        raise gen.Return(messages)
 
-        r_connection = self.get_redis_connection('slave')
+    @gen.coroutine
+    def store_route_messages(self, agency_tag, route_tag, messages):
+
+        yield self._store(KEY_ROUTE_MESSAGES, (agency_tag, route_tag), messages, 'route messages')
+
+        raise gen.Return(messages)
+
+    @gen.coroutine
+    def get_fetch_error(self, fetch_name):
+        """
+        Return the error that NextBus returned recently for fetch_name, or None
+        """
+
+        key_name = KEY_FETCH_ERROR + ':' + fetch_name
+
+        error = self.memory_cache.get(key_name)
+        if error is not None:
+            raise gen.Return(error)
 
         try:
-            key_name = agency_tag + ':' + KEY_ROUTE_MESSAGES + ':' + route_tag
-            data = r_connection.get(key_name)
-        except redis.ConnectionError as ex:
-            raise exceptions.DatabaseOperationError('Cannot get route messages from redis: {0}'.
+            data = yield self._execute(redis_pool.ROLE_SLAVE, 'get', key_name)
+        except redis_pool.ERRORS as ex:
+            raise exceptions.DatabaseOperationError('Cannot get fetch error from redis: {0}'.
                                                     format(ex.message))
+
         if data is None:
-            messages = None
-        else:
-            try:
-                messages = json.loads(data)
-            except TypeError:
-                raise exceptions.DatabaseOperationError('Invalid format for route messages')
+            raise gen.Return(None)
 
-        raise gen.Return(messages)
+        try:
+            error_info = json.loads(data)
+            error = CACHEABLE_ERRORS[error_info['error']](error_info['context'])
+        except (TypeError, ValueError, KeyError):
+            raise exceptions.DatabaseOperationError('Invalid format for fetch error')
+
+        raise gen.Return(error)
 
     @gen.coroutine
-    def store_route_messages(self, agency_tag, route_tag, messages):  # pylint: disable=no-self-use
+    def store_fetch_error(self, fetch_name, error):
+        """
+        Cache error got from NextBus for fetch_name, if it is one that will happen again
+        """
+
+        error_name = type(error).__name__
+        if CACHEABLE_ERRORS.get(error_name) is not type(error):
+            return
 
-        r_connection = self.get_redis_connection('master')
+        key_name = KEY_FETCH_ERROR + ':' + fetch_name
+        ttl = settings.FETCH_ERROR_CACHE_TTL_SECONDS
+        data = json.dumps({'error': error_name, 'context': error.information()[exceptions.CONTEXT_KEY]})
+
+        self.memory_cache.set(key_name, error, len(data), ttl)
 
-        route_messages_ttl = settings.ROUTE_MESSAGES_CACHE_TTL_SECONDS
         try:
-            key_name = agency_tag + ':' + KEY_ROUTE_MESSAGES + ':' + route_tag
-            r_connection.set(key_name, json.dumps(messages), ex=route_messages_ttl)
-        except redis.ConnectionError as ex:
-            raise exceptions.DatabaseOperationError('Cannot store route messages in redis: {0}'.
+            yield self._execute(redis_pool.ROLE_MASTER, 'set', key_name, data, ex=ttl)
+        except redis_pool.ERRORS as ex:
+            raise exceptions.DatabaseOperationError('Cannot store fetch error in redis: {0}'.
                                                     format(ex.message))
 
-        raise gen.Return(messages)
-
     @gen.coroutine
-    def get_route_vehicles(self, agency_tag, route_tag):  # pylint: disable=no-self-use
+    def acquire_fetch_lease(self, lease_name, token, ttl):
+        """
+        Atomically take lease_name for ttl seconds if nobody holds it. Return True if it was taken.
+        """
+
+        key_name = KEY_FETCH_LEASE + ':' + lease_name
+        try:
+            acquired = yield self._execute(redis_pool.ROLE_MASTER, 'set', key_name, token,
+                                           px=int(ttl * 1000), nx=True)
+        except redis_pool.ERRORS as ex:
+            raise exceptions.DatabaseOperationError('Cannot acquire fetch lease in redis: {0}'.
+                                                    format(ex.message))
 
-        r_connection = self.get_redis_connection('slave')
+        raise gen.Return(bool(acquired))
 
+    @gen.coroutine
+    def release_fetch_lease(self, lease_name, token):
+
+        key_name = KEY_FETCH_LEASE + ':' + lease_name
         try:
-            key_name = agency_tag + ':' + KEY_ROUTE_VEHICLES + ':' + route_tag
-            data = r_connection.get(key_name)
-        except redis.ConnectionError as ex:
-            raise exceptions.DatabaseOperationError('Cannot get route vehicles from redis: {0}'.
+            yield self._execute(redis_pool.ROLE_MASTER, 'eval', RELEASE_LEASE_SCRIPT, 1, key_name, token)
+        except redis_pool.ERRORS as ex:
+            raise exceptions.DatabaseOperationError('Cannot release fetch lease in redis: {0}'.
                                                     format(ex.message))
-        if data is None:
-            vehicles = None
-        else:
-            try:
-                vehicles = json.loads(data)
-            except TypeError:
-                raise exceptions.DatabaseOperationError('Invalid format for route vehicles')
+
+    def _report_stale(self, entity, key_args):
+        """
+        Forward entities reported stale by the repositories of this one to its stale handler, which is set
+        after they are built
+        """
+
+        self.stale_handler(entity, key_args)
+
+
+class PredictionsRepository(BaseRepository):
+    """
+    Predictions by stop of a route
+    """
+
+    @gen.coroutine
+    def get_route_predictions(self, agency_tag, route_tag, stop_tag):
+
+        predictions = yield self._get(KEY_ROUTE_PREDICTIONS, (agency_tag, route_tag, stop_tag),
+                                      'route predictions')
+
+        raise gen.Return(predictions)
+
+    @gen.coroutine
+    def get_rendered_route_predictions(self, agency_tag, route_tag, stop_tag):
+
+        predictions = yield self._get_rendered(KEY_ROUTE_PREDICTIONS, (agency_tag, route_tag, stop_tag),
+                                               'route predictions')
+
+        raise gen.Return(predictions)
+
+    @gen.coroutine
+    def store_route_predictions(self, agency_tag, route_tag, stop_tag, predictions):
+
+        yield self._store(KEY_ROUTE_PREDICTIONS, (agency_tag, route_tag, stop_tag), predictions,
+                          'route predictions')
+
+        raise gen.Return(predictions)
+
+    @gen.coroutine
+    def get_stops_predictions(self, agency_tag, stops):
+        """
+        Return a dict with the predictions found by (route tag, stop tag), and the list of stops not found
+        """
+
+        key_args_list = [(agency_tag, route_tag, stop_tag) for route_tag, stop_tag in stops]
+        found, missing = yield self.get_many(KEY_ROUTE_PREDICTIONS, key_args_list)
+
+        predictions = dict((key_args[1:], stop_predictions) for key_args, stop_predictions in found.items())
+
+        raise gen.Return((predictions, [key_args[1:] for key_args in missing]))
+
+    @gen.coroutine
+    def store_stops_predictions(self, agency_tag, predictions):
+
+        items = [((agency_tag, route_tag, stop_tag), stop_predictions)
+                 for (route_tag, stop_tag), stop_predictions in predictions.items()]
+        yield self.store_many(KEY_ROUTE_PREDICTIONS, items)
+
+        raise gen.Return(predictions)
+
+
+class VehiclesRepository(BaseRepository):
+    """
+    Vehicle states by route
+    """
+
+    @gen.coroutine
+    def get_route_vehicles(self, agency_tag, route_tag):
+
+        vehicles = yield self._get(KEY_ROUTE_VEHICLES, (agency_tag, route_tag), 'route vehicles')
 
         raise gen.Return(vehicles)
 
     @gen.coroutine
-    def store_route_vehicles(self, agency_tag, route_tag, vehicles):  # pylint: disable=no-self-use
+    def store_route_vehicles(self, agency_tag, route_tag, vehicles):
 
-        r_connection = self.get_redis_connection('master')
+        yield self._store(KEY_ROUTE_VEHICLES, (agency_tag, route_tag), vehicles, 'route vehicles')
 
-        route_messages_ttl = settings.ROUTE_VEHICLES_CACHE_TTL_SECONDS
-        try:
-            key_name = agency_tag + ':' + KEY_ROUTE_VEHICLES + ':' + route_tag
-            r_connection.set(key_name, json.dumps(vehicles), ex=route_messages_ttl)
-        except redis.ConnectionError as ex:
-            raise exceptions.DatabaseOperationError('Cannot store route vehicles in redis: {0}'.
-                                                    format(ex.message))
+        raise gen.Return(vehicles)
+
+    @gen.coroutine
+    def get_routes_vehicles(self, agency_tag, route_tags):
+        """
+        Return a dict with the vehicles found by route tag, and the list of route tags not found
+        """
+
+        found, missing = yield self.get_many(KEY_ROUTE_VEHICLES,
+                                             [(agency_tag, route_tag) for route_tag in route_tags])
+
+        vehicles = dict((key_args[1], route_vehicles) for key_args, route_vehicles in found.items())
+
+        raise gen.Return((vehicles, [key_args[1] for key_args in missing]))
+
+    @gen.coroutine
+    def store_routes_vehicles(self, agency_tag, vehicles):
+
+        items = [((agency_tag, route_tag), route_vehicles) for route_tag, route_vehicles in vehicles.items()]
+        yield self.store_many(KEY_ROUTE_VEHICLES, items)
 
         raise gen.Return(vehicles)
 
+
+class AgencyIndexRepository(BaseRepository):
+    """
+    Schedules, service windows and stops of many routes of an agency, read and written together
+    """
+
+    @gen.coroutine
+    def get_route_schedules(self, agency_tag, route_tags):
+        """
+        Return a dict with the schedules found by route tag, and the list of route tags not found
+        """
+
+        found, missing = yield self.get_many(KEY_ROUTE_SCHEDULE,
+                                             [(agency_tag, route_tag) for route_tag in route_tags])
+
+        schedules = dict((key_args[1], schedule) for key_args, schedule in found.items())
+
+        raise gen.Return((schedules, [key_args[1] for key_args in missing]))
+
+    @gen.coroutine
+    def store_route_schedules(self, agency_tag, schedules):
+
+        items = [((agency_tag, route_tag), schedule) for route_tag, schedule in schedules.items()]
+        yield self.store_many(KEY_ROUTE_SCHEDULE, items)
+
+        raise gen.Return(schedules)
+
     @gen.coroutine
-    def get_route_predictions(self, agency_tag, route_tag, stop_tag):  # pylint: disable=no-self-use
+    def get_service_windows(self, agency_tag):
+        """
+        Return the service windows of the routes of an agency by route tag. Routes without them are not there.
+        """
 
-        r_connection = self.get_redis_connection('slave')
+        key_name = get_key_name(KEY_SERVICE_WINDOWS, (agency_tag,))
+
+        windows = self.memory_cache.get(key_name)
+        if windows is not None:
+            raise gen.Return(windows)
 
         try:
-            key_name = agency_tag + ':' + KEY_ROUTE_PREDICTIONS + ':' + route_tag + ':' + stop_tag
-            data = r_connection.get(key_name)
-        except redis.ConnectionError as ex:
-            raise exceptions.DatabaseOperationError('Cannot get route predictions from redis: {0}'.
+            data, ttl_milliseconds = yield self._get_hash_with_ttl(key_name)
+        except redis_pool.ERRORS as ex:
+            raise exceptions.DatabaseOperationError('Cannot get service windows from redis: {0}'.
                                                     format(ex.message))
-        if data is None:
-            predictions = None
-        else:
-            try:
-                predictions = json.loads(data)
-            except TypeError:
-                raise exceptions.DatabaseOperationError('Invalid format for route predictions')
 
-        raise gen.Return(predictions)
+        try:
+            windows = dict((route_tag, json.loads(route_windows))
+                           for route_tag, route_windows in data.items())
+        except (TypeError, ValueError):
+            raise exceptions.DatabaseOperationError('Invalid format for service windows')
+
+        if windows:
+            # Windows stored by other replicas are seen once it expires, as with schedules
+            self.memory_cache.set(key_name, windows, sum(len(value) for value in data.values()),
+                                  min(ttl_milliseconds / 1000.0, settings.SCHEDULE_CACHE_TTL_SECONDS))
+
+        raise gen.Return(windows)
 
     @gen.coroutine
-    def store_route_predictions(self, agency_tag, route_tag, stop_tag, predictions):
-        # pylint: disable=no-self-use
+    def store_service_windows(self, agency_tag, windows):
+        """
+        Store service windows of some routes of an agency, given by route tag, keeping those of the others
+        """
+
+        key_name = get_key_name(KEY_SERVICE_WINDOWS, (agency_tag,))
+        fresh_seconds, stale_seconds = get_cache_windows(KEY_ROUTE_SCHEDULE)
+        ttl = fresh_seconds + stale_seconds
 
-        r_connection = self.get_redis_connection('master')
+        data = dict((route_tag, json.dumps(route_windows)) for route_tag, route_windows in windows.items())
+
+        cached_windows = self.memory_cache.get(key_name)
+        if cached_windows is not None:
+            cached_windows = dict(cached_windows, **windows)
+            self.memory_cache.set(key_name, cached_windows, len(json.dumps(cached_windows)),
+                                  settings.SCHEDULE_CACHE_TTL_SECONDS)
 
-        route_messages_ttl = settings.ROUTE_PREDICTIONS_CACHE_TTL_SECONDS
         try:
-            key_name = agency_tag + ':' + KEY_ROUTE_PREDICTIONS + ':' + route_tag + ':' + stop_tag
-            r_connection.set(key_name, json.dumps(predictions), ex=route_messages_ttl)
-        except redis.ConnectionError as ex:
-            raise exceptions.DatabaseOperationError('Cannot store route predictions in redis: {0}'.
+            yield self._set_hash(key_name, data, ttl)
+        except redis_pool.ERRORS as ex:
+            raise exceptions.DatabaseOperationError('Cannot store service windows in redis: {0}'.
                                                     format(ex.message))
 
-        raise gen.Return(predictions)
+    @gen.coroutine
+    def get_route_stops(self, agency_tag):
+        """
+        Return the stops of the routes of an agency by route tag. Routes without them are not there.
+        """
 
-    @staticmethod
-    def get_redis_connection(role):
+        key_name = get_key_name(KEY_ROUTE_STOPS, (agency_tag,))
+
+        route_stops = self.memory_cache.get(key_name)
+        if route_stops is not None:
+            raise gen.Return(route_stops)
+
+        try:
+            data, ttl_milliseconds = yield self._get_hash_with_ttl(key_name)
+        except redis_pool.ERRORS as ex:
+            raise exceptions.DatabaseOperationError('Cannot get route stops from redis: {0}'.
+                                                    format(ex.message))
+
+        try:
+            route_stops = dict((route_tag, json.loads(stops)) for route_tag, stops in data.items())
+        except (TypeError, ValueError):
+            raise exceptions.DatabaseOperationError('Invalid format for route stops')
+
+        if route_stops:
+            # Stops stored by other replicas are seen once it expires, as with route configs
+            self.memory_cache.set(key_name, route_stops, sum(len(value) for value in data.values()),
+                                  min(ttl_milliseconds / 1000.0, settings.ROUTE_CACHE_TTL_SECONDS))
+
+        raise gen.Return(route_stops)
+
+    @gen.coroutine
+    def store_route_stops(self, agency_tag, route_stops):
+        """
+        Store stops of some routes of an agency, given by route tag, keeping those of the others
+        """
+
+        key_name = get_key_name(KEY_ROUTE_STOPS, (agency_tag,))
+        fresh_seconds, stale_seconds = get_cache_windows(KEY_ROUTE)
+        ttl = fresh_seconds + stale_seconds
 
-        host = settings.REDIS_MASTER_HOST if role == 'master' else settings.REDIS_SLAVE_HOST
+        data = dict((route_tag, json.dumps(stops)) for route_tag, stops in route_stops.items())
 
-        r_connection = redis.StrictRedis(host=host, port=settings.REDIS_PORT, db=0)
+        cached_route_stops = self.memory_cache.get(key_name)
+        if cached_route_stops is not None:
+            cached_route_stops = dict(cached_route_stops, **route_stops)
+            self.memory_cache.set(key_name, cached_route_stops, len(json.dumps(cached_route_stops)),
+                                  settings.ROUTE_CACHE_TTL_SECONDS)
 
-        return r_connection
+        try:
+            yield self._set_hash(key_name, data, ttl)
+        except redis_pool.ERRORS as ex:
+            raise exceptions.DatabaseOperationError('Cannot store route stops in redis: {0}'.
+                                                    format(ex.message))
@@ -0,0 +1,111 @@
+"""
+Keep counters of requests by URI in a Redis database
+"""
+from collections import OrderedDict
+
+from tornado import concurrent
+from tornado import gen
+
+from pubtrans.common import exceptions
+from pubtrans.common import redis_pool
+
+SET_URIS_COUNT = 'uris:count'
+SET_SLOW_REQUESTS = 'uris:slow_requests'
+
+
+class UriStatsRepository(object):
+    """
+    Counters of requests by URI. Redis commands run in the executor.
+    """
+
+    def __init__(self, executor):
+        self.executor = executor
+
+    @gen.coroutine
+    def update_uri_stats(self, uri, timing):
+        """
+        Count a request to uri and keep its timing if it is the slowest seen
+        """
+
+        try:
+            yield self._update_uri_stats(uri, timing)
+        except redis_pool.ERRORS as ex:
+            raise exceptions.DatabaseOperationError('Cannot update uri stats in redis: {0}'.
+                                                    format(ex.message))
+
+    @gen.coroutine
+    def get_uri_count(self):
+        """
+        Return requests count by URI, most requested first
+        """
+
+        uris = yield self._get_uris_by_score(SET_URIS_COUNT, '-inf')
+
+        raise gen.Return(uris)
+
+    @gen.coroutine
+    def get_slow_requests(self, slow_limit):
+        """
+        Return the slowest timing by URI, slowest first, skipping those faster than slow_limit if given
+        """
+
+        uris = yield self._get_uris_by_score(SET_SLOW_REQUESTS, slow_limit or '-inf')
+
+        raise gen.Return(uris)
+
+    @gen.coroutine
+    def get_popular_uris(self, limit):
+        """
+        Return the limit most requested URIs, most requested first
+        """
+
+        try:
+            uris = yield self._execute(redis_pool.ROLE_SLAVE, 'zrevrange', SET_URIS_COUNT, 0, limit - 1)
+        except redis_pool.ERRORS as ex:
+            raise exceptions.DatabaseOperationError('Cannot get popular uris from redis: {0}'.
+                                                    format(ex.message))
+
+        raise gen.Return(uris)
+
+    @gen.coroutine
+    def _get_uris_by_score(self, key_name, min_score):
+        try:
+            redis_response = yield self._execute(redis_pool.ROLE_MASTER, 'zrevrangebyscore', key_name,
+                                                 '+inf', min_score, withscores=True)
+        except redis_pool.ERRORS as ex:
+            raise exceptions.DatabaseOperationError('Cannot get uri stats from redis: {0}'.
+                                                    format(ex.message))
+
+        response = OrderedDict()
+        for uri, score in redis_response:
+            response[uri] = int(score)
+
+        raise gen.Return(response)
+
+    @concurrent.run_on_executor
+    def _execute(self, role, command, *args, **kwargs):
+        """
+        Run a redis command in the executor and return a future with its result
+        """
+
+        r_connection = self.get_redis_connection(role)
+
+        return getattr(r_connection, command)(*args, **kwargs)
+
+    @concurrent.run_on_executor
+    def _update_uri_stats(self, uri, timing):
+        """
+        Increment the count of uri and set its timing in a single round trip
+        """
+
+        pipeline = self.get_redis_connection(redis_pool.ROLE_MASTER).pipeline(transaction=False)
+        # Raw commands because zincrby and zadd signatures differ between redis-py versions
+        pipeline.execute_command('ZINCRBY', SET_URIS_COUNT, 1, uri)
+        pipeline.execute_command('ZADD', SET_SLOW_REQUESTS, timing, uri)
+
+        return pipeline.execute()
+
+    @staticmethod
+    def get_redis_connection(role):
+
+        return redis_pool.get_connection(role)
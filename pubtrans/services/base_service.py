@@ -1,6 +1,7 @@
 """
 Base connector to interact with external services
 """
+import copy
 import json
 import xmltodict
 
@@ -21,6 +22,18 @@ class BaseService(object):
         self._context = context
         self._support = support
 
+    def with_context(self, context):
+        """
+        Return a view of this connector for a request, sharing its REST adapter, that logs with the support
+        of the request
+        """
+
+        view = copy.copy(self)
+        view._context = context  # pylint: disable=protected-access
+        view._support = context.support  # pylint: disable=protected-access
+
+        return view
+
     def log_response(self, log_tag, response_code, response_body):
         if not self._support:
             return
@@ -0,0 +1,103 @@
+"""
+Local stand-in for a provider of transit data, answering from values given to it
+
+It has the same calls as NextBusService and answers them with the values added for their arguments, in the
+shapes the NextBus parsers build, after a simulated latency. Calls without a value fail as not found, as
+NextBus does for unknown routes. It is used for tests and benchmarks, and for agencies served from data
+of their own.
+"""
+import copy
+
+from tornado import gen
+
+from pubtrans.common import exceptions
+
+
+class LocalService(object):
+    """
+    Connector that answers from memory. Values that are exceptions are raised to the callers.
+    """
+
+    def __init__(self, latency=0, support=None):
+        self.latency = latency
+        self.calls = []
+        self._support = support
+        self._values = {}
+
+    def with_context(self, context):
+        """
+        Return a view of this connector for a request, sharing its values and calls
+        """
+
+        view = copy.copy(self)
+        view._support = context.support  # pylint: disable=protected-access
+
+        return view
+
+    def add(self, call_name, args, value):
+        """
+        Answer call_name with args with value from now on
+        """
+
+        self._values[(call_name, tuple(args))] = value
+
+    @gen.coroutine
+    def _answer(self, call_name, *args):
+
+        self.calls.append((call_name, args))
+        if self.latency:
+            yield gen.sleep(self.latency)
+
+        key = (call_name, args)
+        if key not in self._values:
+            raise exceptions.NotFound('No local value for {0}{1}'.format(call_name, args))
+
+        value = self._values[key]
+        if isinstance(value, Exception):
+            raise value
+
+        # Callers may change what they get, as they do with parsed responses
+        raise gen.Return(copy.deepcopy(value))
+
+    def get_agencies(self):
+        return self._answer('get_agencies')
+
+    def get_routes(self, agency_tag):
+        return self._answer('get_routes', agency_tag)
+
+    def get_route(self, agency_tag, route_tag):
+        return self._answer('get_route', agency_tag, route_tag)
+
+    def get_route_schedule(self, agency_tag, route_tag):
+        return self._answer('get_route_schedule', agency_tag, route_tag)
+
+    def get_route_messages(self, agency_tag, route_tag):
+        return self._answer('get_route_messages', agency_tag, route_tag)
+
+    def get_route_vehicles(self, agency_tag, route_tag, last_time):  # pylint: disable=unused-argument
+        return self._answer('get_route_vehicles', agency_tag, route_tag)
+
+    def get_agency_vehicles(self, agency_tag, last_time):  # pylint: disable=unused-argument
+        return self._answer('get_agency_vehicles', agency_tag)
+
+    def get_route_predictions(self, agency_tag, route_tag, stop_tag):
+        return self._answer('get_route_predictions', agency_tag, route_tag, stop_tag)
+
+    @gen.coroutine
+    def get_multi_stop_predictions(self, agency_tag, stops):
+        """
+        Return the predictions added for each of the (route tag, stop tag) pairs, leaving out the ones
+        without predictions as NextBus does
+        """
+
+        self.calls.append(('get_multi_stop_predictions', (agency_tag, tuple(stops))))
+        if self.latency:
+            yield gen.sleep(self.latency)
+
+        predictions = {}
+        for route_tag, stop_tag in stops:
+            value = self._values.get(('get_route_predictions', (agency_tag, route_tag, stop_tag)))
+            if value is not None and not isinstance(value, Exception):
+                predictions[(route_tag, stop_tag)] = copy.deepcopy(value)
+
+        raise gen.Return(predictions)
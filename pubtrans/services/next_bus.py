@@ -23,16 +23,18 @@ class NextBusService(base.BaseService):  # pylint: disable=R0903
     QUERY_ROUTE = 'r'
     QUERY_LAST_TIME = 't'
     QUERY_STOP_TAG = 's'
+    QUERY_STOPS = 'stops'
 
     COMMAND_AGENCY_LIST = 'agencyList'
     COMMAND_ROUTE_LIST = 'routeList'
     COMMAND_ROUTE_CONFIG = 'routeConfig'
     COMMAND_PREDICTIONS = 'predictions'
+    COMMAND_MULTI_STOP_PREDICTIONS = 'predictionsForMultiStops'
     COMMAND_SCHEDULE = 'schedule'
     COMMAND_MESSAGES = 'messages'
     COMMAND_VEHICLE_LOCATIONS = 'vehicleLocations'
 
-    def __init__(self, support=None):
+    def __init__(self, support=None, timeout=None):
         endpoint = settings.NEXTBUS_SERVICE_URL
         super(NextBusService, self).__init__(endpoint, support=support)
 
@@ -40,7 +42,7 @@ class NextBusService(base.BaseService):  # pylint: disable=R0903
             constants.ACCEPT_HEADER: "application/xml"
         }
 
-        self.timeout = settings.NEXTBUS_SERVICE_TIMEOUT
+        self.timeout = settings.NEXTBUS_SERVICE_TIMEOUT if timeout is None else timeout
 
     @retry_decorator.retry(exceptions.ExternalProviderUnavailableTemporarily,
                            tries=settings.NEXTBUS_SERVICE_RETRIES,
@@ -188,6 +190,31 @@ class NextBusService(base.BaseService):  # pylint: disable=R0903
         route_messages = next_bus_xml.build_route_vehicles(validated_response)
         raise gen.Return(route_messages)
 
+    @gen.coroutine
+    def get_agency_vehicles(self, agency_tag, last_time):
+        """
+        Get vehicles of every route of an agency with a single call to NextBus service.
+        Return them by route tag and the lastTime of the response.
+        """
+
+        query = {
+            self.QUERY_COMMAND: self.COMMAND_VEHICLE_LOCATIONS,
+            self.QUERY_AGENCY: agency_tag,
+            self.QUERY_LAST_TIME: last_time
+        }
+
+        response_code, response_body = \
+            yield self.rest_adapter.get(query=query,
+                                        headers=self.headers,
+                                        timeout=self.timeout)
+
+        self.log_response(self.LOG_TAG, response_code, response_body)
+
+        validated_response = self.validate_response(response_code, response_body, 'xml')
+        next_bus_xml.handle_error(validated_response)
+        agency_vehicles = next_bus_xml.build_agency_vehicles(validated_response)
+        raise gen.Return(agency_vehicles)
+
     @gen.coroutine
     def get_route_predictions(self, agency_tag, route_tag, stop_tag):
         """
@@ -212,3 +239,28 @@ class NextBusService(base.BaseService):  # pylint: disable=R0903
         next_bus_xml.handle_error(validated_response)
         route_messages = next_bus_xml.build_route_predictions(validated_response)
         raise gen.Return(route_messages)
+
+    @gen.coroutine
+    def get_multi_stop_predictions(self, agency_tag, stops):
+        """
+        Get predictions for many (route tag, stop tag) pairs with a single call to NextBus service
+        """
+
+        # Stops are repeated query arguments, so they go in a list of pairs
+        query = [
+            (self.QUERY_COMMAND, self.COMMAND_MULTI_STOP_PREDICTIONS),
+            (self.QUERY_AGENCY, agency_tag)
+        ]
+        query.extend((self.QUERY_STOPS, route_tag + '|' + stop_tag) for route_tag, stop_tag in stops)
+
+        response_code, response_body = \
+            yield self.rest_adapter.get(query=query,
+                                        headers=self.headers,
+                                        timeout=self.timeout)
+
+        self.log_response(self.LOG_TAG, response_code, response_body)
+
+        validated_response = self.validate_response(response_code, response_body, 'xml')
+        next_bus_xml.handle_error(validated_response)
+        predictions = next_bus_xml.build_multi_stop_predictions(validated_response)
+        raise gen.Return(predictions)
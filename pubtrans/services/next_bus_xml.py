@@ -65,6 +65,8 @@ ATTR_BLOCK = '@block'
 ATTR_TRIP_TAG = '@tripTag'
 ATTR_NAME = '@name'
 ATTR_USE_FOR_UI = '@useForUI'
+ATTR_ROUTE_TAG = '@routeTag'
+ATTR_STOP_TAG = '@stopTag'
 
 
 def handle_error(validated_response):
@@ -406,18 +408,7 @@ def build_route_vehicles(validated_response):
         vehicles_xml = [] if vehicles_xml is None else [vehicles_xml]
 
     for vehicle_xml in vehicles_xml:
-        vehicle = OrderedDict([
-            (api.TAG_ID, vehicle_xml.get(ATTR_ID)),
-            (api.TAG_DIR_TAG, vehicle_xml.get(ATTR_DIR_TAG)),
-            (api.TAG_LAT, vehicle_xml.get(ATTR_LAT)),
-            (api.TAG_LON, vehicle_xml.get(ATTR_LON)),
-            (api.TAG_SECS_SINCE_REPORT, vehicle_xml.get(ATTR_SECS_SINCE_REPORT)),
-            (api.TAG_PREDICTABLE, vehicle_xml.get(ATTR_PREDICTABLE)),
-            (api.TAG_HEADING, vehicle_xml.get(ATTR_HEADING)),
-            (api.TAG_SPEED_KM_HR, vehicle_xml.get(ATTR_SPEED_KM_HR))
-        ])
-
-        route_vehicles[api.TAG_VEHICLES].append(vehicle)
+        route_vehicles[api.TAG_VEHICLES].append(build_vehicle(vehicle_xml))
 
     route_vehicles[api.TAG_LAST_TIME] = validated_response.get(ELEMENT_BODY).\
         get(ELEMENT_LAST_TIME).get(ATTR_TIME)
@@ -425,12 +416,76 @@ def build_route_vehicles(validated_response):
     return route_vehicles
 
 
+def build_agency_vehicles(validated_response):
+    """
+    Return the vehicles in a vehicleLocations response for a whole agency by route tag, in the format of
+    build_route_vehicles, and the lastTime of the response
+    """
+
+    last_time = validated_response.get(ELEMENT_BODY).get(ELEMENT_LAST_TIME).get(ATTR_TIME)
+
+    vehicles_xml = validated_response.get(ELEMENT_BODY).get(ELEMENT_VEHICLE)
+    if not isinstance(vehicles_xml, list):
+        vehicles_xml = [] if vehicles_xml is None else [vehicles_xml]
+
+    vehicles_by_route = {}
+    for vehicle_xml in vehicles_xml:
+        route_tag = vehicle_xml.get(ATTR_ROUTE_TAG)
+        route_vehicles = vehicles_by_route.get(route_tag)
+        if route_vehicles is None:
+            route_vehicles = OrderedDict([
+                (api.TAG_VEHICLES, []),
+                (api.TAG_LAST_TIME, last_time)
+            ])
+            vehicles_by_route[route_tag] = route_vehicles
+
+        route_vehicles[api.TAG_VEHICLES].append(build_vehicle(vehicle_xml))
+
+    return vehicles_by_route, last_time
+
+
+def build_vehicle(vehicle_xml):
+
+    return OrderedDict([
+        (api.TAG_ID, vehicle_xml.get(ATTR_ID)),
+        (api.TAG_DIR_TAG, vehicle_xml.get(ATTR_DIR_TAG)),
+        (api.TAG_LAT, vehicle_xml.get(ATTR_LAT)),
+        (api.TAG_LON, vehicle_xml.get(ATTR_LON)),
+        (api.TAG_SECS_SINCE_REPORT, vehicle_xml.get(ATTR_SECS_SINCE_REPORT)),
+        (api.TAG_PREDICTABLE, vehicle_xml.get(ATTR_PREDICTABLE)),
+        (api.TAG_HEADING, vehicle_xml.get(ATTR_HEADING)),
+        (api.TAG_SPEED_KM_HR, vehicle_xml.get(ATTR_SPEED_KM_HR))
+    ])
+
+
 def build_route_predictions(validated_response):
 
+    return build_predictions(validated_response.get(ELEMENT_BODY).get(ELEMENT_PREDICTIONS))
+
+
+def build_multi_stop_predictions(validated_response):
+    """
+    Return the predictions in a predictionsForMultiStops response by (route tag, stop tag)
+    """
+
+    predictions_by_stop = {}
+
+    stops_xml = validated_response.get(ELEMENT_BODY).get(ELEMENT_PREDICTIONS)
+    if not isinstance(stops_xml, list):
+        stops_xml = [] if stops_xml is None else [stops_xml]
+
+    for predictions_xml in stops_xml:
+        stop = (predictions_xml.get(ATTR_ROUTE_TAG), predictions_xml.get(ATTR_STOP_TAG))
+        predictions_by_stop[stop] = build_predictions(predictions_xml)
+
+    return predictions_by_stop
+
+
+def build_predictions(predictions_xml):
+
     route_predictions = OrderedDict()
 
-    directions_xml = validated_response.get(ELEMENT_BODY).get(ELEMENT_PREDICTIONS).\
-        get(ELEMENT_DIRECTION)
+    directions_xml = predictions_xml.get(ELEMENT_DIRECTION)
 
     if not isinstance(directions_xml, list):
         directions_xml = [] if directions_xml is None else [directions_xml]
@@ -0,0 +1,188 @@
+"""
+Providers of transit data, and the provider of each agency
+
+A provider is a connector, NextBus or a local stand-in, with a circuit breaker and limits of its own: at
+most max_concurrency calls at a time and calls_per_second on average with bursts of burst calls. Calls
+over the limits wait for their turn for at most max_wait_seconds and then fail as the provider being
+unavailable, so a slow provider only makes requests for its own agencies wait. A batch, as the predictions
+of many stops asked for together, is a single call.
+"""
+import datetime
+
+from tornado import gen
+from tornado import ioloop
+from tornado import locks
+
+from pubtrans.common import breaker
+from pubtrans.common import exceptions
+from pubtrans.config import settings
+from pubtrans.services.local import LocalService
+from pubtrans.services.next_bus import NextBusService
+
+TYPE_NEXT_BUS = 'next_bus'
+TYPE_LOCAL = 'local'
+
+STAT_CALLS = 'calls'
+STAT_IN_FLIGHT = 'inFlight'
+STAT_WAITING = 'waiting'
+STAT_REJECTED = 'rejected'
+STAT_CIRCUIT_OPEN = 'circuitOpen'
+
+
+class CallLimiter(object):
+    """
+    Limits of the calls to a provider: at most max_concurrency at a time and calls_per_second on average with
+    bursts of burst calls, waiting at most max_wait_seconds for their turn
+    """
+
+    def __init__(self, max_concurrency, calls_per_second, burst, max_wait_seconds):
+        self.calls_per_second = calls_per_second
+        self.burst = burst
+        self.max_wait_seconds = max_wait_seconds
+        self._semaphore = locks.Semaphore(max_concurrency)
+        self._tokens = float(burst)
+        self._tokens_updated_at = None
+
+    @gen.coroutine
+    def acquire(self):
+        """
+        Wait for the turn of a call, raising gen.TimeoutError if it does not come in max_wait_seconds
+        """
+
+        io_loop = ioloop.IOLoop.current()
+        deadline = io_loop.time() + self.max_wait_seconds
+        yield self._wait_for_rate(io_loop.time())
+        wait_left = max(0, deadline - io_loop.time())
+        yield self._semaphore.acquire(timeout=datetime.timedelta(seconds=wait_left))
+
+    def release(self):
+
+        self._semaphore.release()
+
+    @gen.coroutine
+    def _wait_for_rate(self, now):
+        """
+        Take a token for a call, waiting for it if there are none left
+        """
+
+        if self._tokens_updated_at is not None:
+            self._tokens = min(self.burst,
+                               self._tokens + (now - self._tokens_updated_at) * self.calls_per_second)
+        self._tokens_updated_at = now
+
+        # Tokens go below zero for calls waiting for them, so they get them in turn
+        self._tokens -= 1
+        if self._tokens < 0:
+            delay = -self._tokens / self.calls_per_second
+            if delay > self.max_wait_seconds:
+                self._tokens += 1
+                raise gen.TimeoutError()
+            yield gen.sleep(delay)
+
+
+class Provider(object):
+    """
+    Connector of a provider with its limits, as in config. It is meant to be used only from the IOLoop thread.
+    """
+
+    def __init__(self, name, service, breaker_set, config):
+        self.name = name
+        self.title = config.get('title', name)
+        self.service = service
+        self.breaker_set = breaker_set
+        self.limiter = CallLimiter(config['max_concurrency'], config['calls_per_second'], config['burst'],
+                                   config['max_wait_seconds'])
+        self._counts = dict((stat, 0) for stat in [STAT_CALLS, STAT_IN_FLIGHT, STAT_WAITING, STAT_REJECTED,
+                                                   STAT_CIRCUIT_OPEN])
+
+    @gen.coroutine
+    def call(self, service_call, context):
+        """
+        Call service_call with the connector of the provider for context once the limits allow it
+        """
+
+        self._counts[STAT_WAITING] += 1
+        try:
+            yield self.limiter.acquire()
+        except gen.TimeoutError:
+            self._counts[STAT_REJECTED] += 1
+            raise exceptions.ExternalProviderUnavailableTemporarily(self.title)
+        finally:
+            self._counts[STAT_WAITING] -= 1
+
+        self._counts[STAT_CALLS] += 1
+        self._counts[STAT_IN_FLIGHT] += 1
+        try:
+            with self.breaker_set.context(self.name):
+                result = yield service_call(self.service.with_context(context))
+        except breaker.CircuitOpenError:
+            self._counts[STAT_CIRCUIT_OPEN] += 1
+            context.support.notify_debug('[Provider] Call to {0} failed. Circuit is open'.format(self.name))
+            raise exceptions.ExternalProviderUnavailableTemporarily(self.title)
+        finally:
+            self._counts[STAT_IN_FLIGHT] -= 1
+            self.limiter.release()
+
+        raise gen.Return(result)
+
+    def get_stats(self):
+
+        return dict(self._counts)
+
+
+class ProviderMap(object):
+    """
+    Providers by name and the provider of each agency, agencies not in the map being served by the default one
+    """
+
+    def __init__(self, providers, agency_providers, default_provider):
+        self.providers = dict((provider.name, provider) for provider in providers)
+        self.agency_providers = dict(agency_providers)
+        self.default_provider = default_provider
+
+        unknown = set(self.agency_providers.values() + [default_provider]) - set(self.providers)
+        if unknown:
+            raise ValueError('Unknown providers {0}'.format(', '.join(sorted(unknown))))
+
+    def get_provider(self, agency_tag=None):
+        """
+        Return the provider of agency_tag, or the default one for calls that are not for an agency
+        """
+
+        return self.providers[self.agency_providers.get(agency_tag, self.default_provider)]
+
+    def get_stats(self):
+
+        return dict((name, provider.get_stats()) for name, provider in self.providers.items())
+
+
+def build_service(config, support):
+    """
+    Return the connector of a provider configured with config
+    """
+
+    provider_type = config['type']
+    if provider_type == TYPE_NEXT_BUS:
+        return NextBusService(support=support, timeout=config.get('timeout'))
+    if provider_type == TYPE_LOCAL:
+        return LocalService(latency=config.get('latency_seconds', 0), support=support)
+
+    raise ValueError('Unknown provider type {0}'.format(provider_type))
+
+
+def build_providers(breaker_set, support, providers_config=None, agency_providers=None,
+                    default_provider=None):
+    """
+    Return the provider map with providers_config, agency_providers and default_provider, or the ones in
+    settings if they are not given
+    """
+
+    providers_config = settings.PROVIDERS if providers_config is None else providers_config
+    providers = [
+        Provider(name, build_service(config, support), breaker_set, config)
+        for name, config in providers_config.items()
+    ]
+
+    return ProviderMap(providers,
+                       settings.AGENCY_PROVIDERS if agency_providers is None else agency_providers,
+                       settings.DEFAULT_PROVIDER if default_provider is None else default_provider)
@@ -0,0 +1,128 @@
+import mock
+from tornado import gen
+from tornado import testing
+
+from pubtrans.common import exceptions
+from pubtrans.common import fetch_lease
+
+
+class TestFetchLease(testing.AsyncTestCase):
+
+    def setUp(self):
+        super(TestFetchLease, self).setUp()
+
+        self.repository = mock.MagicMock()
+        self.repository.release_fetch_lease.side_effect = self.coroutine_returning(None)
+        self.fetch_lease = fetch_lease.FetchLease(self.repository, 30, 0.05, 0.01)
+
+        self.calls = []
+        self.cached = []
+
+    @staticmethod
+    def coroutine_returning(*results):
+        results = list(results)
+
+        @gen.coroutine
+        def function(*args):  # pylint: disable=unused-argument
+            raise gen.Return(results.pop(0) if len(results) > 1 else results[0])
+
+        return function
+
+    @gen.coroutine
+    def fetch(self):
+        self.calls.append(True)
+        raise gen.Return('fetched')
+
+    @gen.coroutine
+    def fetch_not_found(self):
+        self.calls.append(True)
+        raise exceptions.NotFound('route')
+
+    @gen.coroutine
+    def cache_call(self):
+        raise gen.Return(self.cached.pop(0) if self.cached else None)
+
+    @testing.gen_test
+    def test_holder_fetches(self):
+
+        self.repository.acquire_fetch_lease.side_effect = self.coroutine_returning(True)
+
+        result = yield self.fetch_lease.run('predictions:sf-muni:E:4502', self.fetch, self.cache_call)
+
+        self.assertEqual(result, 'fetched')
+        self.assertEqual(self.calls, [True])
+        self.repository.acquire_fetch_lease.assert_called_once_with('predictions:sf-muni:E:4502',
+                                                                    mock.ANY, 30)
+        self.assertFalse(self.repository.release_fetch_lease.called)
+        self.assertEqual(self.fetch_lease.get_stats()[fetch_lease.STAT_ACQUIRED], 1)
+
+    @testing.gen_test
+    def test_waiter_reads_value_stored_by_holder(self):
+
+        self.repository.acquire_fetch_lease.side_effect = self.coroutine_returning(False)
+        self.cached = [None, None, 'cached']
+
+        result = yield self.fetch_lease.run('routeList:sf-muni', self.fetch, self.cache_call)
+
+        self.assertEqual(result, 'cached')
+        self.assertEqual(self.calls, [])
+        self.assertEqual(self.fetch_lease.get_stats()[fetch_lease.STAT_SUPPRESSED], 1)
+
+    @testing.gen_test
+    def test_waiter_gives_up_without_calling_upstream(self):
+
+        self.repository.acquire_fetch_lease.side_effect = self.coroutine_returning(False)
+
+        with self.assertRaises(exceptions.ExternalProviderUnavailableTemporarily):
+            yield self.fetch_lease.run('routeList:sf-muni', self.fetch, self.cache_call)
+
+        self.assertEqual(self.calls, [])
+
+    @testing.gen_test
+    def test_waiter_takes_lease_released_by_failed_holder(self):
+
+        self.repository.acquire_fetch_lease.side_effect = self.coroutine_returning(False, True)
+
+        result = yield self.fetch_lease.run('routeList:sf-muni', self.fetch, self.cache_call)
+
+        self.assertEqual(result, 'fetched')
+        self.assertEqual(self.repository.acquire_fetch_lease.call_count, 2)
+
+    @testing.gen_test
+    def test_lease_is_released_on_error(self):
+
+        self.repository.acquire_fetch_lease.side_effect = self.coroutine_returning(True)
+
+        with self.assertRaises(exceptions.NotFound):
+            yield self.fetch_lease.run('routeConfig:sf-muni:X', self.fetch_not_found, self.cache_call)
+
+        self.repository.release_fetch_lease.assert_called_once_with('routeConfig:sf-muni:X', mock.ANY)
+
+    @testing.gen_test
+    def test_error_is_raised_after_lease_is_released(self):
+
+        @gen.coroutine
+        def release_fetch_lease(lease_name, token):  # pylint: disable=unused-argument
+            # Released in another thread, as redis commands are
+            yield gen.sleep(0.001)
+            raise exceptions.DatabaseOperationError('Cannot release fetch lease in redis')
+
+        self.repository.acquire_fetch_lease.side_effect = self.coroutine_returning(True)
+        self.repository.release_fetch_lease.side_effect = release_fetch_lease
+
+        with self.assertRaises(exceptions.NotFound):
+            yield self.fetch_lease.run('routeConfig:sf-muni:X', self.fetch_not_found, self.cache_call)
+
+    @testing.gen_test
+    def test_fetch_without_lease_if_redis_is_not_available(self):
+
+        @gen.coroutine
+        def acquire_fetch_lease(lease_name, token, ttl):  # pylint: disable=unused-argument
+            raise exceptions.DatabaseOperationError('Cannot acquire fetch lease in redis')
+
+        self.repository.acquire_fetch_lease.side_effect = acquire_fetch_lease
+
+        result = yield self.fetch_lease.run('routeList:sf-muni', self.fetch, self.cache_call)
+
+        self.assertEqual(result, 'fetched')
+        self.assertEqual(self.fetch_lease.get_stats()[fetch_lease.STAT_UNGUARDED], 1)
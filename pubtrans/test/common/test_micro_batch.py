@@ -0,0 +1,79 @@
+from tornado import gen
+from tornado import testing
+
+from pubtrans.common import exceptions
+from pubtrans.common import micro_batch
+
+
+class TestMicroBatcher(testing.AsyncTestCase):
+
+    def setUp(self):
+        super(TestMicroBatcher, self).setUp()
+
+        self.batcher = micro_batch.MicroBatcher(0.01, 3)
+        self.calls = []
+
+    @gen.coroutine
+    def double(self, items):
+        self.calls.append(items)
+        raise gen.Return(dict((item, item * 2) for item in items))
+
+    @testing.gen_test
+    def test_calls_within_window_are_batched(self):
+
+        results = yield [self.batcher.run('sf-muni', 1, self.double),
+                         self.batcher.run('sf-muni', 2, self.double),
+                         self.batcher.run('sf-muni', 2, self.double)]
+
+        self.assertEqual(results, [2, 4, 4])
+        self.assertEqual(self.calls, [[1, 2]])
+        stats = self.batcher.get_stats()
+        self.assertEqual(stats[micro_batch.STAT_BATCHES], 1)
+        self.assertEqual(stats[micro_batch.STAT_BATCHED_CALLS], 3)
+        self.assertEqual(stats[micro_batch.STAT_MAX_BATCH_SIZE], 2)
+        self.assertEqual(stats[micro_batch.STAT_BATCH_SIZES], {'2': 1})
+
+    @testing.gen_test
+    def test_groups_are_batched_apart(self):
+
+        results = yield [self.batcher.run('sf-muni', 1, self.double),
+                         self.batcher.run('actransit', 2, self.double)]
+
+        self.assertEqual(results, [2, 4])
+        self.assertEqual(sorted(self.calls), [[1], [2]])
+
+    @testing.gen_test
+    def test_full_batch_is_run_before_window_closes(self):
+
+        results = yield [self.batcher.run('sf-muni', item, self.double) for item in range(5)]
+
+        self.assertEqual(results, [0, 2, 4, 6, 8])
+        self.assertEqual(self.calls, [[0, 1, 2], [3, 4]])
+        self.assertEqual(self.batcher.get_stats()[micro_batch.STAT_BATCH_SIZES], {'2': 1, '3-4': 1})
+
+    @testing.gen_test
+    def test_errors_are_raised_to_callers(self):
+
+        @gen.coroutine
+        def fail_one(items):
+            raise gen.Return({items[0]: exceptions.NotFound('stop'), items[1]: 'found'})
+
+        @gen.coroutine
+        def fail_all(items):  # pylint: disable=unused-argument
+            raise exceptions.ExternalProviderUnavailableTemporarily('NextBus')
+
+        futures = [self.batcher.run('sf-muni', 1, fail_one), self.batcher.run('sf-muni', 2, fail_one)]
+        with self.assertRaises(exceptions.NotFound):
+            yield futures[0]
+        result = yield futures[1]
+        self.assertEqual(result, 'found')
+
+        futures = [self.batcher.run('sf-muni', 1, fail_all), self.batcher.run('sf-muni', 2, fail_all)]
+        for future in futures:
+            with self.assertRaises(exceptions.ExternalProviderUnavailableTemporarily):
+                yield future
+
+    def test_size_buckets(self):
+
+        self.assertEqual([micro_batch.get_size_bucket(size) for size in [1, 2, 3, 4, 5, 8, 9, 100]],
+                         ['1', '2', '3-4', '3-4', '5-8', '5-8', '9-16', '65-128'])
@@ -0,0 +1,141 @@
+import os
+import threading
+import time
+import unittest
+
+import redis
+
+from pubtrans.common import redis_pool
+
+
+class FakeConnection(object):
+
+    def __init__(self, **kwargs):
+        self.kwargs = kwargs
+        self.pid = os.getpid()
+        self.connected = False
+        self.commands = []
+        self.fail_commands = False
+
+    def connect(self):
+        self.connected = True
+
+    def disconnect(self):
+        self.connected = False
+
+    def can_read(self):  # pylint: disable=no-self-use
+        return False
+
+    def send_command(self, *args):
+        if self.fail_commands:
+            raise redis.ConnectionError('Connection reset by peer')
+        self.commands.append(args)
+
+    def read_response(self):  # pylint: disable=no-self-use
+        return 'PONG'
+
+
+class TestMonitoredConnectionPool(unittest.TestCase):
+
+    def setUp(self):
+        super(TestMonitoredConnectionPool, self).setUp()
+
+        self.pool = redis_pool.MonitoredConnectionPool(health_check_interval=30,
+                                                       max_connections=2,
+                                                       timeout=0.01,
+                                                       connection_class=FakeConnection)
+
+    def test_connections_are_reused(self):
+
+        connection1 = self.pool.get_connection('GET')
+        self.pool.release(connection1)
+        connection2 = self.pool.get_connection('GET')
+
+        self.assertIs(connection1, connection2)
+        self.assertEqual(self.pool.get_stats()[redis_pool.STAT_CREATED], 1)
+
+    def test_stats(self):
+
+        connection1 = self.pool.get_connection('GET')
+        connection2 = self.pool.get_connection('GET')
+        self.pool.release(connection2)
+
+        stats = self.pool.get_stats()
+        self.assertEqual(stats[redis_pool.STAT_MAX_CONNECTIONS], 2)
+        self.assertEqual(stats[redis_pool.STAT_CREATED], 2)
+        self.assertEqual(stats[redis_pool.STAT_IN_USE], 1)
+        self.assertEqual(stats[redis_pool.STAT_IDLE], 1)
+        self.assertEqual(stats[redis_pool.STAT_WAITING], 0)
+
+        self.pool.release(connection1)
+        self.assertEqual(self.pool.get_stats()[redis_pool.STAT_IN_USE], 0)
+
+    def test_exhausted_pool_raises_connection_error(self):
+
+        self.pool.get_connection('GET')
+        self.pool.get_connection('GET')
+
+        with self.assertRaises(redis.ConnectionError):
+            self.pool.get_connection('GET')
+
+        self.assertEqual(self.pool.get_stats()[redis_pool.STAT_WAITING], 0)
+
+    def test_idle_connection_is_checked(self):
+
+        connection = self.pool.get_connection('GET')
+        self.pool.release(connection)
+        connection.released_at = time.time() - 60
+
+        self.pool.get_connection('GET')
+
+        self.assertEqual(connection.commands, [('PING',)])
+
+    def test_recently_used_connection_is_not_checked(self):
+
+        connection = self.pool.get_connection('GET')
+        self.pool.release(connection)
+
+        self.pool.get_connection('GET')
+
+        self.assertEqual(connection.commands, [])
+
+    def test_failed_health_check_disconnects(self):
+
+        connection = self.pool.get_connection('GET')
+        self.pool.release(connection)
+        connection.released_at = time.time() - 60
+        connection.fail_commands = True
+
+        self.pool.get_connection('GET')
+
+        self.assertFalse(connection.connected)
+        self.assertEqual(self.pool.get_stats()[redis_pool.STAT_HEALTH_CHECK_FAILURES], 1)
+
+
+class TestGetConnection(unittest.TestCase):
+
+    def test_clients_share_pool_by_role(self):
+
+        master1 = redis_pool.get_connection(redis_pool.ROLE_MASTER)
+        master2 = redis_pool.get_connection(redis_pool.ROLE_MASTER)
+        slave = redis_pool.get_connection(redis_pool.ROLE_SLAVE)
+
+        self.assertIs(master1.connection_pool, master2.connection_pool)
+        self.assertIsNot(master1.connection_pool, slave.connection_pool)
+        self.assertIn(redis_pool.ROLE_MASTER, redis_pool.get_stats())
+
+    def test_threads_get_the_same_client(self):
+
+        clients = []
+
+        def get_connection():
+            clients.append(redis_pool.get_connection(redis_pool.ROLE_SLAVE))
+
+        threads = [threading.Thread(target=get_connection) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(clients), 8)
+        self.assertTrue(all(client is clients[0] for client in clients))
@@ -0,0 +1,70 @@
+from tornado import concurrent
+from tornado import gen
+from tornado import testing
+
+from pubtrans.common import exceptions
+from pubtrans.common import single_flight
+
+
+class TestSingleFlight(testing.AsyncTestCase):
+
+    def setUp(self):
+        super(TestSingleFlight, self).setUp()
+
+        self.single_flight = single_flight.SingleFlight()
+        self.calls = []
+        self.pending = concurrent.Future()
+
+    @gen.coroutine
+    def operation(self, value):
+        self.calls.append(value)
+        result = yield self.pending
+        raise gen.Return(result + value)
+
+    @testing.gen_test
+    def test_concurrent_calls_share_result(self):
+
+        futures = [self.single_flight.run('key', self.operation, 1) for _ in range(5)]
+        self.pending.set_result(10)
+        results = yield futures
+
+        self.assertEqual(results, [11] * 5)
+        self.assertEqual(self.calls, [1])
+        stats = self.single_flight.get_stats()
+        self.assertEqual(stats[single_flight.STAT_EXECUTED], 1)
+        self.assertEqual(stats[single_flight.STAT_COALESCED], 4)
+        self.assertEqual(stats[single_flight.STAT_IN_FLIGHT], 0)
+
+    @testing.gen_test
+    def test_different_keys_are_not_coalesced(self):
+
+        futures = [self.single_flight.run('key1', self.operation, 1),
+                   self.single_flight.run('key2', self.operation, 2)]
+        self.pending.set_result(10)
+        results = yield futures
+
+        self.assertEqual(results, [11, 12])
+        self.assertEqual(self.calls, [1, 2])
+
+    @testing.gen_test
+    def test_concurrent_calls_share_exception(self):
+
+        futures = [self.single_flight.run('key', self.operation, 1) for _ in range(3)]
+        self.pending.set_exception(exceptions.NotFound('route'))
+
+        for future in futures:
+            with self.assertRaises(exceptions.NotFound):
+                yield future
+
+        self.assertEqual(self.calls, [1])
+        self.assertEqual(self.single_flight.get_stats()[single_flight.STAT_IN_FLIGHT], 0)
+
+    @testing.gen_test
+    def test_sequential_calls_are_executed(self):
+
+        self.pending.set_result(10)
+        yield self.single_flight.run('key', self.operation, 1)
+        yield self.single_flight.run('key', self.operation, 1)
+
+        self.assertEqual(self.calls, [1, 1])
+        self.assertEqual(self.single_flight.get_stats()[single_flight.STAT_COALESCED], 0)
@@ -1,7 +1,9 @@
 import mock
 import unittest
+from _socket import gaierror
 
 from pubtrans.common import support
+from pubtrans.config import settings
 
 
 class TestSupportNotify(unittest.TestCase):
@@ -93,3 +95,45 @@ class TestSupportNotify(unittest.TestCase):
         self.support.notify_debug(message, self.details)
         self.expected_extra['details'] = self.details
         self.logger.debug.assert_called_with(message, extra=self.expected_extra)
+
+
+class TestSupportStats(unittest.TestCase):
+
+    def setUp(self):
+        super(TestSupportStats, self).setUp()
+
+        self.logger = mock.MagicMock()
+        self.session_info = {'environment': 'unit_tests'}
+
+        patcher = mock.patch.dict(support._STATS_CLIENTS, clear=True)  # pylint: disable=protected-access
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    @mock.patch('statsd.StatsClient')
+    def test_stats_client_is_shared(self, mocked_stats_client):
+
+        first = support.Support(self.logger, self.session_info)
+        second = support.Support(self.logger, self.session_info)
+        second.stat_increment('net.responses.total_count')
+
+        mocked_stats_client.assert_called_once_with(host='telegraf', port=8125, prefix='pubtrans.unit_tests')
+        self.assertIs(first._stats_client, second._stats_client)  # pylint: disable=protected-access
+        mocked_stats_client.return_value.incr.assert_called_once_with('net.responses.total_count', 1, 1)
+
+    @mock.patch('time.time')
+    @mock.patch('statsd.StatsClient')
+    def test_stats_client_is_created_again_after_retry_interval(self, mocked_stats_client, mocked_time):
+
+        mocked_time.return_value = 1000.0
+        mocked_stats_client.side_effect = [gaierror(-2, 'Name or service not known'), mock.MagicMock()]
+
+        support.Support(self.logger, self.session_info)
+        mocked_time.return_value += settings.STATS_CLIENT_RETRY_SECONDS - 1
+        not_retried = support.Support(self.logger, self.session_info)
+        mocked_time.return_value += 1
+        retried = support.Support(self.logger, self.session_info)
+
+        self.assertEqual(mocked_stats_client.call_count, 2)
+        self.assertFalse(not_retried._stats_enabled)  # pylint: disable=protected-access
+        self.assertTrue(retried._stats_enabled)  # pylint: disable=protected-access
+        self.logger.warning.assert_called_once()
@@ -0,0 +1,745 @@
+import json
+import logging
+import time
+
+import mock
+from tornado import gen
+from tornado import testing
+
+from pubtrans.common import breaker
+from pubtrans.common import fetch_lease
+from pubtrans.common import micro_batch
+from pubtrans.common import single_flight
+from pubtrans.common.rest_adapter import RestAdapter
+from pubtrans.common.support import Support
+from pubtrans.common import dictionaries
+from pubtrans.common import exceptions
+from pubtrans.config import settings
+from pubtrans.domain import agency
+from pubtrans.domain import stop_index
+from pubtrans.domain import vehicle_positions
+from pubtrans.services import provider
+
+
+class TestAgency(testing.AsyncTestCase):
+
+    def setUp(self):
+        super(TestAgency, self).setUp()
+
+        self.agency_tag = 'sf-muni'
+        self.route_tag = 'E'
+        self.stop_tag = '4502'
+
+        self.mock_nextbus_response = \
+            '<body copyright="All data copyright San Francisco Muni 2016.">' \
+            '<predictions agencyTitle="San Francisco Muni" routeTitle="E-Embarcadero" routeTag="E" ' \
+            'stopTitle="The Embarcadero &amp; Bay St" stopTag="4502">' \
+            '  <direction title="Outbound to Mission Bay">' \
+            '    <prediction epochTime="1476394913877" seconds="361" minutes="6" isDeparture="false" ' \
+            'affectedByLayover="true" dirTag="E____O_F00" vehicle="1006" block="9204" tripTag="7273070" />' \
+            '  </direction>' \
+            '</predictions>' \
+            '</body>'
+
+        self.mock_schedule_response = \
+            '<body copyright="All data copyright San Francisco Muni 2016.">' \
+            '<route tag="F" title="F-Market" scheduleClass="2016T_FALL" serviceClass="wkd" ' \
+            'direction="Inbound">' \
+            '  <header><stop tag="5184">Jones St &amp; Beach St</stop></header>' \
+            '  <tr blockID="9201"><stop tag="5184" epochTime="32820020">09:07:20</stop></tr>' \
+            '</route>' \
+            '</body>'
+
+        self.repository = mock.MagicMock()
+        self.repository.predictions.get_route_predictions.side_effect = self.get_item
+        self.repository.predictions.store_route_predictions.side_effect = self.store_item
+        self.repository.acquire_fetch_lease.side_effect = self.acquire_fetch_lease
+        self.repository.get_fetch_error.side_effect = self.get_fetch_error
+
+        self.app_settings = dictionaries.DictAsObject(
+            support=mock.MagicMock(spec=Support),
+            circuit_breaker_set=mock.MagicMock(),
+            repository=self.repository,
+            single_flight=single_flight.SingleFlight(),
+            fetch_lease=fetch_lease.FetchLease(self.repository, 30, 10, 0.1),
+            predictions_batcher=micro_batch.MicroBatcher(0.01, 100),
+            vehicle_positions=vehicle_positions.VehiclePositions(),
+            providers=provider.build_providers(mock.MagicMock(), None))
+
+    @staticmethod
+    @gen.coroutine
+    def get_item(agency_tag, route_tag, stop_tag):  # pylint: disable=unused-argument
+        raise gen.Return(None)
+
+    @staticmethod
+    @gen.coroutine
+    def store_item(agency_tag, route_tag, stop_tag, predictions):  # pylint: disable=unused-argument
+        raise gen.Return(None)
+
+    @staticmethod
+    @gen.coroutine
+    def acquire_fetch_lease(lease_name, token, ttl):  # pylint: disable=unused-argument
+        raise gen.Return(True)
+
+    @staticmethod
+    @gen.coroutine
+    def get_fetch_error(fetch_name):  # pylint: disable=unused-argument
+        raise gen.Return(None)
+
+    @testing.gen_test
+    def test_concurrent_misses_call_nextbus_once(self):
+
+        @gen.coroutine
+        def get_success(path=None, body=None, query=None,
+                        headers=None, timeout=None):  # pylint: disable=unused-argument
+            yield gen.moment
+            raise gen.Return((200, self.mock_nextbus_response))
+
+        with mock.patch.object(RestAdapter, 'get') as mocked_rest_adapter:
+            mocked_rest_adapter.side_effect = get_success
+
+            results = yield [agency.Agency(self.agency_tag, self.app_settings).predictions.
+                             get_route_predictions(self.agency_tag, self.route_tag, self.stop_tag)
+                             for _ in range(10)]
+
+        self.assertEqual(mocked_rest_adapter.call_count, 1)
+        self.assertEqual(self.repository.predictions.store_route_predictions.call_count, 1)
+        self.assertEqual(len(results), 10)
+        for result in results:
+            self.assertEqual(result, results[0])
+        self.assertEqual(self.app_settings.single_flight.get_stats()[single_flight.STAT_COALESCED], 9)
+        self.repository.acquire_fetch_lease.assert_called_once_with(
+            'predictions:sf-muni:E:4502', mock.ANY, 30)
+
+    @testing.gen_test
+    def test_not_found_is_cached(self):
+
+        not_found_response = '<body copyright="All data copyright San Francisco Muni 2016.">' \
+                             '<Error shouldRetry="false">Could not get route "X"</Error>' \
+                             '</body>'
+        fetch_errors = {}
+
+        @gen.coroutine
+        def get_fetch_error(fetch_name):
+            raise gen.Return(fetch_errors.get(fetch_name))
+
+        @gen.coroutine
+        def store_fetch_error(fetch_name, error):
+            fetch_errors[fetch_name] = error
+
+        @gen.coroutine
+        def release_fetch_lease(lease_name, token):  # pylint: disable=unused-argument
+            raise gen.Return(None)
+
+        @gen.coroutine
+        def get_success(path=None, body=None, query=None,
+                        headers=None, timeout=None):  # pylint: disable=unused-argument
+            raise gen.Return((200, not_found_response))
+
+        self.repository.get_fetch_error.side_effect = get_fetch_error
+        self.repository.store_fetch_error.side_effect = store_fetch_error
+        self.repository.release_fetch_lease.side_effect = release_fetch_lease
+
+        with mock.patch.object(RestAdapter, 'get') as mocked_rest_adapter:
+            mocked_rest_adapter.side_effect = get_success
+
+            for _ in range(2):
+                with self.assertRaises(exceptions.NotFound):
+                    yield agency.Agency(self.agency_tag, self.app_settings).predictions.\
+                        get_route_predictions(self.agency_tag, 'X', self.stop_tag)
+
+        self.assertEqual(mocked_rest_adapter.call_count, 1)
+        self.assertEqual(fetch_errors.keys(), ['predictions:sf-muni:X:4502'])
+
+    @testing.gen_test
+    def test_concurrent_misses_for_different_stops_are_batched(self):
+
+        multi_stop_response = \
+            '<body copyright="All data copyright San Francisco Muni 2016.">' \
+            '<predictions routeTag="E" stopTag="4502"><direction title="Outbound to Mission Bay">' \
+            '<prediction epochTime="1476394913877" seconds="361" minutes="6" dirTag="E____O_F00" />' \
+            '</direction></predictions>' \
+            '<predictions routeTag="E" stopTag="4503"></predictions>' \
+            '</body>'
+
+        @gen.coroutine
+        def get_success(path=None, body=None, query=None,
+                        headers=None, timeout=None):  # pylint: disable=unused-argument
+            raise gen.Return((200, multi_stop_response))
+
+        with mock.patch.object(RestAdapter, 'get') as mocked_rest_adapter:
+            mocked_rest_adapter.side_effect = get_success
+
+            results = yield [agency.Agency(self.agency_tag, self.app_settings).predictions.
+                             get_route_predictions(self.agency_tag, self.route_tag, stop_tag)
+                             for stop_tag in ['4502', '4503']]
+
+        mocked_rest_adapter.assert_called_once()
+        self.assertEqual(mocked_rest_adapter.call_args[1]['query'],
+                         [('command', 'predictionsForMultiStops'), ('a', 'sf-muni'),
+                          ('stops', 'E|4502'), ('stops', 'E|4503')])
+        self.assertEqual(len(results[0]['directions']), 1)
+        self.assertEqual(results[1], {'directions': []})
+        # Each stop is cached by its own fetch
+        self.assertEqual(self.repository.predictions.store_route_predictions.call_count, 2)
+        batcher_stats = self.app_settings.predictions_batcher.get_stats()
+        self.assertEqual(batcher_stats[micro_batch.STAT_MAX_BATCH_SIZE], 2)
+
+    @testing.gen_test
+    def test_failed_batch_counts_once_in_circuit_breaker(self):
+
+        @gen.coroutine
+        def get_failure(path=None, body=None, query=None,
+                        headers=None, timeout=None):  # pylint: disable=unused-argument
+            raise exceptions.ExternalProviderUnavailableTemporarily('NextBus')
+
+        @gen.coroutine
+        def release_fetch_lease(lease_name, token):  # pylint: disable=unused-argument
+            raise gen.Return(None)
+
+        self.repository.release_fetch_lease.side_effect = release_fetch_lease
+        breaker_set = breaker.CircuitBreakerSet(time.time, logging.getLogger('circuit-breaker'), maxfail=3)
+        breaker_set.handle_error(exceptions.ExternalProviderUnavailableTemporarily)
+        self.app_settings.providers = provider.build_providers(breaker_set, None)
+
+        with mock.patch.object(RestAdapter, 'get') as mocked_rest_adapter:
+            mocked_rest_adapter.side_effect = get_failure
+
+            results = yield [self.fetch_predictions_error(stop_tag)
+                             for stop_tag in ['4502', '4503', '4504', '4505', '4506']]
+
+        self.assertEqual(results, [exceptions.ExternalProviderUnavailableTemporarily] * 5)
+        mocked_rest_adapter.assert_called_once()
+        self.assertEqual(breaker_set.context('next_bus').state, 'closed')
+
+    @gen.coroutine
+    def fetch_predictions_error(self, stop_tag):
+        try:
+            yield agency.Agency(self.agency_tag, self.app_settings).predictions.\
+                get_route_predictions(self.agency_tag, self.route_tag, stop_tag)
+        except exceptions.ExternalProviderUnavailableTemporarily as ex:
+            raise gen.Return(type(ex))
+
+    @testing.gen_test
+    def test_unknown_stop_does_not_fail_its_batch(self):
+
+        error_response = '<body copyright="All data copyright San Francisco Muni 2016.">' \
+                         '<Error shouldRetry="false">For agency=sf-muni stop s=9999 is on none of the ' \
+                         'directions for r=E so cannot determine which stop to provide data for.</Error>' \
+                         '</body>'
+
+        @gen.coroutine
+        def get_success(path=None, body=None, query=None,
+                        headers=None, timeout=None):  # pylint: disable=unused-argument
+            if dict(query).get('s') == '4502':
+                raise gen.Return((200, self.mock_nextbus_response))
+            raise gen.Return((200, error_response))
+
+        @gen.coroutine
+        def store_fetch_error(fetch_name, error):  # pylint: disable=unused-argument
+            raise gen.Return(None)
+
+        @gen.coroutine
+        def release_fetch_lease(lease_name, token):  # pylint: disable=unused-argument
+            raise gen.Return(None)
+
+        self.repository.store_fetch_error.side_effect = store_fetch_error
+        self.repository.release_fetch_lease.side_effect = release_fetch_lease
+
+        with mock.patch.object(RestAdapter, 'get') as mocked_rest_adapter:
+            mocked_rest_adapter.side_effect = get_success
+
+            futures = [agency.Agency(self.agency_tag, self.app_settings).predictions.
+                       get_route_predictions(self.agency_tag, self.route_tag, stop_tag)
+                       for stop_tag in ['4502', '9999']]
+            result = yield futures[0]
+            with self.assertRaises(exceptions.BadRequest):
+                yield futures[1]
+
+        # The batch and then each stop alone
+        self.assertEqual(mocked_rest_adapter.call_count, 3)
+        self.assertEqual(len(result['directions']), 1)
+        self.repository.store_fetch_error.assert_called_once_with('predictions:sf-muni:E:9999', mock.ANY)
+
+    @testing.gen_test
+    def test_unknown_stop_does_not_fail_stops_predictions(self):
+
+        error_response = '<body copyright="All data copyright San Francisco Muni 2016.">' \
+                         '<Error shouldRetry="false">For agency=sf-muni stop s=9999 is on none of the ' \
+                         'directions for r=E so cannot determine which stop to provide data for.</Error>' \
+                         '</body>'
+
+        @gen.coroutine
+        def get_success(path=None, body=None, query=None,
+                        headers=None, timeout=None):  # pylint: disable=unused-argument
+            if dict(query).get('s') == '4502':
+                raise gen.Return((200, self.mock_nextbus_response))
+            raise gen.Return((200, error_response))
+
+        @gen.coroutine
+        def get_stops_predictions(agency_tag, stops):  # pylint: disable=unused-argument
+            raise gen.Return(({}, list(stops)))
+
+        @gen.coroutine
+        def store_stops_predictions(agency_tag, predictions):  # pylint: disable=unused-argument
+            raise gen.Return(predictions)
+
+        @gen.coroutine
+        def release_fetch_lease(lease_name, token):  # pylint: disable=unused-argument
+            raise gen.Return(None)
+
+        self.repository.predictions.get_stops_predictions.side_effect = get_stops_predictions
+        self.repository.predictions.store_stops_predictions.side_effect = store_stops_predictions
+        self.repository.release_fetch_lease.side_effect = release_fetch_lease
+
+        with mock.patch.object(RestAdapter, 'get') as mocked_rest_adapter:
+            mocked_rest_adapter.side_effect = get_success
+
+            result = yield agency.Agency(self.agency_tag, self.app_settings).predictions.\
+                get_stops_predictions([('E', '4502'), ('E', '9999')])
+
+        # The batch and then each stop alone
+        self.assertEqual(mocked_rest_adapter.call_count, 3)
+        self.assertEqual(len(result[0]['directions']), 1)
+        self.assertEqual(result[1], {'directions': []})
+        self.assertFalse(self.repository.store_fetch_error.called)
+        stored = self.repository.predictions.store_stops_predictions.call_args[0][1]
+        self.assertEqual(sorted(stored.keys()), [('E', '4502'), ('E', '9999')])
+
+    @testing.gen_test
+    def test_stops_batch_is_not_taken_from_cache_until_every_stop_is_there(self):
+
+        @gen.coroutine
+        def get_stops_predictions(agency_tag, stops):  # pylint: disable=unused-argument
+            raise gen.Return(({('E', '4502'): {'directions': []}}, [('E', '9999')]))
+
+        self.repository.predictions.get_stops_predictions.side_effect = get_stops_predictions
+
+        predictions = yield agency.Agency(self.agency_tag, self.app_settings).predictions.\
+            get_stops_batch_from_cache([('E', '4502'), ('E', '9999')])
+
+        self.assertIsNone(predictions)
+
+    @testing.gen_test
+    def test_schedules_not_in_cache_are_fetched_and_stored_together(self):
+
+        cached_schedule = {'scheduleClass': '2016T_FALL', 'scheduleItems': {}}
+
+        @gen.coroutine
+        def get_route_schedules(agency_tag, route_tags):  # pylint: disable=unused-argument
+            raise gen.Return(({'E': cached_schedule}, ['F', 'J']))
+
+        @gen.coroutine
+        def store_route_schedules(agency_tag, schedules):  # pylint: disable=unused-argument
+            raise gen.Return(schedules)
+
+        @gen.coroutine
+        def get_success(path=None, body=None, query=None,
+                        headers=None, timeout=None):  # pylint: disable=unused-argument
+            raise gen.Return((200, self.mock_schedule_response))
+
+        self.repository.agency_index.get_route_schedules.side_effect = get_route_schedules
+        self.repository.agency_index.store_route_schedules.side_effect = store_route_schedules
+
+        with mock.patch.object(RestAdapter, 'get') as mocked_rest_adapter:
+            mocked_rest_adapter.side_effect = get_success
+
+            schedules, errors = yield agency.Agency(self.agency_tag, self.app_settings).schedules.\
+                get_route_schedules(['E', 'F', 'J'])
+
+        self.assertEqual(sorted(schedules.keys()), ['E', 'F', 'J'])
+        self.assertEqual(errors, {})
+        self.assertEqual(schedules['E'], cached_schedule)
+        self.assertEqual(mocked_rest_adapter.call_count, 2)
+        agency_index = self.repository.agency_index
+        agency_index.get_route_schedules.assert_called_once_with(self.agency_tag, ['E', 'F', 'J'])
+        agency_index.store_route_schedules.assert_called_once()
+        self.assertEqual(sorted(agency_index.store_route_schedules.call_args[0][1].keys()), ['F', 'J'])
+        self.assertFalse(self.repository.store_route_schedule.called)
+
+    @testing.gen_test
+    def test_schedule_fetches_are_concurrent_up_to_the_limit(self):
+
+        route_tags = [str(index) for index in range(10)]
+        in_flight = []
+        max_in_flight = []
+
+        @gen.coroutine
+        def get_route_schedules(agency_tag, route_tags):  # pylint: disable=unused-argument
+            raise gen.Return(({}, route_tags))
+
+        @gen.coroutine
+        def store_route_schedules(agency_tag, schedules):  # pylint: disable=unused-argument
+            raise gen.Return(schedules)
+
+        @gen.coroutine
+        def get_success(path=None, body=None, query=None,
+                        headers=None, timeout=None):  # pylint: disable=unused-argument
+            in_flight.append(query['r'])
+            max_in_flight.append(len(in_flight))
+            yield gen.sleep(0.01)
+            in_flight.remove(query['r'])
+            if query['r'] == '3':
+                raise gen.Return((200, '<body><Error shouldRetry="false">Could not get route "3"</Error>'
+                                       '</body>'))
+            raise gen.Return((200, self.mock_schedule_response))
+
+        @gen.coroutine
+        def store_fetch_error(fetch_name, error):  # pylint: disable=unused-argument
+            raise gen.Return(None)
+
+        @gen.coroutine
+        def release_fetch_lease(lease_name, token):  # pylint: disable=unused-argument
+            raise gen.Return(None)
+
+        self.repository.agency_index.get_route_schedules.side_effect = get_route_schedules
+        self.repository.agency_index.store_route_schedules.side_effect = store_route_schedules
+        self.repository.store_fetch_error.side_effect = store_fetch_error
+        self.repository.release_fetch_lease.side_effect = release_fetch_lease
+
+        with mock.patch.object(RestAdapter, 'get') as mocked_rest_adapter, \
+                mock.patch.object(settings, 'SCHEDULE_FETCH_CONCURRENCY', 3):
+            mocked_rest_adapter.side_effect = get_success
+
+            schedules, errors = yield agency.Agency(self.agency_tag, self.app_settings).schedules.\
+                get_route_schedules(route_tags)
+
+        self.assertEqual(mocked_rest_adapter.call_count, 10)
+        self.assertEqual(max(max_in_flight), 3)
+        self.assertEqual(sorted(schedules.keys()), [tag for tag in route_tags if tag != '3'])
+        self.assertEqual(errors.keys(), ['3'])
+        self.assertIsInstance(errors['3'], exceptions.NotFound)
+        self.assertEqual(len(self.repository.agency_index.store_route_schedules.call_args[0][1]), 9)
+
+    @testing.gen_test
+    def test_routes_not_running_at_use_service_windows(self):
+
+        routes = [{'tag': 'E'}, {'tag': 'F'}, {'tag': 'J'}]
+        all_day = [[service_class, 'inbound', 0, 86399] for service_class in ['wkd', 'sat', 'sun']]
+
+        @gen.coroutine
+        def get_service_windows(agency_tag):  # pylint: disable=unused-argument
+            raise gen.Return({'E': all_day, 'F': []})
+
+        @gen.coroutine
+        def get_route_schedules(agency_tag, route_tags):  # pylint: disable=unused-argument
+            raise gen.Return(({'J': {'scheduleItems': {}}}, []))
+
+        @gen.coroutine
+        def store_service_windows(agency_tag, windows):  # pylint: disable=unused-argument
+            raise gen.Return(None)
+
+        self.repository.agency_index.get_service_windows.side_effect = get_service_windows
+        self.repository.agency_index.get_route_schedules.side_effect = get_route_schedules
+        self.repository.agency_index.store_service_windows.side_effect = store_service_windows
+
+        agency_obj = agency.Agency(self.agency_tag, self.app_settings)
+        filtered_routes, unavailable_schedules = \
+            yield agency_obj.index.get_routes_not_running_at(routes, '02:00:00')
+
+        self.assertEqual(filtered_routes, [{'tag': 'F'}, {'tag': 'J'}])
+        self.assertEqual(unavailable_schedules, [])
+        # Only the route that was not in the index needs its schedule
+        self.repository.agency_index.get_route_schedules.assert_called_once_with(self.agency_tag, ['J'])
+        self.repository.agency_index.store_service_windows.assert_called_once_with(self.agency_tag, {'J': []})
+
+    @testing.gen_test
+    def test_route_paths_are_taken_from_cached_geometry(self):
+
+        route = {'tag': 'E', 'title': 'E-Embarcadero', 'stops': [], 'directions': [],
+                 'paths': [{'points': [{'lat': '37.8', 'lon': '-122.41'}, {'lat': '37.8', 'lon': '-122.4'}]}]}
+        geometry = {'0': {'indexes': [[0, 1]], 'polylines': ['_ibfFfw`jV?o}@'], 'pointCounts': [2]},
+                    '5': {'indexes': [[0, 1]], 'polylines': ['_ibfFfw`jV?o}@'], 'pointCounts': [2]}}
+
+        @gen.coroutine
+        def get_route(agency_tag, route_tag):  # pylint: disable=unused-argument
+            raise gen.Return(route)
+
+        @gen.coroutine
+        def get_route_geometry(agency_tag, route_tag):  # pylint: disable=unused-argument
+            raise gen.Return(geometry)
+
+        self.repository.get_route.side_effect = get_route
+        self.repository.get_route_geometry.side_effect = get_route_geometry
+
+        agency_obj = agency.Agency(self.agency_tag, self.app_settings)
+        compact_route = yield agency_obj.get_route('E', None, 'polyline', 7)
+        titled_route = yield agency_obj.get_route('E', ['title'], 'polyline', 7)
+
+        self.assertEqual(compact_route, {'tag': 'E', 'title': 'E-Embarcadero', 'color': None,
+                                         'oppositeColor': None, 'latMin': None, 'latMax': None,
+                                         'lonMin': None, 'lonMax': None, 'stops': [], 'directions': [],
+                                         'paths': [{'polyline': '_ibfFfw`jV?o}@'}], 'pathsTolerance': 5})
+        # Cached route config is left as it is, and geometry is not needed without paths
+        self.assertEqual(len(route['paths'][0]['points']), 2)
+        self.assertEqual(titled_route, {'title': 'E-Embarcadero'})
+        self.repository.get_route_geometry.assert_called_once_with(self.agency_tag, 'E')
+        self.assertFalse(self.repository.store_route_geometry.called)
+
+    @testing.gen_test
+    def test_route_paths_are_built_when_cached_geometry_is_of_another_config(self):
+
+        route = {'tag': 'E', 'title': 'E-Embarcadero', 'stops': [], 'directions': [],
+                 'paths': [{'points': [{'lat': '37.8', 'lon': '-122.41'}, {'lat': '37.8', 'lon': '-122.4'}]},
+                           {'points': [{'lat': '37.8', 'lon': '-122.4'}]}]}
+        # Of a config with only the first path, with one more point
+        geometry = {'0': {'indexes': [[0, 1, 2]], 'polylines': ['_ibfFfw`jV?o}@?o}@'], 'pointCounts': [3]}}
+
+        @gen.coroutine
+        def get_route(agency_tag, route_tag):  # pylint: disable=unused-argument
+            raise gen.Return(route)
+
+        @gen.coroutine
+        def get_route_geometry(agency_tag, route_tag):  # pylint: disable=unused-argument
+            raise gen.Return(geometry)
+
+        self.repository.get_route.side_effect = get_route
+        self.repository.get_route_geometry.side_effect = get_route_geometry
+
+        compact_route = yield agency.Agency(self.agency_tag, self.app_settings).get_route('E', ['paths'],
+                                                                                          'simplified', 0)
+
+        self.assertEqual([path.to_dict() for path in compact_route['paths']], route['paths'])
+        self.assertFalse(self.repository.store_route_geometry.called)
+
+    @testing.gen_test
+    def test_stop_index_adds_routes_not_in_it_from_their_configs(self):
+
+        route_stops = {'E': [{'tag': '3095', 'stopId': '13095', 'directions': ['E____O_F00']}]}
+
+        @gen.coroutine
+        def get_routes(agency_tag):  # pylint: disable=unused-argument
+            raise gen.Return([{'tag': 'E'}, {'tag': 'F'}])
+
+        @gen.coroutine
+        def get_route_stops(agency_tag):  # pylint: disable=unused-argument
+            raise gen.Return(route_stops)
+
+        @gen.coroutine
+        def get_route(agency_tag, route_tag):  # pylint: disable=unused-argument
+            raise gen.Return({'tag': 'F', 'stops': [{'tag': '3095', 'stopId': '13095'}],
+                              'directions': [{'tag': 'F____I_F00', 'stops': [{'tag': '3095'}]}]})
+
+        @gen.coroutine
+        def store_route_stops(agency_tag, stops):  # pylint: disable=unused-argument
+            route_stops.update(stops)
+
+        self.repository.get_routes.side_effect = get_routes
+        self.repository.agency_index.get_route_stops.side_effect = get_route_stops
+        self.repository.get_route.side_effect = get_route
+        self.repository.agency_index.store_route_stops.side_effect = store_route_stops
+
+        agency_obj = agency.Agency(self.agency_tag, self.app_settings)
+        stop = yield agency_obj.index.get_stop('13095')
+        yield agency_obj.index.get_stop('3095')
+
+        self.assertEqual(stop['tag'], '3095')
+        self.assertEqual(stop['routes'], [{'tag': 'E', 'directions': ['E____O_F00']},
+                                          {'tag': 'F', 'directions': ['F____I_F00']}])
+        # Only the route that was not in the index needs its config
+        self.repository.get_route.assert_called_once_with(self.agency_tag, 'F')
+        self.assertEqual(self.repository.agency_index.store_route_stops.call_count, 1)
+
+        with self.assertRaises(exceptions.NotFound):
+            yield agency_obj.index.get_stop('9999')
+
+    @testing.gen_test
+    def test_stop_index_is_not_rebuilt_while_route_stops_are_the_same(self):
+
+        route_stops = {'E': [{'tag': '3095', 'stopId': '13095', 'directions': ['E____O_F00']}]}
+
+        @gen.coroutine
+        def get_routes(agency_tag):  # pylint: disable=unused-argument
+            raise gen.Return([{'tag': 'E'}])
+
+        @gen.coroutine
+        def get_route_stops(agency_tag):  # pylint: disable=unused-argument
+            # As read again from redis by each request
+            raise gen.Return(json.loads(json.dumps(route_stops)))
+
+        self.repository.get_routes.side_effect = get_routes
+        self.repository.agency_index.get_route_stops.side_effect = get_route_stops
+
+        agency_obj = agency.Agency(self.agency_tag, self.app_settings)
+        index, _ = yield agency_obj.index.get_stop_index()
+        same_index, _ = yield agency_obj.index.get_stop_index()
+
+        self.assertIs(same_index, index)
+
+        route_stops['E'][0]['directions'].append('E____I_F00')
+        new_index, _ = yield agency_obj.index.get_stop_index()
+
+        self.assertIsNot(new_index, index)
+        self.assertEqual(stop_index.find_stop(new_index, '3095')['routes'][0]['directions'],
+                         ['E____O_F00', 'E____I_F00'])
+
+    @testing.gen_test
+    def test_agency_vehicles_are_polled_once_and_stored_together(self):
+
+        vehicles_response = \
+            '<body copyright="All data copyright San Francisco Muni 2016.">' \
+            '<vehicle id="1008" routeTag="E" dirTag="E____I_F00" lat="37.7747" lon="-122.39613" ' \
+            'secsSinceReport="4" predictable="true" heading="219" speedKmHr="0"/>' \
+            '<vehicle id="1450" routeTag="J" dirTag="J____O_F00" lat="37.7629" lon="-122.4293" ' \
+            'secsSinceReport="10" predictable="true" heading="200" speedKmHr="20"/>' \
+            '<lastTime time="1476314411287"/>' \
+            '</body>'
+        old_state = {'vehicles': [], 'lastTime': 1476314381287}
+
+        @gen.coroutine
+        def get_routes(agency_tag):  # pylint: disable=unused-argument
+            raise gen.Return([{'tag': 'E'}, {'tag': 'F'}])
+
+        @gen.coroutine
+        def get_routes_vehicles(agency_tag, route_tags):  # pylint: disable=unused-argument
+            raise gen.Return(({'E': old_state, 'F': old_state}, []))
+
+        @gen.coroutine
+        def store_routes_vehicles(agency_tag, states):  # pylint: disable=unused-argument
+            raise gen.Return(states)
+
+        @gen.coroutine
+        def get_success(path=None, body=None, query=None,
+                        headers=None, timeout=None):  # pylint: disable=unused-argument
+            raise gen.Return((200, vehicles_response))
+
+        self.repository.get_routes.side_effect = get_routes
+        self.repository.vehicles.get_routes_vehicles.side_effect = get_routes_vehicles
+        self.repository.vehicles.store_routes_vehicles.side_effect = store_routes_vehicles
+
+        with mock.patch.object(RestAdapter, 'get') as mocked_rest_adapter:
+            mocked_rest_adapter.side_effect = get_success
+
+            states = yield agency.Agency(self.agency_tag, self.app_settings).vehicles.poll_agency_vehicles()
+
+        # One call for the whole agency, since the last poll
+        mocked_rest_adapter.assert_called_once()
+        self.assertEqual(mocked_rest_adapter.call_args[1]['query'],
+                         {'command': 'vehicleLocations', 'a': 'sf-muni', 't': '1476314381287'})
+
+        self.repository.vehicles.store_routes_vehicles.assert_called_once_with(self.agency_tag, states)
+        self.assertEqual(sorted(states.keys()), ['E', 'F', 'J'])
+        self.assertEqual([vehicle['id'] for vehicle in states['E']['vehicles']], ['1008'])
+        self.assertEqual(states['F'], {'vehicles': [], 'lastTime': 1476314411287})
+        self.repository.acquire_fetch_lease.assert_called_once_with('vehicleLocations:sf-muni', mock.ANY, 30)
+
+        # Positions of every route are updated too
+        vehicles = self.app_settings.vehicle_positions.find(self.agency_tag, (-123, 37, -122, 38))
+        self.assertEqual([(vehicle.route_tag, vehicle.id) for vehicle in vehicles],
+                         [('J', '1450'), ('E', '1008')])
+
+    @testing.gen_test
+    def test_consecutive_polls_both_call_nextbus(self):
+
+        now = [1476314411.287]
+        leases = {}
+
+        @gen.coroutine
+        def acquire_fetch_lease(lease_name, token, ttl):
+            # Kept by redis until ttl seconds have passed
+            if lease_name in leases and now[0] - leases[lease_name][1] <= ttl:
+                raise gen.Return(False)
+            leases[lease_name] = (token, now[0])
+            raise gen.Return(True)
+
+        @gen.coroutine
+        def get_routes(agency_tag):  # pylint: disable=unused-argument
+            raise gen.Return([{'tag': 'E'}])
+
+        @gen.coroutine
+        def get_routes_vehicles(agency_tag, route_tags):  # pylint: disable=unused-argument
+            raise gen.Return(({'E': {'vehicles': [], 'lastTime': 1476314381287}}, []))
+
+        @gen.coroutine
+        def store_routes_vehicles(agency_tag, states):  # pylint: disable=unused-argument
+            raise gen.Return(states)
+
+        @gen.coroutine
+        def get_success(path=None, body=None, query=None,
+                        headers=None, timeout=None):  # pylint: disable=unused-argument
+            raise gen.Return((200, '<body><lastTime time="1476314411287"/></body>'))
+
+        self.repository.acquire_fetch_lease.side_effect = acquire_fetch_lease
+        self.repository.get_routes.side_effect = get_routes
+        self.repository.vehicles.get_routes_vehicles.side_effect = get_routes_vehicles
+        self.repository.vehicles.store_routes_vehicles.side_effect = store_routes_vehicles
+        self.app_settings.fetch_lease = fetch_lease.FetchLease(
+            self.repository, settings.NEXTBUS_REQUEST_MIN_INTERVAL_SECONDS, 0.05, 0.01)
+
+        with mock.patch.object(RestAdapter, 'get') as mocked_rest_adapter:
+            mocked_rest_adapter.side_effect = get_success
+
+            yield agency.Agency(self.agency_tag, self.app_settings).vehicles.poll_agency_vehicles()
+            now[0] += settings.VEHICLE_POLL_INTERVAL_SECONDS
+            yield agency.Agency(self.agency_tag, self.app_settings).vehicles.poll_agency_vehicles()
+
+        # The lease of the first poll is gone when the second one starts
+        self.assertEqual(mocked_rest_adapter.call_count, 2)
+
+    @testing.gen_test
+    def test_old_vehicle_positions_are_used_if_agency_cannot_be_polled(self):
+
+        @gen.coroutine
+        def get_routes(agency_tag):  # pylint: disable=unused-argument
+            raise exceptions.ExternalProviderUnavailableTemporarily('NextBus')
+
+        self.repository.get_routes.side_effect = get_routes
+        positions = vehicle_positions.VehiclePositions(clock=lambda: 0)
+        positions.update(self.agency_tag, {'E': {'vehicles': [
+            {'id': '1008', 'lat': '37.7747', 'lon': '-122.39613', 'reportTime': 1000}], 'lastTime': 1000}})
+        positions.clock = lambda: settings.VEHICLE_POSITIONS_MAX_AGE_SECONDS + 1
+        self.app_settings.vehicle_positions = positions
+
+        agency_obj = agency.Agency(self.agency_tag, self.app_settings)
+        vehicles = yield agency_obj.vehicles.get_vehicles_in_box(-123, 37, -122, 38)
+
+        self.assertEqual([vehicle.id for vehicle in vehicles], ['1008'])
+        self.repository.get_routes.assert_called_once_with(self.agency_tag)
+
+        self.app_settings.vehicle_positions = vehicle_positions.VehiclePositions()
+        with self.assertRaises(exceptions.ExternalProviderUnavailableTemporarily):
+            yield agency_obj.vehicles.get_vehicles_in_box(-123, 37, -122, 38)
+
+    @testing.gen_test
+    def test_agency_is_served_by_its_provider(self):
+
+        predictions = {'directions': [{'title': 'Outbound to Mission Bay', 'predictions': []}]}
+        local_config = {'type': 'local', 'max_concurrency': 1, 'calls_per_second': 10, 'burst': 10,
+                        'max_wait_seconds': 1}
+        self.app_settings.providers = provider.build_providers(
+            mock.MagicMock(), None, {'next_bus': dict(local_config), 'local': local_config},
+            {self.agency_tag: 'local'}, 'next_bus')
+        local = self.app_settings.providers.get_provider(self.agency_tag).service
+        local.add('get_route_predictions', [self.agency_tag, self.route_tag, self.stop_tag], predictions)
+
+        with mock.patch.object(RestAdapter, 'get') as mocked_rest_adapter:
+            result = yield agency.Agency(self.agency_tag, self.app_settings).predictions.\
+                get_route_predictions(self.agency_tag, self.route_tag, self.stop_tag)
+
+        self.assertEqual(result, predictions)
+        self.assertEqual(len(local.calls), 1)
+        self.assertEqual(self.app_settings.providers.get_provider().service.calls, [])
+        mocked_rest_adapter.assert_not_called()
+
+    @testing.gen_test
+    def test_batch_is_a_single_call_to_its_provider(self):
+
+        stop_tags = [str(4500 + index) for index in range(12)]
+        local_config = {'type': 'local', 'max_concurrency': 3, 'calls_per_second': 1, 'burst': 1,
+                        'max_wait_seconds': 1}
+        self.app_settings.providers = provider.build_providers(mock.MagicMock(), None,
+                                                               {'local': local_config}, {}, 'local')
+        local_provider = self.app_settings.providers.get_provider(self.agency_tag)
+        for stop_tag in stop_tags:
+            local_provider.service.add('get_route_predictions', [self.agency_tag, self.route_tag, stop_tag],
+                                       {'directions': [], 'stopTag': stop_tag})
+
+        results = yield [agency.Agency(self.agency_tag, self.app_settings).predictions.
+                         get_route_predictions(self.agency_tag, self.route_tag, stop_tag)
+                         for stop_tag in stop_tags]
+
+        self.assertEqual([result['stopTag'] for result in results], stop_tags)
+        self.assertEqual([call_name for call_name, _ in local_provider.service.calls],
+                         ['get_multi_stop_predictions'])
+        self.assertEqual(local_provider.get_stats()[provider.STAT_CALLS], 1)
+        self.assertEqual(local_provider.get_stats()[provider.STAT_REJECTED], 0)
@@ -0,0 +1,157 @@
+import json
+import unittest
+from collections import OrderedDict
+
+import xmltodict
+
+from pubtrans.domain import api
+from pubtrans.domain import entities
+from pubtrans.services import next_bus_xml
+
+ROUTE_CONFIG_RESPONSE = \
+    '<body copyright="All data copyright San Francisco Muni 2016.">' \
+    '<route tag="E" title="E-Embarcadero" latMin="37.7762699" latMax="37.80" lonMin="-122.41700" ' \
+    'lonMax="-122.38798">' \
+    '<stop tag="5184" title="Jones St &amp; Beach St" lat="37.8085000" lon="-122.41737" stopId="15184"/>' \
+    '<stop tag="3092" title="Beach St &amp; Mason St" lat="37.80741" lon="-122.4141"/>' \
+    '<direction tag="E____I_F00" title="Inbound to Fisherman&apos;s Wharf" name="Inbound">' \
+    '<stop tag="5184"/><stop tag="3092"/></direction>' \
+    '<path><point lat="37.80" lon="-122.41700"/><point lat="37.8085000" lon="-122.4"/>' \
+    '<point lat="3.78e1" lon="-122.4"/></path>' \
+    '<path><point lat="37.80741"/><point lat="n/a" lon="-122.4141"/></path>' \
+    '</route>' \
+    '</body>'
+
+SCHEDULE_RESPONSE = \
+    '<body copyright="All data copyright San Francisco Muni 2016.">' \
+    '<route tag="E" title="E-Embarcadero" scheduleClass="2016T_FALL" serviceClass="wkd" ' \
+    'direction="Inbound">' \
+    '<header><stop tag="5184">Jones St &amp; Beach St</stop><stop tag="3092">Beach St</stop></header>' \
+    '<tr blockID="9201"><stop tag="5184" epochTime="25200000">07:00:00</stop>' \
+    '<stop tag="3092" epochTime="-1">--</stop></tr>' \
+    '<tr blockID="9202"><stop tag="5184" epochTime="25800000">07:10:00</stop>' \
+    '<stop tag="3092" epochTime="025860000">07:11:00</stop></tr>' \
+    '</route>' \
+    '</body>'
+
+VEHICLES_RESPONSE = \
+    '<body copyright="All data copyright San Francisco Muni 2016.">' \
+    '<vehicle id="1008" routeTag="E" dirTag="E____O_F00" lat="37.80" lon="-122.39610" secsSinceReport="4" ' \
+    'predictable="true" heading="90" speedKmHr="0.0"/>' \
+    '<vehicle id="1010" routeTag="E" lat="37.8080" lon="-122.4177" secsSinceReport="12" ' \
+    'predictable="false"/>' \
+    '<lastTime time="1476314411287"/>' \
+    '</body>'
+
+
+class TestEntities(unittest.TestCase):
+
+    def setUp(self):
+        self.route = OrderedDict([
+            (api.TAG_TAG, 'E'),
+            (api.TAG_TITLE, 'E-Embarcadero'),
+            (api.TAG_COLOR, '667744'),
+            (api.TAG_OPPOSITE_COLOR, 'ffffff'),
+            (api.TAG_LAT_MIN, '37.7762699'),
+            (api.TAG_LAT_MAX, '37.8085899'),
+            (api.TAG_LON_MIN, '-122.41732'),
+            (api.TAG_LON_MAX, '-122.38798'),
+            (api.TAG_STOPS, [OrderedDict([
+                (api.TAG_TAG, '5184'),
+                (api.TAG_TITLE, 'Jones St & Beach St'),
+                (api.TAG_LAT, '37.8072499'),
+                (api.TAG_LON, '-122.41737'),
+                (api.TAG_STOP_ID, '15184')
+            ])]),
+            (api.TAG_DIRECTIONS, [OrderedDict([
+                (api.TAG_TAG, 'E____I_F00'),
+                (api.TAG_TITLE, 'Inbound to Fisherman\'s Wharf'),
+                (api.TAG_NAME, 'Inbound'),
+                (api.TAG_USE_FOR_UI, 'true'),
+                (api.TAG_STOPS, [{api.TAG_TAG: '5184'}])
+            ])]),
+            (api.TAG_PATHS, [{api.TAG_POINTS: [OrderedDict([(api.TAG_LAT, '37.7762699'),
+                                                            (api.TAG_LON, '-122.38798')])]}])
+        ])
+        self.schedule = OrderedDict([
+            (api.TAG_SCHEDULE_CLASS, '2016T_FALL'),
+            (api.TAG_SCHEDULE_ITEMS, OrderedDict([
+                ('wkd_Inbound', OrderedDict([
+                    (api.TAG_SERVICE_CLASS, 'wkd'),
+                    (api.TAG_DIRECTION, 'Inbound'),
+                    (api.TAG_STOPS, OrderedDict([
+                        ('5184', OrderedDict([
+                            (api.TAG_TAG, '5184'),
+                            (api.TAG_TITLE, 'Jones St & Beach St'),
+                            (api.TAG_SCHEDULED_ARRIVALS, [
+                                OrderedDict([(api.TAG_EPOCH_TIME, '25200000'),
+                                             (api.TAG_TIME_DATA, '07:00:00')]),
+                                OrderedDict([(api.TAG_EPOCH_TIME, '-1'),
+                                             (api.TAG_TIME_DATA, '--')])
+                            ])
+                        ]))
+                    ])),
+                    (api.TAG_SCHEDULE_START_TIME, '18000000'),
+                    (api.TAG_SCHEDULE_END_TIME, '90000000')
+                ]))
+            ]))
+        ])
+
+    def test_route_is_written_back_with_its_json_shape(self):
+
+        route = entities.Route.from_dict(self.route)
+
+        self.assertEqual(route.lat_min, '37.7762699')
+        self.assertEqual(route.directions[0].use_for_ui, 'true')
+        self.assertEqual(route.paths[0].get_positions(), [(37.7762699, -122.38798)])
+        self.assertEqual(route.to_dict(), self.route)
+        self.assertEqual(json.loads(route.dumps()), self.route)
+        self.assertEqual(route.dumps(), json.dumps(route.to_dict()))
+
+    def test_schedule_is_written_back_with_its_json_shape(self):
+
+        schedule = entities.Schedule.from_dict(self.schedule)
+        stop = schedule.items['wkd_Inbound'].stops['5184']
+
+        self.assertEqual(list(stop.epochs), [25200000, -1])
+        self.assertEqual(schedule.to_dict(), self.schedule)
+        self.assertEqual(schedule.dumps(), json.dumps(schedule.to_dict()))
+
+    def test_missing_fields_are_written_as_null(self):
+
+        vehicle = entities.Vehicle.from_dict({api.TAG_ID: '1008', api.TAG_LAT: '37.80', api.TAG_LON: 'x',
+                                              api.TAG_SECS_SINCE_REPORT: '4'})
+
+        self.assertEqual(vehicle.dumps(), '{"id": "1008", "dirTag": null, "lat": "37.80", "lon": "x", '
+                                          '"secsSinceReport": "4", "predictable": null, "heading": null, '
+                                          '"SpeedKmHr": null}')
+
+        vehicle.route_tag = 'E'
+        self.assertEqual(list(vehicle.to_dict())[:2], [api.TAG_ROUTE_TAG, api.TAG_ID])
+
+    def test_json_is_the_one_of_parsed_responses(self):
+
+        route = next_bus_xml.build_route(xmltodict.parse(ROUTE_CONFIG_RESPONSE))
+        schedule = next_bus_xml.build_schedule(xmltodict.parse(SCHEDULE_RESPONSE))
+        vehicles = next_bus_xml.build_route_vehicles(xmltodict.parse(VEHICLES_RESPONSE))[api.TAG_VEHICLES]
+
+        for value, entity in [(route, entities.Route.from_dict(route)),
+                              (schedule, entities.Schedule.from_dict(schedule)),
+                              (vehicles, [entities.Vehicle.from_dict(vehicle) for vehicle in vehicles])]:
+            self.assertEqual(entities.dumps(entity), json.dumps(value))
+            self.assertEqual(json.dumps(entities.Entity.to_dict(entity) if isinstance(entity, entities.Entity)
+                                        else [item.to_dict() for item in entity]), json.dumps(value))
+
+        # Simplified paths keep the texts of their points
+        points = route[api.TAG_PATHS][0][api.TAG_POINTS]
+        path = entities.Route.from_dict(route).paths[0].select([0, 2])
+        self.assertEqual(path.dumps(), json.dumps({api.TAG_POINTS: [points[0], points[2]]}))
+
+    def test_entities_in_values_are_written_with_their_json_shape(self):
+
+        route = entities.Route.from_dict(self.route)
+
+        self.assertEqual(json.loads(entities.dumps({'routes': [route]})), {'routes': [self.route]})
+        self.assertEqual(route.get_fields([api.TAG_TITLE, 'unknown']),
+                         {api.TAG_TITLE: 'E-Embarcadero', 'unknown': None})
+        self.assertIs(entities.Route.from_value(route), route)
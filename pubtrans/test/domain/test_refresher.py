@@ -0,0 +1,195 @@
+import mock
+from tornado import gen
+from tornado import testing
+
+from pubtrans.common import dictionaries
+from pubtrans.common.context import Context
+from pubtrans.common import exceptions
+from pubtrans.domain import agency_vehicles
+from pubtrans.domain import refresher
+from pubtrans.domain import registry
+
+
+class TestStaleRefresher(testing.AsyncTestCase):
+
+    def setUp(self):
+        super(TestStaleRefresher, self).setUp()
+
+        self.times_to_stale = {}
+        repository = mock.MagicMock()
+        repository.get_times_to_stale.side_effect = self.get_times_to_stale
+        self.app_settings = dictionaries.DictAsObject(
+            circuit_breaker_set=mock.MagicMock(),
+            repository=repository,
+            single_flight=mock.MagicMock(),
+            fetch_lease=mock.MagicMock(),
+            predictions_batcher=mock.MagicMock(),
+            vehicle_positions=mock.MagicMock())
+        self.stale_refresher = refresher.StaleRefresher(self.app_settings)
+        self.stale_refresher._domain_settings = dictionaries.DictAsObject(  # pylint: disable=protected-access
+            self.app_settings, support=mock.MagicMock())
+
+    @gen.coroutine
+    def get_times_to_stale(self, items):
+        raise gen.Return([self.times_to_stale.get(item, -1) for item in items])
+
+    @testing.gen_test
+    def test_stale_entity_is_refreshed_once(self):
+
+        fetched = []
+
+        @gen.coroutine
+        def fetch_entity(domain_settings, entity, key_args):  # pylint: disable=unused-argument
+            fetched.append((entity, key_args))
+            yield gen.moment
+
+        with mock.patch.object(refresher, 'fetch_entity', side_effect=fetch_entity):
+            self.stale_refresher.refresh('route_predictions', ('sf-muni', 'E', '4502'))
+            self.stale_refresher.refresh('route_predictions', ('sf-muni', 'E', '4502'))
+            yield gen.sleep(0.01)
+            self.stale_refresher.refresh('route_predictions', ('sf-muni', 'E', '4502'))
+            yield gen.sleep(0.01)
+
+        self.assertEqual(fetched, [('route_predictions', ('sf-muni', 'E', '4502'))] * 2)
+        self.assertEqual(self.stale_refresher.get_stats()[refresher.STAT_STALE_SCHEDULED], 2)
+        self.app_settings.repository.forget_in_memory.assert_called_with('route_predictions',
+                                                                         ('sf-muni', 'E', '4502'))
+
+    @testing.gen_test
+    def test_entity_refreshed_by_another_replica_is_read_from_redis(self):
+
+        self.times_to_stale[('route', ('sf-muni', 'E'))] = 300
+
+        with mock.patch.object(refresher, 'fetch_entity') as mocked_fetch_entity:
+            self.stale_refresher.refresh('route', ('sf-muni', 'E'))
+            yield gen.sleep(0.01)
+
+        mocked_fetch_entity.assert_not_called()
+        # The stale copy in memory is dropped so the fresh one is read from redis
+        self.app_settings.repository.forget_in_memory.assert_called_once_with('route', ('sf-muni', 'E'))
+        self.assertEqual(self.stale_refresher.get_stats()[refresher.STAT_STALE_SKIPPED], 1)
+
+    @testing.gen_test
+    def test_failed_refresh_is_counted(self):
+
+        @gen.coroutine
+        def fetch_entity(domain_settings, entity, key_args):  # pylint: disable=unused-argument
+            raise Exception('NextBus not available')
+
+        with mock.patch.object(refresher, 'fetch_entity', side_effect=fetch_entity):
+            self.stale_refresher.refresh('routes', ('sf-muni',))
+            yield gen.sleep(0.01)
+
+        self.assertEqual(self.stale_refresher.get_stats()[refresher.STAT_STALE_FAILED], 1)
+
+
+class TestPopularityRefresher(testing.AsyncTestCase):
+
+    def setUp(self):
+        super(TestPopularityRefresher, self).setUp()
+
+        self.uris = [
+            '/v1/sf-muni/routes/E/predictions?stopTag=4502',
+            '/v1/sf-muni/routes/E/vehicles',
+            '/v1/stats/uri_count',
+            '/v1/sf-muni/routes',
+            '/v1/sf-muni/routes/F/messages'
+        ]
+        self.times_to_stale = {
+            ('route_predictions', ('sf-muni', 'E', '4502')): 5,
+            ('route_vehicles', ('sf-muni', 'E')): None,
+            ('routes', ('sf-muni',)): 200,
+            ('route_messages', ('sf-muni', 'F')): -1
+        }
+
+        repository = mock.MagicMock()
+        repository.uri_stats.get_popular_uris.side_effect = self.get_popular_uris
+        repository.get_times_to_stale.side_effect = self.get_times_to_stale
+        self.app_settings = dictionaries.DictAsObject(repository=repository)
+
+        self.popularity_refresher = refresher.PopularityRefresher(self.app_settings, 10, 300, 2)
+        domain_settings = dictionaries.DictAsObject(self.app_settings, support=mock.MagicMock())
+        self.popularity_refresher._domain_settings = domain_settings  # pylint: disable=protected-access
+
+    @gen.coroutine
+    def get_popular_uris(self, limit):  # pylint: disable=unused-argument
+        raise gen.Return(self.uris)
+
+    @gen.coroutine
+    def get_times_to_stale(self, items):
+        raise gen.Return([self.times_to_stale[item] for item in items])
+
+    def test_parse_uri(self):
+
+        self.assertEqual(refresher.parse_uri('/v1/sf-muni/routes/E/predictions?stopTag=4502'),
+                         ('route_predictions', ('sf-muni', 'E', '4502')))
+        self.assertEqual(refresher.parse_uri('/v1/sf-muni/routes/E'), ('route', ('sf-muni', 'E')))
+        self.assertEqual(refresher.parse_uri('/v1/sf-muni/routes/E/stops/4502/arrivals?limit=5'),
+                         ('route_schedule', ('sf-muni', 'E')))
+        self.assertEqual(refresher.parse_uri('/v1/sf-muni/routes/E/vehicles?lastTime=1476314411287'),
+                         ('route_vehicles', ('sf-muni', 'E')))
+        self.assertEqual(refresher.parse_uri('/v1/sf-muni/routes/E/vehicles'),
+                         ('route_vehicles', ('sf-muni', 'E')))
+        self.assertEqual(refresher.parse_uri('/v1/agencies'), ('agencies', ()))
+        self.assertIsNone(refresher.parse_uri('/v1/sf-muni/routes/E/predictions'))
+        self.assertIsNone(refresher.parse_uri('/v1/stats/uri_count'))
+
+    @testing.gen_test
+    def test_most_requested_due_entities_are_refreshed_within_budget(self):
+
+        fetched = []
+
+        @gen.coroutine
+        def fetch_entity(domain_settings, entity, key_args):  # pylint: disable=unused-argument
+            fetched.append((entity, key_args))
+
+        with mock.patch.object(refresher, 'fetch_entity', side_effect=fetch_entity):
+            yield self.popularity_refresher.run()
+
+        self.assertEqual(fetched, [('route_predictions', ('sf-muni', 'E', '4502')),
+                                   ('route_vehicles', ('sf-muni', 'E'))])
+        stats = self.popularity_refresher.get_stats()
+        self.assertEqual(stats[refresher.STAT_POPULAR_REFRESHED], 2)
+        self.assertEqual(stats[refresher.STAT_POPULAR_OVER_BUDGET], 1)
+
+
+class TestVehiclePoller(testing.AsyncTestCase):
+
+    def setUp(self):
+        super(TestVehiclePoller, self).setUp()
+
+        self.app_settings = dictionaries.DictAsObject(
+            circuit_breaker_set=mock.MagicMock(),
+            repository=mock.MagicMock(),
+            single_flight=mock.MagicMock(),
+            fetch_lease=mock.MagicMock(),
+            predictions_batcher=mock.MagicMock(),
+            vehicle_positions=mock.MagicMock())
+
+        support = mock.MagicMock()
+        self.app_settings.agencies = registry.AgencyRegistry(self.app_settings, support, 10)
+
+        self.vehicle_poller = refresher.VehiclePoller(self.app_settings, 30, ['sf-muni', 'actransit'])
+        domain_settings = dictionaries.DictAsObject(self.app_settings, support=support,
+                                                    context=Context(support=support))
+        self.vehicle_poller._domain_settings = domain_settings  # pylint: disable=protected-access
+
+    @testing.gen_test
+    def test_every_agency_is_polled(self):
+
+        polled = []
+
+        @gen.coroutine
+        def poll_agency_vehicles(agency_vehicles_obj):
+            if agency_vehicles_obj.agency_tag == 'actransit':
+                raise exceptions.ExternalProviderUnavailableTemporarily('NextBus')
+            polled.append(agency_vehicles_obj.agency_tag)
+
+        with mock.patch.object(agency_vehicles.AgencyVehicles, 'poll_agency_vehicles', autospec=True,
+                               side_effect=poll_agency_vehicles):
+            yield self.vehicle_poller.run()
+
+        self.assertEqual(polled, ['sf-muni'])
+        stats = self.vehicle_poller.get_stats()
+        self.assertEqual(stats[refresher.STAT_VEHICLE_POLLS], 1)
+        self.assertEqual(stats[refresher.STAT_VEHICLE_POLLS_FAILED], 1)
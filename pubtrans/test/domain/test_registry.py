@@ -0,0 +1,66 @@
+import unittest
+
+import mock
+
+from pubtrans.common import dictionaries
+from pubtrans.common.context import Context
+from pubtrans.domain import registry
+from pubtrans.services import provider
+
+
+class TestAgencyRegistry(unittest.TestCase):
+
+    def setUp(self):
+        self.support = mock.MagicMock()
+        self.app_settings = dictionaries.DictAsObject(
+            circuit_breaker_set=mock.MagicMock(),
+            repository=mock.MagicMock(),
+            single_flight=mock.MagicMock(),
+            fetch_lease=mock.MagicMock(),
+            predictions_batcher=mock.MagicMock(),
+            vehicle_positions=mock.MagicMock(),
+            providers=provider.build_providers(mock.MagicMock(), self.support))
+        self.agencies = registry.AgencyRegistry(self.app_settings, self.support, 2)
+
+    def test_agency_is_built_once_and_shared_by_requests(self):
+
+        request_support = mock.MagicMock()
+        agency_obj = self.agencies.get_agency('sf-muni')
+        view = self.agencies.get_agency('sf-muni', Context(support=request_support))
+
+        self.assertIs(self.agencies.get_agency('sf-muni'), agency_obj)
+        self.assertIs(agency_obj.support, self.support)
+        self.assertIs(view.support, request_support)
+        self.assertEqual(view.agency_tag, 'sf-muni')
+        self.assertIs(view.repository, self.app_settings.repository)
+        self.assertIs(view.predictions.support, request_support)
+        self.assertIs(view.predictions.context, view.context)
+        self.assertIs(view.index.provider, agency_obj.provider)
+
+        # Shared objects are always the current ones in settings
+        self.app_settings.vehicle_positions = mock.MagicMock()
+        self.assertIs(agency_obj.vehicles.vehicle_positions, self.app_settings.vehicle_positions)
+
+    def test_least_recently_used_agency_is_dropped(self):
+
+        sf_muni = self.agencies.get_agency('sf-muni')
+        self.agencies.get_agency('actransit')
+        self.agencies.get_agency('sf-muni')
+        self.agencies.get_agency('jhu-apl')
+
+        self.assertIs(self.agencies.get_agency('sf-muni'), sf_muni)
+        agencies = self.agencies._agencies  # pylint: disable=protected-access
+        self.assertEqual(list(agencies), ['jhu-apl', 'sf-muni'])
+
+    def test_next_bus_client_is_shared_by_requests(self):
+
+        request_support = mock.MagicMock()
+        service_obj = self.agencies.get_service()
+        view = self.agencies.get_service(Context(support=request_support))
+        next_bus = self.app_settings.providers.get_provider().service
+        next_bus_view = next_bus.with_context(view.context)
+
+        self.assertIs(self.agencies.get_service(), service_obj)
+        self.assertIs(view.support, request_support)
+        self.assertIs(next_bus_view.rest_adapter, next_bus.rest_adapter)
+        self.assertIs(next_bus_view._support, request_support)  # pylint: disable=protected-access
@@ -0,0 +1,74 @@
+import unittest
+
+from pubtrans.domain import api
+from pubtrans.domain import route_geometry
+
+
+def make_path(positions):
+    return {api.TAG_POINTS: [{api.TAG_LAT: lat, api.TAG_LON: lon} for lat, lon in positions]}
+
+
+class TestRouteGeometry(unittest.TestCase):
+
+    def setUp(self):
+        # Along a street with a point about 1 m off it, then a turn of about 110 m
+        self.paths = [
+            make_path([('37.8', '-122.41'), ('37.80001', '-122.409'), ('37.8', '-122.408'),
+                       ('37.801', '-122.408')]),
+            make_path([('37.77962', '-122.38982'), (None, None)])
+        ]
+
+    def test_polyline_is_encoded_as_google_does(self):
+
+        positions = [(38.5, -120.2), (40.7, -120.95), (43.252, -126.453)]
+
+        self.assertEqual(route_geometry.encode_polyline(positions), '_p~iF~ps|U_ulLnnqC_mqNvxq`@')
+        self.assertEqual(route_geometry.encode_polyline([]), '')
+
+    def test_points_within_tolerance_are_left_out(self):
+
+        positions = [(float(point[api.TAG_LAT]), float(point[api.TAG_LON]))
+                     for point in self.paths[0][api.TAG_POINTS]]
+
+        self.assertEqual(route_geometry.simplify(positions, 0), [0, 1, 2, 3])
+        self.assertEqual(route_geometry.simplify(positions, 2), [0, 2, 3])
+        self.assertEqual(route_geometry.simplify(positions, 200), [0, 3])
+        self.assertEqual(route_geometry.simplify(positions[:2], 200), [0, 1])
+
+    def test_geometry_is_built_for_each_tolerance(self):
+
+        geometry = route_geometry.build_geometry(self.paths, [5, 0])
+
+        self.assertEqual(list(geometry), ['0', '5'])
+        self.assertEqual(geometry['5'][route_geometry.KEY_INDEXES], [[0, 2, 3], [0]])
+        self.assertEqual(geometry['5'][route_geometry.KEY_POLYLINES][1],
+                         route_geometry.encode_polyline([(37.77962, -122.38982)]))
+        self.assertEqual(geometry['5'][route_geometry.KEY_POINT_COUNTS], [4, 2])
+
+    def test_geometry_is_only_built_for_paths_with_as_many_points(self):
+
+        geometry = route_geometry.build_geometry(self.paths, [0, 5])
+
+        self.assertTrue(route_geometry.is_built_for(geometry, self.paths))
+        self.assertFalse(route_geometry.is_built_for(geometry, self.paths[:1]))
+        other_paths = [self.paths[0], make_path([('37.8', '-122.4')])]
+        self.assertFalse(route_geometry.is_built_for(geometry, other_paths))
+        del geometry['5'][route_geometry.KEY_POINT_COUNTS]
+        self.assertFalse(route_geometry.is_built_for(geometry, self.paths))
+
+    def test_paths_use_largest_tolerance_not_above_the_one_asked(self):
+
+        geometry = route_geometry.build_geometry(self.paths, [0, 5, 10])
+
+        points = self.paths[0][api.TAG_POINTS]
+
+        tolerance, paths = route_geometry.get_paths(self.paths, geometry, route_geometry.GEOMETRY_SIMPLIFIED,
+                                                    7.5)
+        self.assertEqual(tolerance, 5)
+        self.assertEqual(paths[0].to_dict()[api.TAG_POINTS], [points[0], points[2], points[3]])
+
+        tolerance, paths = route_geometry.get_paths(self.paths, geometry, route_geometry.GEOMETRY_POLYLINE,
+                                                    100)
+        self.assertEqual(tolerance, 10)
+        self.assertEqual(paths, [{api.TAG_POLYLINE: polyline}
+                                 for polyline in geometry['10'][route_geometry.KEY_POLYLINES]])
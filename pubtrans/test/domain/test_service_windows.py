@@ -0,0 +1,56 @@
+import unittest
+
+from pubtrans.domain import api
+from pubtrans.domain import service_windows
+
+
+def make_schedule_item(service_class, direction, epochs):
+    return {
+        api.TAG_SERVICE_CLASS: service_class,
+        api.TAG_DIRECTION: direction,
+        api.TAG_STOPS: {
+            '5184': {
+                api.TAG_TAG: '5184',
+                api.TAG_SCHEDULED_ARRIVALS: [{api.TAG_EPOCH_TIME: str(epoch)} for epoch in epochs]
+            }
+        }
+    }
+
+
+class TestServiceWindows(unittest.TestCase):
+
+    def setUp(self):
+        self.schedule = {
+            api.TAG_SCHEDULE_ITEMS: {
+                # 05:00 to 01:30 of the next day
+                'wkd:inbound': make_schedule_item('wkd', 'Inbound', [18000000, 43200000, 91800000]),
+                # 06:00 to 22:00
+                'sat:outbound': make_schedule_item('sat', 'Outbound', [79200000, -1, 21600000]),
+                'sun:inbound': make_schedule_item('sun', 'Inbound', [])
+            }
+        }
+        self.windows = service_windows.build_windows(self.schedule)
+
+    def test_build_windows(self):
+
+        self.assertEqual(sorted(self.windows), [['sat', 'outbound', 21600, 79200],
+                                                ['wkd', 'inbound', 18000, 91800]])
+
+    def test_parse_time(self):
+
+        self.assertEqual(service_windows.parse_time('02:30:15'), 9015)
+
+    def test_is_running(self):
+
+        monday, friday, saturday, sunday = 1, 5, 6, 0
+
+        def is_running(time_str, weekday):
+            return service_windows.is_running(self.windows, service_windows.parse_time(time_str), weekday)
+
+        self.assertTrue(is_running('12:00:00', monday))
+        self.assertFalse(is_running('03:00:00', monday))
+        self.assertTrue(is_running('23:00:00', friday))
+        # Friday service goes on past midnight
+        self.assertTrue(is_running('01:00:00', saturday))
+        self.assertFalse(is_running('23:00:00', saturday))
+        self.assertFalse(is_running('12:00:00', sunday))
@@ -0,0 +1,84 @@
+import json
+import unittest
+
+from pubtrans.domain import api
+from pubtrans.domain import stop_index
+
+
+def make_route(route_tag, stop_tags):
+    return {
+        api.TAG_TAG: route_tag,
+        api.TAG_STOPS: [{api.TAG_TAG: stop_tag, api.TAG_TITLE: 'Stop ' + stop_tag, api.TAG_LAT: '37.8',
+                         api.TAG_LON: '-122.4', api.TAG_STOP_ID: '1' + stop_tag} for stop_tag in stop_tags],
+        api.TAG_DIRECTIONS: [
+            {api.TAG_TAG: route_tag + '_O',
+             api.TAG_STOPS: [{api.TAG_TAG: stop_tag} for stop_tag in stop_tags]},
+            {api.TAG_TAG: route_tag + '_I', api.TAG_STOPS: [{api.TAG_TAG: stop_tags[0]}]}
+        ]
+    }
+
+
+class TestStopIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.route_stops = {
+            'E': stop_index.build_route_stops(make_route('E', ['5184', '3095'])),
+            'F': stop_index.build_route_stops(make_route('F', ['3095', '7283']))
+        }
+
+    def test_route_stops_have_their_directions(self):
+
+        self.assertEqual([(stop[api.TAG_TAG], stop[api.TAG_STOP_ID], stop[api.TAG_DIRECTIONS])
+                          for stop in self.route_stops['E']],
+                         [('5184', '15184', ['E_O', 'E_I']), ('3095', '13095', ['E_O'])])
+
+    def test_stops_are_found_by_tag_and_stop_id(self):
+
+        index = stop_index.build_index(self.route_stops)
+
+        stop = stop_index.find_stop(index, '3095')
+        self.assertEqual(stop[api.TAG_TITLE], 'Stop 3095')
+        self.assertEqual(stop[api.TAG_ROUTES], [{api.TAG_TAG: 'E', api.TAG_DIRECTIONS: ['E_O']},
+                                                {api.TAG_TAG: 'F', api.TAG_DIRECTIONS: ['F_O', 'F_I']}])
+        self.assertIs(stop_index.find_stop(index, '13095'), stop)
+        self.assertIsNone(stop_index.find_stop(index, '9999'))
+
+    def test_index_is_rebuilt_only_when_route_stops_change(self):
+
+        index = stop_index.get_index('sf-muni', self.route_stops)
+
+        self.assertIs(stop_index.get_index('sf-muni', self.route_stops), index)
+        # Stops merged into a new dict, or read again from redis, are the same stops
+        self.assertIs(stop_index.get_index('sf-muni', dict(self.route_stops)), index)
+        self.assertIs(stop_index.get_index('sf-muni', json.loads(json.dumps(self.route_stops))), index)
+
+        route_stops = dict(self.route_stops, G=stop_index.build_route_stops(make_route('G', ['7283'])))
+        index = stop_index.get_index('sf-muni', route_stops)
+        self.assertEqual(stop_index.find_stop(index, '7283')[api.TAG_ROUTES][-1][api.TAG_TAG], 'G')
+
+        route_stops = dict(route_stops, G=stop_index.build_route_stops(make_route('G', ['5184'])))
+        self.assertIsNot(stop_index.get_index('sf-muni', route_stops), index)
+        self.assertIsNot(stop_index.get_index('sf-muni', {'E': self.route_stops['E']}), index)
+
+    def test_nearby_stops_are_sorted_by_distance(self):
+
+        route_stops = {'E': [
+            {api.TAG_TAG: 'far', api.TAG_LAT: '37.8100', api.TAG_LON: '-122.4100'},
+            {api.TAG_TAG: 'near', api.TAG_LAT: '37.8001', api.TAG_LON: '-122.4000'},
+            {api.TAG_TAG: 'next cell', api.TAG_LAT: '37.7990', api.TAG_LON: '-122.4021'},
+            {api.TAG_TAG: 'unknown position', api.TAG_LAT: None, api.TAG_LON: None}
+        ]}
+        index = stop_index.build_index(route_stops)
+
+        nearby_stops = stop_index.find_nearby_stops(index, 37.8, -122.4, 400, 10)
+
+        self.assertEqual([(stop[api.TAG_TAG], stop[api.TAG_DISTANCE]) for stop in nearby_stops],
+                         [('near', 11), ('next cell', 215)])
+        self.assertEqual(len(stop_index.find_nearby_stops(index, 37.8, -122.4, 400, 1)), 1)
+        self.assertEqual(len(stop_index.find_nearby_stops(index, 37.8, -122.4, 2000, 10)), 3)
+
+    def test_distance(self):
+
+        # Ferry Building to Fisherman's Wharf, about 2.1 km
+        distance = stop_index.get_distance(37.7955, -122.3937, 37.8080, -122.4177)
+        self.assertTrue(2000 < distance < 2600)
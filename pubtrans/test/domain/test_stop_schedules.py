@@ -0,0 +1,64 @@
+import unittest
+
+from pubtrans.domain import api
+from pubtrans.domain import stop_schedules
+
+
+def make_schedule_item(service_class, direction, epochs):
+    return {
+        api.TAG_SERVICE_CLASS: service_class,
+        api.TAG_DIRECTION: direction,
+        api.TAG_STOPS: {
+            '5184': {
+                api.TAG_TAG: '5184',
+                api.TAG_TITLE: 'Jones St & Beach St',
+                api.TAG_SCHEDULED_ARRIVALS: [{api.TAG_EPOCH_TIME: str(epoch)} for epoch in epochs]
+            }
+        }
+    }
+
+
+class TestStopSchedules(unittest.TestCase):
+
+    def setUp(self):
+        self.schedule = {
+            api.TAG_SCHEDULE_ITEMS: {
+                'wkd:inbound': make_schedule_item('wkd', 'Inbound', [32820000, 28800000, 36000000]),
+                'wkd:outbound': make_schedule_item('wkd', 'Outbound', [30000000, 90000000]),
+                'sun:inbound': make_schedule_item('sun', 'Inbound', [40000000, -1])
+            }
+        }
+        self.stop_schedules = stop_schedules.build_stop_schedules(self.schedule)
+
+    def test_next_arrivals_in_any_direction(self):
+
+        # Monday at 08:30
+        title, arrivals = stop_schedules.find_next_arrivals(self.stop_schedules, '5184', 30600, 1, 2)
+
+        self.assertEqual(title, 'Jones St & Beach St')
+        self.assertEqual(arrivals, [
+            {api.TAG_DIRECTION: 'Inbound', api.TAG_EPOCH_TIME: '32820000', api.TAG_TIME_DATA: '09:07:00'},
+            {api.TAG_DIRECTION: 'Inbound', api.TAG_EPOCH_TIME: '36000000', api.TAG_TIME_DATA: '10:00:00'}
+        ])
+        self.assertEqual(stop_schedules.find_next_arrivals(self.stop_schedules, '5184', 86000, 1, 2)[1], [
+            {api.TAG_DIRECTION: 'Outbound', api.TAG_EPOCH_TIME: '90000000', api.TAG_TIME_DATA: '01:00:00'}
+        ])
+
+    def test_service_past_midnight_is_found_early_next_day(self):
+
+        # Tuesday at 00:30, the Monday service that ends at 01:00 and then Tuesday service
+        _, arrivals = stop_schedules.find_next_arrivals(self.stop_schedules, '5184', 1800, 2, 3)
+
+        self.assertEqual([arrival[api.TAG_EPOCH_TIME] for arrival in arrivals],
+                         ['90000000', '28800000', '30000000'])
+
+    def test_unknown_stop(self):
+
+        self.assertIsNone(stop_schedules.find_next_arrivals(self.stop_schedules, '9999', 0, 1, 2))
+
+    def test_slices_are_rebuilt_only_when_schedule_changes(self):
+
+        sliced = stop_schedules.get_stop_schedules('sf-muni', 'E', self.schedule)
+
+        self.assertIs(stop_schedules.get_stop_schedules('sf-muni', 'E', self.schedule), sliced)
+        self.assertIsNot(stop_schedules.get_stop_schedules('sf-muni', 'E', dict(self.schedule)), sliced)
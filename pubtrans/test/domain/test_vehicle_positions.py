@@ -0,0 +1,47 @@
+import unittest
+
+from pubtrans.domain import api
+from pubtrans.domain import vehicle_positions
+from pubtrans.domain import vehicle_state
+
+
+def make_state(vehicles):
+    return vehicle_state.merge(None, {
+        api.TAG_VEHICLES: [{api.TAG_ID: vehicle_id, api.TAG_LAT: lat, api.TAG_LON: lon,
+                            api.TAG_SECS_SINCE_REPORT: '5'} for vehicle_id, lat, lon in vehicles],
+        api.TAG_LAST_TIME: '100000'
+    }, 900)
+
+
+class TestVehiclePositions(unittest.TestCase):
+
+    def setUp(self):
+        self.now = 1000
+        self.positions = vehicle_positions.VehiclePositions(clock=lambda: self.now)
+        self.positions.update('sf-muni', {
+            'E': make_state([('1008', '37.7747', '-122.39613'), ('1010', '37.8080', '-122.4177')]),
+            'J': make_state([('1450', '37.7629', '-122.4293'), ('1451', None, None)])
+        })
+
+    def test_vehicles_in_box_are_found(self):
+
+        vehicles = self.positions.find('sf-muni', (-122.43, 37.76, -122.39, 37.78))
+
+        self.assertEqual([(vehicle.route_tag, vehicle.id) for vehicle in vehicles],
+                         [('J', '1450'), ('E', '1008')])
+        self.assertEqual(vehicles[1].to_dict()[api.TAG_LAT], '37.7747')
+        self.assertEqual(vehicles[1].secs_since_report, '5')
+        self.assertNotIn(vehicle_state.REPORT_TIME, vehicles[1].to_dict())
+        self.assertEqual(self.positions.find('sf-muni', (-122.41, 37.76, -122.40, 37.78)), [])
+        self.assertEqual(self.positions.find('actransit', (-180, -90, 180, 90)), [])
+
+    def test_positions_are_replaced_on_update(self):
+
+        self.now = 1030
+        self.assertEqual(self.positions.get_age('sf-muni'), 30)
+        self.assertIsNone(self.positions.get_age('actransit'))
+
+        self.positions.update('sf-muni', {'E': make_state([])})
+
+        self.assertEqual(self.positions.get_age('sf-muni'), 0)
+        self.assertEqual(self.positions.find('sf-muni', (-180, -90, 180, 90)), [])
@@ -0,0 +1,57 @@
+import unittest
+
+from pubtrans.domain import api
+from pubtrans.domain import vehicle_state
+
+
+def make_vehicle(vehicle_id, secs_since_report, lat='37.7747'):
+    return {
+        api.TAG_ID: vehicle_id,
+        api.TAG_LAT: lat,
+        api.TAG_SECS_SINCE_REPORT: str(secs_since_report)
+    }
+
+
+class TestVehicleState(unittest.TestCase):
+
+    def setUp(self):
+        self.state = vehicle_state.merge(
+            None,
+            {api.TAG_VEHICLES: [make_vehicle('1008', 4), make_vehicle('1015', 81)],
+             api.TAG_LAST_TIME: '100000'},
+            900)
+
+    def test_merge_keeps_report_times(self):
+
+        self.assertEqual(self.state[api.TAG_LAST_TIME], 100000)
+        self.assertEqual([vehicle[vehicle_state.REPORT_TIME] for vehicle in self.state[api.TAG_VEHICLES]],
+                         [96000, 19000])
+        self.assertTrue(vehicle_state.is_state(self.state))
+        self.assertEqual(vehicle_state.get_last_time(self.state), 100000)
+        self.assertEqual(vehicle_state.get_last_time(None), 0)
+
+    def test_merge_updates_changed_vehicles_and_expires_old_ones(self):
+
+        state = vehicle_state.merge(
+            self.state,
+            {api.TAG_VEHICLES: [make_vehicle('1008', 1, lat='37.78'), make_vehicle('1007', 10)],
+             api.TAG_LAST_TIME: '160000'},
+            140)
+
+        self.assertEqual(state[api.TAG_LAST_TIME], 160000)
+        self.assertEqual([(vehicle[api.TAG_ID], vehicle[api.TAG_LAT], vehicle[vehicle_state.REPORT_TIME])
+                          for vehicle in state[api.TAG_VEHICLES]],
+                         [('1008', '37.78', 159000), ('1007', '37.7747', 150000)])
+
+    def test_diff_returns_vehicles_reported_after_last_time(self):
+
+        self.assertEqual(vehicle_state.diff(self.state, '0'), {
+            api.TAG_VEHICLES: [make_vehicle('1008', 4), make_vehicle('1015', 81)],
+            api.TAG_LAST_TIME: '100000'
+        })
+        self.assertEqual(vehicle_state.diff(self.state, '50000')[api.TAG_VEHICLES], [make_vehicle('1008', 4)])
+        self.assertEqual(vehicle_state.diff(self.state, '100000')[api.TAG_VEHICLES], [])
+
+    def test_cached_responses_are_not_states(self):
+
+        self.assertFalse(vehicle_state.is_state({api.TAG_VEHICLES: [], api.TAG_LAST_TIME: '100000'}))
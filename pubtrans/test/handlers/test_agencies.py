@@ -10,6 +10,7 @@ from pubtrans.common.rest_adapter import RestAdapter
 from pubtrans.config import settings
 from pubtrans.domain import api
 from pubtrans.repositories.redis_repository import RedisRepository
+from pubtrans.repositories.uri_stats_repository import UriStatsRepository
 from pubtrans.services.next_bus import NextBusService
 
 app = application.make_app()
@@ -20,6 +21,11 @@ class TestAgenciesHandlerV1(testing.AsyncHTTPTestCase):
     def setUp(self):
         super(TestAgenciesHandlerV1, self).setUp()
 
+        uri_stats_patcher = mock.patch.object(UriStatsRepository, 'update_uri_stats',
+                                              return_value=gen.maybe_future(None))
+        uri_stats_patcher.start()
+        self.addCleanup(uri_stats_patcher.stop)
+
         self.mock_nextbus_response = \
             '<?xml version="1.0" encoding="utf-8" ?>' \
             '<body copyright="All data copyright agencies listed below and NextBus Inc 2016.">' \
@@ -46,9 +52,13 @@ class TestAgenciesHandlerV1(testing.AsyncHTTPTestCase):
     def get_new_ioloop(self):  # pylint: disable=unused-argument
         return ioloop.IOLoop.instance()
 
+    @mock.patch.object(RedisRepository, "get_rendered_agencies")
+    @mock.patch.object(RedisRepository, "get_fetch_error")
+    @mock.patch.object(RedisRepository, "acquire_fetch_lease")
     @mock.patch.object(RedisRepository, "store_agencies")
     @mock.patch.object(RedisRepository, "get_agencies")
-    def test_agencies_not_in_cache(self, mocked_repo_get, mocked_repo_store):
+    def test_agencies_not_in_cache(self, mocked_repo_get, mocked_repo_store, mocked_repo_lease,
+                                   mocked_repo_error, mocked_repo_rendered):
 
         @gen.coroutine
         def get_success(path=None, body=None, query=None,
@@ -64,6 +74,18 @@ class TestAgenciesHandlerV1(testing.AsyncHTTPTestCase):
         def store_items(items):  # pylint: disable=unused-argument
             raise gen.Return(None)
 
+        @gen.coroutine
+        def acquire_lease(lease_name, token, ttl):  # pylint: disable=unused-argument
+            raise gen.Return(True)
+
+        @gen.coroutine
+        def get_error(fetch_name):  # pylint: disable=unused-argument
+            raise gen.Return(None)
+
+        @gen.coroutine
+        def get_rendered():
+            raise gen.Return(None)
+
         with mock.patch.object(RestAdapter, 'get') as mocked_rest_adapter:
             mocked_rest_adapter.side_effect = get_success
             request = HTTPRequest(
@@ -73,6 +95,9 @@ class TestAgenciesHandlerV1(testing.AsyncHTTPTestCase):
 
             mocked_repo_get.side_effect = get_items
             mocked_repo_store.side_effect = store_items
+            mocked_repo_rendered.side_effect = get_rendered
+            mocked_repo_lease.side_effect = acquire_lease
+            mocked_repo_error.side_effect = get_error
             self.http_client.fetch(request, self.stop)
             response = self.wait()
 
@@ -93,6 +118,8 @@ class TestAgenciesHandlerV1(testing.AsyncHTTPTestCase):
                 timeout=settings.NEXTBUS_SERVICE_TIMEOUT)
 
         mocked_repo_get.assert_called_once()
+        mocked_repo_rendered.assert_called_once()
+        mocked_repo_lease.assert_called_once()
         actual_cached_items = mocked_repo_store.call_args_list[0][0][0]
         self.assertEquals(2, len(actual_cached_items))
         self.assertEquals(actual_cached_items, self.mock_nextbus_response_as_list)
@@ -100,9 +127,10 @@ class TestAgenciesHandlerV1(testing.AsyncHTTPTestCase):
         self.maxDiff = None
         self.assertEqual(expected_service_response, actual_service_response)
 
+    @mock.patch.object(RedisRepository, "get_rendered_agencies")
     @mock.patch.object(RedisRepository, "store_agencies")
     @mock.patch.object(RedisRepository, "get_agencies")
-    def test_agencies_in_cache(self, mocked_repo_get, mocked_repo_store):
+    def test_agencies_in_cache(self, mocked_repo_get, mocked_repo_store, mocked_repo_rendered):
 
         @gen.coroutine
         def get_success(path=None, body=None, query=None,
@@ -120,6 +148,10 @@ class TestAgenciesHandlerV1(testing.AsyncHTTPTestCase):
         def store_items(items):  # pylint: disable=unused-argument
             raise gen.Return(None)
 
+        @gen.coroutine
+        def get_rendered():
+            raise gen.Return(None)
+
         with mock.patch.object(RestAdapter, 'get') as mocked_rest_adapter:
             mocked_rest_adapter.side_effect = get_success
             request = HTTPRequest(
@@ -129,6 +161,7 @@ class TestAgenciesHandlerV1(testing.AsyncHTTPTestCase):
 
             mocked_repo_get.side_effect = get_items
             mocked_repo_store.side_effect = store_items
+            mocked_repo_rendered.side_effect = get_rendered
             self.http_client.fetch(request, self.stop)
             response = self.wait()
 
@@ -140,8 +173,42 @@ class TestAgenciesHandlerV1(testing.AsyncHTTPTestCase):
         }
 
         mocked_repo_get.assert_called_once()
+        mocked_repo_rendered.assert_called_once()
         self.assertFalse(mocked_rest_adapter.called)
         self.assertFalse(mocked_repo_store.called)
 
         self.maxDiff = None
         self.assertEqual(expected_service_response, actual_service_response)
+
+    @mock.patch.object(RedisRepository, "get_rendered_agencies")
+    @mock.patch.object(RedisRepository, "get_agencies")
+    def test_agencies_rendered_in_cache(self, mocked_repo_get, mocked_repo_rendered):
+
+        @gen.coroutine
+        def get_rendered():
+            raise gen.Return(json.dumps(self.mock_nextbus_response_as_list))
+
+        with mock.patch.object(RestAdapter, 'get') as mocked_rest_adapter:
+            request = HTTPRequest(
+                self.get_url('/v1/agencies'),
+                method='GET'
+            )
+
+            mocked_repo_rendered.side_effect = get_rendered
+            self.http_client.fetch(request, self.stop)
+            response = self.wait()
+
+        self.assertEqual(response.code, 200)
+        self.assertEqual(response.headers['Content-Type'], 'application/json')
+        actual_service_response = json.loads(response.body)
+
+        expected_service_response = {
+            api.TAG_AGENCIES: self.mock_nextbus_response_as_list
+        }
+
+        mocked_repo_rendered.assert_called_once()
+        self.assertFalse(mocked_repo_get.called)
+        self.assertFalse(mocked_rest_adapter.called)
+
+        self.maxDiff = None
+        self.assertEqual(expected_service_response, actual_service_response)
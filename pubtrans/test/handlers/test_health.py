@@ -1,9 +1,12 @@
 """
 Tests for health resource
 """
+import mock
 from tornado import testing
+from tornado import gen
 
 import pubtrans.application
+from pubtrans.repositories.uri_stats_repository import UriStatsRepository
 
 app = pubtrans.application.make_app()
 
@@ -13,6 +16,11 @@ class TestHealthCheck(testing.AsyncHTTPTestCase):
     def setUp(self):
         super(TestHealthCheck, self).setUp()
 
+        uri_stats_patcher = mock.patch.object(UriStatsRepository, 'update_uri_stats',
+                                              return_value=gen.maybe_future(None))
+        uri_stats_patcher.start()
+        self.addCleanup(uri_stats_patcher.stop)
+
     def tearDown(self):
         pass
 
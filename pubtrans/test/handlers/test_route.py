@@ -9,7 +9,9 @@ from pubtrans import application
 from pubtrans.common.rest_adapter import RestAdapter
 from pubtrans.config import settings
 from pubtrans.domain import api
+from pubtrans.repositories.redis_repository import AgencyIndexRepository
 from pubtrans.repositories.redis_repository import RedisRepository
+from pubtrans.repositories.uri_stats_repository import UriStatsRepository
 from pubtrans.services.next_bus import NextBusService
 
 app = application.make_app()
@@ -20,6 +22,11 @@ class TestRouteHandlerV1(testing.AsyncHTTPTestCase):
     def setUp(self):
         super(TestRouteHandlerV1, self).setUp()
 
+        uri_stats_patcher = mock.patch.object(UriStatsRepository, 'update_uri_stats',
+                                              return_value=gen.maybe_future(None))
+        uri_stats_patcher.start()
+        self.addCleanup(uri_stats_patcher.stop)
+
         self.agency_tag = 'sf-muni'
         self.route_tag = 'E'
 
@@ -174,9 +181,14 @@ class TestRouteHandlerV1(testing.AsyncHTTPTestCase):
     def get_new_ioloop(self):  # pylint: disable=unused-argument
         return ioloop.IOLoop.instance()
 
+    @mock.patch.object(RedisRepository, "store_route_geometry")
+    @mock.patch.object(AgencyIndexRepository, "store_route_stops")
+    @mock.patch.object(RedisRepository, "get_fetch_error")
+    @mock.patch.object(RedisRepository, "acquire_fetch_lease")
     @mock.patch.object(RedisRepository, "store_route")
     @mock.patch.object(RedisRepository, "get_route")
-    def test_route_not_in_cache(self, mocked_repo_get, mocked_repo_store):
+    def test_route_not_in_cache(self, mocked_repo_get, mocked_repo_store, mocked_repo_lease,
+                                mocked_repo_error, mocked_repo_stops, mocked_repo_geometry):
 
         @gen.coroutine
         def get_success(path=None, body=None, query=None,
@@ -192,6 +204,22 @@ class TestRouteHandlerV1(testing.AsyncHTTPTestCase):
         def store_item(agency_tag, route_tag, route):  # pylint: disable=unused-argument
             raise gen.Return(None)
 
+        @gen.coroutine
+        def acquire_lease(lease_name, token, ttl):  # pylint: disable=unused-argument
+            raise gen.Return(True)
+
+        @gen.coroutine
+        def get_error(fetch_name):  # pylint: disable=unused-argument
+            raise gen.Return(None)
+
+        @gen.coroutine
+        def store_stops(agency_tag, route_stops):  # pylint: disable=unused-argument
+            raise gen.Return(None)
+
+        @gen.coroutine
+        def store_geometry(agency_tag, route_tag, geometry):  # pylint: disable=unused-argument
+            raise gen.Return(None)
+
         with mock.patch.object(RestAdapter, 'get') as mocked_rest_adapter:
             mocked_rest_adapter.side_effect = get_success
             request = HTTPRequest(
@@ -201,6 +229,10 @@ class TestRouteHandlerV1(testing.AsyncHTTPTestCase):
 
             mocked_repo_get.side_effect = get_item
             mocked_repo_store.side_effect = store_item
+            mocked_repo_lease.side_effect = acquire_lease
+            mocked_repo_error.side_effect = get_error
+            mocked_repo_stops.side_effect = store_stops
+            mocked_repo_geometry.side_effect = store_geometry
             self.http_client.fetch(request, self.stop)
             response = self.wait()
 
@@ -221,9 +253,17 @@ class TestRouteHandlerV1(testing.AsyncHTTPTestCase):
                 timeout=settings.NEXTBUS_SERVICE_TIMEOUT)
 
         mocked_repo_get.assert_called_once()
+        mocked_repo_lease.assert_called_once()
         actual_cached_item = mocked_repo_store.call_args_list[0][0][2]
         self.assertEqual(actual_cached_item[api.TAG_TAG],
                          self.mock_nextbus_response_as_obj[api.TAG_TAG])
+        route_stops = mocked_repo_stops.call_args[0][1][self.route_tag]
+        self.assertEqual([(stop[api.TAG_TAG], stop[api.TAG_DIRECTIONS]) for stop in route_stops],
+                         [('5184', ['E____O_F00']), ('3095', ['E____O_F00']), ('7283', ['E____O_F00'])])
+        # Compact geometries are built when the route config is stored
+        geometry = mocked_repo_geometry.call_args[0][2]
+        self.assertEqual(sorted(geometry), sorted(str(tolerance)
+                                                  for tolerance in settings.ROUTE_GEOMETRY_TOLERANCES_METERS))
 
         self.maxDiff = None
         self.assertEqual(actual_service_response[api.TAG_DIRECTIONS],
@@ -272,3 +312,57 @@ class TestRouteHandlerV1(testing.AsyncHTTPTestCase):
 
         self.maxDiff = None
         self.assertEqual(expected_service_response, actual_service_response)
+
+    @mock.patch.object(RedisRepository, "store_route_geometry")
+    @mock.patch.object(RedisRepository, "get_route_geometry")
+    @mock.patch.object(RedisRepository, "get_route")
+    def test_route_with_polyline_geometry(self, mocked_repo_get, mocked_repo_geometry,
+                                          mocked_repo_store_geometry):
+
+        @gen.coroutine
+        def get_item(agency_tag, route_tag):  # pylint: disable=unused-argument
+            raise gen.Return(self.mock_nextbus_response_as_obj)
+
+        @gen.coroutine
+        def get_geometry(agency_tag, route_tag):  # pylint: disable=unused-argument
+            raise gen.Return(None)
+
+        @gen.coroutine
+        def store_geometry(agency_tag, route_tag, geometry):  # pylint: disable=unused-argument
+            raise gen.Return(None)
+
+        mocked_repo_get.side_effect = get_item
+        mocked_repo_geometry.side_effect = get_geometry
+        mocked_repo_store_geometry.side_effect = store_geometry
+        request = HTTPRequest(
+            self.get_url('/v1/' + self.agency_tag + '/routes/' + self.route_tag +
+                         '?fields=tag,paths&geometry=polyline&tolerance=1'),
+            method='GET'
+        )
+        self.http_client.fetch(request, self.stop)
+        response = self.wait()
+
+        self.assertEqual(response.code, 200)
+        actual_service_response = json.loads(response.body)
+
+        self.assertEqual(actual_service_response, {
+            api.TAG_TAG: 'E',
+            api.TAG_PATHS: [{api.TAG_POLYLINE: 'emweFhgcjVBh@`B|@'},
+                            {api.TAG_POLYLINE: 'syqeFjg_jV'},
+                            {api.TAG_POLYLINE: 'emweFhgcjVu@dL'}],
+            api.TAG_PATHS_TOLERANCE: 0
+        })
+        # Geometry missing in cache is built from the route config and stored
+        mocked_repo_store_geometry.assert_called_once()
+        self.assertNotIn(api.TAG_POLYLINE, self.mock_nextbus_response_as_obj[api.TAG_PATHS][0])
+
+    def test_route_with_invalid_geometry(self):
+
+        request = HTTPRequest(
+            self.get_url('/v1/' + self.agency_tag + '/routes/' + self.route_tag + '?geometry=svg'),
+            method='GET'
+        )
+        self.http_client.fetch(request, self.stop)
+        response = self.wait()
+
+        self.assertEqual(response.code, 400)
@@ -10,6 +10,7 @@ from pubtrans.common.rest_adapter import RestAdapter
 from pubtrans.config import settings
 from pubtrans.domain import api
 from pubtrans.repositories.redis_repository import RedisRepository
+from pubtrans.repositories.uri_stats_repository import UriStatsRepository
 from pubtrans.services.next_bus import NextBusService
 
 app = application.make_app()
@@ -20,6 +21,11 @@ class TestRouteMessagesHandlerV1(testing.AsyncHTTPTestCase):
     def setUp(self):
         super(TestRouteMessagesHandlerV1, self).setUp()
 
+        uri_stats_patcher = mock.patch.object(UriStatsRepository, 'update_uri_stats',
+                                              return_value=gen.maybe_future(None))
+        uri_stats_patcher.start()
+        self.addCleanup(uri_stats_patcher.stop)
+
         self.agency_tag = 'sf-muni'
         self.route_tag = 'E'
 
@@ -163,9 +169,13 @@ class TestRouteMessagesHandlerV1(testing.AsyncHTTPTestCase):
     def get_new_ioloop(self):  # pylint: disable=unused-argument
         return ioloop.IOLoop.instance()
 
+    @mock.patch.object(RedisRepository, "get_rendered_route_messages")
+    @mock.patch.object(RedisRepository, "get_fetch_error")
+    @mock.patch.object(RedisRepository, "acquire_fetch_lease")
     @mock.patch.object(RedisRepository, "store_route_messages")
     @mock.patch.object(RedisRepository, "get_route_messages")
-    def test_route_messages_not_in_cache(self, mocked_repo_get, mocked_repo_store):
+    def test_route_messages_not_in_cache(self, mocked_repo_get, mocked_repo_store, mocked_repo_lease,
+                                         mocked_repo_error, mocked_repo_rendered):
 
         @gen.coroutine
         def get_success(path=None, body=None, query=None,
@@ -181,6 +191,18 @@ class TestRouteMessagesHandlerV1(testing.AsyncHTTPTestCase):
         def store_item(agency_tag, route_tag, schedule):  # pylint: disable=unused-argument
             raise gen.Return(None)
 
+        @gen.coroutine
+        def acquire_lease(lease_name, token, ttl):  # pylint: disable=unused-argument
+            raise gen.Return(True)
+
+        @gen.coroutine
+        def get_error(fetch_name):  # pylint: disable=unused-argument
+            raise gen.Return(None)
+
+        @gen.coroutine
+        def get_rendered(agency_tag, route_tag):  # pylint: disable=unused-argument
+            raise gen.Return(None)
+
         with mock.patch.object(RestAdapter, 'get') as mocked_rest_adapter:
             mocked_rest_adapter.side_effect = get_success
             request = HTTPRequest(
@@ -190,6 +212,9 @@ class TestRouteMessagesHandlerV1(testing.AsyncHTTPTestCase):
 
             mocked_repo_get.side_effect = get_item
             mocked_repo_store.side_effect = store_item
+            mocked_repo_rendered.side_effect = get_rendered
+            mocked_repo_lease.side_effect = acquire_lease
+            mocked_repo_error.side_effect = get_error
             self.http_client.fetch(request, self.stop)
             response = self.wait()
 
@@ -211,6 +236,8 @@ class TestRouteMessagesHandlerV1(testing.AsyncHTTPTestCase):
                 timeout=settings.NEXTBUS_SERVICE_TIMEOUT)
 
         mocked_repo_get.assert_called_once()
+        mocked_repo_rendered.assert_called_once()
+        mocked_repo_lease.assert_called_once()
         actual_cached_item = mocked_repo_store.call_args_list[0][0][2]
         self.maxDiff = None
         self.assertDictEqual(actual_cached_item, self.mock_nextbus_response_as_obj)
@@ -219,9 +246,10 @@ class TestRouteMessagesHandlerV1(testing.AsyncHTTPTestCase):
 
         self.assertDictEqual(expected_service_response, actual_service_response)
 
+    @mock.patch.object(RedisRepository, "get_rendered_route_messages")
     @mock.patch.object(RedisRepository, "store_route_messages")
     @mock.patch.object(RedisRepository, "get_route_messages")
-    def test_route_messages_in_cache(self, mocked_repo_get, mocked_repo_store):
+    def test_route_messages_in_cache(self, mocked_repo_get, mocked_repo_store, mocked_repo_rendered):
 
         @gen.coroutine
         def get_success(path=None, body=None, query=None,
@@ -239,6 +267,10 @@ class TestRouteMessagesHandlerV1(testing.AsyncHTTPTestCase):
         def store_item(agency_tag, route_tag, messages):  # pylint: disable=unused-argument
             raise gen.Return(None)
 
+        @gen.coroutine
+        def get_rendered(agency_tag, route_tag):  # pylint: disable=unused-argument
+            raise gen.Return(None)
+
         with mock.patch.object(RestAdapter, 'get') as mocked_rest_adapter:
             mocked_rest_adapter.side_effect = get_success
             request = HTTPRequest(
@@ -248,6 +280,7 @@ class TestRouteMessagesHandlerV1(testing.AsyncHTTPTestCase):
 
             mocked_repo_get.side_effect = get_item
             mocked_repo_store.side_effect = store_item
+            mocked_repo_rendered.side_effect = get_rendered
             self.http_client.fetch(request, self.stop)
             response = self.wait()
 
@@ -258,6 +291,7 @@ class TestRouteMessagesHandlerV1(testing.AsyncHTTPTestCase):
         expected_service_response = self.mock_nextbus_response_as_obj
 
         mocked_repo_get.assert_called_once()
+        mocked_repo_rendered.assert_called_once()
         self.assertFalse(mocked_rest_adapter.called)
         self.assertFalse(mocked_repo_store.called)
 
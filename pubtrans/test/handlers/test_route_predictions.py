@@ -9,7 +9,9 @@ from pubtrans import application
 from pubtrans.common.rest_adapter import RestAdapter
 from pubtrans.config import settings
 from pubtrans.domain import api
+from pubtrans.repositories.redis_repository import PredictionsRepository
 from pubtrans.repositories.redis_repository import RedisRepository
+from pubtrans.repositories.uri_stats_repository import UriStatsRepository
 from pubtrans.services.next_bus import NextBusService
 
 app = application.make_app()
@@ -20,6 +22,11 @@ class TestRoutePredictionsHandlerV1(testing.AsyncHTTPTestCase):
     def setUp(self):
         super(TestRoutePredictionsHandlerV1, self).setUp()
 
+        uri_stats_patcher = mock.patch.object(UriStatsRepository, 'update_uri_stats',
+                                              return_value=gen.maybe_future(None))
+        uri_stats_patcher.start()
+        self.addCleanup(uri_stats_patcher.stop)
+
         self.agency_tag = 'sf-muni'
         self.route_tag = 'E'
         self.stopTag = '4502'
@@ -92,9 +99,13 @@ class TestRoutePredictionsHandlerV1(testing.AsyncHTTPTestCase):
     def get_new_ioloop(self):  # pylint: disable=unused-argument
         return ioloop.IOLoop.instance()
 
-    @mock.patch.object(RedisRepository, "store_route_predictions")
-    @mock.patch.object(RedisRepository, "get_route_predictions")
-    def test_predictions_not_in_cache(self, mocked_repo_get, mocked_repo_store):
+    @mock.patch.object(PredictionsRepository, "get_rendered_route_predictions")
+    @mock.patch.object(RedisRepository, "get_fetch_error")
+    @mock.patch.object(RedisRepository, "acquire_fetch_lease")
+    @mock.patch.object(PredictionsRepository, "store_route_predictions")
+    @mock.patch.object(PredictionsRepository, "get_route_predictions")
+    def test_predictions_not_in_cache(self, mocked_repo_get, mocked_repo_store, mocked_repo_lease,
+                                      mocked_repo_error, mocked_repo_rendered):
 
         @gen.coroutine
         def get_success(path=None, body=None, query=None,
@@ -110,6 +121,18 @@ class TestRoutePredictionsHandlerV1(testing.AsyncHTTPTestCase):
         def store_item(agency_tag, route_tag, stop_tag, predictions):  # pylint: disable=unused-argument
             raise gen.Return(None)
 
+        @gen.coroutine
+        def acquire_lease(lease_name, token, ttl):  # pylint: disable=unused-argument
+            raise gen.Return(True)
+
+        @gen.coroutine
+        def get_error(fetch_name):  # pylint: disable=unused-argument
+            raise gen.Return(None)
+
+        @gen.coroutine
+        def get_rendered(agency_tag, route_tag, stop_tag):  # pylint: disable=unused-argument
+            raise gen.Return(None)
+
         with mock.patch.object(RestAdapter, 'get') as mocked_rest_adapter:
             mocked_rest_adapter.side_effect = get_success
             request = HTTPRequest(
@@ -120,6 +143,9 @@ class TestRoutePredictionsHandlerV1(testing.AsyncHTTPTestCase):
 
             mocked_repo_get.side_effect = get_item
             mocked_repo_store.side_effect = store_item
+            mocked_repo_rendered.side_effect = get_rendered
+            mocked_repo_lease.side_effect = acquire_lease
+            mocked_repo_error.side_effect = get_error
             self.http_client.fetch(request, self.stop)
             response = self.wait()
 
@@ -142,14 +168,17 @@ class TestRoutePredictionsHandlerV1(testing.AsyncHTTPTestCase):
                 timeout=settings.NEXTBUS_SERVICE_TIMEOUT)
 
         mocked_repo_get.assert_called_once()
+        mocked_repo_rendered.assert_called_once()
+        mocked_repo_lease.assert_called_once()
         actual_cached_item = mocked_repo_store.call_args_list[0][0][3]
         self.assertDictEqual(actual_cached_item, self.mock_nextbus_response_as_obj)
 
         self.assertDictEqual(expected_service_response, actual_service_response)
 
-    @mock.patch.object(RedisRepository, "store_route_predictions")
-    @mock.patch.object(RedisRepository, "get_route_predictions")
-    def test_predictions_in_cache(self, mocked_repo_get, mocked_repo_store):
+    @mock.patch.object(PredictionsRepository, "get_rendered_route_predictions")
+    @mock.patch.object(PredictionsRepository, "store_route_predictions")
+    @mock.patch.object(PredictionsRepository, "get_route_predictions")
+    def test_predictions_in_cache(self, mocked_repo_get, mocked_repo_store, mocked_repo_rendered):
 
         @gen.coroutine
         def get_success(path=None, body=None, query=None,
@@ -167,6 +196,10 @@ class TestRoutePredictionsHandlerV1(testing.AsyncHTTPTestCase):
         def store_item(agency_tag, route_tag, stop_tag, predictions):  # pylint: disable=unused-argument
             raise gen.Return(None)
 
+        @gen.coroutine
+        def get_rendered(agency_tag, route_tag, stop_tag):  # pylint: disable=unused-argument
+            raise gen.Return(None)
+
         with mock.patch.object(RestAdapter, 'get') as mocked_rest_adapter:
             mocked_rest_adapter.side_effect = get_success
             request = HTTPRequest(
@@ -177,6 +210,7 @@ class TestRoutePredictionsHandlerV1(testing.AsyncHTTPTestCase):
 
             mocked_repo_get.side_effect = get_item
             mocked_repo_store.side_effect = store_item
+            mocked_repo_rendered.side_effect = get_rendered
             self.http_client.fetch(request, self.stop)
             response = self.wait()
 
@@ -186,8 +220,38 @@ class TestRoutePredictionsHandlerV1(testing.AsyncHTTPTestCase):
         expected_service_response = self.mock_nextbus_response_as_obj
 
         mocked_repo_get.assert_called_once()
+        mocked_repo_rendered.assert_called_once()
         self.assertFalse(mocked_rest_adapter.called)
         self.assertFalse(mocked_repo_store.called)
 
         self.maxDiff = None
         self.assertEqual(expected_service_response, actual_service_response)
+
+    @mock.patch.object(PredictionsRepository, "get_rendered_route_predictions")
+    @mock.patch.object(PredictionsRepository, "get_route_predictions")
+    def test_predictions_rendered_in_cache(self, mocked_repo_get, mocked_repo_rendered):
+
+        rendered = json.dumps(self.mock_nextbus_response_as_obj)
+
+        @gen.coroutine
+        def get_rendered(agency_tag, route_tag, stop_tag):  # pylint: disable=unused-argument
+            raise gen.Return(rendered)
+
+        with mock.patch.object(RestAdapter, 'get') as mocked_rest_adapter:
+            request = HTTPRequest(
+                self.get_url('/v1/' + self.agency_tag + '/routes/' + self.route_tag + '/predictions?' +
+                             api.QUERY_STOP_TAG + '=' + self.stopTag),
+                method='GET'
+            )
+
+            mocked_repo_rendered.side_effect = get_rendered
+            self.http_client.fetch(request, self.stop)
+            response = self.wait()
+
+        self.assertEqual(response.code, 200)
+        self.assertEqual(response.headers['Content-Type'], 'application/json')
+        self.assertEqual(response.body, rendered)
+
+        mocked_repo_rendered.assert_called_once_with(self.agency_tag, self.route_tag, self.stopTag)
+        self.assertFalse(mocked_repo_get.called)
+        self.assertFalse(mocked_rest_adapter.called)
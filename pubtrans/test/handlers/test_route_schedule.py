@@ -9,7 +9,9 @@ from pubtrans import application
 from pubtrans.common.rest_adapter import RestAdapter
 from pubtrans.config import settings
 from pubtrans.domain import api
+from pubtrans.repositories.redis_repository import AgencyIndexRepository
 from pubtrans.repositories.redis_repository import RedisRepository
+from pubtrans.repositories.uri_stats_repository import UriStatsRepository
 from pubtrans.services.next_bus import NextBusService
 
 app = application.make_app()
@@ -20,6 +22,11 @@ class TestRouteScheduleHandlerV1(testing.AsyncHTTPTestCase):
     def setUp(self):
         super(TestRouteScheduleHandlerV1, self).setUp()
 
+        uri_stats_patcher = mock.patch.object(UriStatsRepository, 'update_uri_stats',
+                                              return_value=gen.maybe_future(None))
+        uri_stats_patcher.start()
+        self.addCleanup(uri_stats_patcher.stop)
+
         self.agency_tag = 'sf-muni'
         self.route_tag = 'E'
 
@@ -111,9 +118,14 @@ class TestRouteScheduleHandlerV1(testing.AsyncHTTPTestCase):
     def get_new_ioloop(self):  # pylint: disable=unused-argument
         return ioloop.IOLoop.instance()
 
+    @mock.patch.object(AgencyIndexRepository, "store_service_windows")
+    @mock.patch.object(RedisRepository, "get_rendered_route_schedule")
+    @mock.patch.object(RedisRepository, "get_fetch_error")
+    @mock.patch.object(RedisRepository, "acquire_fetch_lease")
     @mock.patch.object(RedisRepository, "store_route_schedule")
     @mock.patch.object(RedisRepository, "get_route_schedule")
-    def test_schedule_not_in_cache(self, mocked_repo_get, mocked_repo_store):
+    def test_schedule_not_in_cache(self, mocked_repo_get, mocked_repo_store, mocked_repo_lease,
+                                   mocked_repo_error, mocked_repo_rendered, mocked_repo_windows):
 
         @gen.coroutine
         def get_success(path=None, body=None, query=None,
@@ -129,6 +141,22 @@ class TestRouteScheduleHandlerV1(testing.AsyncHTTPTestCase):
         def store_item(agency_tag, route_tag, schedule):  # pylint: disable=unused-argument
             raise gen.Return(None)
 
+        @gen.coroutine
+        def acquire_lease(lease_name, token, ttl):  # pylint: disable=unused-argument
+            raise gen.Return(True)
+
+        @gen.coroutine
+        def get_error(fetch_name):  # pylint: disable=unused-argument
+            raise gen.Return(None)
+
+        @gen.coroutine
+        def get_rendered(agency_tag, route_tag):  # pylint: disable=unused-argument
+            raise gen.Return(None)
+
+        @gen.coroutine
+        def store_windows(agency_tag, windows):  # pylint: disable=unused-argument
+            raise gen.Return(None)
+
         with mock.patch.object(RestAdapter, 'get') as mocked_rest_adapter:
             mocked_rest_adapter.side_effect = get_success
             request = HTTPRequest(
@@ -138,6 +166,10 @@ class TestRouteScheduleHandlerV1(testing.AsyncHTTPTestCase):
 
             mocked_repo_get.side_effect = get_item
             mocked_repo_store.side_effect = store_item
+            mocked_repo_rendered.side_effect = get_rendered
+            mocked_repo_windows.side_effect = store_windows
+            mocked_repo_lease.side_effect = acquire_lease
+            mocked_repo_error.side_effect = get_error
             self.http_client.fetch(request, self.stop)
             response = self.wait()
 
@@ -158,6 +190,11 @@ class TestRouteScheduleHandlerV1(testing.AsyncHTTPTestCase):
                 timeout=settings.NEXTBUS_SERVICE_TIMEOUT)
 
         mocked_repo_get.assert_called_once()
+        mocked_repo_rendered.assert_called_once()
+        mocked_repo_lease.assert_called_once()
+        self.assertEqual(mocked_repo_windows.call_args[0][1],
+                         {self.route_tag: [['wkd', 'inbound', 32820, 32820],
+                                           ['wkd', 'outbound', 32820, 32820]]})
         actual_cached_item = mocked_repo_store.call_args_list[0][0][2]
         self.assertEqual(actual_cached_item[api.TAG_SCHEDULE_CLASS],
                          self.mock_nextbus_response_as_obj[api.TAG_SCHEDULE_CLASS])
@@ -168,9 +205,10 @@ class TestRouteScheduleHandlerV1(testing.AsyncHTTPTestCase):
         # Have to fix expected response
         # self.assertDictEqual(expected_service_response, actual_service_response)
 
+    @mock.patch.object(RedisRepository, "get_rendered_route_schedule")
     @mock.patch.object(RedisRepository, "store_route_schedule")
     @mock.patch.object(RedisRepository, "get_route_schedule")
-    def test_schedule_in_cache(self, mocked_repo_get, mocked_repo_store):
+    def test_schedule_in_cache(self, mocked_repo_get, mocked_repo_store, mocked_repo_rendered):
 
         @gen.coroutine
         def get_success(path=None, body=None, query=None,
@@ -188,6 +226,10 @@ class TestRouteScheduleHandlerV1(testing.AsyncHTTPTestCase):
         def store_item(agency_tag, route_tag, schedule):  # pylint: disable=unused-argument
             raise gen.Return(None)
 
+        @gen.coroutine
+        def get_rendered(agency_tag, route_tag):  # pylint: disable=unused-argument
+            raise gen.Return(None)
+
         with mock.patch.object(RestAdapter, 'get') as mocked_rest_adapter:
             mocked_rest_adapter.side_effect = get_success
             request = HTTPRequest(
@@ -197,6 +239,7 @@ class TestRouteScheduleHandlerV1(testing.AsyncHTTPTestCase):
 
             mocked_repo_get.side_effect = get_item
             mocked_repo_store.side_effect = store_item
+            mocked_repo_rendered.side_effect = get_rendered
             self.http_client.fetch(request, self.stop)
             response = self.wait()
 
@@ -206,6 +249,7 @@ class TestRouteScheduleHandlerV1(testing.AsyncHTTPTestCase):
         expected_service_response = self.mock_nextbus_response_as_obj
 
         mocked_repo_get.assert_called_once()
+        mocked_repo_rendered.assert_called_once()
         self.assertFalse(mocked_rest_adapter.called)
         self.assertFalse(mocked_repo_store.called)
 
@@ -10,6 +10,8 @@ from pubtrans.common.rest_adapter import RestAdapter
 from pubtrans.config import settings
 from pubtrans.domain import api
 from pubtrans.repositories.redis_repository import RedisRepository
+from pubtrans.repositories.redis_repository import VehiclesRepository
+from pubtrans.repositories.uri_stats_repository import UriStatsRepository
 from pubtrans.services.next_bus import NextBusService
 
 app = application.make_app()
@@ -20,6 +22,11 @@ class TestRouteVehiclesHandlerV1(testing.AsyncHTTPTestCase):
     def setUp(self):
         super(TestRouteVehiclesHandlerV1, self).setUp()
 
+        uri_stats_patcher = mock.patch.object(UriStatsRepository, 'update_uri_stats',
+                                              return_value=gen.maybe_future(None))
+        uri_stats_patcher.start()
+        self.addCleanup(uri_stats_patcher.stop)
+
         self.agency_tag = 'sf-muni'
         self.route_tag = 'E'
         self.lastTime = '1476314411287'
@@ -72,15 +79,28 @@ class TestRouteVehiclesHandlerV1(testing.AsyncHTTPTestCase):
             api.TAG_LAST_TIME: self.lastTime
         }
 
+        # Vehicles reported after the last time a client got
+        self.client_last_time = '1476314311287'
+
+        self.state = {
+            api.TAG_VEHICLES: [dict(vehicle, reportTime=int(self.lastTime) -
+                                    int(vehicle[api.TAG_SECS_SINCE_REPORT]) * 1000)
+                               for vehicle in self.mock_nextbus_response_as_obj[api.TAG_VEHICLES]],
+            api.TAG_LAST_TIME: int(self.lastTime)
+        }
+
     def get_app(self):  # pylint: disable=unused-argument
         return app
 
     def get_new_ioloop(self):  # pylint: disable=unused-argument
         return ioloop.IOLoop.instance()
 
-    @mock.patch.object(RedisRepository, "store_route_vehicles")
-    @mock.patch.object(RedisRepository, "get_route_vehicles")
-    def test_vehicles_not_in_cache(self, mocked_repo_get, mocked_repo_store):
+    @mock.patch.object(RedisRepository, "get_fetch_error")
+    @mock.patch.object(RedisRepository, "acquire_fetch_lease")
+    @mock.patch.object(VehiclesRepository, "store_route_vehicles")
+    @mock.patch.object(VehiclesRepository, "get_route_vehicles")
+    def test_vehicles_not_in_cache(self, mocked_repo_get, mocked_repo_store, mocked_repo_lease,
+                                   mocked_repo_error):
 
         @gen.coroutine
         def get_success(path=None, body=None, query=None,
@@ -96,16 +116,26 @@ class TestRouteVehiclesHandlerV1(testing.AsyncHTTPTestCase):
         def store_item(agency_tag, route_tag, vehicles):  # pylint: disable=unused-argument
             raise gen.Return(None)
 
+        @gen.coroutine
+        def acquire_lease(lease_name, token, ttl):  # pylint: disable=unused-argument
+            raise gen.Return(True)
+
+        @gen.coroutine
+        def get_error(fetch_name):  # pylint: disable=unused-argument
+            raise gen.Return(None)
+
         with mock.patch.object(RestAdapter, 'get') as mocked_rest_adapter:
             mocked_rest_adapter.side_effect = get_success
             request = HTTPRequest(
                 self.get_url('/v1/' + self.agency_tag + '/routes/' + self.route_tag + '/vehicles?' +
-                             api.QUERY_LAST_TIME + '=' + self.lastTime),
+                             api.QUERY_LAST_TIME + '=' + self.client_last_time),
                 method='GET'
             )
 
             mocked_repo_get.side_effect = get_item
             mocked_repo_store.side_effect = store_item
+            mocked_repo_lease.side_effect = acquire_lease
+            mocked_repo_error.side_effect = get_error
             self.http_client.fetch(request, self.stop)
             response = self.wait()
 
@@ -123,18 +153,20 @@ class TestRouteVehiclesHandlerV1(testing.AsyncHTTPTestCase):
                 query={'a': self.agency_tag,
                        'command': NextBusService.COMMAND_VEHICLE_LOCATIONS,
                        'r': self.route_tag,
-                       't': self.lastTime},
+                       't': '0'},
                 headers=headers,
                 timeout=settings.NEXTBUS_SERVICE_TIMEOUT)
 
         mocked_repo_get.assert_called_once()
+        mocked_repo_lease.assert_called_once()
+        # The vehicle state of the route is cached
         actual_cached_item = mocked_repo_store.call_args_list[0][0][2]
-        self.assertDictEqual(actual_cached_item, self.mock_nextbus_response_as_obj)
+        self.assertEqual(actual_cached_item, self.state)
 
         self.assertDictEqual(expected_service_response, actual_service_response)
 
-    @mock.patch.object(RedisRepository, "store_route_vehicles")
-    @mock.patch.object(RedisRepository, "get_route_vehicles")
+    @mock.patch.object(VehiclesRepository, "store_route_vehicles")
+    @mock.patch.object(VehiclesRepository, "get_route_vehicles")
     def test_vehicles_in_cache(self, mocked_repo_get, mocked_repo_store):
 
         @gen.coroutine
@@ -145,9 +177,7 @@ class TestRouteVehiclesHandlerV1(testing.AsyncHTTPTestCase):
 
         @gen.coroutine
         def get_item(agency_tag, route_tag):  # pylint: disable=unused-argument
-            schedule = self.mock_nextbus_response_as_obj
-
-            raise gen.Return(schedule)
+            raise gen.Return(self.state)
 
         @gen.coroutine
         def store_item(agency_tag, route_tag, vehicles):  # pylint: disable=unused-argument
@@ -157,7 +187,7 @@ class TestRouteVehiclesHandlerV1(testing.AsyncHTTPTestCase):
             mocked_rest_adapter.side_effect = get_success
             request = HTTPRequest(
                 self.get_url('/v1/' + self.agency_tag + '/routes/' + self.route_tag + '/vehicles?' +
-                             api.QUERY_LAST_TIME + '=' + self.lastTime),
+                             api.QUERY_LAST_TIME + '=' + self.client_last_time),
                 method='GET'
             )
 
@@ -177,3 +207,53 @@ class TestRouteVehiclesHandlerV1(testing.AsyncHTTPTestCase):
 
         self.maxDiff = None
         self.assertEqual(expected_service_response, actual_service_response)
+
+    @mock.patch.object(VehiclesRepository, "store_route_vehicles")
+    @mock.patch.object(VehiclesRepository, "get_route_vehicles")
+    def test_vehicles_in_cache_since_last_time(self, mocked_repo_get, mocked_repo_store):
+
+        @gen.coroutine
+        def get_item(agency_tag, route_tag):  # pylint: disable=unused-argument
+            raise gen.Return(self.state)
+
+        with mock.patch.object(RestAdapter, 'get') as mocked_rest_adapter:
+            # Only 1008 reported in the last 60 seconds
+            request = HTTPRequest(
+                self.get_url('/v1/' + self.agency_tag + '/routes/' + self.route_tag + '/vehicles?' +
+                             api.QUERY_LAST_TIME + '=' + str(int(self.lastTime) - 60000)),
+                method='GET'
+            )
+
+            mocked_repo_get.side_effect = get_item
+            self.http_client.fetch(request, self.stop)
+            response = self.wait()
+
+        self.assertEqual(response.code, 200)
+        actual_service_response = json.loads(response.body)
+
+        self.assertFalse(mocked_rest_adapter.called)
+        self.assertFalse(mocked_repo_store.called)
+        self.assertEqual([vehicle[api.TAG_ID] for vehicle in actual_service_response[api.TAG_VEHICLES]],
+                         ['1008'])
+        self.assertEqual(actual_service_response[api.TAG_LAST_TIME], self.lastTime)
+
+    @mock.patch.object(VehiclesRepository, "get_route_vehicles")
+    def test_vehicles_in_cache_for_invalid_last_time(self, mocked_repo_get):
+
+        @gen.coroutine
+        def get_item(agency_tag, route_tag):  # pylint: disable=unused-argument
+            raise gen.Return(self.state)
+
+        request = HTTPRequest(
+            self.get_url('/v1/' + self.agency_tag + '/routes/' + self.route_tag + '/vehicles?' +
+                         api.QUERY_LAST_TIME + '=yesterday'),
+            method='GET'
+        )
+
+        mocked_repo_get.side_effect = get_item
+        self.http_client.fetch(request, self.stop)
+        response = self.wait()
+
+        # Same as lastTime=0, every vehicle of the route
+        self.assertEqual(response.code, 200)
+        self.assertEqual(self.mock_nextbus_response_as_obj, json.loads(response.body))
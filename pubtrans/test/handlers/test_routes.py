@@ -10,6 +10,7 @@ from pubtrans.common.rest_adapter import RestAdapter
 from pubtrans.config import settings
 from pubtrans.domain import api
 from pubtrans.repositories.redis_repository import RedisRepository
+from pubtrans.repositories.uri_stats_repository import UriStatsRepository
 from pubtrans.services.next_bus import NextBusService
 
 app = application.make_app()
@@ -20,6 +21,11 @@ class TestRoutesHandlerV1(testing.AsyncHTTPTestCase):
     def setUp(self):
         super(TestRoutesHandlerV1, self).setUp()
 
+        uri_stats_patcher = mock.patch.object(UriStatsRepository, 'update_uri_stats',
+                                              return_value=gen.maybe_future(None))
+        uri_stats_patcher.start()
+        self.addCleanup(uri_stats_patcher.stop)
+
         self.agency_tag = 'sf-muni'
 
         self.mock_nextbus_response = \
@@ -95,9 +101,26 @@ class TestRoutesHandlerV1(testing.AsyncHTTPTestCase):
         }
         self.assertDictContainsSubset(expected_response, actual_response)
 
+    def test_when_invalid_geometry_should_return_400(self):
+        request = HTTPRequest(
+            self.get_url('/v1/sf-muni/routes/E?geometry=polyline&tolerance=-1'),
+            method='GET'
+        )
+
+        self.http_client.fetch(request, self.stop)
+        response = self.wait()
+
+        self.assertEqual(response.code, 400)
+        actual_response = json.loads(response.body)
+        self.assertIn('Geometry is one of', actual_response['context'])
+
+    @mock.patch.object(RedisRepository, "get_rendered_routes")
+    @mock.patch.object(RedisRepository, "get_fetch_error")
+    @mock.patch.object(RedisRepository, "acquire_fetch_lease")
     @mock.patch.object(RedisRepository, "store_routes")
     @mock.patch.object(RedisRepository, "get_routes")
-    def test_routes_not_in_cache(self, mocked_repo_get, mocked_repo_store):
+    def test_routes_not_in_cache(self, mocked_repo_get, mocked_repo_store, mocked_repo_lease,
+                                 mocked_repo_error, mocked_repo_rendered):
 
         @gen.coroutine
         def get_success(path=None, body=None, query=None,
@@ -113,6 +136,18 @@ class TestRoutesHandlerV1(testing.AsyncHTTPTestCase):
         def store_items(agency_tag, items):  # pylint: disable=unused-argument
             raise gen.Return(None)
 
+        @gen.coroutine
+        def acquire_lease(lease_name, token, ttl):  # pylint: disable=unused-argument
+            raise gen.Return(True)
+
+        @gen.coroutine
+        def get_error(fetch_name):  # pylint: disable=unused-argument
+            raise gen.Return(None)
+
+        @gen.coroutine
+        def get_rendered(agency_tag):  # pylint: disable=unused-argument
+            raise gen.Return(None)
+
         with mock.patch.object(RestAdapter, 'get') as mocked_rest_adapter:
             mocked_rest_adapter.side_effect = get_success
             request = HTTPRequest(
@@ -122,6 +157,9 @@ class TestRoutesHandlerV1(testing.AsyncHTTPTestCase):
 
             mocked_repo_get.side_effect = get_items
             mocked_repo_store.side_effect = store_items
+            mocked_repo_rendered.side_effect = get_rendered
+            mocked_repo_lease.side_effect = acquire_lease
+            mocked_repo_error.side_effect = get_error
             self.http_client.fetch(request, self.stop)
             response = self.wait()
 
@@ -142,6 +180,8 @@ class TestRoutesHandlerV1(testing.AsyncHTTPTestCase):
                 timeout=settings.NEXTBUS_SERVICE_TIMEOUT)
 
         mocked_repo_get.assert_called_once()
+        mocked_repo_rendered.assert_called_once()
+        mocked_repo_lease.assert_called_once()
         actual_cached_items = mocked_repo_store.call_args_list[0][0][1]
         self.assertEquals(len(self.mock_nextbus_response_as_list), len(actual_cached_items))
         self.assertEquals(actual_cached_items, self.mock_nextbus_response_as_list)
@@ -149,9 +189,10 @@ class TestRoutesHandlerV1(testing.AsyncHTTPTestCase):
         self.maxDiff = None
         self.assertEqual(expected_service_response, actual_service_response)
 
+    @mock.patch.object(RedisRepository, "get_rendered_routes")
     @mock.patch.object(RedisRepository, "store_routes")
     @mock.patch.object(RedisRepository, "get_routes")
-    def test_routes_in_cache(self, mocked_repo_get, mocked_repo_store):
+    def test_routes_in_cache(self, mocked_repo_get, mocked_repo_store, mocked_repo_rendered):
 
         @gen.coroutine
         def get_success(path=None, body=None, query=None,
@@ -169,6 +210,10 @@ class TestRoutesHandlerV1(testing.AsyncHTTPTestCase):
         def store_items(agency_tag, items):  # pylint: disable=unused-argument
             raise gen.Return(None)
 
+        @gen.coroutine
+        def get_rendered(agency_tag):  # pylint: disable=unused-argument
+            raise gen.Return(None)
+
         with mock.patch.object(RestAdapter, 'get') as mocked_rest_adapter:
             mocked_rest_adapter.side_effect = get_success
             request = HTTPRequest(
@@ -178,6 +223,7 @@ class TestRoutesHandlerV1(testing.AsyncHTTPTestCase):
 
             mocked_repo_get.side_effect = get_items
             mocked_repo_store.side_effect = store_items
+            mocked_repo_rendered.side_effect = get_rendered
             self.http_client.fetch(request, self.stop)
             response = self.wait()
 
@@ -189,15 +235,21 @@ class TestRoutesHandlerV1(testing.AsyncHTTPTestCase):
         }
 
         mocked_repo_get.assert_called_once()
+        mocked_repo_rendered.assert_called_once()
         self.assertFalse(mocked_rest_adapter.called)
         self.assertFalse(mocked_repo_store.called)
 
         self.maxDiff = None
         self.assertEqual(expected_service_response, actual_service_response)
 
+    @mock.patch.object(RedisRepository, "get_rendered_routes")
+    @mock.patch.object(RedisRepository, "get_fetch_error")
+    @mock.patch.object(RedisRepository, "acquire_fetch_lease")
     @mock.patch.object(RedisRepository, "store_routes")
     @mock.patch.object(RedisRepository, "get_routes")
-    def test_routes_not_in_cache_with_short_titles(self, mocked_repo_get, mocked_repo_store):
+    def test_routes_not_in_cache_with_short_titles(self, mocked_repo_get, mocked_repo_store,
+                                                   mocked_repo_lease, mocked_repo_error,
+                                                   mocked_repo_rendered):
         @gen.coroutine
         def get_success(path=None, body=None, query=None,
                         headers=None, timeout=None):  # pylint: disable=unused-argument
@@ -212,6 +264,18 @@ class TestRoutesHandlerV1(testing.AsyncHTTPTestCase):
         def store_items(agency_tag, items):  # pylint: disable=unused-argument
             raise gen.Return(None)
 
+        @gen.coroutine
+        def acquire_lease(lease_name, token, ttl):  # pylint: disable=unused-argument
+            raise gen.Return(True)
+
+        @gen.coroutine
+        def get_error(fetch_name):  # pylint: disable=unused-argument
+            raise gen.Return(None)
+
+        @gen.coroutine
+        def get_rendered(agency_tag):  # pylint: disable=unused-argument
+            raise gen.Return(None)
+
         with mock.patch.object(RestAdapter, 'get') as mocked_rest_adapter:
             mocked_rest_adapter.side_effect = get_success
             request = HTTPRequest(
@@ -221,6 +285,9 @@ class TestRoutesHandlerV1(testing.AsyncHTTPTestCase):
 
             mocked_repo_get.side_effect = get_items
             mocked_repo_store.side_effect = store_items
+            mocked_repo_rendered.side_effect = get_rendered
+            mocked_repo_lease.side_effect = acquire_lease
+            mocked_repo_error.side_effect = get_error
             self.http_client.fetch(request, self.stop)
             response = self.wait()
 
@@ -241,6 +308,8 @@ class TestRoutesHandlerV1(testing.AsyncHTTPTestCase):
             timeout=settings.NEXTBUS_SERVICE_TIMEOUT)
 
         mocked_repo_get.assert_called_once()
+        mocked_repo_rendered.assert_called_once()
+        mocked_repo_lease.assert_called_once()
         actual_cached_items = mocked_repo_store.call_args_list[0][0][1]
         self.assertEquals(len(self.mock_nextbus_response_with_short_title_as_list), len(actual_cached_items))
         self.assertEquals(actual_cached_items, self.mock_nextbus_response_with_short_title_as_list)
@@ -0,0 +1,118 @@
+import json
+import mock
+from tornado import ioloop
+from tornado import testing
+from tornado import gen
+from tornado.httpclient import HTTPRequest
+
+from pubtrans import application
+from pubtrans.common.rest_adapter import RestAdapter
+from pubtrans.domain import api
+from pubtrans.repositories.redis_repository import RedisRepository
+from pubtrans.repositories.uri_stats_repository import UriStatsRepository
+
+app = application.make_app()
+
+
+class TestStopArrivalsHandlerV1(testing.AsyncHTTPTestCase):
+
+    def setUp(self):
+        super(TestStopArrivalsHandlerV1, self).setUp()
+
+        uri_stats_patcher = mock.patch.object(UriStatsRepository, 'update_uri_stats',
+                                              return_value=gen.maybe_future(None))
+        uri_stats_patcher.start()
+        self.addCleanup(uri_stats_patcher.stop)
+
+        self.agency_tag = 'sf-muni'
+        self.route_tag = 'E'
+        self.stop_tag = '5237'
+
+        # Same service every day, so arrivals do not depend on the day tests run
+        self.schedule = {
+            api.TAG_SCHEDULE_CLASS: '2016T_FALL',
+            api.TAG_SCHEDULE_ITEMS: dict(
+                ('{0}:inbound'.format(service_class), {
+                    api.TAG_SERVICE_CLASS: service_class,
+                    api.TAG_DIRECTION: 'Inbound',
+                    api.TAG_STOPS: {
+                        '5237': {
+                            api.TAG_TAG: '5237',
+                            api.TAG_TITLE: 'King St & 2nd St',
+                            api.TAG_SCHEDULED_ARRIVALS: [
+                                {api.TAG_EPOCH_TIME: '32820000', api.TAG_TIME_DATA: '09:07:00'},
+                                {api.TAG_EPOCH_TIME: '33420000', api.TAG_TIME_DATA: '09:17:00'},
+                                {api.TAG_EPOCH_TIME: '34020000', api.TAG_TIME_DATA: '09:27:00'}
+                            ]
+                        }
+                    }
+                }) for service_class in ['wkd', 'sat', 'sun'])
+        }
+
+    def get_app(self):  # pylint: disable=unused-argument
+        return app
+
+    def get_new_ioloop(self):  # pylint: disable=unused-argument
+        return ioloop.IOLoop.instance()
+
+    @mock.patch.object(RedisRepository, "get_route_schedule")
+    def test_next_arrivals_from_schedule_in_cache(self, mocked_repo_get):
+
+        @gen.coroutine
+        def get_item(agency_tag, route_tag):  # pylint: disable=unused-argument
+            raise gen.Return(self.schedule)
+
+        with mock.patch.object(RestAdapter, 'get') as mocked_rest_adapter:
+            request = HTTPRequest(
+                self.get_url('/v1/' + self.agency_tag + '/routes/' + self.route_tag + '/stops/' +
+                             self.stop_tag + '/arrivals?time=09:10&limit=5'),
+                method='GET'
+            )
+
+            mocked_repo_get.side_effect = get_item
+            self.http_client.fetch(request, self.stop)
+            response = self.wait()
+
+        self.assertEqual(response.code, 200)
+        self.assertFalse(mocked_rest_adapter.called)
+        mocked_repo_get.assert_called_once_with(self.agency_tag, self.route_tag)
+        self.assertEqual(json.loads(response.body), {
+            api.TAG_ROUTE_TAG: 'E',
+            api.TAG_STOP_TAG: '5237',
+            api.TAG_STOP_TITLE: 'King St & 2nd St',
+            api.TAG_ARRIVALS: [
+                {api.TAG_DIRECTION: 'Inbound', api.TAG_EPOCH_TIME: '33420000', api.TAG_TIME_DATA: '09:17:00'},
+                {api.TAG_DIRECTION: 'Inbound', api.TAG_EPOCH_TIME: '34020000', api.TAG_TIME_DATA: '09:27:00'}
+            ]
+        })
+
+    @mock.patch.object(RedisRepository, "get_route_schedule")
+    def test_stop_not_in_schedule(self, mocked_repo_get):
+
+        @gen.coroutine
+        def get_item(agency_tag, route_tag):  # pylint: disable=unused-argument
+            raise gen.Return(self.schedule)
+
+        request = HTTPRequest(
+            self.get_url('/v1/' + self.agency_tag + '/routes/' + self.route_tag + '/stops/9999/arrivals'),
+            method='GET'
+        )
+
+        mocked_repo_get.side_effect = get_item
+        self.http_client.fetch(request, self.stop)
+        response = self.wait()
+
+        self.assertEqual(response.code, 404)
+
+    def test_invalid_time(self):
+
+        request = HTTPRequest(
+            self.get_url('/v1/' + self.agency_tag + '/routes/' + self.route_tag + '/stops/' +
+                         self.stop_tag + '/arrivals?time=25:00'),
+            method='GET'
+        )
+
+        self.http_client.fetch(request, self.stop)
+        response = self.wait()
+
+        self.assertEqual(response.code, 400)
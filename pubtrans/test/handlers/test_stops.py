@@ -0,0 +1,132 @@
+import json
+import mock
+from tornado import ioloop
+from tornado import testing
+from tornado import gen
+from tornado.httpclient import HTTPRequest
+
+from pubtrans import application
+from pubtrans.common.rest_adapter import RestAdapter
+from pubtrans.domain import api
+from pubtrans.repositories.redis_repository import AgencyIndexRepository
+from pubtrans.repositories.redis_repository import RedisRepository
+from pubtrans.repositories.uri_stats_repository import UriStatsRepository
+
+app = application.make_app()
+
+
+class TestStopsHandlerV1(testing.AsyncHTTPTestCase):
+
+    def setUp(self):
+        super(TestStopsHandlerV1, self).setUp()
+
+        uri_stats_patcher = mock.patch.object(UriStatsRepository, 'update_uri_stats',
+                                              return_value=gen.maybe_future(None))
+        uri_stats_patcher.start()
+        self.addCleanup(uri_stats_patcher.stop)
+
+        self.agency_tag = 'sf-muni'
+
+        self.routes = [{api.TAG_TAG: 'E'}, {api.TAG_TAG: 'F'}]
+        self.route_stops = {
+            'E': [{api.TAG_TAG: '5184', api.TAG_TITLE: 'Jones St & Beach St', api.TAG_LAT: '37.8071299',
+                   api.TAG_LON: '-122.41732', api.TAG_STOP_ID: '15184', api.TAG_DIRECTIONS: ['E____O_F00']}],
+            'F': [{api.TAG_TAG: '5184', api.TAG_TITLE: 'Jones St & Beach St', api.TAG_LAT: '37.8071299',
+                   api.TAG_LON: '-122.41732', api.TAG_STOP_ID: '15184', api.TAG_DIRECTIONS: ['F____I_F00']}]
+        }
+
+    def get_app(self):  # pylint: disable=unused-argument
+        return app
+
+    def get_new_ioloop(self):  # pylint: disable=unused-argument
+        return ioloop.IOLoop.instance()
+
+    @mock.patch.object(AgencyIndexRepository, "get_route_stops")
+    @mock.patch.object(RedisRepository, "get_routes")
+    def test_stop_in_index(self, mocked_repo_routes, mocked_repo_stops):
+
+        @gen.coroutine
+        def get_routes(agency_tag):  # pylint: disable=unused-argument
+            raise gen.Return(self.routes)
+
+        @gen.coroutine
+        def get_route_stops(agency_tag):  # pylint: disable=unused-argument
+            raise gen.Return(self.route_stops)
+
+        with mock.patch.object(RestAdapter, 'get') as mocked_rest_adapter:
+            request = HTTPRequest(self.get_url('/v1/' + self.agency_tag + '/stops/15184'), method='GET')
+
+            mocked_repo_routes.side_effect = get_routes
+            mocked_repo_stops.side_effect = get_route_stops
+            self.http_client.fetch(request, self.stop)
+            response = self.wait()
+
+        self.assertEqual(response.code, 200)
+        self.assertFalse(mocked_rest_adapter.called)
+        self.assertEqual(json.loads(response.body), {
+            api.TAG_TAG: '5184',
+            api.TAG_TITLE: 'Jones St & Beach St',
+            api.TAG_LAT: '37.8071299',
+            api.TAG_LON: '-122.41732',
+            api.TAG_STOP_ID: '15184',
+            api.TAG_ROUTES: [
+                {api.TAG_TAG: 'E', api.TAG_DIRECTIONS: ['E____O_F00']},
+                {api.TAG_TAG: 'F', api.TAG_DIRECTIONS: ['F____I_F00']}
+            ]
+        })
+
+    @mock.patch.object(AgencyIndexRepository, "get_route_stops")
+    @mock.patch.object(RedisRepository, "get_routes")
+    def test_stop_not_in_index(self, mocked_repo_routes, mocked_repo_stops):
+
+        @gen.coroutine
+        def get_routes(agency_tag):  # pylint: disable=unused-argument
+            raise gen.Return(self.routes)
+
+        @gen.coroutine
+        def get_route_stops(agency_tag):  # pylint: disable=unused-argument
+            raise gen.Return(self.route_stops)
+
+        request = HTTPRequest(self.get_url('/v1/' + self.agency_tag + '/stops/9999'), method='GET')
+
+        mocked_repo_routes.side_effect = get_routes
+        mocked_repo_stops.side_effect = get_route_stops
+        self.http_client.fetch(request, self.stop)
+        response = self.wait()
+
+        self.assertEqual(response.code, 404)
+
+    @mock.patch.object(AgencyIndexRepository, "get_route_stops")
+    @mock.patch.object(RedisRepository, "get_routes")
+    def test_nearby_stops(self, mocked_repo_routes, mocked_repo_stops):
+
+        @gen.coroutine
+        def get_routes(agency_tag):  # pylint: disable=unused-argument
+            raise gen.Return(self.routes)
+
+        @gen.coroutine
+        def get_route_stops(agency_tag):  # pylint: disable=unused-argument
+            raise gen.Return(self.route_stops)
+
+        request = HTTPRequest(self.get_url('/v1/' + self.agency_tag + '/stops?lat=37.8074&lon=-122.4172'),
+                              method='GET')
+
+        mocked_repo_routes.side_effect = get_routes
+        mocked_repo_stops.side_effect = get_route_stops
+        self.http_client.fetch(request, self.stop)
+        response = self.wait()
+
+        self.assertEqual(response.code, 200)
+        nearby_stops = json.loads(response.body)[api.TAG_STOPS]
+        self.assertEqual([(stop[api.TAG_TAG], stop[api.TAG_DISTANCE]) for stop in nearby_stops],
+                         [('5184', 32)])
+
+    def test_nearby_stops_with_invalid_radius(self):
+
+        request = HTTPRequest(
+            self.get_url('/v1/' + self.agency_tag + '/stops?lat=37.8&lon=-122.4&radius=50000'), method='GET')
+
+        self.http_client.fetch(request, self.stop)
+        response = self.wait()
+
+        self.assertEqual(response.code, 400)
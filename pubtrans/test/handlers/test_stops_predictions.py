@@ -0,0 +1,284 @@
+import json
+import mock
+from tornado import ioloop
+from tornado import testing
+from tornado import gen
+from tornado.httpclient import HTTPRequest
+
+from pubtrans import application
+from pubtrans.common.rest_adapter import RestAdapter
+from pubtrans.config import settings
+from pubtrans.domain import api
+from pubtrans.repositories.redis_repository import PredictionsRepository
+from pubtrans.repositories.redis_repository import RedisRepository
+from pubtrans.repositories.uri_stats_repository import UriStatsRepository
+from pubtrans.services.next_bus import NextBusService
+
+app = application.make_app()
+
+
+class TestStopsPredictionsHandlerV1(testing.AsyncHTTPTestCase):
+
+    def setUp(self):
+        super(TestStopsPredictionsHandlerV1, self).setUp()
+
+        uri_stats_patcher = mock.patch.object(UriStatsRepository, 'update_uri_stats',
+                                              return_value=gen.maybe_future(None))
+        uri_stats_patcher.start()
+        self.addCleanup(uri_stats_patcher.stop)
+
+        self.agency_tag = 'sf-muni'
+
+        self.mock_nextbus_response = \
+            '<body copyright="All data copyright San Francisco Muni 2016.">' \
+            '<predictions agencyTitle="San Francisco Muni" routeTitle="E-Embarcadero" routeTag="E" ' \
+            'stopTitle="The Embarcadero &amp; Bay St" stopTag="4502">' \
+            '  <direction title="Outbound to Mission Bay">' \
+            '    <prediction epochTime="1476394913877" seconds="361" minutes="6" isDeparture="false" ' \
+            'affectedByLayover="true" dirTag="E____O_F00" vehicle="1006" block="9204" tripTag="7273070" />' \
+            '  </direction>' \
+            '</predictions>' \
+            '<predictions agencyTitle="San Francisco Muni" routeTitle="N-Judah" routeTag="N" ' \
+            'stopTitle="Judah St &amp; 9th Ave" stopTag="5205" ' \
+            'dirTitleBecauseNoPredictions="Outbound to Ocean Beach">' \
+            '</predictions>' \
+            '</body>'
+
+        self.e_predictions = {
+            api.TAG_DIRECTIONS: [
+                {
+                    api.TAG_TITLE: "Outbound to Mission Bay",
+                    api.TAG_PREDICTIONS: [
+                        {
+                            api.TAG_EPOCH_TIME: "1476394913877",
+                            api.TAG_SECONDS: "361",
+                            api.TAG_MINUTES: "6",
+                            api.TAG_IS_DEPARTURE: "false",
+                            api.TAG_AFFECTED_BY_LAYOVER: "true",
+                            api.TAG_DIR_TAG: "E____O_F00",
+                            api.TAG_VEHICLE: "1006",
+                            api.TAG_BLOCK: "9204",
+                            api.TAG_TRIP_TAG: "7273070"
+                        }
+                    ]
+                }
+            ]
+        }
+        self.n_predictions = {
+            api.TAG_DIRECTIONS: []
+        }
+
+        self.expected_service_response = {
+            api.TAG_PREDICTIONS: [
+                dict(self.e_predictions, **{api.TAG_ROUTE_TAG: 'E', api.TAG_STOP_TAG: '4502'}),
+                dict(self.n_predictions, **{api.TAG_ROUTE_TAG: 'N', api.TAG_STOP_TAG: '5205'})
+            ]
+        }
+
+        self.url = '/v1/' + self.agency_tag + '/predictions?' + \
+            api.QUERY_STOPS + '=E|4502&' + api.QUERY_STOPS + '=N|5205'
+
+    def get_app(self):  # pylint: disable=unused-argument
+        return app
+
+    def get_new_ioloop(self):  # pylint: disable=unused-argument
+        return ioloop.IOLoop.instance()
+
+    @mock.patch.object(RedisRepository, "get_fetch_error")
+    @mock.patch.object(RedisRepository, "acquire_fetch_lease")
+    @mock.patch.object(PredictionsRepository, "store_stops_predictions")
+    @mock.patch.object(PredictionsRepository, "get_stops_predictions")
+    def test_predictions_not_in_cache(self, mocked_repo_get, mocked_repo_store, mocked_repo_lease,
+                                      mocked_repo_error):
+
+        @gen.coroutine
+        def get_success(path=None, body=None, query=None,
+                        headers=None, timeout=None):  # pylint: disable=unused-argument
+
+            raise gen.Return((200, self.mock_nextbus_response))
+
+        @gen.coroutine
+        def get_items(agency_tag, stops):  # pylint: disable=unused-argument
+            raise gen.Return(({}, list(stops)))
+
+        @gen.coroutine
+        def store_items(agency_tag, predictions):  # pylint: disable=unused-argument
+            raise gen.Return(None)
+
+        @gen.coroutine
+        def acquire_lease(lease_name, token, ttl):  # pylint: disable=unused-argument
+            raise gen.Return(True)
+
+        @gen.coroutine
+        def get_error(fetch_name):  # pylint: disable=unused-argument
+            raise gen.Return(None)
+
+        with mock.patch.object(RestAdapter, 'get') as mocked_rest_adapter:
+            mocked_rest_adapter.side_effect = get_success
+            request = HTTPRequest(self.get_url(self.url), method='GET')
+
+            mocked_repo_get.side_effect = get_items
+            mocked_repo_store.side_effect = store_items
+            mocked_repo_lease.side_effect = acquire_lease
+            mocked_repo_error.side_effect = get_error
+            self.http_client.fetch(request, self.stop)
+            response = self.wait()
+
+        self.maxDiff = None
+        self.assertEqual(response.code, 200)
+        actual_service_response = json.loads(response.body)
+
+        headers = {
+            "Accept": "application/xml"
+        }
+
+        mocked_rest_adapter.assert_called_once_with(
+            query=[('command', NextBusService.COMMAND_MULTI_STOP_PREDICTIONS),
+                   ('a', self.agency_tag),
+                   ('stops', 'E|4502'),
+                   ('stops', 'N|5205')],
+            headers=headers,
+            timeout=settings.NEXTBUS_SERVICE_TIMEOUT)
+
+        mocked_repo_get.assert_called_once_with(self.agency_tag, [('E', '4502'), ('N', '5205')])
+        mocked_repo_lease.assert_called_once()
+
+        # Cached by stop, as single stop predictions are
+        mocked_repo_store.assert_called_once()
+        actual_cached_items = mocked_repo_store.call_args_list[0][0][1]
+        self.assertEqual({('E', '4502'): self.e_predictions, ('N', '5205'): self.n_predictions},
+                         actual_cached_items)
+
+        self.assertEqual(self.expected_service_response, actual_service_response)
+
+    @mock.patch.object(RedisRepository, "get_fetch_error")
+    @mock.patch.object(RedisRepository, "acquire_fetch_lease")
+    @mock.patch.object(PredictionsRepository, "store_stops_predictions")
+    @mock.patch.object(PredictionsRepository, "get_stops_predictions")
+    def test_predictions_in_batches(self, mocked_repo_get, mocked_repo_store, mocked_repo_lease,
+                                    mocked_repo_error):
+
+        stop_responses = {
+            '4502':
+                '<body copyright="All data copyright San Francisco Muni 2016.">'
+                '<predictions agencyTitle="San Francisco Muni" routeTitle="E-Embarcadero" routeTag="E" '
+                'stopTitle="The Embarcadero &amp; Bay St" stopTag="4502">'
+                '  <direction title="Outbound to Mission Bay">'
+                '    <prediction epochTime="1476394913877" seconds="361" minutes="6" isDeparture="false" '
+                'affectedByLayover="true" dirTag="E____O_F00" vehicle="1006" block="9204" '
+                'tripTag="7273070" />'
+                '  </direction>'
+                '</predictions>'
+                '</body>',
+            '5205':
+                '<body copyright="All data copyright San Francisco Muni 2016.">'
+                '<predictions agencyTitle="San Francisco Muni" routeTitle="N-Judah" routeTag="N" '
+                'stopTitle="Judah St &amp; 9th Ave" stopTag="5205" '
+                'dirTitleBecauseNoPredictions="Outbound to Ocean Beach">'
+                '</predictions>'
+                '</body>'
+        }
+
+        @gen.coroutine
+        def get_success(path=None, body=None, query=None,
+                        headers=None, timeout=None):  # pylint: disable=unused-argument
+
+            # Batches of a single stop ask for the predictions of that stop
+            raise gen.Return((200, stop_responses[query['s']]))
+
+        @gen.coroutine
+        def get_items(agency_tag, stops):  # pylint: disable=unused-argument
+            raise gen.Return(({}, list(stops)))
+
+        @gen.coroutine
+        def store_items(agency_tag, predictions):  # pylint: disable=unused-argument
+            raise gen.Return(None)
+
+        @gen.coroutine
+        def acquire_lease(lease_name, token, ttl):  # pylint: disable=unused-argument
+            raise gen.Return(True)
+
+        @gen.coroutine
+        def get_error(fetch_name):  # pylint: disable=unused-argument
+            raise gen.Return(None)
+
+        with mock.patch.object(RestAdapter, 'get') as mocked_rest_adapter, \
+                mock.patch.object(settings, 'PREDICTIONS_MAX_STOPS_PER_CALL', 1):
+            mocked_rest_adapter.side_effect = get_success
+            request = HTTPRequest(self.get_url(self.url), method='GET')
+
+            mocked_repo_get.side_effect = get_items
+            mocked_repo_store.side_effect = store_items
+            mocked_repo_lease.side_effect = acquire_lease
+            mocked_repo_error.side_effect = get_error
+            self.http_client.fetch(request, self.stop)
+            response = self.wait()
+
+        self.assertEqual(response.code, 200)
+
+        self.assertEqual(mocked_rest_adapter.call_count, 2)
+        queried_stops = [(call[1]['query']['r'], call[1]['query']['s'])
+                         for call in mocked_rest_adapter.call_args_list]
+        self.assertEqual([('E', '4502'), ('N', '5205')], queried_stops)
+        self.assertEqual(self.expected_service_response, json.loads(response.body))
+        self.assertEqual(mocked_repo_store.call_count, 2)
+
+    @mock.patch.object(PredictionsRepository, "store_stops_predictions")
+    @mock.patch.object(PredictionsRepository, "get_stops_predictions")
+    def test_predictions_in_cache(self, mocked_repo_get, mocked_repo_store):
+
+        @gen.coroutine
+        def get_items(agency_tag, stops):  # pylint: disable=unused-argument
+            raise gen.Return(({('E', '4502'): self.e_predictions, ('N', '5205'): self.n_predictions}, []))
+
+        with mock.patch.object(RestAdapter, 'get') as mocked_rest_adapter:
+            request = HTTPRequest(self.get_url(self.url), method='GET')
+
+            mocked_repo_get.side_effect = get_items
+            self.http_client.fetch(request, self.stop)
+            response = self.wait()
+
+        self.assertEqual(response.code, 200)
+        actual_service_response = json.loads(response.body)
+
+        mocked_repo_get.assert_called_once()
+        self.assertFalse(mocked_rest_adapter.called)
+        self.assertFalse(mocked_repo_store.called)
+
+        self.maxDiff = None
+        self.assertEqual(self.expected_service_response, actual_service_response)
+
+    def test_invalid_stops_should_return_400(self):
+        request = HTTPRequest(
+            self.get_url('/v1/' + self.agency_tag + '/predictions?' + api.QUERY_STOPS + '=4502'),
+            method='GET'
+        )
+
+        self.http_client.fetch(request, self.stop)
+        response = self.wait()
+
+        self.assertEqual(response.code, 400)
+        actual_response = json.loads(response.body)
+
+        expected_response = {
+            "developer_message": "A valid argument was provided with an invalid value",
+        }
+        self.assertDictContainsSubset(expected_response, actual_response)
+
+    def test_when_no_stops_should_return_400(self):
+        request = HTTPRequest(
+            self.get_url('/v1/' + self.agency_tag + '/predictions'),
+            method='GET'
+        )
+
+        self.http_client.fetch(request, self.stop)
+        response = self.wait()
+
+        self.assertEqual(response.code, 400)
+        actual_response = json.loads(response.body)
+
+        expected_response = {
+            "context": "Missing argument " + api.QUERY_STOPS,
+            "developer_message": "No value provided for an argument with required value",
+        }
+        self.assertDictContainsSubset(expected_response, actual_response)
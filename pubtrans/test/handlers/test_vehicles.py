@@ -0,0 +1,76 @@
+import json
+import mock
+from tornado import ioloop
+from tornado import testing
+from tornado import gen
+from tornado.httpclient import HTTPRequest
+
+from pubtrans import application
+from pubtrans.common.rest_adapter import RestAdapter
+from pubtrans.config import settings
+from pubtrans.domain import api
+from pubtrans.domain import vehicle_positions
+from pubtrans.repositories.uri_stats_repository import UriStatsRepository
+
+app = application.make_app()
+
+
+class TestVehiclesHandlerV1(testing.AsyncHTTPTestCase):
+
+    def setUp(self):
+        super(TestVehiclesHandlerV1, self).setUp()
+
+        uri_stats_patcher = mock.patch.object(UriStatsRepository, 'update_uri_stats',
+                                              return_value=gen.maybe_future(None))
+        uri_stats_patcher.start()
+        self.addCleanup(uri_stats_patcher.stop)
+
+        self.agency_tag = 'sf-muni'
+
+        self.positions = vehicle_positions.VehiclePositions()
+        self.positions.update(self.agency_tag, {
+            'E': {
+                api.TAG_VEHICLES: [
+                    {api.TAG_ID: '1008', api.TAG_LAT: '37.7747', api.TAG_LON: '-122.39613',
+                     'reportTime': 1476314407287},
+                    {api.TAG_ID: '1010', api.TAG_LAT: '37.8080', api.TAG_LON: '-122.4177',
+                     'reportTime': 1476314407287}
+                ],
+                api.TAG_LAST_TIME: 1476314411287
+            }
+        })
+
+    def get_app(self):  # pylint: disable=unused-argument
+        return app
+
+    def get_new_ioloop(self):  # pylint: disable=unused-argument
+        return ioloop.IOLoop.instance()
+
+    def test_vehicles_in_box(self):
+
+        with mock.patch.object(RestAdapter, 'get') as mocked_rest_adapter, \
+                mock.patch.object(settings, 'vehicle_positions', self.positions):
+            request = HTTPRequest(
+                self.get_url('/v1/' + self.agency_tag + '/vehicles?bbox=-122.40,37.77,-122.39,37.78'),
+                method='GET')
+            self.http_client.fetch(request, self.stop)
+            response = self.wait()
+
+        self.assertEqual(response.code, 200)
+        self.assertFalse(mocked_rest_adapter.called)
+        self.assertEqual(json.loads(response.body), {
+            api.TAG_VEHICLES: [
+                {api.TAG_ROUTE_TAG: 'E', api.TAG_ID: '1008', api.TAG_DIR_TAG: None, api.TAG_LAT: '37.7747',
+                 api.TAG_LON: '-122.39613', api.TAG_SECS_SINCE_REPORT: '4', api.TAG_PREDICTABLE: None,
+                 api.TAG_HEADING: None, api.TAG_SPEED_KM_HR: None}
+            ]
+        })
+
+    def test_vehicles_with_invalid_box(self):
+
+        request = HTTPRequest(self.get_url('/v1/' + self.agency_tag + '/vehicles?bbox=-122.39,37.77,-122.40'),
+                              method='GET')
+        self.http_client.fetch(request, self.stop)
+        response = self.wait()
+
+        self.assertEqual(response.code, 400)
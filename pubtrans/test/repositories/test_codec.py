@@ -0,0 +1,72 @@
+import json
+import unittest
+from collections import OrderedDict
+
+import mock
+
+from pubtrans.repositories import codec
+
+
+class TestCodec(unittest.TestCase):
+
+    def setUp(self):
+        self.fetched_at = 1476394913.877
+        self.route = OrderedDict([
+            ('tag', u'E'),
+            ('title', u'E-Embarcadero'),
+            ('paths', [{'points': [OrderedDict([('lat', u'37.7929'), ('lon', u'-122.3971')])] * 50}])
+        ])
+
+    def test_all_codecs_round_trip(self):
+
+        for codec_name in codec.CODECS_BY_NAME:
+            data, size = codec.encode(codec_name, self.route, self.fetched_at)
+            value, fetched_at, decoded_size = codec.decode(data)
+
+            self.assertEqual(value, self.route, codec_name)
+            self.assertEqual(fetched_at, self.fetched_at)
+            self.assertEqual(decoded_size, size)
+
+    def test_compressed_codecs_are_smaller(self):
+
+        plain, _ = codec.encode(codec.CODEC_MSGPACK, self.route, self.fetched_at)
+        compressed, _ = codec.encode(codec.CODEC_MSGPACK_ZLIB, self.route, self.fetched_at)
+
+        self.assertLess(len(compressed), len(plain))
+
+    def test_legacy_values_are_decoded(self):
+
+        data = json.dumps(self.route)
+        self.assertEqual(codec.decode(data), (self.route, None, len(data)))
+
+        envelope = json.dumps({'fetchedAt': self.fetched_at, 'value': self.route})
+        self.assertEqual(codec.decode(envelope)[:2], (self.route, self.fetched_at))
+
+    def test_unknown_codec_id_cannot_be_decoded(self):
+
+        data, _ = codec.encode(codec.CODEC_MSGPACK, self.route, self.fetched_at)
+
+        with self.assertRaises(ValueError):
+            codec.decode(data[:1] + chr(99) + data[2:])
+
+    def test_falls_back_to_json_without_msgpack(self):
+
+        with mock.patch.object(codec, 'msgpack', None):
+            data, _ = codec.encode(codec.CODEC_MSGPACK_ZLIB, self.route, self.fetched_at)
+
+        self.assertEqual(codec.get_codec(codec.CODEC_MSGPACK_ZLIB).name, codec.CODEC_MSGPACK_ZLIB)
+        self.assertEqual(ord(data[1]), codec.CODECS_BY_NAME[codec.CODEC_JSON_ZLIB].codec_id)
+        self.assertEqual(codec.decode(data)[0], self.route)
+
+    def test_json_codecs_keep_the_json_document(self):
+
+        for codec_name in [codec.CODEC_JSON, codec.CODEC_JSON_ZLIB]:
+            data, _ = codec.encode(codec_name, self.route, self.fetched_at)
+            rendered, fetched_at = codec.decode_rendered(data)
+
+            self.assertEqual(json.loads(rendered, object_pairs_hook=OrderedDict), self.route)
+            self.assertEqual(fetched_at, self.fetched_at)
+
+        data, _ = codec.encode(codec.CODEC_MSGPACK, self.route, self.fetched_at)
+        self.assertIsNone(codec.decode_rendered(data))
+        self.assertIsNone(codec.decode_rendered(json.dumps(self.route)))
@@ -0,0 +1,67 @@
+import unittest
+
+from pubtrans.repositories import memory_cache
+
+
+class TestMemoryCache(unittest.TestCase):
+
+    def setUp(self):
+        super(TestMemoryCache, self).setUp()
+
+        self.now = 1000.0
+        self.cache = memory_cache.MemoryCache(100, clock=lambda: self.now)
+
+    def test_get_missing(self):
+
+        self.assertIsNone(self.cache.get('a'))
+        self.assertEqual(self.cache.get_stats()[memory_cache.STAT_MISSES], 1)
+
+    def test_set_and_get(self):
+
+        self.cache.set('a', {'tag': 'E'}, 10, 60)
+
+        self.assertEqual(self.cache.get('a'), {'tag': 'E'})
+        stats = self.cache.get_stats()
+        self.assertEqual(stats[memory_cache.STAT_HITS], 1)
+        self.assertEqual(stats[memory_cache.STAT_BYTES], 10)
+
+    def test_entry_expires(self):
+
+        self.cache.set('a', 'value', 10, 60)
+        self.now += 61
+
+        self.assertIsNone(self.cache.get('a'))
+        stats = self.cache.get_stats()
+        self.assertEqual(stats[memory_cache.STAT_EXPIRATIONS], 1)
+        self.assertEqual(stats[memory_cache.STAT_BYTES], 0)
+
+    def test_least_recently_used_is_evicted_by_size(self):
+
+        self.cache.set('a', 'a', 40, 60)
+        self.cache.set('b', 'b', 40, 60)
+        self.cache.get('a')
+        self.cache.set('c', 'c', 40, 60)
+
+        self.assertIsNone(self.cache.get('b'))
+        self.assertEqual(self.cache.get('a'), 'a')
+        self.assertEqual(self.cache.get('c'), 'c')
+        stats = self.cache.get_stats()
+        self.assertEqual(stats[memory_cache.STAT_EVICTIONS], 1)
+        self.assertEqual(stats[memory_cache.STAT_BYTES], 80)
+
+    def test_replace_updates_size(self):
+
+        self.cache.set('a', 'a', 40, 60)
+        self.cache.set('a', 'b', 30, 60)
+
+        self.assertEqual(self.cache.get('a'), 'b')
+        self.assertEqual(self.cache.get_stats()[memory_cache.STAT_BYTES], 30)
+
+    def test_too_big_or_expired_values_are_not_cached(self):
+
+        self.cache.set('a', 'a', 101, 60)
+        self.cache.set('b', 'b', 10, 0)
+
+        self.assertIsNone(self.cache.get('a'))
+        self.assertIsNone(self.cache.get('b'))
+        self.assertEqual(self.cache.get_stats()[memory_cache.STAT_ENTRIES], 0)
@@ -0,0 +1,364 @@
+import json
+import threading
+
+import mock
+import redis
+from tornado import testing
+
+from pubtrans.common import exceptions
+from pubtrans.config import settings
+from pubtrans.domain import entities
+from pubtrans.repositories import codec
+from pubtrans.repositories.memory_cache import MemoryCache
+from pubtrans.repositories.redis_repository import BaseRepository
+from pubtrans.repositories.redis_repository import RedisRepository
+
+
+class TestRedisRepository(testing.AsyncTestCase):
+
+    def setUp(self):
+        super(TestRedisRepository, self).setUp()
+
+        self.agency_tag = 'sf-muni'
+        self.route_tag = 'E'
+        self.route = {'tag': 'E', 'title': 'E-Embarcadero'}
+        self.messages = {'allMessages': []}
+
+        self.connection = mock.MagicMock()
+        self.pipeline = self.connection.pipeline.return_value
+        self.memory_cache = MemoryCache(1024 * 1024)
+        self.now = 1476394913.0
+        self.repository = RedisRepository(None, memory_cache_instance=self.memory_cache,
+                                          clock=lambda: self.now)
+        self.stale_entities = []
+        self.repository.stale_handler = \
+            lambda entity, key_args: self.stale_entities.append((entity, key_args))
+
+    @testing.gen_test
+    def test_get_runs_outside_ioloop_thread(self):
+
+        io_loop_thread = threading.current_thread()
+        command_threads = []
+
+        def get(key_name):  # pylint: disable=unused-argument
+            command_threads.append(threading.current_thread())
+            return json.dumps(self.messages)
+
+        self.connection.get.side_effect = get
+
+        with mock.patch.object(BaseRepository, 'get_redis_connection', return_value=self.connection):
+            messages = yield self.repository.get_route_messages(self.agency_tag, self.route_tag)
+
+        self.assertEqual(messages, self.messages)
+        self.connection.get.assert_called_once_with('sf-muni:route_messages:E')
+        self.assertNotEqual(command_threads[0], io_loop_thread)
+
+    @testing.gen_test
+    def test_store_uses_master(self):
+
+        with mock.patch.object(BaseRepository, 'get_redis_connection',
+                               return_value=self.connection) as mocked_connection:
+            yield self.repository.store_route(self.agency_tag, self.route_tag, self.route)
+
+        mocked_connection.assert_called_once_with('master')
+        self.assertEqual(self.connection.set.call_args[0][0], 'sf-muni:route:E')
+        self.assertEqual(codec.decode(self.connection.set.call_args[0][1])[:2], (self.route, self.now))
+        self.assertEqual(self.connection.set.call_args[1],
+                         {'ex': settings.ROUTE_CACHE_TTL_SECONDS + settings.ROUTE_CACHE_STALE_SECONDS})
+
+    @testing.gen_test
+    def test_connection_error_raises_database_operation_error(self):
+
+        self.connection.get.side_effect = redis.ConnectionError('Connection refused')
+
+        with mock.patch.object(BaseRepository, 'get_redis_connection', return_value=self.connection):
+            with self.assertRaises(exceptions.DatabaseOperationError):
+                yield self.repository.get_route_messages(self.agency_tag, self.route_tag)
+
+    @testing.gen_test
+    def test_route_read_from_redis_is_kept_in_memory(self):
+
+        self.pipeline.execute.return_value = [json.dumps(self.route), 30000]
+
+        with mock.patch.object(BaseRepository, 'get_redis_connection', return_value=self.connection):
+            route1 = yield self.repository.get_route(self.agency_tag, self.route_tag)
+            route2 = yield self.repository.get_route(self.agency_tag, self.route_tag)
+
+        self.assertEqual(route1, entities.Route.from_dict(self.route))
+        self.assertIs(route2, route1)
+        self.pipeline.execute.assert_called_once()
+        self.pipeline.pttl.assert_called_once_with('sf-muni:route:E')
+        self.assertEqual(self.memory_cache.get_stats()['hits'], 1)
+
+    @testing.gen_test
+    def test_stored_route_is_served_from_memory(self):
+
+        with mock.patch.object(BaseRepository, 'get_redis_connection', return_value=self.connection):
+            yield self.repository.store_route(self.agency_tag, self.route_tag, self.route)
+            route = yield self.repository.get_route(self.agency_tag, self.route_tag)
+
+        self.assertIsInstance(route, entities.Route)
+        self.assertEqual(route, entities.Route.from_dict(self.route))
+        self.assertFalse(self.pipeline.execute.called)
+
+    @testing.gen_test
+    def test_predictions_are_not_kept_in_memory(self):
+
+        stop_tag = '4502'
+        predictions = {'directions': []}
+        self.connection.get.return_value = json.dumps(predictions)
+
+        with mock.patch.object(BaseRepository, 'get_redis_connection', return_value=self.connection):
+            yield self.repository.predictions.store_route_predictions(self.agency_tag, self.route_tag,
+                                                                      stop_tag, predictions)
+            yield self.repository.predictions.get_route_predictions(self.agency_tag, self.route_tag, stop_tag)
+
+        self.connection.get.assert_called_once_with('sf-muni:route_predictions:E:4502')
+        self.assertEqual(self.memory_cache.get_stats()['entries'], 0)
+
+    @testing.gen_test
+    def test_rendered_messages_are_read_without_decoding(self):
+
+        data, _ = codec.encode(codec.CODEC_JSON, self.messages, self.now)
+        self.connection.get.return_value = data
+
+        with mock.patch.object(BaseRepository, 'get_redis_connection', return_value=self.connection):
+            with mock.patch.object(codec, 'decode') as mocked_decode:
+                rendered = yield self.repository.get_rendered_route_messages(self.agency_tag, self.route_tag)
+
+        self.assertEqual(json.loads(rendered), self.messages)
+        self.assertFalse(mocked_decode.called)
+
+    @testing.gen_test
+    def test_rendered_is_none_for_other_codecs(self):
+
+        data, _ = codec.encode(codec.CODEC_MSGPACK, self.messages, self.now)
+        self.connection.get.return_value = data
+
+        with mock.patch.object(BaseRepository, 'get_redis_connection', return_value=self.connection):
+            rendered = yield self.repository.get_rendered_route_messages(self.agency_tag, self.route_tag)
+
+        self.assertIsNone(rendered)
+
+    @testing.gen_test
+    def test_stored_routes_are_rendered_from_memory(self):
+
+        routes = [self.route]
+
+        with mock.patch.object(BaseRepository, 'get_redis_connection', return_value=self.connection):
+            yield self.repository.store_routes(self.agency_tag, routes)
+            rendered = yield self.repository.get_rendered_routes(self.agency_tag)
+
+        self.assertEqual(json.loads(rendered), routes)
+        self.assertFalse(self.connection.get.called)
+
+    @testing.gen_test
+    def test_get_many_reads_missing_from_memory_in_one_round_trip(self):
+
+        schedule = {'scheduleItems': {}}
+        data, _ = codec.encode(codec.CODEC_JSON, schedule, self.now)
+        self.pipeline.execute.return_value = [data, 30000, None, -2]
+
+        with mock.patch.object(BaseRepository, 'get_redis_connection', return_value=self.connection):
+            yield self.repository.store_route_schedule(self.agency_tag, 'E', schedule)
+            schedules, missing = yield self.repository.agency_index.get_route_schedules(self.agency_tag,
+                                                                                        ['E', 'F', 'J'])
+
+        self.assertEqual(schedules, {'E': entities.Schedule.from_dict(schedule),
+                                     'F': entities.Schedule.from_dict(schedule)})
+        self.assertEqual(missing, ['J'])
+        self.pipeline.execute.assert_called_once()
+        self.assertEqual(self.pipeline.get.call_args_list,
+                         [mock.call('sf-muni:route_schedule:F'), mock.call('sf-muni:route_schedule:J')])
+
+    @testing.gen_test
+    def test_get_many_uses_mget(self):
+
+        predictions = {'directions': []}
+        data, _ = codec.encode(codec.CODEC_JSON, predictions, self.now)
+        self.connection.mget.return_value = [None, data]
+
+        with mock.patch.object(BaseRepository, 'get_redis_connection', return_value=self.connection):
+            found, missing = yield self.repository.get_many('route_predictions', [('sf-muni', 'E', '4502'),
+                                                                                  ('sf-muni', 'E', '4503')])
+
+        self.connection.mget.assert_called_once_with(['sf-muni:route_predictions:E:4502',
+                                                      'sf-muni:route_predictions:E:4503'])
+        self.assertEqual(found, {('sf-muni', 'E', '4503'): predictions})
+        self.assertEqual(missing, [('sf-muni', 'E', '4502')])
+
+    @testing.gen_test
+    def test_stops_predictions_are_keyed_by_stop(self):
+
+        predictions = {'directions': []}
+        data, _ = codec.encode(codec.CODEC_JSON, predictions, self.now)
+        self.connection.mget.return_value = [data, None]
+
+        with mock.patch.object(BaseRepository, 'get_redis_connection', return_value=self.connection):
+            found, missing = yield self.repository.predictions.get_stops_predictions(
+                self.agency_tag, [('E', '4502'), ('N', '5205')])
+            yield self.repository.predictions.store_stops_predictions(self.agency_tag,
+                                                                      {('N', '5205'): predictions})
+
+        self.assertEqual(found, {('E', '4502'): predictions})
+        self.assertEqual(missing, [('N', '5205')])
+        self.pipeline.set.assert_called_once_with('sf-muni:route_predictions:N:5205', mock.ANY,
+                                                  ex=mock.ANY)
+
+    @testing.gen_test
+    def test_store_many_uses_one_pipeline(self):
+
+        schedules = {'E': {'scheduleItems': {}}, 'F': {'scheduleItems': {}}}
+
+        with mock.patch.object(BaseRepository, 'get_redis_connection', return_value=self.connection):
+            yield self.repository.agency_index.store_route_schedules(self.agency_tag, schedules)
+
+        self.pipeline.execute.assert_called_once()
+        self.assertEqual(sorted(call[0][0] for call in self.pipeline.set.call_args_list),
+                         ['sf-muni:route_schedule:E', 'sf-muni:route_schedule:F'])
+        self.assertFalse(self.connection.set.called)
+
+    @testing.gen_test
+    def test_service_windows_are_read_once_and_updated_in_memory(self):
+
+        windows = {'E': [['wkd', 'inbound', 18000, 91800]]}
+        self.pipeline.execute.return_value = [{'E': json.dumps(windows['E'])}, 30000]
+
+        with mock.patch.object(BaseRepository, 'get_redis_connection', return_value=self.connection):
+            cached_windows = yield self.repository.agency_index.get_service_windows(self.agency_tag)
+            yield self.repository.agency_index.store_service_windows(self.agency_tag, {'F': []})
+            updated_windows = yield self.repository.agency_index.get_service_windows(self.agency_tag)
+
+        self.assertEqual(cached_windows, windows)
+        self.assertEqual(updated_windows, {'E': windows['E'], 'F': []})
+        self.pipeline.hgetall.assert_called_once_with('sf-muni:service_windows')
+        self.pipeline.hset.assert_called_once_with('sf-muni:service_windows', 'F', '[]')
+        self.pipeline.expire.assert_called_once_with(
+            'sf-muni:service_windows',
+            settings.SCHEDULE_CACHE_TTL_SECONDS + settings.SCHEDULE_CACHE_STALE_SECONDS)
+
+    @testing.gen_test
+    def test_route_stops_are_read_once_and_updated_in_memory(self):
+
+        route_stops = {'E': [{'tag': '3095', 'stopId': '13095', 'directions': ['E____O_F00']}]}
+        self.pipeline.execute.return_value = [{'E': json.dumps(route_stops['E'])}, 30000]
+
+        with mock.patch.object(BaseRepository, 'get_redis_connection', return_value=self.connection):
+            cached_route_stops = yield self.repository.agency_index.get_route_stops(self.agency_tag)
+            yield self.repository.agency_index.store_route_stops(self.agency_tag, {'F': []})
+            updated_route_stops = yield self.repository.agency_index.get_route_stops(self.agency_tag)
+
+        self.assertEqual(cached_route_stops, route_stops)
+        self.assertEqual(updated_route_stops, {'E': route_stops['E'], 'F': []})
+        self.pipeline.hgetall.assert_called_once_with('sf-muni:route_stops')
+        self.pipeline.hset.assert_called_once_with('sf-muni:route_stops', 'F', '[]')
+        self.pipeline.expire.assert_called_once_with(
+            'sf-muni:route_stops', settings.ROUTE_CACHE_TTL_SECONDS + settings.ROUTE_CACHE_STALE_SECONDS)
+
+    @testing.gen_test
+    def test_acquire_fetch_lease_sets_key_if_not_exists(self):
+
+        self.connection.set.return_value = None
+
+        with mock.patch.object(BaseRepository, 'get_redis_connection',
+                               return_value=self.connection) as mocked_connection:
+            acquired = yield self.repository.acquire_fetch_lease('routeList:sf-muni', 'token', 30)
+
+        self.assertFalse(acquired)
+        mocked_connection.assert_called_once_with('master')
+        self.connection.set.assert_called_once_with('fetch_lease:routeList:sf-muni', 'token',
+                                                    px=30000, nx=True)
+
+    @testing.gen_test
+    def test_fresh_entity_is_not_reported(self):
+
+        data = json.dumps({'fetchedAt': self.now - settings.ROUTE_MESSAGES_CACHE_TTL_SECONDS + 1,
+                           'value': self.messages})
+        self.connection.get.return_value = data
+
+        with mock.patch.object(BaseRepository, 'get_redis_connection', return_value=self.connection):
+            messages = yield self.repository.get_route_messages(self.agency_tag, self.route_tag)
+
+        self.assertEqual(messages, self.messages)
+        self.assertEqual(self.stale_entities, [])
+
+    @testing.gen_test
+    def test_stale_entity_is_returned_and_reported(self):
+
+        data = json.dumps({'fetchedAt': self.now - settings.ROUTE_MESSAGES_CACHE_TTL_SECONDS - 1,
+                           'value': self.messages})
+        self.connection.get.return_value = data
+
+        with mock.patch.object(BaseRepository, 'get_redis_connection', return_value=self.connection):
+            messages = yield self.repository.get_route_messages(self.agency_tag, self.route_tag)
+
+        self.assertEqual(messages, self.messages)
+        self.assertEqual(self.stale_entities, [('route_messages', ('sf-muni', 'E'))])
+
+    @testing.gen_test
+    def test_stale_entity_in_memory_is_reported(self):
+
+        with mock.patch.object(BaseRepository, 'get_redis_connection', return_value=self.connection):
+            yield self.repository.store_route(self.agency_tag, self.route_tag, self.route)
+            self.now += settings.ROUTE_CACHE_TTL_SECONDS + 1
+            route = yield self.repository.get_route(self.agency_tag, self.route_tag)
+
+        self.assertEqual(route, entities.Route.from_dict(self.route))
+        self.assertEqual(self.stale_entities, [('route', ('sf-muni', 'E'))])
+
+    @testing.gen_test
+    def test_forgotten_entity_is_read_again_from_redis(self):
+
+        refreshed_route = {'tag': 'E', 'title': 'E-Embarcadero (refreshed)'}
+
+        with mock.patch.object(BaseRepository, 'get_redis_connection', return_value=self.connection):
+            yield self.repository.store_route(self.agency_tag, self.route_tag, self.route)
+            self.now += settings.ROUTE_CACHE_TTL_SECONDS + 1
+            # Another replica stored it again in the meantime
+            self.pipeline.execute.return_value = [codec.encode('json', refreshed_route, self.now)[0], 30000]
+            self.repository.forget_in_memory('route', ('sf-muni', 'E'))
+            route = yield self.repository.get_route(self.agency_tag, self.route_tag)
+
+        self.assertEqual(route, entities.Route.from_dict(refreshed_route))
+        self.pipeline.execute.assert_called_once()
+        self.assertEqual(self.stale_entities, [])
+
+    @testing.gen_test
+    def test_times_to_stale(self):
+
+        stale_seconds = settings.ROUTE_CACHE_STALE_SECONDS
+        self.pipeline.execute.return_value = [(stale_seconds + 10) * 1000, -2]
+
+        with mock.patch.object(BaseRepository, 'get_redis_connection', return_value=self.connection):
+            times_to_stale = yield self.repository.get_times_to_stale([('route', ('sf-muni', 'E')),
+                                                                       ('route', ('sf-muni', 'F'))])
+
+        self.assertEqual(times_to_stale, [10, None])
+        self.assertEqual(self.pipeline.pttl.call_args_list,
+                         [mock.call('sf-muni:route:E'), mock.call('sf-muni:route:F')])
+
+    @testing.gen_test
+    def test_not_found_error_is_cached(self):
+
+        error = exceptions.NotFound('Could not get route "X"')
+
+        with mock.patch.object(BaseRepository, 'get_redis_connection', return_value=self.connection):
+            yield self.repository.store_fetch_error('routeConfig:sf-muni:X', error)
+            self.memory_cache.clear()
+            self.connection.get.return_value = self.connection.set.call_args[0][1]
+            cached_error = yield self.repository.get_fetch_error('routeConfig:sf-muni:X')
+
+        self.assertEqual(self.connection.set.call_args[0][0], 'fetch_error:routeConfig:sf-muni:X')
+        self.assertEqual(self.connection.set.call_args[1], {'ex': settings.FETCH_ERROR_CACHE_TTL_SECONDS})
+        self.assertIsInstance(cached_error, exceptions.NotFound)
+        self.assertEqual(cached_error.information(), error.information())
+
+    @testing.gen_test
+    def test_temporary_error_is_not_cached(self):
+
+        error = exceptions.ExternalProviderUnavailableTemporarily('NextBus')
+
+        with mock.patch.object(BaseRepository, 'get_redis_connection', return_value=self.connection):
+            yield self.repository.store_fetch_error('routeConfig:sf-muni:X', error)
+
+        self.assertFalse(self.connection.set.called)
@@ -0,0 +1,71 @@
+import threading
+
+import mock
+import redis
+from tornado import testing
+
+from pubtrans.common import exceptions
+from pubtrans.repositories.redis_repository import EXECUTOR
+from pubtrans.repositories.uri_stats_repository import UriStatsRepository
+
+
+class TestUriStatsRepository(testing.AsyncTestCase):
+
+    def setUp(self):
+        super(TestUriStatsRepository, self).setUp()
+
+        self.uri = '/v1/sf-muni/routes'
+        self.connection = mock.MagicMock()
+        self.pipeline = self.connection.pipeline.return_value
+        self.repository = UriStatsRepository(EXECUTOR)
+
+    @testing.gen_test
+    def test_uri_stats_are_updated_outside_ioloop_thread_in_one_round_trip(self):
+
+        io_loop_thread = threading.current_thread()
+        threads = []
+        self.pipeline.execute.side_effect = lambda: threads.append(threading.current_thread())
+
+        with mock.patch.object(UriStatsRepository, 'get_redis_connection',
+                               return_value=self.connection) as mocked_connection:
+            yield self.repository.update_uri_stats(self.uri, 12)
+
+        mocked_connection.assert_called_once_with('master')
+        self.assertEqual(self.pipeline.execute_command.call_args_list,
+                         [mock.call('ZINCRBY', 'uris:count', 1, self.uri),
+                          mock.call('ZADD', 'uris:slow_requests', 12, self.uri)])
+        self.assertEqual(len(threads), 1)
+        self.assertNotEqual(threads[0], io_loop_thread)
+
+    @testing.gen_test
+    def test_uri_count_is_sorted_by_count(self):
+
+        self.connection.zrevrangebyscore.return_value = [(self.uri, 3.0), ('/v1/agencies', 1.0)]
+
+        with mock.patch.object(UriStatsRepository, 'get_redis_connection', return_value=self.connection):
+            uri_count = yield self.repository.get_uri_count()
+
+        self.assertEqual(uri_count.items(), [(self.uri, 3), ('/v1/agencies', 1)])
+        self.connection.zrevrangebyscore.assert_called_once_with('uris:count', '+inf', '-inf',
+                                                                 withscores=True)
+
+    @testing.gen_test
+    def test_slow_requests_are_limited(self):
+
+        self.connection.zrevrangebyscore.return_value = [(self.uri, 120.0)]
+
+        with mock.patch.object(UriStatsRepository, 'get_redis_connection', return_value=self.connection):
+            slow_requests = yield self.repository.get_slow_requests('100')
+
+        self.assertEqual(slow_requests.items(), [(self.uri, 120)])
+        self.connection.zrevrangebyscore.assert_called_once_with('uris:slow_requests', '+inf', '100',
+                                                                 withscores=True)
+
+    @testing.gen_test
+    def test_connection_error_raises_database_operation_error(self):
+
+        self.pipeline.execute.side_effect = redis.ConnectionError('down')
+
+        with mock.patch.object(UriStatsRepository, 'get_redis_connection', return_value=self.connection):
+            with self.assertRaises(exceptions.DatabaseOperationError):
+                yield self.repository.update_uri_stats(self.uri, 12)
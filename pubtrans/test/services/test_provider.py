@@ -0,0 +1,140 @@
+import time
+import unittest
+
+import mock
+from tornado import testing
+
+from pubtrans.common import breaker
+from pubtrans.common import exceptions
+from pubtrans.common.context import Context
+from pubtrans.services import provider
+from pubtrans.services.local import LocalService
+from pubtrans.services.next_bus import NextBusService
+
+LOCAL_CONFIG = {
+    'type': 'local',
+    'title': 'Local',
+    'latency_seconds': 0.05,
+    'max_concurrency': 1,
+    'calls_per_second': 1000,
+    'burst': 1000,
+    'max_wait_seconds': 1
+}
+
+
+class TestProvider(testing.AsyncTestCase):
+
+    def setUp(self):
+        super(TestProvider, self).setUp()
+
+        self.context = Context(support=mock.MagicMock())
+        self.breaker_set = mock.MagicMock()
+
+    def make_provider(self, name='local', latency=0, max_concurrency=1, calls_per_second=1000, burst=1000,
+                      max_wait_seconds=1):
+        service = LocalService(latency=latency)
+        service.add('get_routes', ['sf-muni'], [{'tag': 'E'}])
+        return provider.Provider(name, service, self.breaker_set,
+                                 {'title': name.title(), 'max_concurrency': max_concurrency,
+                                  'calls_per_second': calls_per_second, 'burst': burst,
+                                  'max_wait_seconds': max_wait_seconds})
+
+    @staticmethod
+    def get_routes(service):
+        return service.get_routes('sf-muni')
+
+    @testing.gen_test
+    def test_call_uses_service_of_provider(self):
+
+        local = self.make_provider()
+
+        result = yield local.call(self.get_routes, self.context)
+
+        self.assertEqual(result, [{'tag': 'E'}])
+        self.assertEqual(local.service.calls, [('get_routes', ('sf-muni',))])
+        self.breaker_set.context.assert_called_once_with('local')
+        stats = local.get_stats()
+        self.assertEqual(stats[provider.STAT_CALLS], 1)
+        self.assertEqual(stats[provider.STAT_IN_FLIGHT], 0)
+
+    @testing.gen_test
+    def test_slow_provider_does_not_block_other_providers(self):
+
+        slow = self.make_provider('slow', latency=0.2)
+        fast = self.make_provider('fast')
+
+        start = time.time()
+        slow_calls = [slow.call(self.get_routes, self.context) for _ in range(2)]
+        yield fast.call(self.get_routes, self.context)
+        fast_time = time.time() - start
+
+        self.assertLess(fast_time, 0.1)
+        self.assertEqual(slow.get_stats()[provider.STAT_WAITING], 1)
+        yield slow_calls
+
+    @testing.gen_test
+    def test_calls_over_concurrency_are_rejected_after_max_wait(self):
+
+        slow = self.make_provider(latency=0.2, max_wait_seconds=0.05)
+
+        first_call = slow.call(self.get_routes, self.context)
+        with self.assertRaises(exceptions.ExternalProviderUnavailableTemporarily):
+            yield slow.call(self.get_routes, self.context)
+
+        result = yield first_call
+        self.assertEqual(result, [{'tag': 'E'}])
+        self.assertEqual(slow.get_stats()[provider.STAT_REJECTED], 1)
+
+    @testing.gen_test
+    def test_calls_over_rate_wait_for_their_turn(self):
+
+        limited = self.make_provider(max_concurrency=10, calls_per_second=20, burst=2, max_wait_seconds=0.12)
+
+        start = time.time()
+        yield [limited.call(self.get_routes, self.context) for _ in range(4)]
+        elapsed = time.time() - start
+        with self.assertRaises(exceptions.ExternalProviderUnavailableTemporarily):
+            yield [limited.call(self.get_routes, self.context) for _ in range(4)]
+
+        # Two calls of the burst and two more at 20 per second
+        self.assertGreaterEqual(elapsed, 0.09)
+        self.assertEqual(limited.get_stats()[provider.STAT_CALLS], 4 + 2)
+        self.assertEqual(limited.get_stats()[provider.STAT_REJECTED], 2)
+
+    @testing.gen_test
+    def test_open_circuit_is_provider_unavailable(self):
+
+        local = self.make_provider()
+        self.breaker_set.context.side_effect = breaker.CircuitOpenError('local')
+
+        with self.assertRaises(exceptions.ExternalProviderUnavailableTemporarily):
+            yield local.call(self.get_routes, self.context)
+
+        self.assertEqual(local.get_stats()[provider.STAT_CIRCUIT_OPEN], 1)
+
+
+class TestProviderMap(unittest.TestCase):
+
+    def test_agencies_are_routed_to_their_provider(self):
+
+        providers = provider.build_providers(mock.MagicMock(), mock.MagicMock(),
+                                             {'next_bus': dict(LOCAL_CONFIG, type='next_bus'),
+                                              'local': LOCAL_CONFIG},
+                                             {'jhu-apl': 'local'}, 'next_bus')
+
+        self.assertIs(providers.get_provider('jhu-apl'), providers.providers['local'])
+        self.assertIs(providers.get_provider('sf-muni'), providers.providers['next_bus'])
+        self.assertIs(providers.get_provider(), providers.providers['next_bus'])
+        self.assertIsInstance(providers.get_provider('jhu-apl').service, LocalService)
+        self.assertIsInstance(providers.get_provider().service, NextBusService)
+        self.assertEqual(sorted(providers.get_stats()), ['local', 'next_bus'])
+
+    def test_unknown_providers_are_rejected(self):
+
+        with self.assertRaises(ValueError):
+            provider.build_providers(mock.MagicMock(), mock.MagicMock(), {'local': LOCAL_CONFIG},
+                                     {'jhu-apl': 'other'}, 'local')
+
+        with self.assertRaises(ValueError):
+            provider.build_providers(mock.MagicMock(), mock.MagicMock(),
+                                     {'local': dict(LOCAL_CONFIG, type='x')}, {}, 'local')